@@ -1,154 +1,85 @@
-import os
-from flask import Flask, request, jsonify, render_template, send_from_directory
+import logging
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
-from pathlib import Path
-import base64
-from openai import OpenAI
-import io
-from PIL import Image
-import json
-from google.cloud import vision
+from werkzeug.exceptions import RequestEntityTooLarge
+from metrics import REGISTRY, UPLOADS_REJECTED, admission_samples, instrument_flask, job_samples, rate_limit_samples, timed
+from receipt_logging import configure_logging
+from receipt_upload import MAX_REQUEST_BYTES, UploadCoalescer, UploadRejected, preflight, read_upload
+from receipt_stream import SSE_HEADERS, sse_event
+from receipt_jobs import JOB_AUTOSTART, JobQueue, create_broker, public_job
+from receipt_batch import BATCH_MAX_FILES, combined_food_items
+from receipt_core import UpstreamUnavailable, create_processor
+from receipt_store import DEFAULT_PAGE_SIZE, ReceiptFilter
+from rate_limit import client_key, create_admission, create_rate_limiter, protect_flask
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
+# Request counts, latencies and in-flight gauges, served at /metrics
+instrument_flask(app)
 
 # Configuration
-UPLOAD_FOLDER = Path('static/uploads')
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Bodies over UPLOAD_MAX_REQUEST_BYTES are refused from Content-Length, before any of it is read
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
+# OCR and LLM backends come from RECEIPT_OCR_BACKENDS / RECEIPT_LLM_BACKENDS (default: Vision and OpenAI)
+processor = create_processor()
+receipt_cache = processor.cache
 
-# Initialize clients
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-vision_client = vision.ImageAnnotatorClient()
+# Background jobs. Workers start on the first submission, or on import with JOB_AUTOSTART=1 so
+# jobs a restart left in a durable broker are drained straight away. Importing this module for
+# its handler (python -m receipt_jobs app:run_receipt_job) starts none
+run_receipt_job = processor.run_job
+receipt_jobs = JobQueue(create_broker(), run_receipt_job)
+if JOB_AUTOSTART:
+    receipt_jobs.start()
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+REGISTRY.register_collector('processor', processor.metric_samples)
+REGISTRY.register_collector('jobs', lambda: job_samples(receipt_jobs.broker.counts()))
 
-def process_receipt_with_vision(image_path):
-    """
-    Process receipt using Google Cloud Vision API
-    """
-    try:
-        # Read the image file
-        with open(image_path, 'rb') as image_file:
-            content = image_file.read()
+# Double submits of the same photo share one run (see receipt_upload.UploadCoalescer)
+receipt_uploads = UploadCoalescer('process-receipt')
+receipt_streams = UploadCoalescer('process-receipt-stream')
+job_uploads = UploadCoalescer('jobs')
 
-        # Create image object
-        image = vision.Image(content=content)
+# Per-client token buckets (RATE_LIMIT_*) and fair-share admission (ADMISSION_*) in front of
+# every endpoint that calls Vision or OpenAI; see rate_limit.py
+rate_limiter = create_rate_limiter()
+admission = create_admission(lambda: sum(s['waiting'] for s in processor.upstream_stats().values()))
+protect_flask(app, ['process_receipt', 'process_receipts_route', 'process_receipt_stream', 'receipt_recipes',
+                    'submit_job'], rate_limiter, admission, queued=['submit_job'])
+if rate_limiter is not None:
+    limiter = rate_limiter
+    REGISTRY.register_collector('rate_limit', lambda: rate_limit_samples(limiter.stats()))
+if admission is not None:
+    admission_controller = admission
+    REGISTRY.register_collector('admission', lambda: admission_samples(admission_controller.stats()))
 
-        # Perform OCR
-        response = vision_client.text_detection(image=image)
-        texts = response.text_annotations
+@app.errorhandler(UploadRejected)
+def upload_rejected(e):
+    return jsonify({'error': str(e)}), e.status
 
-        if not texts:
-            raise ValueError("No text found in image")
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    UPLOADS_REJECTED.inc(reason='request_too_large')
+    return jsonify({'error': f'Request is over the {MAX_REQUEST_BYTES / 1024 / 1024:g} MiB limit'}), 413
 
-        # Extract full text (first element contains all text)
-        extracted_text = texts[0].description
-        
-        # Process the extracted text
-        return process_receipt_text(extracted_text)
-    except Exception as e:
-        print(f"Error in OCR processing: {e}")
-        return None
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def process_receipt_text(text):
+def request_client():
     """
-    Process receipt text using GPT-3.5-turbo
+    Returns the identity repeat uploads are coalesced under, the same one the rate limiter uses
     """
-    try:
-        format_prompt = f"""
-        Format the following receipt text into a structured JSON format.
-        Identify and clearly label:
-        - Store/Merchant name
-        - Date and time
-        - Individual items and their prices
-        - Subtotal
-        - Tax
-        - Total amount
-        - Any food items
-
-        Receipt text:
-        {text}
-
-        You must respond with ONLY valid JSON that matches this structure exactly, with no additional text or explanation:
-        {{
-            "merchant": "store name",
-            "datetime": "date and time",
-            "items": [
-                {{"name": "item name", "price": "price", "is_food": true/false}}
-            ],
-            "subtotal": "amount",
-            "tax": "amount",
-            "total": "amount",
-            "food_items": ["list of food items only"]
-        }}
-        """
-
-        response = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that processes receipt text and extracts structured information. Always respond with valid JSON only."},
-                {"role": "user", "content": format_prompt}
-            ]
-        )
-
-        receipt_data = json.loads(response.choices[0].message.content)
-        
-        # Generate recipe suggestions if food items are present
-        if receipt_data.get("food_items"):
-            recipe_prompt = f"""
-            Based on these ingredients: {', '.join(receipt_data['food_items'])}
-            
-            Suggest 2-3 recipes that could be made using some or all of these ingredients.
-            For each recipe provide:
-            1. Recipe name
-            2. Additional ingredients needed
-            3. Step-by-step instructions
-            4. Estimated cooking time
-            5. Difficulty level (Easy/Medium/Hard)
-
-            You must respond with ONLY valid JSON that matches this structure exactly, with no additional text or explanation:
-            {{
-                "recipes": [
-                    {{
-                        "name": "recipe name",
-                        "additional_ingredients": ["list of additional ingredients needed"],
-                        "instructions": ["list of steps"],
-                        "cooking_time": "estimated time",
-                        "difficulty": "difficulty level"
-                    }}
-                ]
-            }}
-            """
-
-            recipe_response = openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful chef that suggests recipes based on available ingredients. Always respond with valid JSON only."},
-                    {"role": "user", "content": recipe_prompt}
-                ]
-            )
-
-            recipes = json.loads(recipe_response.choices[0].message.content)
-            receipt_data["recipe_suggestions"] = recipes["recipes"]
-
-        return receipt_data
-
-    except Exception as e:
-        print(f"Error in text processing: {e}")
-        return None
-
-@app.route('/')
-def index():
-    return render_template('index.html')
+    return client_key(request.headers, request.remote_addr)
 
-@app.route('/api/process-receipt', methods=['POST'])
-def process_receipt():
+def validate_upload():
+    """
+    Returns an error response for a missing or invalid upload, or None if the upload is acceptable
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     
@@ -158,29 +89,211 @@ def process_receipt():
     
     if not allowed_file(file.filename):
         return jsonify({'error': 'Invalid file type'}), 400
+    return None
+
+def read_file(file):
+    """Read an upload straight from the request stream and pre-flight check it (raises UploadRejected)"""
+    with timed('upload_read'):
+        content = read_upload(file)
+    preflight(content)
+    return content
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+@app.route('/api/process-receipt', methods=['POST'])
+def process_receipt():
+    error = validate_upload()
+    if error:
+        return error
     
+    content = read_file(request.files['file'])
     try:
-        # Save the uploaded file
-        filename = secure_filename(file.filename)
-        filepath = app.config['UPLOAD_FOLDER'] / filename
-        file.save(str(filepath))
-        
-        # Process the receipt using Google Cloud Vision API
-        processed_data = process_receipt_with_vision(filepath)
+        # OCR and structure the receipt with the configured backends
+        processed_data = receipt_uploads.run(content, lambda: processor.process_image(content),
+                                             client=request_client())
         if not processed_data:
             raise ValueError("Failed to process receipt")
 
-        # Clean up the uploaded file
-        os.remove(filepath)
-        
         return jsonify({
             'success': True,
             'processed_data': processed_data
         })
     
+    except UpstreamUnavailable as e:
+        return jsonify({'error': str(e)}), e.status, e.headers()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/process-receipts', methods=['POST'])
+def process_receipts_route():
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({'error': f'At most {BATCH_MAX_FILES} files per request'}), 400
+    for file in files:
+        if file.filename == '' or not allowed_file(file.filename):
+            return jsonify({'error': f'Invalid file: {file.filename}'}), 400
+
+    contents = [read_file(file) for file in files]
+    try:
+        results = processor.process_images(contents)
+
+        # One recipe pass over the ingredients of the whole batch; ?recipes=0 skips it
+        recipe_suggestions = []
+        if request.args.get('recipes', '1') not in ('0', 'false'):
+            food_items = combined_food_items([r['processed_data'] for r in results if r['success']])
+            if food_items:
+                recipe_suggestions = processor.generate_recipes(food_items)
+
+        return jsonify({'success': True, 'results': results, 'recipe_suggestions': recipe_suggestions})
+    except UpstreamUnavailable as e:
+        return jsonify({'error': str(e)}), e.status, e.headers()
+    except Exception as e:
+        logger.exception("batch processing failed")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/process-receipt/stream', methods=['POST'])
+def process_receipt_stream():
+    error = validate_upload()
+    if error:
+        return error
+
+    # Read the upload before streaming starts; the request body is gone once the response begins
+    content = read_file(request.files['file'])
+
+    client = request_client()
+
+    def events():
+        try:
+            for event, data in receipt_streams.stream(content, lambda: processor.events(content), client=client):
+                yield sse_event(event, data)
+        except Exception as e:
+            logger.exception("streaming receipt processing failed")
+            yield sse_event('error', {'error': str(e)})
+
+    return Response(events(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    error = validate_upload()
+    if error:
+        return error
+
+    content = read_file(request.files['file'])
+    try:
+        job_id = job_uploads.run(content, lambda: receipt_jobs.submit(content, request.form.get('webhook')),
+                                 client=request_client())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'}), 202
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = receipt_jobs.broker.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(public_job(job))
+
+@app.route('/api/jobs/stats')
+def job_stats():
+    return jsonify({'jobs': receipt_jobs.stats(), 'upstreams': processor.upstream_stats()})
+
+@app.route('/api/receipts/<receipt_id>/recipes')
+def receipt_recipes(receipt_id):
+    receipt_data = processor.get_receipt(receipt_id)
+    if receipt_data is None:
+        return jsonify({'error': 'Unknown or expired receipt'}), 404
+
+    food_items = receipt_data.get('food_items') or []
+    if not food_items:
+        return jsonify({'success': True, 'recipe_suggestions': []})
+
+    try:
+        return jsonify({'success': True, 'recipe_suggestions': processor.generate_recipes(food_items)})
+    except UpstreamUnavailable as e:
+        return jsonify({'error': str(e)}), e.status, e.headers()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def query_store(run):
+    """
+    Run a query against the receipt store with the request's filter (merchant, from, to,
+    min_total, max_total). A disabled store is a 404 and malformed parameters a 400.
+    """
+    if processor.store is None:
+        return jsonify({'error': 'Receipt store is disabled'}), 404
+    try:
+        return jsonify(run(processor.store, ReceiptFilter.from_args(request.args)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/receipts')
+def list_receipts():
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return query_store(lambda store, where: store.list(where, limit, request.args.get('cursor')))
+
+@app.route('/api/receipts/<receipt_id>')
+def get_receipt(receipt_id):
+    receipt_data = processor.get_receipt(receipt_id)
+    if receipt_data is None:
+        return jsonify({'error': 'Unknown receipt'}), 404
+    return jsonify(receipt_data)
+
+@app.route('/api/receipts/export')
+def export_receipts():
+    if processor.store is None:
+        return jsonify({'error': 'Receipt store is disabled'}), 404
+    fmt = request.args.get('format', 'jsonl')
+    kind = request.args.get('kind', 'receipts')
+    try:
+        chunks = processor.store.export(fmt, kind, ReceiptFilter.from_args(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(chunks, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'})
+
+@app.route('/api/analytics/summary')
+def analytics_summary():
+    return query_store(lambda store, where: store.summary(where))
+
+@app.route('/api/analytics/spend-by-merchant')
+def spend_by_merchant():
+    return query_store(lambda store, where: {'spend': store.spend_by_merchant_month(where)})
+
+@app.route('/api/analytics/top-food-items')
+def top_food_items():
+    limit = request.args.get('limit', 20, type=int)
+    return query_store(lambda store, where: {'items': store.top_food_items(where, limit)})
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    return jsonify(receipt_cache.stats())
+
+@app.route('/api/parser-stats')
+def parser_stats():
+    return jsonify(processor.parser_metrics.stats())
+
+@app.route('/api/recipe-index-stats')
+def recipe_index_stats():
+    if processor.recipe_index is None:
+        return jsonify({'error': 'Recipe index is disabled'}), 404
+    return jsonify(processor.recipe_index.stats())
+
+@app.route('/api/rate-limit-stats')
+def rate_limit_stats():
+    return jsonify({
+        'rate_limit': rate_limiter.stats() if rate_limiter is not None else None,
+        'admission': admission.stats() if admission is not None else None,
+    })
+
+@app.route('/api/backend-stats')
+def backend_stats():
+    return jsonify(processor.stats())
+
 @app.route('/static/<path:path>')
 def serve_static(path):
     return send_from_directory('static', path)
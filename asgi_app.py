@@ -0,0 +1,292 @@
+import asyncio
+import json
+import logging
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+from metrics import REGISTRY, UPLOADS_REJECTED, ASGIMetrics, admission_samples, rate_limit_samples, timed
+from rate_limit import ASGIProtection, client_key, create_admission, create_rate_limiter
+from receipt_async import AsyncReceiptProcessor
+from receipt_core import UpstreamUnavailable, create_processor
+from receipt_logging import configure_logging
+from receipt_store import DEFAULT_PAGE_SIZE, ReceiptFilter
+from receipt_upload import MAX_REQUEST_BYTES, UploadCoalescer, UploadRejected, check_format, check_size, preflight
+from receipt_stream import SSE_HEADERS, sse_event
+
+# ASGI entry point alongside the Flask `app`. Run with:
+#   uvicorn asgi_app:app
+#   gunicorn -k uvicorn.workers.UvicornWorker asgi_app:app
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+
+# The same pipeline as the Flask app (backends from RECEIPT_OCR_BACKENDS / RECEIPT_LLM_BACKENDS),
+# its blocking stages run on a thread pool so the event loop keeps serving
+processor = create_processor()
+pipeline = AsyncReceiptProcessor(processor)
+REGISTRY.register_collector('processor', processor.metric_samples)
+
+# Double submits of the same photo share one run (see receipt_upload.UploadCoalescer)
+receipt_uploads = UploadCoalescer('process-receipt')
+receipt_ndjson = UploadCoalescer('process-receipt-ndjson')
+receipt_streams = UploadCoalescer('process-receipt-stream')
+
+# Per-client token buckets (RATE_LIMIT_*) and fair-share admission (ADMISSION_*) in front of
+# every endpoint that calls an upstream; see rate_limit.py
+rate_limiter = create_rate_limiter()
+admission = create_admission(lambda: sum(s['waiting'] for s in processor.upstream_stats().values()))
+if rate_limiter is not None:
+    limiter = rate_limiter
+    REGISTRY.register_collector('rate_limit', lambda: rate_limit_samples(limiter.stats()))
+if admission is not None:
+    admission_controller = admission
+    REGISTRY.register_collector('admission', lambda: admission_samples(admission_controller.stats()))
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def request_client(request):
+    """
+    Returns the identity repeat uploads are coalesced under, the same one the rate limiter uses
+    """
+    return client_key(request.headers, request.client.host if request.client else None)
+
+
+def upstream_error(e):
+    return JSONResponse({'error': str(e)}, status_code=e.status, headers=e.headers())
+
+
+async def index(request):
+    # index.html has no template variables, so it is served as a plain file
+    return FileResponse('templates/index.html')
+
+
+async def read_image(request):
+    """
+    Returns (content, None) for an acceptable upload, or (None, error response). Bodies over
+    UPLOAD_MAX_REQUEST_BYTES are refused before the form is parsed, and files that are not
+    JPEG or PNG, or are over the size limit, before they are read.
+    """
+    if int(request.headers.get('content-length') or 0) > MAX_REQUEST_BYTES:
+        UPLOADS_REJECTED.inc(reason='request_too_large')
+        return None, JSONResponse({'error': f'Request is over the {MAX_REQUEST_BYTES / 1024 / 1024:g} MiB limit'},
+                                  status_code=413)
+    with timed('upload_read'):
+        form = await request.form()
+    file = form.get('file')
+    if file is None or isinstance(file, str):
+        return None, JSONResponse({'error': 'No file provided'}, status_code=400)
+    if file.filename == '':
+        return None, JSONResponse({'error': 'No file selected'}, status_code=400)
+    if not allowed_file(file.filename):
+        return None, JSONResponse({'error': 'Invalid file type'}, status_code=400)
+    try:
+        check_format(await file.read(16))
+        if file.size is not None:
+            check_size(file.size)
+        await file.seek(0)
+        with timed('upload_read'):
+            content = await file.read()
+        preflight(content)
+    except UploadRejected as e:
+        return None, JSONResponse({'error': str(e)}, status_code=e.status)
+    return content, None
+
+
+def ndjson_stream(content, client):
+    """
+    Newline-delimited JSON: the receipt as soon as it is parsed, then the recipe suggestions
+    once they are ready
+    """
+    async def events():
+        try:
+            async for event in receipt_ndjson.stream_async(content, lambda: pipeline.stream(content), client=client):
+                yield json.dumps(event) + '\n'
+        except Exception as e:
+            yield json.dumps({'stage': 'error', 'error': str(e)}) + '\n'
+
+    return StreamingResponse(events(), media_type='application/x-ndjson')
+
+
+async def process_receipt(request):
+    content, error = await read_image(request)
+    if error:
+        return error
+
+    client = request_client(request)
+    if request.query_params.get('stream') in ('1', 'true'):
+        return ndjson_stream(content, client)
+
+    try:
+        processed_data = await receipt_uploads.run_async(content, lambda: pipeline.process(content), client=client)
+        if not processed_data:
+            raise ValueError("Failed to process receipt")
+        return JSONResponse({'success': True, 'processed_data': processed_data})
+    except UpstreamUnavailable as e:
+        return upstream_error(e)
+    except Exception as e:
+        logger.exception("receipt processing failed")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def process_receipt_stream(request):
+    content, error = await read_image(request)
+    if error:
+        return error
+
+    client = request_client(request)
+
+    async def events():
+        try:
+            # The processor's events end with 'done'
+            async for event, data in receipt_streams.stream_async(content, lambda: pipeline.events(content),
+                                                                  client=client):
+                yield sse_event(event, data)
+        except Exception as e:
+            logger.exception("streaming receipt processing failed")
+            yield sse_event('error', {'error': str(e)})
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+
+async def receipt_recipes(request):
+    receipt_data = processor.get_receipt(request.path_params['receipt_id'])
+    if receipt_data is None:
+        return JSONResponse({'error': 'Unknown or expired receipt'}, status_code=404)
+
+    food_items = receipt_data.get('food_items') or []
+    if not food_items:
+        return JSONResponse({'success': True, 'recipe_suggestions': []})
+
+    try:
+        return JSONResponse({'success': True, 'recipe_suggestions': await pipeline.generate_recipes(food_items)})
+    except UpstreamUnavailable as e:
+        return upstream_error(e)
+    except Exception as e:
+        logger.exception("recipe generation failed")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def query_store(request, run):
+    """
+    Run a query against the receipt store with the request's filter (merchant, from, to,
+    min_total, max_total) on a worker thread. A disabled store is a 404 and malformed
+    parameters a 400.
+    """
+    if processor.store is None:
+        return JSONResponse({'error': 'Receipt store is disabled'}, status_code=404)
+    try:
+        where = ReceiptFilter.from_args(request.query_params)
+        return JSONResponse(await asyncio.to_thread(run, processor.store, where))
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+
+def int_param(request, name, default):
+    try:
+        return int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+
+
+async def list_receipts(request):
+    limit = int_param(request, 'limit', DEFAULT_PAGE_SIZE)
+    cursor = request.query_params.get('cursor')
+    return await query_store(request, lambda store, where: store.list(where, limit, cursor))
+
+
+async def get_receipt(request):
+    receipt_data = processor.get_receipt(request.path_params['receipt_id'])
+    if receipt_data is None:
+        return JSONResponse({'error': 'Unknown receipt'}, status_code=404)
+    return JSONResponse(receipt_data)
+
+
+async def export_receipts(request):
+    if processor.store is None:
+        return JSONResponse({'error': 'Receipt store is disabled'}, status_code=404)
+    fmt = request.query_params.get('format', 'jsonl')
+    kind = request.query_params.get('kind', 'receipts')
+    try:
+        chunks = processor.store.export(fmt, kind, ReceiptFilter.from_args(request.query_params))
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    # A plain iterator: Starlette runs it in the thread pool, off the event loop
+    media_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(chunks, media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'})
+
+
+async def analytics_summary(request):
+    return await query_store(request, lambda store, where: store.summary(where))
+
+
+async def spend_by_merchant(request):
+    return await query_store(request, lambda store, where: {'spend': store.spend_by_merchant_month(where)})
+
+
+async def top_food_items(request):
+    limit = int_param(request, 'limit', 20)
+    return await query_store(request, lambda store, where: {'items': store.top_food_items(where, limit)})
+
+
+async def cache_stats(request):
+    return JSONResponse(processor.cache.stats())
+
+
+async def parser_stats(request):
+    return JSONResponse(processor.parser_metrics.stats())
+
+
+async def recipe_index_stats(request):
+    if processor.recipe_index is None:
+        return JSONResponse({'error': 'Recipe index is disabled'}, status_code=404)
+    return JSONResponse(processor.recipe_index.stats())
+
+
+async def rate_limit_stats(request):
+    return JSONResponse({
+        'rate_limit': rate_limiter.stats() if rate_limiter is not None else None,
+        'admission': admission.stats() if admission is not None else None,
+    })
+
+
+async def backend_stats(request):
+    return JSONResponse(processor.stats())
+
+
+routes = [
+    Route('/', index),
+    Route('/api/process-receipt', process_receipt, methods=['POST']),
+    Route('/api/process-receipt/stream', process_receipt_stream, methods=['POST']),
+    Route('/api/receipts', list_receipts),
+    Route('/api/receipts/export', export_receipts),
+    Route('/api/receipts/{receipt_id}', get_receipt),
+    Route('/api/receipts/{receipt_id}/recipes', receipt_recipes),
+    Route('/api/analytics/summary', analytics_summary),
+    Route('/api/analytics/spend-by-merchant', spend_by_merchant),
+    Route('/api/analytics/top-food-items', top_food_items),
+    Route('/api/cache-stats', cache_stats),
+    Route('/api/parser-stats', parser_stats),
+    Route('/api/recipe-index-stats', recipe_index_stats),
+    Route('/api/rate-limit-stats', rate_limit_stats),
+    Route('/api/backend-stats', backend_stats),
+    Mount('/static', app=StaticFiles(directory='static', check_dir=False), name='static'),
+]
+
+# Request counts, latencies and in-flight gauges, served at /metrics. Rate limiting and admission
+# sit inside it, so refused requests are counted too
+app = Starlette(routes=routes, middleware=[
+    Middleware(ASGIMetrics, routes=routes),
+    Middleware(ASGIProtection, routes=routes,
+               endpoints=['process_receipt', 'process_receipt_stream', 'receipt_recipes'],
+               limiter=rate_limiter, admission=admission),
+])
@@ -0,0 +1,136 @@
+"""
+Compare flat OCR text with column-aligned OCRLayout text: prompt tokens for the receipt
+formatting call, layout reconstruction time, and how often the local parser can skip the LLM.
+
+By default word boxes are simulated from synthetic receipts, with the flat text in the
+column order Vision's full-text annotation often produces (item column, then price column).
+--tesseract OCRs rendered receipt photos instead; --vision sends them to Cloud Vision.
+
+    python -m benchmarks.bench_layout --receipts 50
+    python -m benchmarks.bench_layout --receipts 6 --tesseract
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.synthetic import RESOLUTIONS, encode_receipt, receipt_lines, render_receipt
+from ocr_layout import OCRLayout, Word
+from receipt_parser import MIN_CONFIDENCE, parse_receipt
+from receipt_prompts import count_message_tokens, format_messages
+
+CHAR_WIDTH = 18
+LINE_HEIGHT = 40
+
+
+def simulate_vision(rng, n_items):
+    """
+    Word boxes for a synthetic receipt laid out like a photo (slight vertical jitter), plus the
+    flat text Vision would return for it: each column block read top to bottom in turn.
+    """
+    lines = receipt_lines(rng, n_items)
+    # Printed rule above the totals
+    lines.insert(lines.index(("", "")), ("-" * 32, ""))
+    words, left_column, right_column = [], [], []
+    for row, (left, right) in enumerate(lines):
+        y = 100 + row * LINE_HEIGHT + rng.randint(-4, 4)
+        x = 60
+        for token in left.split():
+            words.append(Word(token, x, y, x + CHAR_WIDTH * len(token), y + 28))
+            x += CHAR_WIDTH * (len(token) + 1)
+        if left:
+            left_column.append(left)
+        if right:
+            x1 = 60 + CHAR_WIDTH * 32
+            words.append(Word(right, x1 - CHAR_WIDTH * len(right), y + rng.randint(-3, 3), x1, y + 28))
+            right_column.append(right)
+    return "\n".join(left_column + right_column), OCRLayout.from_words(words)
+
+
+def measure(samples):
+    """
+    Args:
+        samples: (flat text, OCRLayout, layout build ms) triples
+    """
+    rows = {"flat text": [], "layout text": []}
+    build_ms = []
+    for flat, layout, ms in samples:
+        start = time.perf_counter()
+        text = layout.to_text()
+        build_ms.append(ms + (time.perf_counter() - start) * 1000)
+        for name, ocr_text in (("flat text", flat), ("layout text", text)):
+            tokens = count_message_tokens(format_messages(ocr_text))
+            bypass = parse_receipt(ocr_text).confidence >= MIN_CONFIDENCE
+            # Receipts the local parser handles send no tokens at all
+            rows[name].append((tokens, bypass, 0 if bypass else tokens))
+
+    print(f"{'':>12} {'prompt tokens':>14} {'parser bypass':>14} {'LLM tokens/receipt':>19}")
+    for name, values in rows.items():
+        tokens, bypass, spent = zip(*values)
+        print(f"{name:>12} {statistics.mean(tokens):14.1f} {statistics.mean(bypass):14.0%} {statistics.mean(spent):19.1f}")
+    print(f"layout reconstruction: p50 {statistics.median(build_ms):.2f} ms, max {max(build_ms):.2f} ms per receipt")
+
+
+def synthetic_samples(count, seed):
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(count):
+        flat, layout = simulate_vision(rng, rng.randint(4, 16))
+        samples.append((flat, layout, 0.0))
+    return samples
+
+
+def tesseract_samples(count, seed):
+    import pytesseract
+    from PIL import Image
+
+    from receipt_ocr import ReceiptOCR
+
+    ocr = ReceiptOCR(ocr_pool_size=0)
+    samples = []
+    for i in range(count):
+        image = ocr.preprocess_image(ocr.load_image(encode_receipt(render_receipt(RESOLUTIONS["3mp"], seed=seed + i))))
+        flat = pytesseract.image_to_string(Image.fromarray(image))
+        start = time.perf_counter()
+        layout = ocr.extract_layout(image)
+        samples.append((flat, layout, (time.perf_counter() - start) * 1000))
+    return samples
+
+
+def vision_samples(count, seed):
+    from google.cloud import vision
+
+    from image_normalize import normalize_image_bytes
+
+    client = vision.ImageAnnotatorClient()
+    samples = []
+    for i in range(count):
+        content = normalize_image_bytes(encode_receipt(render_receipt(RESOLUTIONS["3mp"], seed=seed + i)))
+        response = client.text_detection(image=vision.Image(content=content))
+        start = time.perf_counter()
+        layout = OCRLayout.from_vision(response.text_annotations)
+        samples.append((response.text_annotations[0].description, layout, (time.perf_counter() - start) * 1000))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--tesseract", action="store_true", help="OCR rendered receipts with tesseract")
+    source.add_argument("--vision", action="store_true", help="OCR rendered receipts with Cloud Vision (needs credentials)")
+    args = parser.parse_args()
+
+    if args.tesseract:
+        samples = tesseract_samples(args.receipts, args.seed)
+    elif args.vision:
+        samples = vision_samples(args.receipts, args.seed)
+    else:
+        samples = synthetic_samples(args.receipts, args.seed)
+    print(f"{len(samples)} receipts")
+    measure(samples)
+
+
+if __name__ == "__main__":
+    main()
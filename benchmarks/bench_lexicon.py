@@ -0,0 +1,100 @@
+"""
+Micro-benchmark for the food lexicon: build time, per-name match time with a cold and a warm
+cache, the substring scan it replaces for reference, and how many OCR-style typos of the
+synthetic item names still reach the same ingredient. Results are appended to
+benchmarks/results/lexicon.jsonl; compare runs with `python -m benchmarks.results lexicon --compare`.
+
+    python -m benchmarks.bench_lexicon
+    python -m benchmarks.bench_lexicon --typos 500 --repeat 2000
+"""
+import argparse
+import random
+import string
+import time
+from typing import Dict, List
+
+from benchmarks.results import save_result
+from benchmarks.synthetic import ITEMS
+from food_lexicon import FoodLexicon
+
+
+def with_typo(name: str, rng: random.Random) -> str:
+    """Drop, swap or replace one letter of a word of at least five letters, as OCR does."""
+    words = name.split()
+    candidates = [i for i, word in enumerate(words) if len(word) >= 5 and word.isalpha()]
+    if not candidates:
+        return name
+    i = rng.choice(candidates)
+    word = words[i]
+    at = rng.randrange(1, len(word) - 1)
+    edit = rng.choice(("drop", "swap", "replace"))
+    if edit == "drop":
+        word = word[:at] + word[at + 1:]
+    elif edit == "swap":
+        word = word[:at] + word[at + 1] + word[at] + word[at + 2:]
+    else:
+        word = word[:at] + rng.choice(string.ascii_uppercase) + word[at + 1:]
+    words[i] = word
+    return " ".join(words)
+
+
+def per_name_us(func, names: List[str], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name in names:
+            func(name)
+    return (time.perf_counter() - start) / (repeat * len(names)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--typos", type=int, default=200, help="typo variants of the synthetic item names")
+    parser.add_argument("--repeat", type=int, default=1000, help="passes over the names for the warm timing")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-save", action="store_true", help="do not append the results to benchmarks/results")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    lexicon = FoodLexicon.default()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    rng = random.Random(args.seed)
+    originals = [rng.choice(ITEMS) for _ in range(args.typos)]
+    typos = [with_typo(name, rng) for name in originals]
+    names = list(dict.fromkeys(list(ITEMS) + typos))
+
+    # Every name once through an empty cache, then again and again through a full one
+    cold_us = per_name_us(lexicon.match, names, 1)
+    warm_us = per_name_us(lexicon.match, names, args.repeat)
+    phrases = [" ".join(entry.phrase) for entry in lexicon.entries]
+    scan_us = per_name_us(lambda name: any(phrase in name.lower() for phrase in phrases), names,
+                          max(1, args.repeat // 100))
+
+    recovered = sum(lexicon.canonical(typo) == lexicon.canonical(name) for typo, name in zip(typos, originals))
+    classified = sum(lexicon.classify(name) is not None for name in ITEMS)
+
+    metrics: Dict[str, float] = {
+        "entries": len(lexicon),
+        "build_ms": round(build_ms, 2),
+        "cold_match_us": round(cold_us, 2),
+        "warm_match_us": round(warm_us, 3),
+        "substring_scan_us": round(scan_us, 2),
+        "items_classified": round(classified / len(ITEMS), 3),
+        "typos_recovered": round(recovered / max(1, len(typos)), 3),
+    }
+    print(f"{len(lexicon)} entries built in {metrics['build_ms']} ms")
+    print(f"match: cold {metrics['cold_match_us']} us, warm {metrics['warm_match_us']} us per name "
+          f"(substring scan over every phrase: {metrics['substring_scan_us']} us)")
+    print(f"synthetic items classified: {metrics['items_classified']:.1%}, "
+          f"typos mapped to the same ingredient: {metrics['typos_recovered']:.1%}")
+    for name in ITEMS:
+        match = lexicon.match(name)
+        print(f"  {name:<24} food={match.is_food!s:<5} {match.ingredient}")
+
+    if not args.no_save:
+        params = {key: value for key, value in vars(args).items() if key != "no_save"}
+        print(f"Saved to {save_result('lexicon', params, metrics)}")
+
+
+if __name__ == "__main__":
+    main()
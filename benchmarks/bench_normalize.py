@@ -0,0 +1,101 @@
+"""
+Benchmark the image normalization stage: request payload size and latency before and after,
+on test_images/sample_receipt.jpg plus a generated corpus of synthetic phone photos.
+
+    python -m benchmarks.bench_normalize
+    python -m benchmarks.bench_normalize --corpus 9 --ocr        # include tesseract OCR
+    python -m benchmarks.bench_normalize --vision                # include a real Vision round trip
+    python -m benchmarks.bench_normalize --output results.json
+"""
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+
+from benchmarks.synthetic import generate_corpus
+from image_normalize import NormalizeConfig, normalize_image_bytes
+
+SAMPLE = Path("test_images/sample_receipt.jpg")
+
+
+def timed(func, *args, repeat=1):
+    """Run func `repeat` times and return (last result, median milliseconds)."""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(samples)
+
+
+def local_pipeline(ocr, content, run_ocr):
+    image = ocr.load_image(content)
+    processed = ocr.preprocess_image(image)
+    if run_ocr:
+        ocr.extract_text(processed)
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=int, default=6, help="number of synthetic images to generate")
+    parser.add_argument("--repeat", type=int, default=3, help="timing repetitions per image")
+    parser.add_argument("--ocr", action="store_true", help="include tesseract extract_text in the local pipeline")
+    parser.add_argument("--vision", action="store_true", help="include a Google Cloud Vision text_detection call")
+    parser.add_argument("--output", help="write per-image results as JSON to this path")
+    args = parser.parse_args()
+
+    from receipt_ocr import ReceiptOCR
+
+    config = NormalizeConfig.from_env()
+    raw_ocr = ReceiptOCR(normalize_config=NormalizeConfig(enabled=False))
+    normalized_ocr = ReceiptOCR(normalize_config=config)
+
+    vision_client = None
+    if args.vision:
+        from google.cloud import vision
+        vision_client = vision.ImageAnnotatorClient()
+
+    images = [(SAMPLE.name, SAMPLE.read_bytes())] if SAMPLE.exists() else []
+    images += generate_corpus(args.corpus)
+
+    results = []
+    for name, content in images:
+        normalized, normalize_ms = timed(normalize_image_bytes, content, config, repeat=args.repeat)
+        _, local_before_ms = timed(local_pipeline, raw_ocr, content, args.ocr, repeat=args.repeat)
+        _, local_after_ms = timed(local_pipeline, normalized_ocr, content, args.ocr, repeat=args.repeat)
+        row = {
+            "image": name,
+            "bytes_before": len(content),
+            "bytes_after": len(normalized),
+            "normalize_ms": round(normalize_ms, 1),
+            "local_before_ms": round(local_before_ms, 1),
+            "local_after_ms": round(local_after_ms, 1),
+        }
+        if vision_client is not None:
+            from google.cloud import vision
+            _, row["vision_before_ms"] = timed(lambda: vision_client.text_detection(image=vision.Image(content=content)))
+            _, row["vision_after_ms"] = timed(
+                lambda: vision_client.text_detection(image=vision.Image(content=normalize_image_bytes(content, config))))
+        results.append(row)
+
+    columns = list(results[0].keys())
+    print(" ".join(f"{column:>18}" for column in columns))
+    for row in results:
+        print(" ".join(f"{str(row.get(column, '')):>18}" for column in columns))
+
+    total_before = sum(row["bytes_before"] for row in results)
+    total_after = sum(row["bytes_after"] for row in results)
+    print(f"\nPayload: {total_before / 1e6:.2f} MB -> {total_after / 1e6:.2f} MB "
+          f"({100 * (1 - total_after / total_before):.0f}% smaller)")
+    print(f"Local pipeline median: {statistics.median(r['local_before_ms'] for r in results):.0f} ms -> "
+          f"{statistics.median(r['local_after_ms'] for r in results):.0f} ms")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({"config": vars(config), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Micro-benchmarks for the local OCR path: ReceiptOCR.load_image, preprocess_image per
+profile and extract_text, on synthetic receipts at each resolution. Results are appended to
+benchmarks/results/ocr.jsonl; compare runs with `python -m benchmarks.results ocr --compare`.
+
+    python -m benchmarks.bench_ocr
+    python -m benchmarks.bench_ocr --resolutions 3mp,12mp --profiles fast,quality --repeat 10
+    python -m benchmarks.bench_ocr --no-ocr          # skip tesseract
+"""
+import argparse
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+from benchmarks.results import save_result
+from benchmarks.synthetic import RESOLUTIONS, encode_receipt, render_receipt
+from image_normalize import NormalizeConfig
+from preprocessing import PROFILES
+from receipt_core.routing import percentile
+
+
+def measure(func: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    """Time `func` `repeat` times after `warmup` untimed calls; milliseconds."""
+    for _ in range(warmup):
+        func()
+    samples: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": round(statistics.median(samples), 2),
+        "p95_ms": round(percentile(samples, 95), 2),
+        "min_ms": round(min(samples), 2),
+    }
+
+
+def tesseract_available() -> bool:
+    import pytesseract
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except (OSError, pytesseract.TesseractNotFoundError):
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", default="3mp,12mp", help="comma-separated, see benchmarks/synthetic.py")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help="comma-separated preprocessing profiles")
+    parser.add_argument("--repeat", type=int, default=5, help="timed calls per measurement")
+    parser.add_argument("--ocr-repeat", type=int, default=3, help="timed extract_text calls per measurement")
+    parser.add_argument("--no-ocr", action="store_true", help="skip extract_text")
+    parser.add_argument("--no-save", action="store_true", help="do not append the results to benchmarks/results")
+    args = parser.parse_args()
+
+    from receipt_ocr import ReceiptOCR
+
+    ocr = ReceiptOCR(normalize_config=NormalizeConfig())
+    run_ocr = not args.no_ocr and tesseract_available()
+    if not args.no_ocr and not run_ocr:
+        print("tesseract is not installed; extract_text is skipped")
+
+    metrics: Dict[str, float] = {}
+    print(f"{'measurement':<32} {'median ms':>10} {'p95 ms':>10} {'min ms':>10}")
+    for resolution in args.resolutions.split(","):
+        content = encode_receipt(render_receipt(RESOLUTIONS[resolution], seed=1))
+        results = {f"load_image.{resolution}": measure(lambda: ocr.load_image(content), args.repeat)}
+        image = ocr.load_image(content)
+        for profile in args.profiles.split(","):
+            results[f"preprocess.{profile}.{resolution}"] = measure(
+                lambda: ocr.preprocess_image(image, profile), args.repeat)
+            if run_ocr:
+                processed = ocr.preprocess_image(image, profile)
+                results[f"extract_text.{profile}.{resolution}"] = measure(
+                    lambda: ocr.extract_text(processed), args.ocr_repeat)
+        for name, stats in results.items():
+            print(f"{name:<32} {stats['median_ms']:>10} {stats['p95_ms']:>10} {stats['min_ms']:>10}")
+            metrics.update({f"{name}.{key}": value for key, value in stats.items()})
+
+    if not args.no_save:
+        params = {key: value for key, value in vars(args).items() if key != "no_save"}
+        params["ocr_pool"] = ocr.ocr_pool is not None
+        params["extract_text"] = run_ocr
+        print(f"Saved to {save_result('ocr', params, metrics)}")
+
+
+if __name__ == "__main__":
+    main()
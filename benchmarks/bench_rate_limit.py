@@ -0,0 +1,112 @@
+"""
+Overhead of rate limiting and admission control: microseconds per token-bucket check for each
+backend, from one thread and from several at once (the SQLite backend takes a write lock per
+check), one admit/release pair, and what protect_flask adds to a request through the Flask
+test client against a view that does nothing. Results are appended to
+benchmarks/results/rate_limit.jsonl; compare runs with `python -m benchmarks.results rate_limit --compare`.
+
+    python -m benchmarks.bench_rate_limit
+    python -m benchmarks.bench_rate_limit --checks 20000 --threads 8 --clients 1000
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict
+
+from flask import Flask
+
+from benchmarks.results import save_result
+from rate_limit import AdmissionController, InProcessRateLimiter, RateLimiter, SQLiteRateLimiter, protect_flask
+
+
+def per_call_us(func: Callable[[int], None], calls: int, threads: int = 1) -> float:
+    """Wall time per call of `func(i)` for `calls` calls split over `threads` threads."""
+    share = calls // threads
+
+    def run(offset: int):
+        for i in range(offset, offset + share):
+            func(i)
+
+    workers = [threading.Thread(target=run, args=(n * share,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (share * threads) * 1e6
+
+
+def check_us(limiter: RateLimiter, clients: int, calls: int, threads: int = 1) -> float:
+    # Buckets big enough that nothing is refused: the cost of a refusal is the same lookup
+    return per_call_us(lambda i: limiter.check(f"ip:10.0.{i % clients // 256}.{i % 256}"), calls, threads)
+
+
+def request_us(protected: bool, requests: int, clients: int) -> float:
+    app = Flask(__name__)
+
+    @app.route("/work", methods=["POST"])
+    def work():
+        return "ok"
+
+    if protected:
+        protect_flask(app, ["work"], InProcessRateLimiter(rate=1e6, burst=1e6),
+                      AdmissionController(capacity=64, upstream_waiting=lambda: 0))
+    client = app.test_client()
+
+    def post(i: int):
+        client.post("/work", environ_base={"REMOTE_ADDR": f"10.0.{i % clients // 256}.{i % 256}"}).close()
+
+    post(0)
+    return per_call_us(post, requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checks", type=int, default=20000, help="bucket checks per timing")
+    parser.add_argument("--requests", type=int, default=2000, help="test-client requests per timing")
+    parser.add_argument("--clients", type=int, default=500, help="distinct client addresses")
+    parser.add_argument("--threads", type=int, default=4, help="threads for the concurrent timings")
+    parser.add_argument("--no-save", action="store_true", help="do not append the results to benchmarks/results")
+    args = parser.parse_args()
+
+    metrics: Dict[str, float] = {}
+    memory = InProcessRateLimiter(rate=1e6, burst=1e6)
+    metrics["memory_check_us"] = round(check_us(memory, args.clients, args.checks), 2)
+    metrics["memory_check_threaded_us"] = round(check_us(memory, args.clients, args.checks, args.threads), 2)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite = SQLiteRateLimiter(os.path.join(tmp, "ratelimit.sqlite3"), rate=1e6, burst=1e6)
+        sqlite_checks = max(args.threads, args.checks // 10)
+        metrics["sqlite_check_us"] = round(check_us(sqlite, args.clients, sqlite_checks), 1)
+        metrics["sqlite_check_threaded_us"] = round(check_us(sqlite, args.clients, sqlite_checks, args.threads), 1)
+
+    admission = AdmissionController(capacity=64, upstream_waiting=lambda: 0)
+
+    def admit_release(i: int):
+        client = f"ip:10.0.0.{i % 256}"
+        admission.release(client, admission.admit(client))
+
+    metrics["admission_us"] = round(per_call_us(admit_release, args.checks), 2)
+
+    bare = request_us(False, args.requests, args.clients)
+    protected = request_us(True, args.requests, args.clients)
+    metrics["request_us"] = round(bare, 1)
+    metrics["protected_request_us"] = round(protected, 1)
+    metrics["overhead_per_request_us"] = round(protected - bare, 1)
+
+    print(f"token bucket check: memory {metrics['memory_check_us']} us "
+          f"({metrics['memory_check_threaded_us']} us with {args.threads} threads), "
+          f"sqlite {metrics['sqlite_check_us']} us ({metrics['sqlite_check_threaded_us']} us)")
+    print(f"admit + release: {metrics['admission_us']} us")
+    print(f"test-client request: {metrics['request_us']} us bare, {metrics['protected_request_us']} us protected "
+          f"(+{metrics['overhead_per_request_us']} us)")
+
+    if not args.no_save:
+        params = {key: value for key, value in vars(args).items() if key != "no_save"}
+        print(f"Saved to {save_result('rate_limit', params, metrics)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Cold-start cost of an entry point: what `python -X importtime` reports for importing it, the
+wall time of a fresh process up to the loaded app, and the first /api/warmup call, which
+imports the upstream SDKs and creates their clients. Each run starts new interpreters, so the
+numbers include everything a serverless cold start pays before user code handles a request.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --module app --runs 10 --top 30
+
+Results are appended to benchmarks/results/startup.jsonl; track them per deploy with
+`python -m benchmarks.results startup --compare`.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+from benchmarks.results import save_result
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# Imports the app, then calls /api/warmup if it has one; prints the timings as JSON
+_FIRST_REQUEST = """
+import json, sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1])
+loaded = time.perf_counter()
+warmup = {}
+client = module.app.test_client()
+response = client.get("/api/warmup")
+if response.status_code == 200:
+    warmup = response.get_json()
+response.close()
+print(json.dumps({"load_ms": (loaded - start) * 1000, "warmup_call_ms": (time.perf_counter() - loaded) * 1000,
+                  "warmup": warmup}))
+"""
+
+
+class ImportRow(NamedTuple):
+    module: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+
+
+def parse_importtime(stderr: str) -> List[ImportRow]:
+    """Rows of a `-X importtime` report, in the order the interpreter printed them."""
+    rows = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append(ImportRow(module, len(indent) // 2, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    # The apps refuse to start without a key; nothing here talks to OpenAI
+    env.setdefault("OPENAI_API_KEY", "stub")
+    # Lets warm-up build the Vision client without credentials; it never connects
+    env.setdefault("VISION_ENDPOINT", "http://127.0.0.1:9")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    return env
+
+
+def import_profile(module: str) -> Tuple[List[ImportRow], float]:
+    """
+    Import `module` in a fresh interpreter under -X importtime.
+    Returns:
+        Tuple[List[ImportRow], float]: The report and the process wall time in milliseconds
+    """
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, cwd=ROOT, env=_env())
+    wall = (time.perf_counter() - start) * 1000
+    if proc.returncode:
+        raise RuntimeError(f"importing {module} failed:\n{proc.stderr[-2000:]}")
+    return parse_importtime(proc.stderr), wall
+
+
+def first_request(module: str) -> Dict[str, float]:
+    """Load the app in a fresh interpreter and time the first /api/warmup call."""
+    proc = subprocess.run([sys.executable, "-c", _FIRST_REQUEST, module],
+                          capture_output=True, text=True, cwd=ROOT, env=_env())
+    if proc.returncode:
+        raise RuntimeError(f"starting {module} failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    timings = {"load_ms": result["load_ms"], "warmup_call_ms": result["warmup_call_ms"]}
+    for backend, ms in result["warmup"].get("backends", {}).items():
+        if isinstance(ms, (int, float)):
+            timings[f"warmup_{backend}_ms"] = ms
+    return timings
+
+
+def by_package(rows: List[ImportRow]) -> Dict[str, float]:
+    """Self time per top-level package in milliseconds, largest first."""
+    totals: Dict[str, float] = defaultdict(float)
+    for row in rows:
+        totals[row.module.split(".")[0]] += row.self_us / 1000
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="vercel_app", help="entry point to import")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=20, help="slowest imports and packages to list")
+    parser.add_argument("--no-warmup", action="store_true", help="skip the /api/warmup measurement")
+    parser.add_argument("--no-save", action="store_true", help="do not append the results to benchmarks/results")
+    args = parser.parse_args()
+
+    # Populate the bytecode cache so every measured run is equally warm on disk
+    import_profile(args.module)
+
+    import_ms, wall_ms, reports = [], [], []
+    for _ in range(args.runs):
+        rows, wall = import_profile(args.module)
+        target = next(row for row in reversed(rows) if row.module == args.module)
+        import_ms.append(target.cumulative_us / 1000)
+        wall_ms.append(wall)
+        reports.append(rows)
+
+    # The median run's report is representative; the others only feed the totals
+    median_run = sorted(range(args.runs), key=lambda i: import_ms[i])[args.runs // 2]
+    rows = reports[median_run]
+    print(f"{args.module}: import {statistics.median(import_ms):.1f} ms, "
+          f"process {statistics.median(wall_ms):.1f} ms (median of {args.runs})")
+    print(f"\n{'cumulative ms':>14} {'self ms':>9}  slowest imports")
+    for row in sorted(rows, key=lambda row: -row.cumulative_us)[:args.top]:
+        print(f"{row.cumulative_us / 1000:>14.1f} {row.self_us / 1000:>9.1f}  {'  ' * row.depth}{row.module}")
+    packages = by_package(rows)
+    print(f"\n{'self ms':>9}  package")
+    for package, ms in list(packages.items())[:args.top]:
+        print(f"{ms:>9.1f}  {package}")
+
+    metrics: Dict[str, float] = {
+        "import_ms": round(statistics.median(import_ms), 1),
+        "process_ms": round(statistics.median(wall_ms), 1),
+        "modules": len(rows),
+    }
+    metrics.update({f"package_{name}_ms": round(ms, 1) for name, ms in list(packages.items())[:args.top]})
+
+    if not args.no_warmup:
+        samples = [first_request(args.module) for _ in range(args.runs)]
+        warmup = {key: round(statistics.median(s[key] for s in samples if key in s), 1)
+                  for key in samples[0]}
+        print("\nfirst request (median):", "  ".join(f"{key} {ms}" for key, ms in warmup.items()))
+        metrics.update(warmup)
+
+    if not args.no_save:
+        params = {key: value for key, value in vars(args).items() if key != "no_save"}
+        print(f"Saved to {save_result('startup', params, metrics)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare ReceiptOCR.extract_text through pytesseract (a tesseract subprocess per call) against
+the persistent TesseractPool (engines kept loaded in-process via tesserocr).
+
+    python -m benchmarks.bench_tesseract --images 12 --concurrency 4
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.synthetic import RESOLUTIONS, encode_receipt, render_receipt
+from image_normalize import NormalizeConfig
+from tesseract_pool import pool_available
+
+
+def prepare_images(count, profile):
+    from receipt_ocr import ReceiptOCR
+
+    ocr = ReceiptOCR(normalize_config=NormalizeConfig())
+    images = []
+    for i in range(count):
+        content = encode_receipt(render_receipt(RESOLUTIONS["3mp"], seed=i))
+        images.append(ocr.preprocess_image(ocr.load_image(content), profile))
+    return images
+
+
+def run(ocr, images, concurrency):
+    latencies = []
+
+    def one(image):
+        start = time.perf_counter()
+        ocr.extract_text(image)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, images))
+    wall = time.perf_counter() - start
+    return {
+        "images_per_s": len(images) / wall,
+        "p50_ms": statistics.median(latencies),
+        "max_ms": max(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent extract_text calls")
+    parser.add_argument("--profile", default="fast", help="preprocessing profile applied before OCR")
+    args = parser.parse_args()
+
+    from receipt_ocr import ReceiptOCR
+
+    images = prepare_images(args.images, args.profile)
+    print(f"{len(images)} images, mean {np.mean([image.size for image in images]) / 1e6:.1f} MP, "
+          f"concurrency {args.concurrency}")
+
+    backends = [("pytesseract", ReceiptOCR(ocr_pool_size=0))]
+    if pool_available():
+        backends.append(("TesseractPool", ReceiptOCR(ocr_pool_size=args.concurrency)))
+    else:
+        print("tesserocr is not installed; only the pytesseract path is measured")
+
+    for name, ocr in backends:
+        # Warm-up call so engine startup is not attributed to the first image
+        ocr.extract_text(images[0])
+        stats = run(ocr, images, args.concurrency)
+        print(f"{name:>14}: {stats['images_per_s']:6.2f} images/s  p50 {stats['p50_ms']:7.1f} ms  "
+              f"max {stats['max_ms']:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
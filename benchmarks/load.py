@@ -0,0 +1,202 @@
+"""
+Load test for POST /api/process-receipt: throughput, latency percentiles and errors.
+
+    python -m benchmarks.load --requests 500 --concurrency 16
+    python -m benchmarks.load --vision-latency 0.3 --vision-jitter 0.2 --openai-latency 0.8 \
+        --openai-error-rate 0.02
+    python -m benchmarks.load --url http://127.0.0.1:8000 --requests 200   # a server you started
+
+By default the Flask app is started in-process on a free port, with Cloud Vision and OpenAI
+pointed at the stub servers from benchmarks/stubs.py and the result cache off, so every
+request does the full pipeline with only the configured upstream latency. The driver shares
+a process (and the GIL) with the app in that mode; for numbers closer to production, start
+the stubs and a gunicorn server separately and pass --url.
+
+Uploads are synthetic receipt photos (benchmarks/synthetic.py) at mixed resolutions. Set
+RECEIPT_PARSER_MIN_CONFIDENCE=1.1 to force every receipt through the LLM. Results, including
+the server's per-stage means from /metrics, are appended to benchmarks/results/load.jsonl.
+"""
+import argparse
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence, Tuple
+
+import openai
+import requests
+
+from benchmarks.results import save_result
+from benchmarks.stubs import OpenAIStubHandler, VisionStubHandler, add_fault_arguments, fault_settings, start_stub_server
+from benchmarks.synthetic import generate_corpus
+from receipt_core.llm import LEGACY_OPENAI
+from receipt_core.routing import percentile
+
+ENDPOINT = "/api/process-receipt"
+
+
+def start_app(module: str, vision_url: str, openai_url: str, cache: str,
+              log_level: str = "WARNING") -> Tuple[Any, str]:
+    """
+    Import the app with its upstreams pointed at the stubs and serve it on a background thread.
+    Returns:
+        Tuple[werkzeug.serving.BaseWSGIServer, str]: The server and its base URL
+    """
+    # Read at import time by the backends and the cache, so set before importing the app
+    os.environ["VISION_ENDPOINT"] = vision_url
+    os.environ["OPENAI_BASE_URL"] = f"{openai_url}/v1"
+    if LEGACY_OPENAI:
+        # openai<1.0 reads OPENAI_API_BASE once, when it is imported
+        openai.api_base = f"{openai_url}/v1"  # type: ignore[attr-defined]
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ["RECEIPT_CACHE_BACKEND"] = cache
+    # Every simulated client is 127.0.0.1 and the corpus repeats, so coalescing would skip the work being measured
+    os.environ.setdefault("UPLOAD_DEDUPE_WINDOW", "0")
+    # ...and one client's token bucket would refuse most of the run; admission control stays on
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "none")
+
+    import importlib
+
+    from werkzeug.serving import make_server
+
+    module_name, _, attribute = module.partition(":")
+    app = getattr(importlib.import_module(module_name), attribute or "app")
+    # The app configures INFO logging on import; per-request access lines would swamp the report
+    logging.getLogger().setLevel(log_level)
+    logging.getLogger("werkzeug").setLevel(log_level)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def run_load(url: str, images: Sequence[Tuple[str, bytes]], total: int, concurrency: int,
+             timeout: float = 60.0) -> Tuple[List[float], Counter, float]:
+    """
+    Send `total` uploads with `concurrency` clients, each cycling through the images.
+    Returns:
+        Tuple[List[float], Counter, float]: Latencies in seconds, status counts (0 for
+        connection errors) and wall time
+    """
+    local = threading.local()
+    counter = itertools.count()
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    lock = threading.Lock()
+
+    def client() -> None:
+        session = getattr(local, "session", None) or requests.Session()
+        local.session = session
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            name, content = images[i % len(images)]
+            start = time.perf_counter()
+            try:
+                status = session.post(url + ENDPOINT, files={"file": (name, content, "image/jpeg")},
+                                      timeout=timeout).status_code
+            except requests.exceptions.RequestException:
+                status = 0
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    return latencies, statuses, time.perf_counter() - start
+
+
+def stage_means(metrics_text: str) -> Dict[str, float]:
+    """Mean milliseconds per stage from receipt_stage_seconds in a /metrics scrape."""
+    sums: Dict[str, float] = {}
+    counts: Dict[str, float] = {}
+    for match in re.finditer(r'^receipt_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', metrics_text, re.MULTILINE):
+        kind, stage, value = match.groups()
+        (sums if kind == "sum" else counts)[stage] = float(value)
+    return {stage: round(1000 * sums[stage] / counts[stage], 2) for stage in sums if counts.get(stage)}
+
+
+def summarize(latencies: List[float], statuses: Counter, wall: float) -> Dict[str, Any]:
+    ok = statuses.get(200, 0)
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / wall, 2),
+        "ok_rps": round(ok / wall, 2),
+        "error_rate": round(1 - ok / len(latencies), 4) if latencies else None,
+        "p50_ms": round(percentile(ms, 50), 1),
+        "p95_ms": round(percentile(ms, 95), 1),
+        "p99_ms": round(percentile(ms, 99), 1),
+        "max_ms": round(max(ms), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running server (default: start the app in-process)")
+    parser.add_argument("--app", default="app:app", help="WSGI app to start in-process, module:attribute")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=10, help="requests sent before measuring")
+    parser.add_argument("--images", type=int, default=12, help="distinct synthetic receipts to upload")
+    parser.add_argument("--resolutions", default="3mp,8mp,12mp", help="comma-separated, see benchmarks/synthetic.py")
+    parser.add_argument("--cache", default="none", help="RECEIPT_CACHE_BACKEND for the in-process app")
+    parser.add_argument("--log-level", default="WARNING", help="log level of the in-process app")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed OpenAI tokens")
+    add_fault_arguments(parser, "vision-")
+    add_fault_arguments(parser, "openai-")
+    parser.add_argument("--no-save", action="store_true", help="do not append the results to benchmarks/results")
+    args = parser.parse_args()
+
+    print(f"Rendering {args.images} synthetic receipts...")
+    images = generate_corpus(args.images, tuple(args.resolutions.split(",")))
+
+    stubs = []
+    url = args.url
+    if url is None:
+        vision, vision_url = start_stub_server(VisionStubHandler, **fault_settings(args, "vision-"))
+        openai, openai_url = start_stub_server(OpenAIStubHandler, token_delay=args.token_delay,
+                                               **fault_settings(args, "openai-"))
+        stubs = [vision, openai]
+        server, url = start_app(args.app, vision_url, openai_url, args.cache, args.log_level)
+        stubs.append(server)
+    url = url.rstrip("/")
+
+    if args.warmup:
+        run_load(url, images, args.warmup, min(args.concurrency, args.warmup))
+    latencies, statuses, wall = run_load(url, images, args.requests, args.concurrency)
+    metrics = summarize(latencies, statuses, wall)
+
+    print(f"{metrics['requests']} requests, concurrency {args.concurrency}, {wall:.1f}s")
+    print(f"  {metrics['rps']} req/s ({metrics['ok_rps']} ok/s), error rate {metrics['error_rate']:.2%}")
+    print(f"  p50 {metrics['p50_ms']} ms  p95 {metrics['p95_ms']} ms  p99 {metrics['p99_ms']} ms  "
+          f"max {metrics['max_ms']} ms")
+    print("  status:", dict(sorted(statuses.items())))
+
+    try:
+        stages = stage_means(requests.get(url + "/metrics", timeout=10).text)
+    except requests.exceptions.RequestException:
+        stages = {}
+    if stages:
+        print("  mean stage ms (server side, warm-up included):",
+              "  ".join(f"{stage} {ms}" for stage, ms in stages.items()))
+    metrics.update({f"stage_{stage}_ms": ms for stage, ms in stages.items()})
+    metrics.update({f"status_{status}": count for status, count in statuses.items()})
+
+    if not args.no_save:
+        params = {key: value for key, value in vars(args).items() if key != "no_save"}
+        print(f"Saved to {save_result('load', params, metrics)}")
+
+    for server in stubs:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Stored benchmark results. Each run is appended as one JSON line to
+benchmarks/results/<benchmark>.jsonl (or BENCHMARK_RESULTS_DIR), with the git commit, Python
+version and machine it ran on, so runs can be compared over time.
+
+    python -m benchmarks.results load              # recent load-test runs
+    python -m benchmarks.results load --compare    # latest run against the one before
+    python -m benchmarks.results ocr --compare 3   # latest run against the third most recent
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+RESULTS_DIR = Path(os.getenv("BENCHMARK_RESULTS_DIR", Path(__file__).resolve().parent / "results"))
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, timeout=5,
+                              cwd=Path(__file__).resolve().parent).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    """Where and on what code a benchmark ran."""
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def save_result(benchmark: str, params: Dict[str, Any], metrics: Dict[str, Any],
+                results_dir: Optional[Path] = None) -> Path:
+    """
+    Append one run to the benchmark's results file.
+    Args:
+        benchmark (str): Benchmark name, also the file name
+        params (Dict[str, Any]): Settings the run used
+        metrics (Dict[str, Any]): Flat mapping of metric name to value
+        results_dir (Path, optional): Directory, defaults to RESULTS_DIR
+    Returns:
+        Path: The results file
+    """
+    path = Path(results_dir or RESULTS_DIR) / f"{benchmark}.jsonl"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as f:
+        f.write(json.dumps({"benchmark": benchmark, **environment(), "params": params, "metrics": metrics}) + "\n")
+    return path
+
+
+def load_results(benchmark: str, results_dir: Optional[Path] = None) -> List[Dict[str, Any]]:
+    """Every stored run of a benchmark, oldest first."""
+    path = Path(results_dir or RESULTS_DIR) / f"{benchmark}.jsonl"
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Metric-by-metric comparison of two runs.
+    Returns:
+        List[Dict[str, Any]]: {"metric", "before", "after", "change_pct"} rows for metrics in either run
+    """
+    rows = []
+    for name in sorted(set(before["metrics"]) | set(after["metrics"])):
+        old, new = before["metrics"].get(name), after["metrics"].get(name)
+        change = None
+        if isinstance(old, (int, float)) and isinstance(new, (int, float)) and old:
+            change = round(100 * (new - old) / old, 1)
+        rows.append({"metric": name, "before": old, "after": new, "change_pct": change})
+    return rows
+
+
+def _label(run: Dict[str, Any]) -> str:
+    return f"{run['time']} {run.get('commit') or '?'}{'+' if run.get('dirty') else ''}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", help="benchmark name, e.g. load or ocr")
+    parser.add_argument("--last", type=int, default=5, help="runs to list")
+    parser.add_argument("--compare", type=int, nargs="?", const=2, metavar="N",
+                        help="compare the latest run with the Nth most recent (default: the previous one)")
+    args = parser.parse_args()
+
+    runs = load_results(args.benchmark)
+    if not runs:
+        print(f"No stored results for {args.benchmark} in {RESULTS_DIR}")
+        return
+
+    if args.compare:
+        if len(runs) < args.compare:
+            print(f"Only {len(runs)} stored runs")
+            return
+        before, after = runs[-args.compare], runs[-1]
+        print(f"before: {_label(before)}  {json.dumps(before['params'])}")
+        print(f"after:  {_label(after)}  {json.dumps(after['params'])}")
+        width = max(len(row["metric"]) for row in compare(before, after))
+        for row in compare(before, after):
+            change = f"{row['change_pct']:+.1f}%" if row["change_pct"] is not None else ""
+            print(f"{row['metric']:<{width}}  {str(row['before']):>12}  {str(row['after']):>12}  {change:>8}")
+        return
+
+    for run in runs[-args.last:]:
+        print(_label(run), json.dumps(run["params"]))
+        print("   ", "  ".join(f"{name}={value}" for name, value in run["metrics"].items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Local stand-ins for upstream services, for benchmarks and manual testing without network access.
+
+    python -m benchmarks.stubs ollama --port 11434 --token-delay 0.01
+    python -m benchmarks.stubs vision --port 8081 --latency 0.3 --jitter 0.1
+    python -m benchmarks.stubs openai --port 8082 --latency 0.8 --error-rate 0.02
+
+Then point the app at the stubs:
+
+    OLLAMA_URL=http://127.0.0.1:11434
+    VISION_ENDPOINT=http://127.0.0.1:8081
+    OPENAI_BASE_URL=http://127.0.0.1:8082/v1 OPENAI_API_KEY=stub
+
+Every stub adds `--latency` seconds plus an exponentially distributed `--jitter` (so there
+is a latency tail), and fails `--error-rate` of requests with `--error-status`.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple, Type
+from urllib.parse import urlparse
+
+from benchmarks.synthetic import receipt_lines, receipt_text
+from receipt_parser import parse_receipt
+from receipt_prompts import RECIPE_SYSTEM_PROMPT
+
+
+class StubServer(ThreadingHTTPServer):
+    """HTTP server holding the stub settings its handlers read, and request/error counts."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], handler: Type["StubHandler"], token_delay: float = 0.0,
+                 repeat: int = 1, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 503, seed: int = 0):
+        super().__init__(address, handler)
+        self.token_delay = token_delay
+        self.repeat = repeat
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Base handler: JSON helpers, quiet logging and latency/error injection. Settings live on
+    the server object.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server: StubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def inject_faults(self) -> bool:
+        """
+        Sleep for the configured latency, then fail the request with the configured error rate.
+        Returns:
+            bool: True if an error response was sent and the handler should stop
+        """
+        server = self.server
+        with server.lock:
+            delay = server.latency + (server.rng.expovariate(1 / server.jitter) if server.jitter else 0.0)
+            fail = server.rng.random() < server.error_rate
+            server.requests += 1
+            server.errors += fail
+        if delay:
+            time.sleep(delay)
+        if fail:
+            self.send_json({"error": {"code": server.error_status, "message": "injected failure"}},
+                           status=server.error_status)
+        return fail
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class OllamaStubHandler(StubHandler):
+    """
+    Mimics Ollama's POST /api/generate: streams one JSON object per line with a "response"
+    fragment, then a final {"done": true} line. The reply echoes the model name and the
+    first words of the prompt so callers can check what was sent.
+    """
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self.send_json({"error": "not found"}, status=404)
+            return
+        payload = self.read_json()
+        if self.inject_faults():
+            return
+        words = f"stub reply from {payload.get('model')}: {' '.join(payload.get('prompt', '').split()[:20])}".split(" ")
+        tokens = [word + " " for word in words] * self.server.repeat
+
+        if not payload.get("stream", True):
+            self.send_json({"model": payload.get("model"), "response": "".join(tokens), "done": True})
+            return
+
+        self.start_chunked("application/x-ndjson")
+        for token in tokens:
+            time.sleep(self.server.token_delay)
+            self._write_chunk(json.dumps({"model": payload.get("model"), "response": token, "done": False}) + "\n")
+        self._write_chunk(json.dumps({"model": payload.get("model"), "response": "", "done": True}) + "\n")
+        self.end_chunked()
+
+
+# Layout of the simulated word boxes, in pixels
+CHAR_WIDTH = 18
+LINE_HEIGHT = 40
+
+
+def _box(x0: int, y0: int, x1: int, y1: int) -> Dict[str, Any]:
+    return {"vertices": [{"x": x0, "y": y0}, {"x": x1, "y": y0}, {"x": x1, "y": y1}, {"x": x0, "y": y1}]}
+
+
+def vision_annotations(content: bytes) -> List[Dict[str, Any]]:
+    """
+    Text annotations for an image, as Vision's REST API returns them: the full text first,
+    then one entry per word with its bounding box. The receipt is synthetic, seeded by the
+    image bytes, so the same upload always reads the same and different uploads differ.
+    """
+    rng = random.Random(int(hashlib.sha256(content).hexdigest()[:16], 16))
+    lines = receipt_lines(rng, rng.randint(6, 16))
+    words = []
+    for row, (left, right) in enumerate(lines):
+        y = 100 + row * LINE_HEIGHT + rng.randint(-4, 4)
+        x = 60
+        for token in left.split():
+            words.append({"description": token, "boundingPoly": _box(x, y, x + CHAR_WIDTH * len(token), y + 28)})
+            x += CHAR_WIDTH * (len(token) + 1)
+        if right:
+            x1 = 60 + CHAR_WIDTH * 32
+            words.append({"description": right, "boundingPoly": _box(x1 - CHAR_WIDTH * len(right), y, x1, y + 28)})
+    page = _box(60, 100, 60 + CHAR_WIDTH * 32, 100 + LINE_HEIGHT * len(lines))
+    full = {"description": receipt_text(lines), "boundingPoly": page}
+    return [full, *words]
+
+
+class VisionStubHandler(StubHandler):
+    """
+    Mimics Cloud Vision's REST POST /v1/images:annotate (what ImageAnnotatorClient sends with
+    transport="rest"): one response per request, with text annotations for a synthetic receipt.
+    """
+
+    def do_POST(self):
+        if not urlparse(self.path).path.endswith("images:annotate"):
+            self.send_json({"error": {"code": 404, "message": "not found"}}, status=404)
+            return
+        payload = self.read_json()
+        if self.inject_faults():
+            return
+        responses = []
+        for request in payload.get("requests", []):
+            content = base64.b64decode(request.get("image", {}).get("content", ""))
+            annotations = vision_annotations(content)
+            responses.append({"textAnnotations": annotations,
+                              "fullTextAnnotation": {"text": annotations[0]["description"]}})
+        self.send_json({"responses": responses})
+
+
+STUB_RECIPES = {"recipes": [{
+    "name": "Stub Skillet",
+    "additional_ingredients": ["salt", "pepper"],
+    "instructions": ["Chop everything.", "Cook it in a hot pan for 15 minutes."],
+    "cooking_time": "20 minutes",
+    "difficulty": "Easy",
+}]}
+
+
+def chat_reply(messages: List[dict]) -> str:
+    """
+    A plausible reply to one of the app's prompts: canned recipes for recipe prompts, and the
+    local parser's reading of the receipt text (one entry per receipt for batched prompts).
+    """
+    if any(m["role"] == "system" and m["content"] == RECIPE_SYSTEM_PROMPT for m in messages):
+        return json.dumps(STUB_RECIPES)
+    prompt = messages[-1]["content"]
+    batch = re.split(r"^\s*### Receipt \d+\s*$", prompt, flags=re.MULTILINE)
+    if len(batch) > 1:
+        return json.dumps({"receipts": [parse_receipt(text).data for text in batch[1:]]})
+    # The receipt text follows a one-line lead-in
+    return json.dumps(parse_receipt(prompt.partition("\n")[2]).data)
+
+
+class OpenAIStubHandler(StubHandler):
+    """
+    Mimics OpenAI's POST /v1/chat/completions, streamed (server-sent events, `token_delay`
+    seconds apart) or not. Replies come from chat_reply; usage counts are rough word counts.
+    """
+
+    def do_POST(self):
+        if not urlparse(self.path).path.rstrip("/").endswith("/chat/completions"):
+            self.send_json({"error": {"message": "not found"}}, status=404)
+            return
+        payload = self.read_json()
+        if self.inject_faults():
+            return
+        reply = chat_reply(payload.get("messages", []))
+        model = payload.get("model", "stub")
+        created = int(time.time())
+        prompt_tokens = sum(len(m.get("content", "").split()) for m in payload.get("messages", []))
+
+        if not payload.get("stream"):
+            self.send_json({
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(reply.split()),
+                          "total_tokens": prompt_tokens + len(reply.split())},
+            })
+            return
+
+        self.start_chunked("text/event-stream")
+        # Roughly token-sized pieces
+        for piece in re.findall(r"\S+\s*|\s+", reply):
+            time.sleep(self.server.token_delay)
+            chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        done = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self._write_chunk(f"data: {json.dumps(done)}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.end_chunked()
+
+
+def start_stub_server(handler: Type[StubHandler], host: str = "127.0.0.1", port: int = 0,
+                      **settings) -> Tuple[StubServer, str]:
+    """
+    Start a stub server on a background thread.
+    Args:
+        handler (Type[StubHandler]): Handler class
+        host (str): Bind address
+        port (int): Port, 0 picks a free one
+        **settings: StubServer settings for the handler to read: token_delay, repeat,
+            latency, jitter, error_rate, error_status and seed
+    Returns:
+        Tuple[StubServer, str]: The running server (call shutdown() to stop) and its base URL
+    """
+    server = StubServer((host, port), handler, **settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+STUBS = {"ollama": OllamaStubHandler, "vision": VisionStubHandler, "openai": OpenAIStubHandler}
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser, prefix: str = "") -> None:
+    """Add --latency, --jitter, --error-rate and --error-status (optionally prefixed, e.g. --vision-latency)."""
+    parser.add_argument(f"--{prefix}latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument(f"--{prefix}jitter", type=float, default=0.0,
+                        help="mean of an exponentially distributed extra delay, in seconds")
+    parser.add_argument(f"--{prefix}error-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument(f"--{prefix}error-status", type=int, default=503, help="HTTP status of injected failures")
+
+
+def fault_settings(args: argparse.Namespace, prefix: str = "") -> Dict[str, Any]:
+    prefix = prefix.replace("-", "_")
+    return {name: getattr(args, prefix + name) for name in ("latency", "jitter", "error_rate", "error_status")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("service", choices=sorted(STUBS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--repeat", type=int, default=1, help="repeat the reply this many times")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server, url = start_stub_server(STUBS[args.service], args.host, args.port,
+                                    token_delay=args.token_delay, repeat=args.repeat, **fault_settings(args))
+    print(f"{args.service} stub listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
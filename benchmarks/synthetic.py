@@ -0,0 +1,131 @@
+"""
+Synthetic receipt photos for benchmarks: a white receipt with item lines on a darker
+background, rendered at phone-camera resolutions with optional EXIF rotation.
+"""
+import io
+import random
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+MERCHANTS = ["FRESH MART", "CORNER GROCERY", "GREEN VALLEY FOODS", "CITY SUPERMARKET"]
+ITEMS = [
+    "ORG BNLS CHKN BRST", "BANANAS", "WHOLE MILK 1GAL", "LG EGGS 12CT", "SPINACH 10OZ",
+    "CHEDDAR SHRP", "SOURDOUGH LOAF", "ROMA TOMATOES", "YELLOW ONIONS", "GARLIC",
+    "BASMATI RICE 2LB", "OLIVE OIL EV", "PAPER TOWELS", "DISH SOAP", "GRND BEEF 80/20",
+    "AVOCADOS 4CT", "GREEK YOGURT", "PASTA PENNE", "BROCCOLI CROWNS", "CARROTS 2LB",
+]
+
+# Common phone camera resolutions (width, height), portrait
+RESOLUTIONS = {
+    "3mp": (1536, 2048),
+    "8mp": (2448, 3264),
+    "12mp": (3024, 4032),
+}
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 has no scalable default font
+        return ImageFont.load_default()
+
+
+def receipt_lines(rng: random.Random, n_items: int) -> List[Tuple[str, str]]:
+    """
+    Build the lines of a plausible grocery receipt as (left text, right-aligned amount) pairs.
+    """
+    lines = [(rng.choice(MERCHANTS), ""), ("123 MAIN ST", ""),
+             (f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2024 {rng.randint(8, 21):02d}:{rng.randint(0, 59):02d}", ""),
+             ("", "")]
+    subtotal = 0.0
+    for name in rng.sample(ITEMS, min(n_items, len(ITEMS))):
+        price = round(rng.uniform(0.79, 14.99), 2)
+        subtotal += price
+        lines.append((name, f"{price:.2f}"))
+    tax = round(subtotal * 0.0825, 2)
+    lines += [("", ""), ("SUBTOTAL", f"{subtotal:.2f}"), ("TAX", f"{tax:.2f}"),
+              ("TOTAL", f"{subtotal + tax:.2f}"), ("", ""), ("VISA ************1234", ""),
+              ("THANK YOU FOR SHOPPING", "")]
+    return lines
+
+
+def receipt_text(lines: List[Tuple[str, str]], width: int = 32) -> str:
+    """
+    Plain-text rendering of receipt lines, as a perfect OCR engine would read them.
+    """
+    return "\n".join(f"{left:<{width - len(right)}}{right}" if right else left for left, right in lines)
+
+
+def render_receipt(size: Tuple[int, int] = RESOLUTIONS["12mp"], seed: int = 0, n_items: int = 12,
+                   rotate_exif: bool = False) -> Image.Image:
+    """
+    Render a synthetic receipt photo.
+    Args:
+        size (Tuple[int, int]): Output (width, height)
+        seed (int): Random seed; the same seed renders the same receipt
+        n_items (int): Number of item lines
+        rotate_exif (bool): Store the image rotated 90° so only the EXIF tag makes it upright
+    Returns:
+        PIL.Image.Image: RGB image
+    """
+    rng = random.Random(seed)
+    width, height = size
+    image = Image.new("RGB", size, (rng.randint(60, 110),) * 3)
+    paper = (int(width * 0.15), int(height * 0.05), int(width * 0.85), int(height * 0.95))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle(paper, fill=(245, 243, 236))
+
+    lines = receipt_lines(rng, n_items)
+    line_height = (paper[3] - paper[1]) // (len(lines) + 4)
+    font = _font(int(line_height * 0.7))
+    left_x = paper[0] + int(width * 0.04)
+    right_x = paper[2] - int(width * 0.04)
+    y = paper[1] + line_height * 2
+    for left, right in lines:
+        draw.text((left_x, y), left, fill=(25, 25, 25), font=font)
+        if right:
+            draw.text((right_x - draw.textlength(right, font=font), y), right, fill=(25, 25, 25), font=font)
+        y += line_height
+
+    image = image.rotate(rng.uniform(-3, 3), resample=Image.Resampling.BICUBIC, fillcolor=(80, 80, 80))
+    image = image.filter(ImageFilter.GaussianBlur(radius=max(width, height) / 3000))
+    if rotate_exif:
+        image = image.transpose(Image.Transpose.ROTATE_90)
+    return image
+
+
+def encode_receipt(image: Image.Image, quality: int = 95, exif_orientation: Optional[int] = None) -> bytes:
+    """
+    Encode a rendered receipt as a camera-style JPEG.
+    Args:
+        image (PIL.Image.Image): Rendered receipt
+        quality (int): JPEG quality
+        exif_orientation (int, optional): EXIF orientation tag to embed
+    Returns:
+        bytes: JPEG bytes
+    """
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    if exif_orientation:
+        exif[0x0112] = exif_orientation
+    image.save(buffer, format="JPEG", quality=quality, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def generate_corpus(count: int = 6, resolutions=("3mp", "8mp", "12mp"), seed: int = 0) -> List[Tuple[str, bytes]]:
+    """
+    Generate a small corpus of synthetic receipt photos at mixed resolutions.
+    Every other image is stored rotated with an EXIF orientation tag.
+    Returns:
+        List[Tuple[str, bytes]]: (name, JPEG bytes) pairs
+    """
+    corpus = []
+    for i in range(count):
+        resolution = resolutions[i % len(resolutions)]
+        rotated = i % 2 == 1
+        image = render_receipt(RESOLUTIONS[resolution], seed=seed + i, n_items=8 + (i * 3) % 12, rotate_exif=rotated)
+        # Orientation 6 means "rotate 90° clockwise to display", undoing ROTATE_90
+        corpus.append((f"synthetic_{i:02d}_{resolution}.jpg", encode_receipt(image, exif_orientation=6 if rotated else None)))
+    return corpus
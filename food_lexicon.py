@@ -0,0 +1,615 @@
+"""
+Local food and ingredient lexicon for receipt item names. A name is tokenized, receipt
+abbreviations are expanded ("ORG BNLS CHKN BRST" reads as organic boneless chicken breast)
+and the tokens run through a word-level Aho-Corasick automaton of ingredient phrases, so
+"chicken breast" and "chicken" are found in one pass and the longer phrase wins. Tokens the
+vocabulary does not know get a fuzzy lookup (a deletion index, edit distance 1, or 2 for
+long words) to absorb OCR typos. Lookups are cached; a warm one takes a few microseconds.
+"""
+import os
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
+
+from metrics import FOOD_TAGS
+
+# Set to 0 to match exact and abbreviated words only
+FUZZY_MAX_EDITS = int(os.getenv("FOOD_LEXICON_MAX_EDITS", "2"))
+# Shorter tokens are too often a different word one edit away ("each" and "peach")
+FUZZY_MIN_LENGTH = 5
+# Item names remembered per lexicon
+CACHE_SIZE = int(os.getenv("FOOD_LEXICON_CACHE_SIZE", "8192"))
+
+# One canonical ingredient per line, then the phrases that name it; the canonical name is
+# always one of its phrases. Phrases are singular and use expanded words, not abbreviations.
+INGREDIENTS = """
+apple: gala, fuji, honeycrisp, granny smith, pink lady, braeburn
+avocado: hass avocado, avo
+banana: plantain
+blueberry
+strawberry
+raspberry
+blackberry
+cranberry
+grape: red grape, green grape
+lemon
+lime
+orange: navel orange, navel, blood orange
+mandarin: clementine, tangerine, cutie
+grapefruit
+mango
+pineapple
+peach: nectarine
+pear: bartlett, anjou, bosc
+plum
+cherry: bing cherry
+apricot
+kiwi
+pomegranate
+watermelon
+melon: cantaloupe, honeydew
+coconut
+date: medjool
+fig
+raisin
+broccoli: broccoli crown, broccolini
+cauliflower
+carrot: baby carrot
+celery
+cucumber: english cucumber, pickle cucumber
+lettuce: romaine, iceberg, butter lettuce, spring mix, mixed green, salad mix
+spinach: baby spinach
+kale
+arugula: rocket
+cabbage: red cabbage, napa cabbage, bok choy
+brussels sprout
+zucchini: courgette
+squash: butternut squash, acorn squash, spaghetti squash, yellow squash
+pumpkin
+eggplant: aubergine
+asparagus
+green bean: string bean, french bean, haricot vert
+bell pepper: pepper, sweet pepper, red pepper, green pepper, yellow pepper, orange pepper, capsicum
+jalapeno: serrano, habanero, chili pepper, chile pepper, poblano
+onion: yellow onion, red onion, white onion, sweet onion, vidalia
+green onion: scallion, spring onion
+shallot
+leek
+garlic
+ginger
+potato: russet, yukon gold, red potato, gold potato, baby potato
+sweet potato: yam
+tomato: roma, cherry tomato, grape tomato, heirloom tomato, tomato on the vine
+mushroom: portobello, cremini, baby bella, shiitake, white mushroom, oyster mushroom
+corn: sweet corn, corn on the cob
+pea: snap pea, snow pea, green pea
+beet
+radish
+turnip
+parsnip
+artichoke
+okra
+basil
+cilantro: coriander
+parsley
+mint
+dill
+rosemary
+thyme
+oregano
+sage
+chive
+chicken: whole chicken, rotisserie chicken, chicken tender, chicken tenderloin
+chicken breast
+chicken thigh
+chicken wing: wing
+chicken drumstick: drumstick
+ground beef: hamburger, ground chuck, ground round, ground sirloin, lean ground beef
+beef: chuck roast, brisket, stew meat, beef roast, short rib, roast beef
+steak: ribeye, sirloin, strip steak, new york strip, flank steak, skirt steak, filet mignon, t bone
+pork: pork loin, pork shoulder, pork tenderloin, pork butt, spare rib, baby back rib
+pork chop
+ground pork
+ham: deli ham, spiral ham
+bacon: turkey bacon
+sausage: bratwurst, chorizo, kielbasa, italian sausage, breakfast sausage
+hot dog: frank, frankfurter, wiener
+turkey: turkey breast, deli turkey
+ground turkey
+lamb: lamb chop, leg of lamb
+salami
+pepperoni
+prosciutto
+salmon: salmon fillet, atlantic salmon, smoked salmon
+tuna: tuna steak, canned tuna
+cod
+tilapia
+shrimp: prawn
+crab: crab meat
+scallop
+fish: fish fillet, white fish
+milk: whole milk, skim milk, low fat milk, reduced fat milk, lactose free milk
+almond milk
+oat milk
+soy milk
+butter: unsalted butter, salted butter
+cheese: american cheese, cheese slice, shredded cheese, string cheese, monterey jack, colby jack, pepper jack
+cheddar: cheddar cheese, sharp cheddar
+mozzarella: fresh mozzarella
+parmesan: parmigiano, parmigiano reggiano, grana padano
+feta
+swiss cheese: swiss
+provolone
+cream cheese
+cottage cheese
+ricotta
+goat cheese: chevre
+brie
+yogurt: yoghurt
+greek yogurt
+cream: heavy cream, whipping cream, heavy whipping cream, half and half, creamer
+sour cream
+egg: large egg, brown egg, cage free egg
+ice cream: gelato
+bread: white bread, wheat bread, whole wheat bread, sandwich bread, sourdough, rye bread, loaf, multigrain bread
+baguette
+bagel
+croissant
+tortilla: flour tortilla, corn tortilla
+pita
+naan
+bun: hamburger bun, hot dog bun, brioche bun
+dinner roll
+english muffin
+muffin
+cake
+cookie
+donut: doughnut
+pie
+cracker
+rice: jasmine rice, basmati rice, brown rice, white rice, arborio
+pasta: spaghetti, penne, macaroni, fettuccine, linguine, rigatoni, lasagna, rotini, farfalle, fusilli, orzo
+noodle: ramen, egg noodle, udon, rice noodle, soba
+flour: all purpose flour, bread flour
+sugar: brown sugar, powdered sugar, cane sugar
+baking soda
+baking powder
+yeast
+salt: sea salt, kosher salt
+black pepper: peppercorn, ground pepper
+cinnamon
+paprika
+cumin
+chili powder
+vanilla: vanilla extract
+olive oil: extra virgin olive oil
+vegetable oil: canola oil, canola, sunflower oil, cooking oil
+vinegar: balsamic vinegar, apple cider vinegar, red wine vinegar
+soy sauce: tamari
+ketchup: catsup
+mustard: dijon
+mayonnaise: mayo
+hot sauce: sriracha, tabasco
+salsa
+barbecue sauce: bbq sauce
+tomato sauce: marinara, pasta sauce, passata, spaghetti sauce
+tomato paste
+canned tomato: diced tomato, crushed tomato
+honey
+maple syrup: syrup, pancake syrup
+jam: jelly, preserves
+peanut butter
+bean: black bean, pinto bean, kidney bean, navy bean, cannellini, refried bean
+chickpea: chick pea, garbanzo
+lentil
+oats: oat, oatmeal, rolled oat
+cereal: granola, corn flake
+almond
+walnut
+pecan
+cashew
+peanut
+pistachio
+nuts: nut, mixed nut, trail mix
+chips: chip, tortilla chip, potato chip, crisp
+popcorn
+pretzel
+chocolate: dark chocolate, chocolate bar, chocolate chip
+candy
+soup
+broth: chicken broth, beef broth, vegetable broth, stock, chicken stock, bone broth
+coffee: ground coffee, coffee bean, espresso
+tea: green tea, black tea
+orange juice
+apple juice
+juice
+water: sparkling water, seltzer, spring water, mineral water
+soda: cola, soft drink
+beer
+wine: red wine, white wine
+tofu
+tempeh
+hummus
+guacamole
+pizza: frozen pizza
+dumpling
+"""
+
+# Words that say an item is food without naming an ingredient ("ORGANIC", "PRODUCE 4011")
+FOOD_MARKERS = """
+food fresh organic fruit vegetable veggie meat dairy produce grocery deli bakery seafood poultry
+spice herb snack frozen entree salad
+"""
+
+# Phrases that make an item something other than food, whatever else its name says
+NON_FOOD = """
+bag, bag fee, battery, bleach, light bulb, bulb, candle, charger, cleaner, conditioner, deodorant,
+detergent, laundry, dish soap, dishwasher, diaper, aluminum foil, foil, lotion, napkin, paper towel,
+toilet paper, paper plate, paper, razor, shampoo, soap, body wash, sponge, tissue, toothbrush,
+toothpaste, floss, mouthwash, towel, trash bag, garbage bag, trash, wipe, plastic wrap, cling wrap,
+zip bag, storage bag, vitamin, supplement, ibuprofen, acetaminophen, bandage, sunscreen, cotton,
+tampon, cat litter, litter, dog, cat, pet, charcoal, lighter, lottery, magazine, greeting card,
+gift card, card, deposit, bottle deposit, crv, battery pack, cable, shopping bag
+"""
+
+# Receipt abbreviations and the words they stand for
+ABBREVIATIONS = {
+    "org": "organic", "orgnc": "organic", "frsh": "fresh", "frz": "frozen", "frzn": "frozen",
+    "chkn": "chicken", "chk": "chicken", "ckn": "chicken", "brst": "breast",
+    "bnls": "boneless", "bls": "boneless", "sknls": "skinless", "thgh": "thigh", "thi": "thigh",
+    "grnd": "ground", "grd": "ground", "bf": "beef", "trky": "turkey", "tky": "turkey",
+    "bcn": "bacon", "saus": "sausage", "sausg": "sausage", "slmn": "salmon", "shrmp": "shrimp",
+    "stk": "steak", "whl": "whole", "wht": "white", "ww": "whole wheat",
+    "brd": "bread", "bnn": "banana", "bnna": "banana", "ban": "banana", "avoc": "avocado",
+    "tom": "tomato", "toms": "tomato", "tmto": "tomato", "pots": "potato",
+    "ptato": "potato", "swt": "sweet", "onn": "onion", "onin": "onion", "grn": "green",
+    "rd": "red", "ylw": "yellow", "yel": "yellow", "lett": "lettuce", "ltc": "lettuce",
+    "rom": "romaine", "spin": "spinach", "mush": "mushroom", "mshrm": "mushroom", "brocc": "broccoli",
+    "broc": "broccoli", "cuc": "cucumber", "cuke": "cucumber", "zuc": "zucchini", "zucc": "zucchini",
+    "strwb": "strawberry", "strawb": "strawberry", "stwb": "strawberry", "blubry": "blueberry",
+    "bluebry": "blueberry", "rasp": "raspberry", "mlk": "milk", "chs": "cheese", "chse": "cheese",
+    "chz": "cheese", "ched": "cheddar", "mozz": "mozzarella", "parm": "parmesan", "yog": "yogurt",
+    "ygrt": "yogurt", "yogrt": "yogurt", "grk": "greek", "btr": "butter", "bttr": "butter",
+    "crm": "cream", "hvy": "heavy", "whp": "whipping", "sr": "sour", "lg": "large",
+    "evoo": "extra virgin olive oil", "olv": "olive", "veg": "vegetable", "vgtbl": "vegetable",
+    "flr": "flour", "sgr": "sugar", "spag": "spaghetti", "mac": "macaroni", "ndl": "noodle",
+    "ndls": "noodle", "crl": "cereal", "oj": "orange juice", "pb": "peanut butter", "jc": "juice",
+    "jce": "juice", "wtr": "water", "spkl": "sparkling", "spk": "sparkling", "cof": "coffee",
+    "cfe": "coffee", "choc": "chocolate", "ckie": "cookie", "cke": "cake", "tort": "tortilla",
+    "bgl": "bagel", "crsnt": "croissant", "hmbgr": "hamburger", "sce": "sauce", "sauc": "sauce",
+    "bbq": "barbecue", "vin": "vinegar", "mayo": "mayonnaise", "pnt": "peanut", "pntbtr": "peanut butter",
+    "twl": "towel", "tp": "toilet paper", "ppr": "paper", "dtrgnt": "detergent", "lndry": "laundry",
+}
+
+# Units, quantities and shelf-tag words; never fuzzy-matched to an ingredient
+IGNORED = frozenset("""
+each pack count ounce pound gallon quart pint dozen liter litre gram price total subtotal savings regular
+member coupon discount sale value brand style select large small medium family size bottle bunch bulk
+""".split())
+
+_DIGIT_LETTERS = str.maketrans("015", "ois")
+# Bare numbers and sizes ("12", "2lb", "16oz", "12ct")
+_SIZE_RE = re.compile(r"\d+[a-z]{0,3}")
+
+
+class _Entry(NamedTuple):
+    phrase: Tuple[str, ...]
+    ingredient: Optional[str]
+    food: bool
+
+
+class FoodMatch(NamedTuple):
+    # True or False, or None when no known word appears
+    is_food: Optional[bool]
+    # Canonical name of the main ingredient, or None
+    ingredient: Optional[str]
+    # Canonical names of every ingredient found, in order
+    ingredients: Tuple[str, ...]
+    # Whether a typo correction was needed
+    fuzzy: bool
+
+
+def _phrases(text: str) -> List[str]:
+    return [phrase.strip() for phrase in text.split(",") if phrase.strip()]
+
+
+def parse_ingredients(text: str) -> Dict[str, List[str]]:
+    """
+    Args:
+        text (str): Lines of "canonical: phrase, phrase", as in INGREDIENTS
+    Returns:
+        Dict[str, List[str]]: Phrases per canonical ingredient, the canonical name first
+    """
+    ingredients: Dict[str, List[str]] = {}
+    for line in text.strip().splitlines():
+        canonical, _, aliases = line.partition(":")
+        ingredients[canonical.strip()] = [canonical.strip()] + _phrases(aliases)
+    return ingredients
+
+
+def _singulars(token: str) -> Iterable[str]:
+    if token.endswith("ies"):
+        yield token[:-3] + "y"
+    if token.endswith("ves"):
+        yield token[:-3] + "f"
+    if token.endswith("es"):
+        yield token[:-2]
+    if token.endswith("s"):
+        yield token[:-1]
+
+
+def _deletes(word: str, edits: int) -> Set[str]:
+    found = {word}
+    frontier = {word}
+    for _ in range(edits):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        found |= frontier
+    return found
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Optimal string alignment distance: insertions, deletions, substitutions and adjacent swaps."""
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class FoodLexicon:
+    """
+    Food classification and ingredient canonicalization for receipt item names.
+    """
+
+    def __init__(self, ingredients: Mapping[str, Sequence[str]], markers: Iterable[str] = (),
+                 non_food: Iterable[str] = (), abbreviations: Optional[Mapping[str, str]] = None,
+                 max_edits: int = FUZZY_MAX_EDITS, cache_size: int = CACHE_SIZE):
+        """
+        Args:
+            ingredients (Mapping[str, Sequence[str]]): Phrases per canonical ingredient
+            markers (Iterable[str]): Words that mark an item as food without naming an ingredient
+            non_food (Iterable[str]): Phrases that make an item non-food
+            abbreviations (Mapping[str, str], optional): Receipt abbreviations and their expansions
+            max_edits (int): Largest typo correction, in edits; 0 turns fuzzy lookup off
+            cache_size (int): Item names whose matches are remembered
+        """
+        self.entries: List[_Entry] = []
+        for canonical, phrases in ingredients.items():
+            self.entries.extend(_Entry(tuple(phrase.split()), canonical, True) for phrase in phrases)
+        self.entries.extend(_Entry((marker,), None, True) for marker in markers)
+        self.entries.extend(_Entry(tuple(phrase.split()), None, False) for phrase in non_food)
+        self.abbreviations = {key: tuple(value.split()) for key, value in (abbreviations or {}).items()}
+        self.vocabulary = frozenset(token for entry in self.entries for token in entry.phrase)
+        self._non_food_words = frozenset(token for entry in self.entries if not entry.food for token in entry.phrase)
+        self.max_edits = max_edits
+        self._build_automaton()
+        self._build_fuzzy_index()
+        self._resolve = lru_cache(cache_size)(self._resolve_token)
+        self.match = lru_cache(cache_size)(self._match)
+
+    @classmethod
+    def default(cls) -> "FoodLexicon":
+        """The built-in lexicon: INGREDIENTS, FOOD_MARKERS, NON_FOOD and ABBREVIATIONS."""
+        return cls(parse_ingredients(INGREDIENTS), FOOD_MARKERS.split(), _phrases(NON_FOOD), ABBREVIATIONS)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _build_automaton(self) -> None:
+        # Aho-Corasick over words: a trie of phrases plus failure links, so one pass over a
+        # name reports every phrase in it, overlapping ones included
+        self._goto: List[Dict[str, int]] = [{}]
+        self._output: List[List[int]] = [[]]
+        for index, entry in enumerate(self.entries):
+            state = 0
+            for token in entry.phrase:
+                if token not in self._goto[state]:
+                    self._goto[state][token] = len(self._goto)
+                    self._goto.append({})
+                    self._output.append([])
+                state = self._goto[state][token]
+            self._output[state].append(index)
+
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(token, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def _build_fuzzy_index(self) -> None:
+        # Every vocabulary word under every deletion of up to max_edits characters; a typo
+        # and its word share a deletion, so candidates are a few dict lookups away
+        self._deletions: Dict[str, Set[str]] = {}
+        if self.max_edits <= 0:
+            return
+        for word in self.vocabulary:
+            if len(word) >= FUZZY_MIN_LENGTH:
+                for deletion in _deletes(word, self.max_edits):
+                    self._deletions.setdefault(deletion, set()).add(word)
+
+    def _closest(self, token: str) -> Optional[str]:
+        allowed = min(self.max_edits, 1 if len(token) < 8 else 2)
+        candidates: Set[str] = set()
+        for deletion in _deletes(token, allowed):
+            candidates |= self._deletions.get(deletion, set())
+        # Ties go to food words: "peper" is more likely pepper than paper on a grocery receipt
+        scored = [(edit_distance(token, word), word in self._non_food_words, abs(len(word) - len(token)), word)
+                  for word in candidates]
+        scored = [score for score in scored if score[0] <= allowed]
+        return min(scored)[3] if scored else None
+
+    def _resolve_token(self, token: str, fuzzy: bool = True) -> Tuple[Tuple[str, ...], bool]:
+        # Plural, known word, abbreviation, typo, in that order; returns (words, corrected).
+        # Singulars first, so "chips" reaches the phrase "tortilla chip"
+        for singular in _singulars(token):
+            if singular in self.vocabulary:
+                return (singular,), False
+        if token in self.vocabulary:
+            return (token,), False
+        if token in self.abbreviations:
+            return self.abbreviations[token], False
+        if fuzzy and self.max_edits > 0 and len(token) >= FUZZY_MIN_LENGTH and token not in IGNORED:
+            closest = self._closest(token)
+            if closest is not None:
+                return (closest,), True
+        return (token,), False
+
+    def tokens(self, name: str, fuzzy: bool = True) -> Tuple[List[str], bool]:
+        """
+        Normalize an item name into lexicon words.
+        Args:
+            name (str): Item name as printed or OCR'd ("ORG BNLS CHKN BRST 2LB")
+            fuzzy (bool): Correct typos; off for text that was not OCR'd
+        Returns:
+            Tuple[List[str], bool]: The words, with sizes and quantities dropped, and whether
+            a typo was corrected
+        """
+        words: List[str] = []
+        any_corrected = False
+        for token in re.findall(r"[a-z0-9]+", name.lower()):
+            if _SIZE_RE.fullmatch(token):
+                continue
+            if not token.isalpha():
+                # OCR reads l, o and s as 1, 0 and 5 inside words ("CH1CKEN")
+                token = re.sub(r"\d", "", token.translate(_DIGIT_LETTERS))
+                if not token:
+                    continue
+            resolved, corrected = self._resolve(token, fuzzy)
+            words.extend(resolved)
+            any_corrected = any_corrected or corrected
+        return words, any_corrected
+
+    def _phrases(self, words: List[str]) -> List[Tuple[int, int, _Entry]]:
+        # (start, end, entry) of the phrases found in the words, in order
+        found: List[Tuple[int, int, int]] = []
+        state = 0
+        for end, word in enumerate(words, 1):
+            while state and word not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(word, 0)
+            found.extend((end - len(self.entries[index].phrase), end, index) for index in self._output[state])
+
+        # Longest phrases first, and no word counts twice: "hot dog" is food even though "dog" is not
+        taken = [False] * len(words)
+        selected = []
+        for start, end, index in sorted(found, key=lambda m: (m[0] - m[1], m[0])):
+            if not any(taken[start:end]):
+                taken[start:end] = [True] * (end - start)
+                selected.append((start, end, self.entries[index]))
+        return sorted(selected, key=lambda m: m[0])
+
+    def _match(self, name: str) -> FoodMatch:
+        words, fuzzy = self.tokens(name)
+        selected = self._phrases(words)
+        if any(not entry.food for _, _, entry in selected):
+            return FoodMatch(False, None, (), fuzzy)
+        ingredients = [(end - start, end, entry.ingredient) for start, end, entry in selected if entry.ingredient]
+        if not ingredients:
+            return FoodMatch(True if selected else None, None, (), fuzzy)
+        # The longest phrase names the item; among equals the last, as English puts the head noun last
+        ingredient = max(ingredients)[2]
+        names = tuple(dict.fromkeys(name for _, _, name in ingredients))
+        return FoodMatch(True, ingredient, names, fuzzy)
+
+    def ingredients_in(self, text: str) -> List[str]:
+        """
+        Every ingredient named in free text such as recipe instructions, in order of first
+        mention. Unlike match, non-food words do not veto anything and typos are not corrected.
+        Args:
+            text (str): Any text
+        Returns:
+            List[str]: Canonical ingredient names
+        """
+        words = self.tokens(text, fuzzy=False)[0]
+        return list(dict.fromkeys(entry.ingredient for _, _, entry in self._phrases(words) if entry.ingredient))
+
+    def classify(self, name: str) -> Optional[bool]:
+        """
+        Returns:
+            Optional[bool]: True or False, or None when no known word appears in the name
+        """
+        return self.match(name).is_food
+
+    def canonical(self, name: str) -> Optional[str]:
+        """
+        Returns:
+            Optional[str]: Canonical ingredient name ("chicken breast"), or None if there is none
+        """
+        return self.match(name).ingredient
+
+    def ingredient_name(self, name: str) -> str:
+        """
+        Name to use for an item in recipe prompts and cache keys: the canonical ingredient,
+        or else the normalized words of the name.
+        """
+        return self.canonical(name) or " ".join(self.tokens(name)[0])
+
+
+@lru_cache(maxsize=None)
+def default_lexicon() -> FoodLexicon:
+    """The process-wide built-in lexicon, built on first use."""
+    return FoodLexicon.default()
+
+
+def classify_food(name: str) -> Optional[bool]:
+    """
+    Classify an item name as food with the built-in lexicon.
+    Returns:
+        Optional[bool]: True or False, or None when no known word appears
+    """
+    return default_lexicon().classify(name)
+
+
+def canonical_ingredient(name: str) -> Optional[str]:
+    """Canonical ingredient name of an item, or None when the lexicon has none."""
+    return default_lexicon().canonical(name)
+
+
+def food_item_names(items: Sequence[Dict[str, Any]]) -> List[str]:
+    """
+    Args:
+        items (Sequence[Dict[str, Any]]): Receipt items with name and is_food
+    Returns:
+        List[str]: Ingredient names of the food items, deduplicated, in receipt order
+    """
+    lexicon = default_lexicon()
+    names = (lexicon.ingredient_name(str(item.get("name") or "")) for item in items if item.get("is_food"))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def tag_food(receipt_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Decide which items of LLM-structured receipt data are food. The lexicon decides for the
+    names it knows; the LLM's is_food flag is kept for the rest. food_items is rebuilt from
+    the result as canonical ingredient names, so recipe cache keys do not depend on how a
+    receipt abbreviates them.
+    Args:
+        receipt_data (Dict[str, Any]): Receipt data; updated in place
+    Returns:
+        Dict[str, Any]: The same receipt data
+    """
+    lexicon = default_lexicon()
+    items = [item for item in receipt_data.get("items") or [] if isinstance(item, dict)]
+    for item in items:
+        is_food = lexicon.classify(str(item.get("name") or ""))
+        FOOD_TAGS.inc(source="llm" if is_food is None else "lexicon")
+        item["is_food"] = bool(item.get("is_food")) if is_food is None else is_food
+    if items:
+        receipt_data["food_items"] = food_item_names(items)
+    else:
+        names = (lexicon.ingredient_name(str(name)) for name in receipt_data.get("food_items") or [])
+        receipt_data["food_items"] = list(dict.fromkeys(name for name in names if name))
+    return receipt_data
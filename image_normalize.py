@@ -0,0 +1,145 @@
+import io
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class NormalizeConfig:
+    """
+    Settings for the image normalization stage shared by the Vision and tesseract paths.
+    Defaults come from IMAGE_NORMALIZE, IMAGE_MAX_DIMENSION, IMAGE_MAX_BYTES,
+    IMAGE_GRAYSCALE and IMAGE_FORMAT.
+    """
+    enabled: bool = True
+    # Longest side in pixels; receipt text stays legible well below phone-camera resolution
+    max_dimension: int = 2048
+    # Target encoded size; JPEG quality is stepped down until the payload fits
+    max_bytes: int = 1024 * 1024
+    grayscale: bool = True
+    format: str = "JPEG"
+    min_quality: int = 50
+    start_quality: int = 80
+
+    @classmethod
+    def from_env(cls) -> "NormalizeConfig":
+        return cls(
+            enabled=os.getenv("IMAGE_NORMALIZE", "1") not in ("0", "false"),
+            max_dimension=int(os.getenv("IMAGE_MAX_DIMENSION", "2048")),
+            max_bytes=int(os.getenv("IMAGE_MAX_BYTES", str(1024 * 1024))),
+            grayscale=os.getenv("IMAGE_GRAYSCALE", "1") not in ("0", "false"),
+            format=os.getenv("IMAGE_FORMAT", "JPEG").upper(),
+        )
+
+
+def open_normalized(content, config: Optional[NormalizeConfig] = None) -> Image.Image:
+    """
+    Decode an image and apply orientation fix, downscale and grayscale conversion.
+    Args:
+        content (bytes | memoryview): Encoded image bytes
+        config (NormalizeConfig, optional): Normalization settings
+    Returns:
+        PIL.Image.Image: Normalized image
+    """
+    config = config or NormalizeConfig.from_env()
+    with timed("image_decode"):
+        decoded = Image.open(io.BytesIO(content))
+        if decoded.format == "JPEG":
+            # Let libjpeg decode at a reduced scale (1/2, 1/4, 1/8) instead of
+            # decoding all 12 MP and throwing most of them away
+            decoded.draft("L" if config.grayscale else "RGB", (config.max_dimension, config.max_dimension))
+        decoded.load()
+    with timed("preprocess"):
+        image: Image.Image = ImageOps.exif_transpose(decoded)
+        if config.grayscale:
+            image = image.convert("L")
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        if max(image.size) > config.max_dimension:
+            image.thumbnail((config.max_dimension, config.max_dimension), Image.Resampling.LANCZOS)
+    return image
+
+
+def encode_image(image: Image.Image, config: NormalizeConfig) -> bytes:
+    """
+    Encode an image, lowering JPEG quality until it fits within config.max_bytes.
+    Args:
+        image (PIL.Image.Image): Image to encode
+        config (NormalizeConfig): Normalization settings
+    Returns:
+        bytes: Encoded image
+    """
+    if config.format == "PNG":
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue()
+
+    quality = config.start_quality
+    while True:
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+        if buffer.tell() <= config.max_bytes or quality <= config.min_quality:
+            return buffer.getvalue()
+        quality = max(config.min_quality, quality - 10)
+
+
+def normalize_image_bytes(content, config: Optional[NormalizeConfig] = None) -> bytes:
+    """
+    Normalize an uploaded image for OCR and re-encode it within the byte budget.
+    Returns the input unchanged when normalization is disabled or the image can't be decoded,
+    so the upstream OCR service still gets a chance to reject or read it.
+    Args:
+        content (bytes | memoryview): Encoded image bytes
+        config (NormalizeConfig, optional): Normalization settings
+    Returns:
+        bytes: Encoded normalized image
+    """
+    config = config or NormalizeConfig.from_env()
+    if not config.enabled:
+        return bytes(content)
+    try:
+        image = open_normalized(content, config)
+    except (OSError, ValueError) as e:
+        logger.warning("could not normalize image", extra={"error": str(e)})
+        return bytes(content)
+    with timed("preprocess"):
+        encoded = encode_image(image, config)
+    if len(encoded) >= len(content) and _is_upright(content):
+        # The original is already more compact and needs no rotation; re-encoding would only grow it
+        return bytes(content)
+    return encoded
+
+
+def _is_upright(content) -> bool:
+    # Image.open only parses the header, so this does not decode pixels again
+    with Image.open(io.BytesIO(content)) as original:
+        return original.getexif().get(0x0112, 1) == 1
+
+
+def normalize_image_array(content, config: Optional[NormalizeConfig] = None) -> Optional[np.ndarray]:
+    """
+    Normalize an image for the tesseract path, returning pixels without re-encoding.
+    Args:
+        content (bytes | memoryview): Encoded image bytes
+        config (NormalizeConfig, optional): Normalization settings
+    Returns:
+        Optional[numpy.ndarray]: Grayscale (H, W) or BGR (H, W, 3) array, or None if decoding fails
+    """
+    config = config or NormalizeConfig.from_env()
+    try:
+        image = open_normalized(content, config)
+    except (OSError, ValueError):
+        return None
+    array = np.asarray(image)
+    if array.ndim == 3:
+        # PIL is RGB, OpenCV expects BGR
+        array = np.ascontiguousarray(array[:, :, ::-1])
+    return array
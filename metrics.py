@@ -0,0 +1,622 @@
+"""
+Process-local metrics in the Prometheus text format, per-stage timers and an opt-in sampling
+profiler for slow requests.
+
+Counters, gauges and histograms live in REGISTRY and are rendered by /metrics. Stats that other
+components already keep (cache hit rates, backend breakers, parser bypasses) are read at scrape
+time through collectors instead of being counted twice. Each worker process has its own
+registry, so scrape every worker (or use a single worker per container).
+"""
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as Tally
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upstream calls and whole requests run from milliseconds to tens of seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Requests slower than this get their sampled stacks logged; 0 leaves the profiler off
+PROFILE_SLOW_MS = float(os.getenv("RECEIPT_PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL = float(os.getenv("RECEIPT_PROFILE_INTERVAL_MS", "5")) / 1000
+# Optional directory for collapsed stacks (one file per slow request, flamegraph.pl input)
+PROFILE_DIR = os.getenv("RECEIPT_PROFILE_DIR")
+PROFILE_TOP = 5
+PROFILE_MAX_DEPTH = 40
+
+
+class Sample(NamedTuple):
+    """One series value produced by a collector at scrape time."""
+    name: str
+    kind: str
+    help: str
+    labels: Dict[str, Any]
+    value: float
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class: a named family of series, one per combination of label values."""
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _labels(self, key: Tuple[str, ...], **extra: Any) -> Dict[str, Any]:
+        return {**dict(zip(self.label_names, key)), **extra}
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._lines()]
+
+    def _lines(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _lines(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self._labels(key))} {_format_value(v)}" for key, v in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """Cumulative bucket counts, sum and count per label set, as Prometheus histograms expect."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (non-cumulative, +Inf last), sum]
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, **labels: Any) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _lines(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self._labels(key, le=_format_value(bound)))} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self._labels(key))} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self._labels(key))} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Holds the metrics and scrape-time collectors of one process."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: Dict[str, Callable[[], Iterable[Sample]]] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric: Metric) -> Any:
+        with self._lock:
+            # Re-importing a module (or building a second app in tests) reuses the same series
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def register_collector(self, name: str, collect: Callable[[], Iterable[Sample]]) -> None:
+        """
+        Add a function called on every scrape. Registering under an existing name replaces it.
+        Args:
+            name (str): Collector name
+            collect (Callable[[], Iterable[Sample]]): Returns the current samples
+        """
+        with self._lock:
+            self._collectors[name] = collect
+
+    def render(self) -> str:
+        """
+        Returns:
+            str: Every metric and collected sample in the Prometheus text format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.items())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        families: Dict[str, Tuple[str, str, List[str]]] = {}
+        for name, collect in collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                # A broken collector must not take the whole scrape down
+                logger.warning("metrics collector failed", extra={"collector": name, "error": str(e)})
+                continue
+            for sample in samples:
+                if sample.value is None:
+                    continue
+                family = families.setdefault(sample.name, (sample.kind, sample.help, []))
+                family[2].append(f"{sample.name}{_format_labels(sample.labels)} {_format_value(sample.value)}")
+        for name, (kind, help, series) in families.items():
+            lines.extend([f"# HELP {name} {help}", f"# TYPE {name} {kind}", *series])
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "receipt_stage_seconds",
+    "Time spent in each processing stage (rate_limit, admission, upload_read, preflight, image_decode, preprocess, "
+    "ocr, local_parse, prompt_compact, llm_format, json_parse, store, recipe_index, recipes)",
+    ["stage"])
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "receipt_upstream_call_seconds", "Latency of calls to OCR and LLM backends", ["backend", "method", "outcome"])
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    "receipt_upstream_in_flight", "Backend calls currently running, hedges included", ["backend"])
+LLM_TOKENS = REGISTRY.counter(
+    "receipt_llm_tokens_total", "Prompt and completion tokens sent to and received from LLM backends",
+    ["purpose", "kind"])
+PROMPT_TEXT_TOKENS = REGISTRY.counter(
+    "receipt_prompt_text_tokens_total", "OCR text tokens of receipts sent to the LLM, before and after compaction",
+    ["stage"])
+PROMPT_CHUNKS = REGISTRY.counter(
+    "receipt_prompt_chunks_total", "Formatting completions per receipt sent to the LLM, after the token budget")
+FOOD_TAGS = REGISTRY.counter(
+    "receipt_food_tags_total", "LLM-structured items tagged as food or not, by who decided (lexicon or llm)",
+    ["source"])
+UPLOADS_REJECTED = REGISTRY.counter(
+    "receipt_uploads_rejected_total", "Uploads refused before decoding (too_large, format, corrupt)", ["reason"])
+UPLOADS_COALESCED = REGISTRY.counter(
+    "receipt_uploads_coalesced_total", "Repeat uploads answered by another upload's run", ["endpoint"])
+RATE_LIMITED = REGISTRY.counter(
+    "receipt_rate_limited_total", "Requests refused with 429, by reason (rate or overload)", ["reason"])
+REQUESTS = REGISTRY.counter("receipt_http_requests_total", "HTTP requests by endpoint and status",
+                            ["endpoint", "status"])
+REQUEST_SECONDS = REGISTRY.histogram("receipt_http_request_seconds", "HTTP request duration, streams included",
+                                     ["endpoint"])
+REQUESTS_IN_FLIGHT = REGISTRY.gauge("receipt_http_requests_in_flight", "HTTP requests being served",
+                                    ["endpoint"])
+
+# Stage timer for each kind of completion
+LLM_STAGES = {"format": "llm_format", "recipes": "recipes"}
+
+# Stage durations of the request running in the current context, for the slow-request log
+_request_stages: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_stages", default=None)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Time a block as a processing stage, in the stage histogram and in the current request's
+    stage breakdown.
+    Args:
+        stage (str): Stage name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+
+def count_llm_tokens(purpose: str, messages: Optional[List[dict]] = None, completion: Optional[str] = None) -> None:
+    """
+    Add the token counts of an LLM exchange to receipt_llm_tokens_total.
+    Args:
+        purpose (str): What the call was for, e.g. "format" or "recipes"
+        messages (List[dict], optional): Prompt messages
+        completion (str, optional): Completion text
+    """
+    # Imported here so the metrics module stays free of the tokenizer at import time
+    from receipt_prompts import count_message_tokens, count_tokens
+    if messages:
+        LLM_TOKENS.inc(count_message_tokens(messages), purpose=purpose, kind="prompt")
+    if completion:
+        LLM_TOKENS.inc(count_tokens(completion), purpose=purpose, kind="completion")
+
+
+def _stack(frame: Any) -> str:
+    names: List[str] = []
+    while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of registered threads at a fixed interval from a daemon thread.
+    Only threads serving a request are sampled, so idle workers cost nothing; the sampler
+    thread itself starts on first use.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._threads: Dict[int, Tally] = {}
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self) -> Tally:
+        """Start sampling the calling thread. Returns the tally of collapsed stacks."""
+        samples: Tally = Tally()
+        with self._lock:
+            self._threads[threading.get_ident()] = samples
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run, name="metrics-profiler", daemon=True)
+                self._sampler.start()
+        return samples
+
+    def stop(self, samples: Tally) -> Tally:
+        with self._lock:
+            for ident, tally in list(self._threads.items()):
+                if tally is samples:
+                    del self._threads[ident]
+        return samples
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                threads = list(self._threads.items())
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident, tally in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    tally[_stack(frame)] += 1
+
+
+PROFILER = SamplingProfiler() if PROFILE_SLOW_MS > 0 else None
+
+# Called with every RequestTrace slower than PROFILE_SLOW_MS
+_slow_request_hooks: List[Callable[["RequestTrace"], None]] = []
+
+
+def add_slow_request_hook(hook: Callable[["RequestTrace"], None]) -> None:
+    """
+    Register a function called with the RequestTrace of each slow request, in addition to the
+    default log line. Only runs when RECEIPT_PROFILE_SLOW_MS is set.
+    """
+    _slow_request_hooks.append(hook)
+
+
+class RequestTrace:
+    """
+    Tracks one HTTP request: in-flight gauge, duration and status, the time spent per stage, and
+    stack samples when the profiler is on. Create it when the request starts and call finish()
+    once the response (including any stream) is done.
+    """
+
+    def __init__(self, endpoint: str, sample: bool = True):
+        """
+        Args:
+            endpoint (str): Endpoint label
+            sample (bool): Profile this request's thread; off for event-loop servers, where one
+                thread serves every request
+        """
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.status: Optional[int] = None
+        self.duration: Optional[float] = None
+        self.samples: Optional[Tally] = PROFILER.start() if PROFILER and sample else None
+        self._token = _request_stages.set(self.stages)
+        REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+
+    def finish(self, status: int) -> None:
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.start
+        self.status = status
+        if self.samples is not None and PROFILER is not None:
+            PROFILER.stop(self.samples)
+        try:
+            _request_stages.reset(self._token)
+        except (RuntimeError, ValueError):
+            # Finished from another context, e.g. a response close callback
+            pass
+        REQUESTS_IN_FLIGHT.dec(endpoint=self.endpoint)
+        REQUESTS.inc(endpoint=self.endpoint, status=status)
+        REQUEST_SECONDS.observe(self.duration, endpoint=self.endpoint)
+        if PROFILE_SLOW_MS and self.duration * 1000 >= PROFILE_SLOW_MS:
+            for hook in [log_slow_request, *_slow_request_hooks]:
+                try:
+                    hook(self)
+                except Exception as e:
+                    logger.warning("slow request hook failed", extra={"error": str(e)})
+
+    def top_stacks(self, limit: int = PROFILE_TOP) -> List[Tuple[str, int]]:
+        return self.samples.most_common(limit) if self.samples else []
+
+
+def log_slow_request(trace: RequestTrace) -> None:
+    """Default slow-request hook: log the stage breakdown and hottest stacks, and dump collapsed stacks to PROFILE_DIR."""
+    logger.warning("slow request", extra={
+        "endpoint": trace.endpoint,
+        "status": trace.status,
+        "duration_ms": round((trace.duration or 0.0) * 1000, 1),
+        "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in trace.stages.items()},
+        "samples": sum(trace.samples.values()) if trace.samples else 0,
+        # Leaf frames are the interesting end of a stack
+        "top_stacks": [{"count": count, "stack": stack.split(";")[-8:]} for stack, count in trace.top_stacks()],
+    })
+    if PROFILE_DIR and trace.samples:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{int(time.time() * 1000)}-{trace.endpoint}.folded")
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in trace.samples.items())
+
+
+def instrument_flask(app: Any, path: str = "/metrics") -> None:
+    """
+    Track every request of a Flask app and serve the registry at `path`.
+    Args:
+        app (flask.Flask): Application to instrument
+        path (str): Metrics endpoint
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_trace():
+        g.request_trace = RequestTrace(request.endpoint or "unmatched")
+
+    @app.after_request
+    def _finish_trace(response):
+        trace = g.pop("request_trace", None)
+        if trace is not None:
+            # Streaming responses are still running here; finish when the body is done
+            response.call_on_close(lambda: trace.finish(response.status_code))
+        return response
+
+    @app.teardown_request
+    def _abort_trace(error=None):
+        trace = g.pop("request_trace", None)
+        if trace is not None:
+            trace.finish(500)
+
+    app.add_url_rule(path, "metrics", lambda: Response(REGISTRY.render(), content_type=CONTENT_TYPE))
+
+
+def route_name(routes: Sequence[Any], scope: Dict[str, Any]) -> str:
+    """
+    Args:
+        routes (Sequence[starlette.routing.BaseRoute]): Routes of a Starlette app
+        scope (Dict[str, Any]): ASGI scope of a request
+    Returns:
+        str: Name of the route the request matches, or "unmatched"
+    """
+    from starlette.routing import Match
+    for route in routes:
+        if route.matches(scope)[0] == Match.FULL:
+            return getattr(route, "name", None) or "unmatched"
+    return "unmatched"
+
+
+class ASGIMetrics:
+    """
+    ASGI middleware for the Starlette app: tracks every HTTP request like instrument_flask and
+    serves the registry at `path`. Requests are labelled with the name of the matching route.
+    """
+
+    def __init__(self, app: Any, routes: Sequence[Any] = (), path: str = "/metrics"):
+        """
+        Args:
+            app: ASGI application to wrap
+            routes (Sequence[starlette.routing.BaseRoute]): Routes used to name endpoints
+            path (str): Metrics endpoint
+        """
+        self.app = app
+        self.routes = routes
+        self.path = path
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if scope["path"] == self.path:
+            body = REGISTRY.render().encode()
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", CONTENT_TYPE.encode()),
+                                    (b"content-length", str(len(body)).encode())]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        # One event loop thread serves every request, so its stacks can't be attributed
+        trace = RequestTrace(route_name(self.routes, scope), sample=False)
+        status = 500
+
+        async def send_tracked(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                trace.finish(status)
+
+        try:
+            await self.app(scope, receive, send_tracked)
+        finally:
+            trace.finish(status)
+
+
+def _counter(name: str, help: str, value: Any, **labels: Any) -> Sample:
+    return Sample(name, "counter", help, labels, value)
+
+
+def _gauge(name: str, help: str, value: Any, **labels: Any) -> Sample:
+    return Sample(name, "gauge", help, labels, value)
+
+
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def cache_samples(stats: Dict[str, Dict[str, Any]]) -> Iterator[Sample]:
+    """Samples from ReceiptCache.stats(), one series per tier."""
+    for tier, tier_stats in stats.items():
+        yield _counter("receipt_cache_hits_total", "Cache hits", tier_stats.get("hits"), tier=tier)
+        yield _counter("receipt_cache_misses_total", "Cache misses", tier_stats.get("misses"), tier=tier)
+        yield _counter("receipt_cache_evictions_total", "Cache evictions", tier_stats.get("evictions"), tier=tier)
+        yield _gauge("receipt_cache_hit_ratio", "Cache hit ratio since start", tier_stats.get("hit_rate"), tier=tier)
+        yield _gauge("receipt_cache_entries", "Entries in the cache", tier_stats.get("size"), tier=tier)
+
+
+def backend_samples(group: str, stats: Dict[str, Any]) -> Iterator[Sample]:
+    """Samples from BackendGroup.stats() for the `group` stage ("ocr" or "llm")."""
+    yield _counter("receipt_backend_hedged_total", "Hedged backend calls", stats["hedged"], group=group)
+    yield _counter("receipt_backend_hedge_wins_total", "Hedged calls that answered first", stats["hedge_wins"],
+                   group=group)
+    yield _counter("receipt_backend_failovers_total", "Failovers to a secondary backend", stats["failovers"],
+                   group=group)
+    yield _counter("receipt_deadline_exceeded_total", "Calls abandoned at the request deadline",
+                   stats["deadline_exceeded"], group=group)
+    for name, backend in stats["backends"].items():
+        yield _counter("receipt_backend_calls_total", "Backend calls started", backend["calls"],
+                       group=group, backend=name)
+        yield _counter("receipt_backend_errors_total", "Backend calls that failed", backend["errors"],
+                       group=group, backend=name)
+        breaker = backend.get("breaker")
+        if breaker:
+            yield _gauge("receipt_backend_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+                         BREAKER_STATES.get(breaker["state"]), group=group, backend=name)
+            yield _counter("receipt_backend_breaker_opens_total", "Times the circuit breaker opened",
+                           breaker["opens"], group=group, backend=name)
+            yield _counter("receipt_backend_breaker_rejected_total", "Calls refused by an open breaker",
+                           breaker["rejected"], group=group, backend=name)
+    for name, limit in stats["limits"].items():
+        yield _gauge("receipt_backend_waiting", "Calls waiting for a concurrency slot", limit.get("waiting"),
+                     backend=name)
+
+
+def parser_samples(stats: Dict[str, Any]) -> Iterator[Sample]:
+    """Samples from ParserMetrics.stats()."""
+    yield _counter("receipt_parser_parsed_total", "Receipts run through the local parser", stats["parsed"])
+    yield _counter("receipt_parser_bypassed_total", "Receipts structured without the LLM", stats["bypassed"])
+    yield _counter("receipt_parser_llm_calls_total", "Receipts that needed LLM formatting", stats["llm_calls"])
+    yield _gauge("receipt_parser_bypass_ratio", "Share of parsed receipts that skipped the LLM", stats["bypass_rate"])
+
+
+def recipe_index_samples(stats: Dict[str, Any]) -> Iterator[Sample]:
+    """Samples from RecipeIndex.stats()."""
+    yield _counter("receipt_recipe_index_hits_total", "Baskets answered from the recipe index", stats["hits"])
+    yield _counter("receipt_recipe_index_misses_total", "Baskets the recipe index could not answer", stats["misses"])
+    yield _counter("receipt_recipe_index_added_total", "Recipes added to the recipe index", stats["added"])
+    yield _counter("receipt_recipe_index_evictions_total", "Recipes evicted from the recipe index", stats["evictions"])
+    yield _gauge("receipt_recipe_index_hit_ratio", "Share of baskets answered from the recipe index", stats["hit_rate"])
+    yield _gauge("receipt_recipe_index_recipes", "Recipes in the recipe index", stats["size"])
+
+
+def rate_limit_samples(stats: Dict[str, Any]) -> Iterator[Sample]:
+    """Samples from RateLimiter.stats()."""
+    yield _counter("receipt_rate_limit_allowed_total", "Requests within their client's rate limit", stats["allowed"],
+                   backend=stats["backend"])
+    yield _gauge("receipt_rate_limit_clients", "Clients with a token bucket", stats.get("clients"),
+                 backend=stats["backend"])
+
+
+def admission_samples(stats: Dict[str, Any]) -> Iterator[Sample]:
+    """Samples from AdmissionController.stats()."""
+    yield _gauge("receipt_admission_running", "Admitted requests running", stats["running"])
+    yield _gauge("receipt_admission_waiting", "Requests waiting for admission", stats["waiting"])
+    yield _gauge("receipt_admission_fair_share", "Requests each client may run at once right now", stats["fair_share"])
+    yield _counter("receipt_admission_queued_total", "Requests that had to wait for admission", stats["queued"])
+
+
+def job_samples(counts: Dict[str, int]) -> Iterator[Sample]:
+    """Samples from JobBroker.counts()."""
+    for status, count in counts.items():
+        yield _gauge("receipt_jobs", "Background jobs by status", count, status=status)
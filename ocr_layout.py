@@ -0,0 +1,151 @@
+"""
+Word-level OCR results with geometry. Both OCR backends produce an OCRLayout, which keeps
+each word's box so that printed lines can be rebuilt and rendered as column-aligned text:
+one receipt line per text line, with prices lined up at the right, as printed.
+"""
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+# Rendered lines are at most this many characters wide; wider pages are squeezed horizontally
+MAX_LINE_WIDTH = 48
+
+
+class Word(NamedTuple):
+    """One OCR word and its bounding box, in image pixels."""
+    text: str
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+
+
+class OCRLayout:
+    """
+    Words of one OCR result in compact arrays: `texts` (N strings), `boxes` (N x 4 int32,
+    x0 y0 x1 y1) and `line_ids` (N int32, the reconstructed line of each word, numbered top to bottom).
+    """
+
+    def __init__(self, texts: Sequence[str], boxes):
+        self.texts = list(texts)
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.line_ids = self._assign_lines()
+
+    @classmethod
+    def from_words(cls, words: Sequence[Word]) -> "OCRLayout":
+        return cls([w.text for w in words], [(w.x0, w.y0, w.x1, w.y1) for w in words])
+
+    @classmethod
+    def from_vision(cls, annotations: Sequence[Any]) -> "OCRLayout":
+        """
+        Args:
+            annotations (Sequence): Vision response.text_annotations; the first entry (the full text) is skipped
+        """
+        texts, boxes = [], []
+        for annotation in annotations[1:]:
+            vertices = annotation.bounding_poly.vertices
+            if not vertices:
+                continue
+            xs = [v.x for v in vertices]
+            ys = [v.y for v in vertices]
+            texts.append(annotation.description)
+            boxes.append((min(xs), min(ys), max(xs), max(ys)))
+        return cls(texts, boxes)
+
+    @classmethod
+    def from_tesseract(cls, data: Mapping[str, Sequence]) -> "OCRLayout":
+        """
+        Args:
+            data (Mapping): pytesseract.image_to_data(..., output_type=Output.DICT) result
+        """
+        texts, boxes = [], []
+        rows = zip(data["text"], data["conf"], data["left"], data["top"], data["width"], data["height"])
+        for text, conf, left, top, width, height in rows:
+            # Block, paragraph and line rows have conf -1 and no text
+            if not str(text).strip() or float(conf) < 0:
+                continue
+            texts.append(str(text).strip())
+            boxes.append((left, top, left + width, top + height))
+        return cls(texts, boxes)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def _assign_lines(self) -> np.ndarray:
+        line_ids = np.zeros(len(self.texts), dtype=np.int32)
+        if not self.texts:
+            return line_ids
+        centers = (self.boxes[:, 1] + self.boxes[:, 3]) / 2.0
+        line = 0
+        top: Optional[float] = None
+        bottom: Optional[float] = None
+        members = 0
+        for i in np.argsort(centers, kind="stable"):
+            # A word joins the current line when its vertical center falls inside the line's
+            # average box; otherwise it starts a new line below
+            if top is not None and bottom is not None and top <= centers[i] <= bottom:
+                top = (top * members + self.boxes[i, 1]) / (members + 1)
+                bottom = (bottom * members + self.boxes[i, 3]) / (members + 1)
+                members += 1
+            else:
+                if top is not None:
+                    line += 1
+                top, bottom, members = float(self.boxes[i, 1]), float(self.boxes[i, 3]), 1
+            line_ids[i] = line
+        return line_ids
+
+    def words(self) -> List[Word]:
+        return [Word(text, *map(int, box)) for text, box in zip(self.texts, self.boxes)]
+
+    def lines(self) -> List[List[int]]:
+        """
+        Returns:
+            List[List[int]]: Word indices of each line, top to bottom and left to right
+        """
+        if not self.texts:
+            return []
+        order = np.lexsort((self.boxes[:, 0], self.line_ids))
+        lines: List[List[int]] = [[] for _ in range(int(self.line_ids.max()) + 1)]
+        for i in order:
+            lines[self.line_ids[i]].append(int(i))
+        return lines
+
+    def line_texts(self) -> List[str]:
+        """Lines with their words joined by single spaces."""
+        return [" ".join(self.texts[i] for i in line) for line in self.lines()]
+
+    def to_text(self, max_width: int = MAX_LINE_WIDTH) -> str:
+        """
+        Render the page as column-aligned text. Each word is placed at the character column
+        matching its horizontal position, so items and their prices share a line and amounts
+        line up on the right, instead of the price column being listed after the item column.
+        Rule lines ("-----", "=====") carry no information and are dropped.
+        Args:
+            max_width (int): Line width in characters
+        Returns:
+            str: One line of text per printed line
+        """
+        if not self.texts:
+            return ""
+        lengths = np.array([max(len(text), 1) for text in self.texts], dtype=np.float64)
+        char_width = float(np.median((self.boxes[:, 2] - self.boxes[:, 0]) / lengths)) or 1.0
+        left = int(self.boxes[:, 0].min())
+        page_chars = (int(self.boxes[:, 2].max()) - left) / char_width
+        scale = min(1.0, max_width / page_chars) if page_chars > 0 else 1.0
+
+        rendered = []
+        for line in self.lines():
+            if not any(ch.isalnum() for i in line for ch in self.texts[i]):
+                continue
+            out = ""
+            for i in line:
+                column = int(round((self.boxes[i, 0] - left) / char_width * scale))
+                # Always keep at least one space between words
+                column = max(column, len(out) + 1 if out else 0)
+                out += " " * (column - len(out)) + self.texts[i]
+            rendered.append(out)
+        return "\n".join(rendered)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Compact JSON-serializable form: parallel word, box and line arrays."""
+        return {"words": self.texts, "boxes": self.boxes.tolist(), "lines": self.line_ids.tolist()}
@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "http://localhost:11434"
+
+
+class OllamaClient:
+    """
+    Reusable client for the Ollama /api/generate endpoint. A single requests.Session keeps
+    connections alive across calls; connection errors and 429/5xx responses are retried with
+    exponential backoff before any of the response has been consumed.
+    """
+
+    def __init__(self, base_url: Optional[str] = None,
+                 timeout: Union[float, Tuple[float, float]] = (3.05, 120),
+                 retries: int = 3, backoff_factor: float = 0.5, pool_size: int = 10):
+        """
+        Args:
+            base_url (str, optional): Server URL, defaults to OLLAMA_URL or http://localhost:11434
+            timeout (float | Tuple[float, float]): Connect and read timeouts in seconds; the read
+                timeout applies between streamed chunks, not to the whole generation
+            retries (int): Retry attempts for failed connections and 429/5xx responses
+            backoff_factor (float): Backoff base in seconds (0.5 waits 0.5s, 1s, 2s, ...)
+            pool_size (int): Keep-alive connections to hold open
+        """
+        if base_url is None:
+            base_url = os.getenv("OLLAMA_URL", DEFAULT_BASE_URL)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def stream_generate(self, model: str, prompt: str, timeout: Union[None, float, Tuple[float, float]] = None,
+                        **options: Any) -> Iterator[str]:
+        """
+        Generate text, yielding tokens as the server streams them.
+        Args:
+            model (str): Model name
+            prompt (str): Prompt text
+            timeout (float | Tuple[float, float], optional): Overrides the client's timeouts for this call
+            **options: Extra fields for the request payload (e.g. options={"temperature": 0})
+        Yields:
+            str: Response fragments in order
+        Raises:
+            requests.exceptions.RequestException: On connection failure or an error status
+        """
+        payload: Dict[str, Any] = {"model": model, "prompt": prompt, "stream": True, **options}
+        with self.session.post(f"{self.base_url}/api/generate", json=payload, stream=True,
+                               timeout=timeout or self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.warning("skipping undecodable Ollama stream line", extra={"error": str(e)})
+                    continue
+                if data.get("error"):
+                    raise requests.exceptions.RequestException(data["error"])
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    break
+
+    def generate(self, model: str, prompt: str, timeout: Union[None, float, Tuple[float, float]] = None,
+                 **options: Any) -> str:
+        """
+        Generate text and return it once complete.
+        Args:
+            model (str): Model name
+            prompt (str): Prompt text
+            timeout (float | Tuple[float, float], optional): Overrides the client's timeouts for this call
+        Returns:
+            str: Full response
+        """
+        # Collect fragments and join once; repeated string concatenation is quadratic
+        return "".join(self.stream_generate(model, prompt, timeout, **options))
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> "OllamaClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,182 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+Stage = Tuple[str, Callable[[np.ndarray], np.ndarray]]
+
+# Receipt region detection runs on a copy downscaled to this width, skew estimation on a smaller one
+ANALYSIS_WIDTH = 800
+SKEW_ANALYSIS_WIDTH = 400
+# Largest skew searched for; beyond this a photo is more likely rotated than tilted
+MAX_DESKEW_DEGREES = 15.0
+
+
+def grayscale(image: np.ndarray) -> np.ndarray:
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def _analysis_copy(gray: np.ndarray, width: int = ANALYSIS_WIDTH) -> Tuple[np.ndarray, float]:
+    scale = min(1.0, width / gray.shape[1])
+    if scale == 1.0:
+        return gray, scale
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+
+def _paper_mask(small: np.ndarray) -> np.ndarray:
+    # Bright paper vs darker background, with text holes closed up
+    _, paper = cv2.threshold(cv2.GaussianBlur(small, (5, 5), 0), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return cv2.morphologyEx(paper, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+
+
+def crop_receipt(gray: np.ndarray) -> np.ndarray:
+    """
+    Crop to the bright paper region, so tesseract does not scan the table or background.
+    Leaves the image unchanged when no plausible receipt region is found.
+    """
+    small, scale = _analysis_copy(gray)
+    contours, _ = cv2.findContours(_paper_mask(small), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return gray
+
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    coverage = (w * h) / float(small.shape[0] * small.shape[1])
+    if not 0.1 <= coverage <= 0.95:
+        return gray
+
+    margin = int(0.02 * max(w, h))
+    x0, y0 = max(0, int((x - margin) / scale)), max(0, int((y - margin) / scale))
+    x1, y1 = min(gray.shape[1], int((x + w + margin) / scale)), min(gray.shape[0], int((y + h + margin) / scale))
+    return gray[y0:y1, x0:x1]
+
+
+def _rotate(image: np.ndarray, angle: float, border=cv2.BORDER_CONSTANT) -> np.ndarray:
+    h, w = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_LINEAR, borderMode=border)
+
+
+def estimate_skew(gray: np.ndarray) -> float:
+    """
+    Estimate the text skew angle in degrees with a projection profile: the rotation under
+    which the row sums of ink pixels are most sharply peaked puts text lines horizontal.
+    """
+    small, _ = _analysis_copy(gray, SKEW_ANALYSIS_WIDTH)
+    ink = cv2.adaptiveThreshold(small, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+    # Ignore edges of the dark background around the paper
+    ink = cv2.bitwise_and(ink, cv2.erode(_paper_mask(small), np.ones((9, 9), np.uint8)))
+
+    def sharpness(angle: float) -> float:
+        rows = _rotate(ink, angle).sum(axis=1, dtype=np.float64)
+        return float(np.sum(np.diff(rows) ** 2))
+
+    coarse = max(np.arange(-MAX_DESKEW_DEGREES, MAX_DESKEW_DEGREES + 0.5, 1.0), key=sharpness)
+    return float(max(np.arange(coarse - 1.0, coarse + 1.01, 0.1), key=sharpness))
+
+
+def deskew(gray: np.ndarray) -> np.ndarray:
+    """
+    Rotate the image so text lines are horizontal.
+    """
+    angle = estimate_skew(gray)
+    if abs(angle) < 0.3:
+        return gray
+    return _rotate(gray, angle, border=cv2.BORDER_REPLICATE)
+
+
+def median_blur(gray: np.ndarray) -> np.ndarray:
+    return cv2.medianBlur(gray, 3)
+
+
+def otsu_threshold(gray: np.ndarray) -> np.ndarray:
+    return cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+
+def adaptive_threshold(gray: np.ndarray) -> np.ndarray:
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 21, 10)
+
+
+def nl_means_denoise(gray: np.ndarray) -> np.ndarray:
+    return cv2.fastNlMeansDenoising(gray)
+
+
+PROFILES: Dict[str, List[Stage]] = {
+    # Cheap global binarization; good enough for flat, evenly lit scans
+    "fast": [
+        ("grayscale", grayscale),
+        ("crop", crop_receipt),
+        ("deskew", deskew),
+        ("median_blur", median_blur),
+        ("otsu_threshold", otsu_threshold),
+    ],
+    # Adaptive thresholding copes with shadows; a median filter stands in for NL-means
+    "balanced": [
+        ("grayscale", grayscale),
+        ("crop", crop_receipt),
+        ("deskew", deskew),
+        ("adaptive_threshold", adaptive_threshold),
+        ("median_blur", median_blur),
+    ],
+    # The original pipeline: adaptive threshold followed by NL-means denoising
+    "quality": [
+        ("grayscale", grayscale),
+        ("crop", crop_receipt),
+        ("deskew", deskew),
+        ("adaptive_threshold", adaptive_threshold),
+        ("denoise", nl_means_denoise),
+    ],
+}
+
+DEFAULT_PROFILE = os.getenv("OCR_PREPROCESS_PROFILE", "quality")
+
+
+def register_profile(name: str, stages: Sequence[Stage]) -> None:
+    """
+    Add or replace a named preprocessing profile.
+    Args:
+        name (str): Profile name
+        stages (Sequence[Stage]): (stage name, function) pairs run in order
+    """
+    PROFILES[name] = list(stages)
+
+
+def run_profile(image: np.ndarray, profile: Optional[str] = None) -> Tuple[np.ndarray, Dict[str, float]]:
+    """
+    Run a preprocessing profile on one image.
+    Args:
+        image (numpy.ndarray): BGR or grayscale image
+        profile (str, optional): Profile name, defaults to OCR_PREPROCESS_PROFILE or "quality"
+    Returns:
+        Tuple[numpy.ndarray, Dict[str, float]]: Processed image and per-stage timings in milliseconds
+    """
+    profile = profile or DEFAULT_PROFILE
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown preprocessing profile: {profile}")
+
+    timings: Dict[str, float] = {}
+    for name, stage in PROFILES[profile]:
+        start = time.perf_counter()
+        image = stage(image)
+        timings[name] = (time.perf_counter() - start) * 1000
+    return image, timings
+
+
+def run_profile_batch(images: Sequence[np.ndarray], profile: Optional[str] = None,
+                      workers: Optional[int] = None) -> List[Tuple[np.ndarray, Dict[str, float]]]:
+    """
+    Run a preprocessing profile on several images at once. OpenCV releases the GIL,
+    so a thread pool spreads the images across cores without copying them to subprocesses.
+    Args:
+        images (Sequence[numpy.ndarray]): Images to process
+        profile (str, optional): Profile name
+        workers (int, optional): Thread count, defaults to the CPU count
+    Returns:
+        List[Tuple[numpy.ndarray, Dict[str, float]]]: Results in input order
+    """
+    if len(images) <= 1:
+        return [run_profile(image, profile) for image in images]
+    with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+        return list(pool.map(lambda image: run_profile(image, profile), images))
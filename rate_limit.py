@@ -0,0 +1,515 @@
+"""
+Per-client rate limiting and fair-share admission control for the expensive endpoints.
+
+Each client (an API key from RATE_LIMIT_API_KEYS, or else its IP address) gets a token
+bucket: requests spend a token and tokens refill at a steady rate, so short bursts pass and
+sustained floods get 429 with Retry-After. Buckets live in process memory, or in a SQLite
+file shared by every worker on the host.
+
+Admitted requests then go through admission control: only so many run at once, no client
+holds more than its fair share of them while others wait, and new work waits (and is
+eventually refused) while the upstream concurrency limits already have calls queued.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Sequence, Tuple
+
+from metrics import RATE_LIMITED, route_name, timed
+
+logger = logging.getLogger(__name__)
+
+# Tokens added per second per client, and the most a client can save up
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "0.5"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+# Known API keys get a bucket of their own; anything else is limited by IP address
+API_KEY_HEADER = os.getenv("RATE_LIMIT_KEY_HEADER", "X-API-Key")
+API_KEYS = frozenset(key.strip() for key in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if key.strip())
+# Behind a proxy that sets X-Forwarded-For (Vercel, a load balancer), the client is its first hop
+TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "0").lower() in ("1", "true", "yes")
+# Buckets kept by the in-process backend; the least recently seen client is forgotten first
+MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000"))
+
+# Expensive requests running at once per process; 0 turns admission control off
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", "16"))
+# Requests allowed to wait for a slot before new ones are refused outright
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+# Seconds a request waits for a slot before it is refused
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+# Upstream calls queued on the concurrency limits at which new requests stop being admitted
+ADMISSION_MAX_UPSTREAM_WAITING = int(os.getenv("ADMISSION_MAX_UPSTREAM_WAITING", "16"))
+# Upstream pressure is polled, since nothing signals when it drops
+_POLL_INTERVAL = 0.05
+
+
+class RateLimited(Exception):
+    """A request refused by the rate limiter or admission control; answer with 429 and Retry-After."""
+    status = 429
+
+    def __init__(self, message: str, retry_after: float, reason: str = "rate"):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+        RATE_LIMITED.inc(reason=reason)
+
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+def client_key(headers: Mapping[str, str], remote_addr: Optional[str], trust_forwarded: bool = TRUST_FORWARDED) -> str:
+    """
+    The identity a request is limited under.
+    Args:
+        headers (Mapping[str, str]): Request headers
+        remote_addr (str, optional): Peer address of the connection
+        trust_forwarded (bool): Take the address from X-Forwarded-For, set by a trusted proxy
+    Returns:
+        str: "key:<digest>" for a known API key, else "ip:<address>"
+    """
+    api_key = headers.get(API_KEY_HEADER)
+    if api_key and api_key in API_KEYS:
+        # Never keep the key itself in memory dumps, the database or the logs
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    if trust_forwarded:
+        forwarded = headers.get("X-Forwarded-For", "").split(",")[0].strip()
+        if forwarded:
+            return "ip:" + forwarded
+    return "ip:" + (remote_addr or "unknown")
+
+
+class RateLimiter:
+    """Base class for token-bucket rate limiters. Subclasses keep the buckets."""
+    name = "base"
+
+    def __init__(self, rate: float = RATE_LIMIT_RATE, burst: float = RATE_LIMIT_BURST):
+        """
+        Args:
+            rate (float): Tokens added per second
+            burst (float): Bucket size, the most requests a rested client can make at once
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.allowed = 0
+        self.limited = 0
+        self._counts_lock = threading.Lock()
+
+    def _refill(self, tokens: float, updated: float, now: float, cost: float) -> Tuple[float, float]:
+        # Returns the tokens left and, when there are too few, seconds until there are enough
+        tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+        if tokens >= cost:
+            return tokens - cost, 0.0
+        return tokens, (cost - tokens) / self.rate
+
+    def _take(self, key: str, cost: float) -> float:
+        raise NotImplementedError
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """
+        Spend `cost` tokens from `key`'s bucket if it has them.
+        Args:
+            key (str): Client identity, see client_key
+            cost (float): Tokens the request costs
+        Returns:
+            float: 0 if the request may proceed, else seconds until it would be allowed
+        """
+        wait = self._take(key, cost)
+        with self._counts_lock:
+            if wait:
+                self.limited += 1
+            else:
+                self.allowed += 1
+        return wait
+
+    def check(self, key: str, cost: float = 1.0) -> None:
+        """
+        Like acquire, raising instead of returning the wait.
+        Raises:
+            RateLimited: When the bucket is short of tokens
+        """
+        wait = self.acquire(key, cost)
+        if wait:
+            raise RateLimited(f"Rate limit exceeded, retry in {math.ceil(wait)}s", wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "rate": self.rate, "burst": self.burst,
+                "allowed": self.allowed, "limited": self.limited}
+
+
+class InProcessRateLimiter(RateLimiter):
+    """Buckets in a dict. Each worker process limits on its own, so N workers allow N times the rate."""
+    name = "memory"
+
+    def __init__(self, rate: float = RATE_LIMIT_RATE, burst: float = RATE_LIMIT_BURST, max_clients: int = MAX_CLIENTS):
+        super().__init__(rate, burst)
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _take(self, key: str, cost: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens, wait = self._refill(tokens, updated, now, cost)
+            self._buckets[key] = (tokens, now)
+            # A forgotten client starts again with a full bucket, which it would have
+            # refilled to by now unless it is one of the most active
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "clients": len(self._buckets)}
+
+
+class SQLiteRateLimiter(RateLimiter):
+    """
+    Buckets in a SQLite table, so every web worker on the host draws from the same ones.
+    Each check is one short write transaction.
+    """
+    name = "sqlite"
+
+    def __init__(self, path, rate: float = RATE_LIMIT_RATE, burst: float = RATE_LIMIT_BURST,
+                 prune_every: int = 1000):
+        """
+        Args:
+            path (str | Path): Database file, shared by every process that should share limits
+            rate (float): Tokens added per second
+            burst (float): Bucket size
+            prune_every (int): Checks between deletions of buckets that have refilled
+        """
+        super().__init__(rate, burst)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.prune_every = prune_every
+        self._checks = 0
+        self._local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # The table is a cache of recent traffic; losing the last writes in a crash is fine
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _take(self, key: str, cost: float) -> float:
+        conn = self._connect()
+        # Wall-clock time, since the buckets are shared between processes
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't spend the same tokens
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row or (self.burst, now)
+            tokens, wait = self._refill(tokens, updated, now, cost)
+            conn.execute("INSERT OR REPLACE INTO rate_limits (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            self._checks += 1
+            if self._checks % self.prune_every == 0:
+                # A bucket idle long enough to be full again is the same as no bucket
+                conn.execute("DELETE FROM rate_limits WHERE updated < ?", (now - self.burst / self.rate,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        (clients,) = self._connect().execute("SELECT COUNT(*) FROM rate_limits").fetchone()
+        return {**super().stats(), "clients": clients}
+
+
+def create_rate_limiter(backend: Optional[str] = None, **kwargs) -> Optional[RateLimiter]:
+    """
+    Build a rate limiter from arguments, falling back to environment configuration:
+    RATE_LIMIT_BACKEND (memory, sqlite or none), RATE_LIMIT_PATH, RATE_LIMIT_RATE and RATE_LIMIT_BURST.
+    Args:
+        backend (str, optional): Backend name overriding RATE_LIMIT_BACKEND
+    Returns:
+        Optional[RateLimiter]: Configured limiter, or None when rate limiting is off
+    """
+    if backend is None:
+        backend = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    backend = backend.lower()
+    if backend in ("none", "off", ""):
+        return None
+    if backend == "memory":
+        return InProcessRateLimiter(**kwargs)
+    if backend == "sqlite":
+        path = kwargs.pop("path", None) or os.getenv("RATE_LIMIT_PATH", "cache/ratelimit.sqlite3")
+        return SQLiteRateLimiter(path, **kwargs)
+    raise ValueError(f"Unknown rate limit backend: {backend}")
+
+
+class AdmissionController:
+    """
+    Fair-share admission for expensive requests in one process. At most `capacity` run at
+    once, and while others wait no client holds more than capacity divided by the number of
+    clients with requests running or waiting, so one heavy client can't starve the rest.
+    Requests are also held back while `upstream_waiting()` reports that many upstream calls
+    already queued on the concurrency limits. A request waits up to `queue_timeout` seconds
+    for a slot; it is refused at once when `queue_size` requests are already waiting.
+    """
+
+    def __init__(self, capacity: int = ADMISSION_CAPACITY, queue_size: int = ADMISSION_QUEUE_SIZE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+                 upstream_waiting: Optional[Callable[[], int]] = None,
+                 max_upstream_waiting: int = ADMISSION_MAX_UPSTREAM_WAITING):
+        """
+        Args:
+            capacity (int): Requests running at once
+            queue_size (int): Requests allowed to wait for a slot
+            queue_timeout (float): Seconds a request may wait
+            upstream_waiting (Callable[[], int], optional): Upstream calls currently queued for a slot
+            max_upstream_waiting (int): Queued upstream calls at which admission pauses
+        """
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.upstream_waiting = upstream_waiting
+        self.max_upstream_waiting = max_upstream_waiting
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self._running: Dict[str, int] = {}
+        self._waiting: Dict[str, int] = {}
+        self._waiting_total = 0
+        # Smoothed seconds a request holds its slot, for Retry-After
+        self._hold_time = 1.0
+        self._cond = threading.Condition()
+
+    def _fair_share(self) -> int:
+        clients = len(self._running.keys() | self._waiting.keys())
+        return max(1, self.capacity // max(1, clients))
+
+    def _upstream_busy(self) -> bool:
+        return self.upstream_waiting is not None and self.upstream_waiting() >= self.max_upstream_waiting
+
+    def _can_run(self, client: str) -> bool:
+        return (sum(self._running.values()) < self.capacity
+                and self._running.get(client, 0) < self._fair_share()
+                and not self._upstream_busy())
+
+    def _retry_after(self) -> float:
+        # Roughly how long until the requests ahead have drained
+        return self._hold_time * (self._waiting_total + 1) / max(1, self.capacity)
+
+    def _reject(self, message: str) -> RateLimited:
+        self.rejected += 1
+        return RateLimited(message, self._retry_after(), reason="overload")
+
+    def admit(self, client: str) -> float:
+        """
+        Wait for a slot for `client`. Pair every admission with release().
+        Args:
+            client (str): Client identity, see client_key
+        Returns:
+            float: Admission time, to pass to release()
+        Raises:
+            RateLimited: When the queue is full or no slot frees up within queue_timeout
+        """
+        with self._cond:
+            if not self._can_run(client):
+                if self._waiting_total >= self.queue_size:
+                    raise self._reject("Server is busy, retry later")
+                self.queued += 1
+                self._waiting[client] = self._waiting.get(client, 0) + 1
+                self._waiting_total += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while not self._can_run(client):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise self._reject("Server is busy, retry later")
+                        self._cond.wait(min(remaining, _POLL_INTERVAL) if self.upstream_waiting else remaining)
+                finally:
+                    self._waiting_total -= 1
+                    self._waiting[client] -= 1
+                    if not self._waiting[client]:
+                        del self._waiting[client]
+            self._running[client] = self._running.get(client, 0) + 1
+            self.admitted += 1
+        return time.monotonic()
+
+    def release(self, client: str, admitted_at: Optional[float] = None) -> None:
+        """Give back the slot `client` got from admit()."""
+        with self._cond:
+            self._running[client] -= 1
+            if not self._running[client]:
+                del self._running[client]
+            if admitted_at is not None:
+                self._hold_time = 0.8 * self._hold_time + 0.2 * (time.monotonic() - admitted_at)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "capacity": self.capacity,
+                "running": sum(self._running.values()),
+                "waiting": self._waiting_total,
+                "clients": len(self._running.keys() | self._waiting.keys()),
+                "fair_share": self._fair_share(),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "hold_time": round(self._hold_time, 3),
+            }
+
+
+def create_admission(upstream_waiting: Optional[Callable[[], int]] = None) -> Optional[AdmissionController]:
+    """
+    Build admission control from ADMISSION_* configuration.
+    Args:
+        upstream_waiting (Callable[[], int], optional): Upstream calls currently queued for a slot
+    Returns:
+        Optional[AdmissionController]: The controller, or None when ADMISSION_CAPACITY is 0
+    """
+    if ADMISSION_CAPACITY <= 0:
+        return None
+    return AdmissionController(upstream_waiting=upstream_waiting)
+
+
+def protect_flask(app: Any, endpoints: Iterable[str], limiter: Optional[RateLimiter] = None,
+                  admission: Optional[AdmissionController] = None, queued: Iterable[str] = (),
+                  trust_forwarded: bool = TRUST_FORWARDED) -> None:
+    """
+    Rate limit and admit requests to `endpoints` of a Flask app before their view runs.
+    Refused requests get 429 with Retry-After and a JSON error.
+    Args:
+        app (flask.Flask): Application
+        endpoints (Iterable[str]): Endpoint (view function) names to protect
+        limiter (RateLimiter, optional): Per-client token buckets
+        admission (AdmissionController, optional): Concurrency and fair-share limits
+        queued (Iterable[str]): Those of `endpoints` that only queue work for later, which are
+            rate limited but not admitted
+        trust_forwarded (bool): Identify clients by X-Forwarded-For (see client_key)
+    """
+    from flask import g, jsonify, request
+
+    protected = frozenset(endpoints)
+    background = frozenset(queued)
+
+    @app.before_request
+    def _admit():
+        if request.endpoint not in protected:
+            return None
+        client = client_key(request.headers, request.remote_addr, trust_forwarded)
+        try:
+            if limiter is not None:
+                with timed("rate_limit"):
+                    limiter.check(client)
+            if admission is not None and request.endpoint not in background:
+                with timed("admission"):
+                    g.admission = (client, admission.admit(client))
+        except RateLimited as e:
+            logger.debug("request refused",
+                         extra={"client": client, "reason": e.reason, "retry_after": round(e.retry_after, 1)})
+            return jsonify({'error': str(e)}), e.status, e.headers()
+        return None
+
+    if admission is not None:
+        _release_admissions(app, admission)
+
+
+def _release_admissions(app: Any, admission: AdmissionController) -> None:
+    # Give back the slot protect_flask admitted a request to, once, whether or not the view failed
+    from flask import g
+
+    @app.after_request
+    def _release_when_sent(response):
+        held = g.pop("admission", None)
+        if held is not None:
+            # Streaming responses are still running here; release the slot when the body is done
+            response.call_on_close(lambda: admission.release(*held))
+        return response
+
+    @app.teardown_request
+    def _release_on_error(error=None):
+        held = g.pop("admission", None)
+        if held is not None:
+            admission.release(*held)
+
+
+class ASGIProtection:
+    """
+    ASGI middleware that does for a Starlette app what protect_flask does for Flask: requests
+    to the named routes are rate limited and admitted before the app sees them, and refused
+    ones get 429 with Retry-After and a JSON error. An admitted request keeps its slot until
+    its response, streamed or not, has been sent.
+    """
+
+    def __init__(self, app: Any, routes: Sequence[Any] = (), endpoints: Iterable[str] = (),
+                 limiter: Optional[RateLimiter] = None, admission: Optional[AdmissionController] = None,
+                 trust_forwarded: bool = TRUST_FORWARDED):
+        """
+        Args:
+            app: ASGI application to wrap
+            routes (Sequence[starlette.routing.BaseRoute]): Routes used to name endpoints
+            endpoints (Iterable[str]): Route names to protect
+            limiter (RateLimiter, optional): Per-client token buckets
+            admission (AdmissionController, optional): Concurrency and fair-share limits
+            trust_forwarded (bool): Identify clients by X-Forwarded-For (see client_key)
+        """
+        self.app = app
+        self.routes = routes
+        self.endpoints = frozenset(endpoints)
+        self.limiter = limiter
+        self.admission = admission
+        self.trust_forwarded = trust_forwarded
+
+    def _admit(self, client: str) -> Optional[float]:
+        # Blocking: the SQLite limiter and the admission queue both wait, so this runs on a thread
+        if self.limiter is not None:
+            with timed("rate_limit"):
+                self.limiter.check(client)
+        if self.admission is None:
+            return None
+        with timed("admission"):
+            return self.admission.admit(client)
+
+    def _release_abandoned(self, client: str, admitting: "asyncio.Future[Optional[float]]") -> None:
+        if self.admission is not None and not admitting.cancelled() and admitting.exception() is None:
+            self.admission.release(client, admitting.result())
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or route_name(self.routes, scope) not in self.endpoints:
+            await self.app(scope, receive, send)
+            return
+        from starlette.datastructures import Headers
+        from starlette.responses import JSONResponse
+
+        peer = scope.get("client")
+        client = client_key(Headers(scope=scope), peer[0] if peer else None, self.trust_forwarded)
+        admitting = asyncio.ensure_future(asyncio.to_thread(self._admit, client))
+        try:
+            admitted_at = await asyncio.shield(admitting)
+        except asyncio.CancelledError:
+            # The client went away while queued; its slot, if it still gets one, goes straight back
+            admitting.add_done_callback(lambda done: self._release_abandoned(client, done))
+            raise
+        except RateLimited as e:
+            logger.debug("request refused",
+                         extra={"client": client, "reason": e.reason, "retry_after": round(e.retry_after, 1)})
+            response = JSONResponse({'error': str(e)}, status_code=e.status, headers=e.headers())
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if self.admission is not None:
+                self.admission.release(client, admitted_at)
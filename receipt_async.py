@@ -0,0 +1,125 @@
+"""
+asyncio facade over ReceiptProcessor for the ASGI app. The pipeline itself is the one the
+Flask apps and job workers use, with its backends, deadlines, circuit breakers, failover and
+hedging; each blocking stage runs on a thread pool sized for hundreds of receipts in flight,
+so the event loop keeps serving while they wait on upstream APIs.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from receipt_core import ReceiptProcessor
+
+T = TypeVar("T")
+
+# Threads running blocking stages at once per worker. Most of them sit waiting on Vision or
+# the LLM, so this can be far above the CPU count; the backends' own concurrency limits still apply
+ASYNC_THREADS = int(os.getenv("RECEIPT_ASYNC_THREADS", "256"))
+
+
+class AsyncReceiptProcessor:
+    """
+    Awaitable versions of the ReceiptProcessor entry points. Calls run on a worker thread
+    in a copy of the caller's context, so stage timers still count toward the request.
+    """
+
+    def __init__(self, processor: ReceiptProcessor, threads: int = ASYNC_THREADS):
+        """
+        Args:
+            processor (ReceiptProcessor): The pipeline to run
+            threads (int): Blocking stages running at once
+        """
+        self.processor = processor
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="receipt-async")
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """Run a blocking call on the pool and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, contextvars.copy_context().run, func, *args)
+
+    async def iterate(self, func: Callable[[], Iterator[T]]) -> AsyncIterator[T]:
+        """
+        Drive a blocking generator on one pool thread, yielding its items as they arrive. When
+        the consumer stops early, the generator is closed once its current item is produced.
+        """
+        loop = asyncio.get_running_loop()
+        items: "asyncio.Queue[Tuple[bool, Any]]" = asyncio.Queue()
+        stop = threading.Event()
+
+        def produce() -> None:
+            # (False, item) per item, then (True, None) at the end or (True, error) on failure
+            iterator = func()
+            try:
+                for item in iterator:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(items.put_nowait, (False, item))
+                outcome: Tuple[bool, Any] = (True, None)
+            except Exception as e:
+                outcome = (True, e)
+            finally:
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+            loop.call_soon_threadsafe(items.put_nowait, outcome)
+
+        loop.run_in_executor(self._executor, contextvars.copy_context().run, produce)
+        try:
+            while True:
+                finished, value = await items.get()
+                if finished:
+                    if value is not None:
+                        raise value
+                    return
+                yield value
+        finally:
+            stop.set()
+
+    async def process(self, content: bytes) -> Optional[Dict[str, Any]]:
+        """See ReceiptProcessor.process_image."""
+        return await self.run(self.processor.process_image, content)
+
+    async def generate_recipes(self, food_items: List[str]) -> List[Dict[str, Any]]:
+        """See ReceiptProcessor.generate_recipes."""
+        return await self.run(self.processor.generate_recipes, food_items)
+
+    def events(self, content: bytes) -> AsyncIterator[Tuple[str, Any]]:
+        """See ReceiptProcessor.events."""
+        return self.iterate(lambda: self.processor.events(content))
+
+    async def stream(self, content: bytes) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process a receipt image, yielding each stage as soon as it is ready:
+        a "receipt" event with the structured data, then a "recipes" event when food items were found.
+        Args:
+            content (bytes): Raw image bytes
+        Yields:
+            Dict[str, Any]: {"stage": ..., "data": ...} events
+        Raises:
+            ValueError: If the receipt could not be processed
+            UpstreamUnavailable: If the deadline passed or every backend of a stage is unavailable
+        """
+        receipt_data = await self.process(content)
+        if not receipt_data:
+            raise ValueError("Failed to process receipt")
+        # Start the recipe call before handing the receipt to the consumer, so it
+        # runs while the caller is still writing the first event out
+        recipe_task = None
+        if receipt_data.get("food_items"):
+            recipe_task = asyncio.ensure_future(self.generate_recipes(receipt_data["food_items"]))
+        try:
+            yield {"stage": "receipt", "data": receipt_data}
+
+            if recipe_task is not None:
+                yield {"stage": "recipes", "data": await recipe_task}
+        finally:
+            # The client went away mid-stream; stop waiting for the recipes. The call already
+            # running ends at its deadline and still fills the caches
+            if recipe_task is not None and not recipe_task.done():
+                recipe_task.cancel()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,263 @@
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+from food_lexicon import tag_food
+from image_normalize import NormalizeConfig, normalize_image_bytes
+from metrics import timed
+from ocr_layout import OCRLayout
+from receipt_compaction import compact_receipt, report_compaction
+from receipt_cache import ReceiptCache, hash_bytes, normalize_ingredients, text_key
+from receipt_prompts import batch_format_messages, parse_json
+
+logger = logging.getLogger(__name__)
+
+# Vision accepts at most 16 images per batch_annotate_images call
+VISION_BATCH_LIMIT = 16
+# Upper bound on files accepted by one /api/process-receipts request
+BATCH_MAX_FILES = int(os.getenv("RECEIPT_BATCH_MAX_FILES", "50"))
+# Receipts packed into one completion: limited by count and by total OCR characters,
+# so a batch of long receipts is split before its reply outgrows the output token limit
+BATCH_MAX_RECEIPTS = int(os.getenv("RECEIPT_BATCH_SIZE", "8"))
+BATCH_MAX_CHARS = int(os.getenv("RECEIPT_BATCH_CHARS", "6000"))
+# Completions in flight at once for one batch request
+BATCH_LLM_WORKERS = int(os.getenv("RECEIPT_BATCH_WORKERS", "4"))
+# Ingredients passed to the combined recipe prompt, most frequent first
+MAX_RECIPE_INGREDIENTS = 25
+
+Complete = Callable[[List[dict]], str]
+FormatOne = Callable[[str], Optional[Dict[str, Any]]]
+
+
+def chunked(items: Sequence, size: int) -> List[Sequence]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def annotate_images(vision_client: Any, contents: Sequence[bytes],
+                    normalize_config: Optional[NormalizeConfig] = None,
+                    slot: Optional[Callable[[], Any]] = None,
+                    timeout: Optional[float] = None) -> List[Union[str, Exception]]:
+    """
+    OCR several images with as few Vision round trips as possible.
+    Args:
+        vision_client (vision.ImageAnnotatorClient): Vision client
+        contents (Sequence[bytes]): Raw image bytes
+        normalize_config (NormalizeConfig, optional): Normalization applied before upload
+        slot (Callable, optional): Returns a context manager held around each Vision call
+        timeout (float, optional): Seconds allowed for each Vision call
+    Returns:
+        List[Union[str, Exception]]: Column-aligned OCR text per image, or the error for images that failed
+    """
+    # Imported on first use; it adds about half a second to every cold start otherwise
+    from google.cloud import vision
+
+    # Pillow releases the GIL while decoding and encoding, so normalize in parallel
+    with ThreadPoolExecutor(min(8, len(contents)) or 1) as pool:
+        normalized = list(pool.map(lambda content: normalize_image_bytes(content, normalize_config), contents))
+
+    # Leave the client's default timeout in place unless the caller has a deadline
+    options = {"timeout": timeout} if timeout else {}
+    results: List[Union[str, Exception]] = []
+    for chunk in chunked(normalized, VISION_BATCH_LIMIT):
+        requests = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=content),
+                features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)],
+            )
+            for content in chunk
+        ]
+        with (slot() if slot else nullcontext()):
+            response = vision_client.batch_annotate_images(requests=requests, **options)
+        for item in response.responses:
+            message = getattr(getattr(item, "error", None), "message", None)
+            if message:
+                results.append(RuntimeError(message))
+            elif not item.text_annotations:
+                results.append(ValueError("No text found in image"))
+            else:
+                results.append(OCRLayout.from_vision(item.text_annotations).to_text()
+                               or item.text_annotations[0].description)
+    return results
+
+
+def pack_texts(texts: Sequence[str], max_receipts: int = BATCH_MAX_RECEIPTS,
+               max_chars: int = BATCH_MAX_CHARS) -> List[List[int]]:
+    """
+    Group receipts into completions, in order.
+    Args:
+        texts (Sequence[str]): OCR text of each receipt
+        max_receipts (int): Receipts per group
+        max_chars (int): Total characters per group; a longer receipt gets a group of its own
+    Returns:
+        List[List[int]]: Indices into `texts` for each group
+    """
+    groups: List[List[int]] = []
+    size = 0
+    for i, text in enumerate(texts):
+        if not groups or len(groups[-1]) >= max_receipts or size + len(text) > max_chars:
+            groups.append([])
+            size = 0
+        groups[-1].append(i)
+        size += len(text)
+    return groups
+
+
+def parse_batch_response(content: str, count: int) -> List[Dict[str, Any]]:
+    """
+    Split a batched completion back into per-receipt results.
+    Args:
+        content (str): Raw completion text
+        count (int): Number of receipts in the prompt
+    Returns:
+        List[Dict[str, Any]]: Structured data for each receipt, in prompt order
+    Raises:
+        ValueError: If the reply is not JSON or does not hold exactly `count` receipts
+    """
+    data = parse_json(content)
+    receipts = data.get("receipts") if isinstance(data, dict) else None
+    if not isinstance(receipts, list) or len(receipts) != count or not all(isinstance(r, dict) for r in receipts):
+        raise ValueError(f"Expected {count} receipts in batched response")
+    return receipts
+
+
+def format_packed_group(texts: Sequence[str], complete: Complete) -> Optional[List[Dict[str, Any]]]:
+    """
+    Structure several compacted receipts in one completion.
+    Args:
+        texts (Sequence[str]): Compacted OCR text of each receipt
+        complete (Callable[[List[dict]], str]): Runs a chat completion and returns its text
+    Returns:
+        Optional[List[Dict[str, Any]]]: Food-tagged receipt data in order, or None when the
+            completion failed or its reply can't be split back per receipt
+    """
+    try:
+        parsed = parse_batch_response(complete(batch_format_messages(list(texts))), len(texts))
+    except Exception as e:
+        logger.warning("batched formatting failed, falling back to one receipt per call",
+                       extra={"receipts": len(texts), "error": str(e)})
+        return None
+    return [tag_food(receipt_data) for receipt_data in parsed]
+
+
+def _store(cache: ReceiptCache, text: str, receipt_data: Dict[str, Any]) -> Dict[str, Any]:
+    cache_key = text_key(text)
+    # The text key doubles as the receipt ID used by /api/receipts/<id>/recipes
+    receipt_data["receipt_id"] = cache_key
+    cache.text.set(cache_key, receipt_data)
+    return receipt_data
+
+
+def _known_receipt(text: str, cache: ReceiptCache, parse: Optional[FormatOne]) -> Optional[Dict[str, Any]]:
+    # Cached, or parsed locally (and then cached), without a completion
+    cached = cache.text.get(text_key(text))
+    if cached is not None:
+        return cached
+    receipt_data = parse(text) if parse else None
+    return _store(cache, text, receipt_data) if receipt_data is not None else None
+
+
+def format_receipt_texts(texts: Sequence[str], cache: ReceiptCache, complete: Complete,
+                         format_one: FormatOne, parse: Optional[FormatOne] = None,
+                         workers: int = BATCH_LLM_WORKERS) -> List[Optional[Dict[str, Any]]]:
+    """
+    Structure several receipts, packing the ones that are neither cached nor parsed locally
+    into shared completions. A group whose reply can't be split back per receipt is retried
+    one receipt at a time.
+    Args:
+        texts (Sequence[str]): OCR text of each receipt
+        cache (ReceiptCache): Result cache; the text tier is read and filled
+        complete (Callable[[List[dict]], str]): Runs a chat completion and returns its text
+        format_one (Callable[[str], Optional[dict]]): Structures a single receipt (with caching)
+        parse (Callable[[str], Optional[dict]], optional): Local parser, returning None when it is not confident
+        workers (int): Completions run concurrently
+    Returns:
+        List[Optional[Dict[str, Any]]]: Receipt data in input order, None where processing failed
+    """
+    results = [_known_receipt(text, cache, parse) for text in texts]
+    pending = [i for i, receipt_data in enumerate(results) if receipt_data is None]
+
+    def run_group(indices: List[int]) -> None:
+        if len(indices) > 1:
+            for i in indices:
+                report_compaction(compacted[i])
+            parsed = format_packed_group([compacted[i].text for i in indices], complete)
+            if parsed is not None:
+                for i, receipt_data in zip(indices, parsed):
+                    results[i] = _store(cache, texts[i], receipt_data)
+                return
+        # format_one compacts (and if need be chunks) the receipt itself
+        for i in indices:
+            results[i] = format_one(texts[i])
+
+    # Receipts over the prompt token budget are chunked by format_one; the rest are packed
+    # by their compacted length
+    with timed("prompt_compact"):
+        compacted = {i: compact_receipt(texts[i]) for i in pending}
+    oversized = [[i] for i in pending if len(compacted[i].chunks) > 1]
+    packable = [i for i in pending if len(compacted[i].chunks) == 1]
+    groups = oversized + [[packable[j] for j in group] for group in pack_texts([compacted[i].text for i in packable])]
+    if groups:
+        with ThreadPoolExecutor(min(workers, len(groups))) as pool:
+            list(pool.map(run_group, groups))
+    return results
+
+
+def process_receipt_batch(contents: Sequence[bytes], cache: ReceiptCache,
+                          ocr: Callable[[Sequence[bytes]], List[Union[str, Exception]]],
+                          complete: Complete, format_one: FormatOne,
+                          parse: Optional[FormatOne] = None) -> List[Dict[str, Any]]:
+    """
+    Process several receipt images: batched OCR, then packed formatting completions.
+    Args:
+        contents (Sequence[bytes]): Raw image bytes
+        cache (ReceiptCache): Result cache; images already seen skip OCR and formatting
+        ocr (Callable): OCRs a list of images, e.g. a partial of annotate_images
+        complete (Callable[[List[dict]], str]): Runs a chat completion and returns its text
+        format_one (Callable[[str], Optional[dict]]): Structures a single receipt
+        parse (Callable[[str], Optional[dict]], optional): Local parser tried before any completion
+    Returns:
+        List[Dict[str, Any]]: Per-image {"success": True, "processed_data": ...} or {"success": False, "error": ...}
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(contents)
+    image_keys = [hash_bytes(content) for content in contents]
+    pending = []
+    for i, image_key in enumerate(image_keys):
+        cached = cache.image.get(image_key)
+        if cached is not None:
+            results[i] = {"success": True, "processed_data": cached}
+        else:
+            pending.append(i)
+
+    texts = ocr([contents[i] for i in pending]) if pending else []
+    readable = [(i, text) for i, text in zip(pending, texts) if not isinstance(text, Exception)]
+    for i, text in zip(pending, texts):
+        if isinstance(text, Exception):
+            results[i] = {"success": False, "error": str(text)}
+
+    formatted = format_receipt_texts([text for _, text in readable], cache, complete, format_one, parse)
+    for (i, _), receipt_data in zip(readable, formatted):
+        if receipt_data:
+            cache.image.set(image_keys[i], receipt_data)
+            results[i] = {"success": True, "processed_data": receipt_data}
+        else:
+            results[i] = {"success": False, "error": "Failed to process receipt"}
+    # Every slot is filled above; the fallback only narrows the type
+    return [result or {"success": False, "error": "Failed to process receipt"} for result in results]
+
+
+def combined_food_items(receipts: Sequence[Dict[str, Any]], limit: int = MAX_RECIPE_INGREDIENTS) -> List[str]:
+    """
+    Merge the food items of several receipts for one recipe pass.
+    Args:
+        receipts (Sequence[Dict[str, Any]]): Structured receipt data
+        limit (int): Maximum ingredients returned
+    Returns:
+        List[str]: Normalized ingredients, most frequent across receipts first
+    """
+    counts: "Counter[str]" = Counter()
+    for receipt_data in receipts:
+        counts.update(normalize_ingredients(receipt_data.get("food_items") or []))
+    return [item for item, _ in counts.most_common(limit)]
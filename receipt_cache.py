@@ -0,0 +1,303 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from food_lexicon import canonical_ingredient
+
+
+def hash_bytes(data) -> str:
+    """
+    Content hash used as the image-tier cache key.
+    Args:
+        data (bytes | memoryview): Raw uploaded image bytes
+    Returns:
+        str: Hex SHA-256 digest
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def normalize_ocr_text(text: str) -> str:
+    """
+    Normalize OCR text so that different photos of the same receipt map to the same key.
+    Lowercases, drops blank lines and collapses runs of whitespace inside each line.
+    Args:
+        text (str): Raw OCR text
+    Returns:
+        str: Normalized text
+    """
+    lines = (re.sub(r"\s+", " ", line).strip().lower() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def text_key(text: str) -> str:
+    """
+    Cache key for the OCR-text tier.
+    Args:
+        text (str): Raw OCR text
+    Returns:
+        str: Hex SHA-256 digest of the normalized text
+    """
+    return hashlib.sha256(normalize_ocr_text(text).encode("utf-8")).hexdigest()
+
+
+def normalize_ingredients(food_items) -> List[str]:
+    """
+    Canonical form of an ingredient basket: each item as its canonical ingredient name (or
+    lowercased and whitespace-collapsed when the food lexicon has none), deduplicated and sorted.
+    Args:
+        food_items (List[str]): Food items as returned by the receipt parser
+    Returns:
+        List[str]: Normalized ingredient list
+    """
+    return sorted({canonical_ingredient(item) or re.sub(r"\s+", " ", item).strip().lower()
+                   for item in food_items if item and item.strip()})
+
+
+def ingredient_key(food_items) -> str:
+    """
+    Cache key for recipe suggestions; identical baskets in any order share a key.
+    Args:
+        food_items (List[str]): Food items from the receipt
+    Returns:
+        str: Hex SHA-256 digest of the normalized ingredient set
+    """
+    return hashlib.sha256("\n".join(normalize_ingredients(food_items)).encode("utf-8")).hexdigest()
+
+
+class CacheBackend:
+    """
+    Base class for result caches. Entries expire after `ttl` seconds (None disables expiry)
+    and the least recently used entries are evicted once `max_entries` is exceeded.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _expiry(self) -> Optional[float]:
+        return time.time() + self.ttl if self.ttl else None
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: Hit/miss/eviction counters and current size
+        """
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class NullCache(CacheBackend):
+    """Cache that stores nothing; used when caching is disabled."""
+
+    def get(self, key: str) -> Optional[Any]:
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return 0
+
+
+class LRUCache(CacheBackend):
+    """In-memory LRU cache, local to the worker process."""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        super().__init__(max_entries, ttl)
+        self._entries: "OrderedDict[str, Tuple[Optional[float], Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (self._expiry(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache(CacheBackend):
+    """
+    On-disk cache backed by SQLite, shared by every worker pointing at the same file.
+    Values must be JSON-serializable.
+    """
+
+    def __init__(self, path, table: str = "cache", max_entries: int = 10000, ttl: Optional[float] = None):
+        super().__init__(max_entries, ttl)
+        if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", table):
+            raise ValueError(f"Invalid cache table name: {table}")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        value, expires_at = row
+        with conn:
+            if expires_at is not None and expires_at < now:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.evictions += 1
+                self.misses += 1
+                return None
+            conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key: str, value: Any) -> None:
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), self._expiry(), now),
+            )
+            conn.execute(f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+            overflow = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN "
+                    f"(SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+
+    def __len__(self) -> int:
+        return self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+def create_cache(namespace: str, backend: Optional[str] = None, **kwargs) -> CacheBackend:
+    """
+    Build a cache backend from arguments, falling back to environment configuration:
+    RECEIPT_CACHE_BACKEND (memory, sqlite or none), RECEIPT_CACHE_PATH,
+    RECEIPT_CACHE_TTL (seconds) and RECEIPT_CACHE_SIZE (max entries).
+    Args:
+        namespace (str): Logical cache name, used as the SQLite table name
+        backend (str, optional): Backend name overriding RECEIPT_CACHE_BACKEND
+    Returns:
+        CacheBackend: Configured cache
+    """
+    if backend is None:
+        backend = os.getenv("RECEIPT_CACHE_BACKEND", "memory")
+    backend = backend.lower()
+    ttl = kwargs.pop("ttl", None)
+    if ttl is None and os.getenv("RECEIPT_CACHE_TTL"):
+        ttl = float(os.environ["RECEIPT_CACHE_TTL"])
+    max_entries = kwargs.pop("max_entries", None) or int(os.getenv("RECEIPT_CACHE_SIZE", "1024"))
+
+    if backend == "none":
+        return NullCache(max_entries, ttl)
+    if backend == "memory":
+        return LRUCache(max_entries, ttl)
+    if backend == "sqlite":
+        path = kwargs.pop("path", None) or os.getenv("RECEIPT_CACHE_PATH", "cache/receipts.sqlite3")
+        return SQLiteCache(path, table=namespace, max_entries=max_entries, ttl=ttl)
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+class ReceiptCache:
+    """
+    Tiered result cache for receipt processing.
+    The image tier is keyed by a hash of the uploaded bytes and skips both OCR and the LLM;
+    the text tier is keyed by the normalized OCR text and skips only the LLM. The text key
+    doubles as the receipt ID, so the text tier is also where receipts are looked up by ID.
+    The recipe tier memoizes suggestions per normalized ingredient set.
+    """
+
+    def __init__(self, image_cache: CacheBackend, text_cache: CacheBackend, recipe_cache: CacheBackend):
+        self.image = image_cache
+        self.text = text_cache
+        self.recipes = recipe_cache
+
+    @classmethod
+    def from_env(cls, backend: Optional[str] = None) -> "ReceiptCache":
+        return cls(
+            create_cache("image_results", backend),
+            create_cache("text_results", backend),
+            create_cache("recipe_results", backend),
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"image": self.image.stats(), "text": self.text.stats(), "recipes": self.recipes.stats()}
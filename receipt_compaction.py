@@ -0,0 +1,180 @@
+"""
+Prompt compaction for receipt formatting. OCR text is normalized and stripped of lines the
+LLM never needs (barcodes, survey URLs, masked card numbers, loyalty and payment-terminal
+chatter, separators, repeated banners) before it is sent, and receipts still over the token
+budget are split into chunks that are formatted separately and merged.
+"""
+import logging
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Sequence
+
+from metrics import PROMPT_CHUNKS, PROMPT_TEXT_TOKENS
+from receipt_parser import DATE_RE, PRICE_RE, SUBTOTAL_RE, TAX_RE, TIME_RE, TOTAL_RE
+from receipt_prompts import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Set to 0 to send OCR text as-is
+COMPACTION_ENABLED = os.getenv("RECEIPT_PROMPT_COMPACTION", "1").lower() not in ("0", "false", "no")
+# Receipt-text tokens per formatting completion; longer receipts are chunked
+PROMPT_TOKEN_BUDGET = int(os.getenv("RECEIPT_PROMPT_TOKEN_BUDGET", "1500"))
+
+# Lines dropped unless they state a total or the date, prices or not
+PAYMENT_NOISE_RE = re.compile(
+    r"(https?://|www\.|\.(com|net|org|co\.uk)\b"
+    # Card masks and payment phrases
+    r"|[*xX#]{4,}\s*-?\s*\d{4}\b"
+    r"|\b(auth(orization)? (code|no|#)|approval|appr code|entry method|contactless|chip read|pin verified"
+    r"|verified by pin)\b)",
+    re.IGNORECASE,
+)
+# Payment-terminal fields ("AID: A0000000031010", "TID 12345678"). The codes are short enough
+# to start item names ("MID ATLANTIC MILK"), so only the key-value shape counts
+TERMINAL_FIELD_RE = re.compile(
+    r"^(aid|tvr|tsi|iad|arqc|mid|tid|terminal( id)?|seq( no)?|trace( no)?)"
+    r"(\s*[:#]|\s+[0-9a-f*]{4,}\s*$)",
+    re.IGNORECASE,
+)
+# Lines dropped only when they carry no price, since item names can contain these words too
+CHATTER_RE = re.compile(
+    r"\b(survey|feedback|tell us|rate us|chance to win|sweepstakes?|thank you|thanks for|come again"
+    r"|have a (nice|great|good) day|return policy|returns? (within|accepted|with)|receipt required"
+    r"|customer copy|merchant copy|retain this|keep this receipt"
+    r"|points?|rewards?|member(ship)?|loyalty|you saved|your savings|total savings|club ?card)\b",
+    re.IGNORECASE,
+)
+# Barcodes and other long digit runs with no amount, and rows of OCR'd barcode bars
+BARCODE_RE = re.compile(r"^(?=(?:\D*\d){10})[\d\s-]+$|^[|Il1!\s]{8,}$")
+# Rows of dashes, stars, equals signs and the like
+SEPARATOR_RE = re.compile(r"^[\W_]{3,}$")
+
+
+class CompactedText(NamedTuple):
+    text: str
+    chunks: List[str]
+    tokens_before: int
+    tokens_after: int
+    lines_before: int
+    lines_after: int
+
+
+def _keep(line: str) -> bool:
+    # Totals and the date are never boilerplate, whatever else the line says
+    return bool(SUBTOTAL_RE.search(line) or TAX_RE.search(line) or TOTAL_RE.search(line)
+                or DATE_RE.search(line) or TIME_RE.search(line))
+
+
+def is_boilerplate(line: str) -> bool:
+    """
+    Args:
+        line (str): One normalized OCR line
+    Returns:
+        bool: True if the line carries nothing the receipt schema asks for
+    """
+    if SEPARATOR_RE.match(line) or BARCODE_RE.match(line):
+        return True
+    if _keep(line):
+        return False
+    return bool(PAYMENT_NOISE_RE.search(line) or TERMINAL_FIELD_RE.match(line)
+                or (CHATTER_RE.search(line) and not PRICE_RE.search(line)))
+
+
+def compact_lines(text: str) -> List[str]:
+    """
+    Normalize OCR text line by line: strip, collapse whitespace (column gaps become two
+    spaces, so an item and its price stay apart), drop boilerplate and repeat non-item lines.
+    Args:
+        text (str): OCR text
+    Returns:
+        List[str]: The lines worth sending, in order
+    """
+    lines: List[str] = []
+    seen = set()
+    for raw in text.splitlines():
+        line = re.sub(r"[ \t]{2,}", "  ", raw.strip())
+        if not line or is_boilerplate(line):
+            continue
+        # The same item bought twice prints twice; anything else repeated is a banner or footer
+        if not PRICE_RE.search(line):
+            key = line.lower()
+            if key in seen:
+                continue
+            seen.add(key)
+        lines.append(line)
+    return lines
+
+
+def chunk_lines(lines: Sequence[str], budget: int = PROMPT_TOKEN_BUDGET) -> List[str]:
+    """
+    Split lines into chunks of at most `budget` tokens, never inside a line.
+    Args:
+        lines (Sequence[str]): Compacted lines
+        budget (int): Tokens per chunk; a single longer line gets a chunk of its own
+    Returns:
+        List[str]: Chunk texts, at least one
+    """
+    chunks: List[List[str]] = [[]]
+    size = 0
+    for line in lines:
+        # One more for the newline
+        tokens = count_tokens(line) + 1
+        if chunks[-1] and size + tokens > budget:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(line)
+        size += tokens
+    return ["\n".join(chunk) for chunk in chunks]
+
+
+def compact_receipt(text: str, budget: int = PROMPT_TOKEN_BUDGET) -> CompactedText:
+    """
+    Compact OCR text for the formatting prompt and split it to fit the token budget.
+    Args:
+        text (str): OCR text
+        budget (int): Receipt-text tokens per completion
+    Returns:
+        CompactedText: The compacted text, its chunks and the token and line counts before and after
+    """
+    raw_lines = [line for line in text.splitlines() if line.strip()]
+    lines = compact_lines(text) if COMPACTION_ENABLED else [line.rstrip() for line in raw_lines]
+    compacted = "\n".join(lines)
+    tokens_after = count_tokens(compacted)
+    chunks = chunk_lines(lines, budget) if tokens_after > budget else [compacted]
+    return CompactedText(compacted, chunks, count_tokens(text), tokens_after, len(raw_lines), len(lines))
+
+
+def report_compaction(compacted: CompactedText) -> None:
+    """Log a receipt's token counts before and after compaction and add them to the metrics."""
+    PROMPT_TEXT_TOKENS.inc(compacted.tokens_before, stage="raw")
+    PROMPT_TEXT_TOKENS.inc(compacted.tokens_after, stage="compacted")
+    PROMPT_CHUNKS.inc(len(compacted.chunks))
+    logger.info("prompt compacted", extra={
+        "tokens_before": compacted.tokens_before,
+        "tokens_after": compacted.tokens_after,
+        "lines_before": compacted.lines_before,
+        "lines_after": compacted.lines_after,
+        "chunks": len(compacted.chunks),
+    })
+
+
+def merge_chunk_results(parts: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine the structured data of a receipt's chunks: header fields from the first chunk
+    that has them, totals from the last, items and food items from all of them in order.
+    Args:
+        parts (Sequence[Dict[str, Any]]): Receipt data per chunk, in chunk order
+    Returns:
+        Dict[str, Any]: Receipt data for the whole receipt
+    """
+    merged: Dict[str, Any] = {"merchant": None, "datetime": None, "items": [],
+                              "subtotal": None, "tax": None, "total": None, "food_items": []}
+    for part in parts:
+        for key in ("merchant", "datetime"):
+            merged[key] = merged[key] or part.get(key)
+        for key in ("subtotal", "tax", "total"):
+            merged[key] = part.get(key) or merged[key]
+        merged["items"].extend(part.get("items") or [])
+        merged["food_items"].extend(item for item in part.get("food_items") or []
+                                    if item not in merged["food_items"])
+    return merged
@@ -0,0 +1,31 @@
+"""
+Receipt processing shared by the Flask apps, the job workers and ReceiptOCR: interchangeable
+OCR backends (Cloud Vision, tesseract) and LLM backends (OpenAI, Ollama, a stub), grouped with
+per-backend concurrency limits, circuit breakers, failover, hedging and request deadlines.
+"""
+from receipt_prompts import parse_json
+
+from .llm import LLMBackend, OllamaChat, OpenAIChat, StubLLM, create_llm_backend
+from .ocr import OCRBackend, TesseractOCR, VisionOCR, create_ocr_backend
+from .processor import ReceiptProcessor, create_processor
+from .routing import BackendGroup, CircuitOpenError, Deadline, DeadlineExceeded, UpstreamUnavailable
+
+__all__ = [
+    "BackendGroup",
+    "CircuitOpenError",
+    "Deadline",
+    "DeadlineExceeded",
+    "LLMBackend",
+    "OCRBackend",
+    "OllamaChat",
+    "OpenAIChat",
+    "ReceiptProcessor",
+    "StubLLM",
+    "TesseractOCR",
+    "UpstreamUnavailable",
+    "VisionOCR",
+    "create_llm_backend",
+    "create_ocr_backend",
+    "create_processor",
+    "parse_json",
+]
@@ -0,0 +1,211 @@
+"""
+LLM backends. Each backend runs a chat completion over OpenAI-style messages and returns its
+text, or streams it token by token, so the same prompts work against OpenAI, a local Ollama
+server or a stub.
+"""
+import json
+import os
+import threading
+import time
+from importlib import metadata
+from typing import Any, Callable, Iterator, List, Optional
+
+from ollama_client import OllamaClient
+from receipt_parser import parse_receipt
+from receipt_prompts import JSON_RESPONSE_FORMAT, MODEL, OPENAI_JSON_MODE
+
+
+def _legacy_openai() -> bool:
+    # Read from the package metadata: importing openai 1.x takes most of a second
+    try:
+        return int(metadata.version("openai").split(".")[0]) < 1
+    except (metadata.PackageNotFoundError, ValueError):
+        return False
+
+
+# openai<1.0 exposes ChatCompletion; 1.x exposes the OpenAI client
+LEGACY_OPENAI = _legacy_openai()
+
+
+class LLMBackend:
+    """
+    Base class for LLM backends. `name` keys the backend's concurrency limit and stats;
+    `concurrency` caps calls in flight at once (None is unlimited).
+    """
+    name = "llm"
+    concurrency: Optional[int] = None
+
+    def complete(self, messages: List[dict], timeout: Optional[float] = None) -> str:
+        """
+        Args:
+            messages (List[dict]): Chat messages
+            timeout (float, optional): Seconds the call may take
+        Returns:
+            str: Completion text
+        """
+        raise NotImplementedError
+
+    def stream(self, messages: List[dict], timeout: Optional[float] = None) -> Iterator[str]:
+        """Yield the completion in fragments. Backends without streaming yield it whole."""
+        yield self.complete(messages, timeout)
+
+    def complete_json(self, messages: List[dict], timeout: Optional[float] = None) -> str:
+        """Like complete, for prompts that ask for a JSON object; backends with a JSON mode enforce it."""
+        return self.complete(messages, timeout)
+
+    def stream_json(self, messages: List[dict], timeout: Optional[float] = None) -> Iterator[str]:
+        """Like stream, for prompts that ask for a JSON object."""
+        return self.stream(messages, timeout)
+
+    def warm_up(self) -> None:
+        """Create clients and import dependencies ahead of the first call. Safe to call repeatedly."""
+
+
+class OpenAIChat(LLMBackend):
+    """
+    OpenAI chat completions, with either SDK generation. Unless one is given, the SDK is imported
+    and the client created by the first call (or warm_up), once across threads.
+    """
+    name = "openai"
+
+    def __init__(self, client: Any = None, model: str = MODEL, api_key: Optional[str] = None,
+                 concurrency: Optional[int] = None, json_mode: Optional[bool] = None):
+        """
+        Args:
+            client (optional): Preconfigured client (openai.OpenAI, or openai.ChatCompletion before 1.0)
+            model (str): Chat model
+            api_key (str, optional): Defaults to OPENAI_API_KEY
+            concurrency (int, optional): Concurrent calls, defaults to OPENAI_CONCURRENCY or 8
+            json_mode (bool, optional): Send response_format json_object on JSON prompts, so replies
+                always parse; defaults to OPENAI_JSON_MODE
+        """
+        self._client = client
+        self._client_lock = threading.Lock()
+        self.model = model
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.concurrency = concurrency or int(os.getenv("OPENAI_CONCURRENCY", "8"))
+        self.json_mode = OPENAI_JSON_MODE if json_mode is None else json_mode
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import openai
+
+                    if LEGACY_OPENAI:
+                        openai.api_key = self.api_key
+                        self._client = openai.ChatCompletion  # type: ignore[attr-defined]
+                    else:
+                        self._client = openai.OpenAI(api_key=self.api_key)  # type: ignore[attr-defined]
+        return self._client
+
+    def warm_up(self) -> None:
+        self.client
+
+    def _create(self, messages: List[dict], timeout: Optional[float], **kwargs: Any) -> Any:
+        create = self.client.create if LEGACY_OPENAI else self.client.chat.completions.create
+        if timeout:
+            kwargs["request_timeout" if LEGACY_OPENAI else "timeout"] = timeout
+        return create(model=self.model, messages=messages, **kwargs)
+
+    def _json_options(self) -> dict:
+        return {"response_format": JSON_RESPONSE_FORMAT} if self.json_mode else {}
+
+    def complete(self, messages: List[dict], timeout: Optional[float] = None) -> str:
+        return self._create(messages, timeout).choices[0].message.content.strip()
+
+    def complete_json(self, messages: List[dict], timeout: Optional[float] = None) -> str:
+        return self._create(messages, timeout, **self._json_options()).choices[0].message.content.strip()
+
+    def stream(self, messages: List[dict], timeout: Optional[float] = None) -> Iterator[str]:
+        return self._stream(messages, timeout)
+
+    def stream_json(self, messages: List[dict], timeout: Optional[float] = None) -> Iterator[str]:
+        return self._stream(messages, timeout, **self._json_options())
+
+    def _stream(self, messages: List[dict], timeout: Optional[float], **kwargs: Any) -> Iterator[str]:
+        for chunk in self._create(messages, timeout, stream=True, **kwargs):
+            if LEGACY_OPENAI:
+                token = chunk["choices"][0]["delta"].get("content")
+            else:
+                token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                yield token
+
+
+class OllamaChat(LLMBackend):
+    """A local Ollama model. System messages go in Ollama's `system` field, the rest form the prompt."""
+    name = "ollama"
+
+    def __init__(self, client: Optional[OllamaClient] = None, model: Optional[str] = None,
+                 concurrency: Optional[int] = None):
+        self.client = client or OllamaClient()
+        self.model: str = model or os.getenv("OLLAMA_MODEL") or "llama3"
+        # A local model serves one or two generations at a time; more just queue on the server
+        self.concurrency = concurrency or int(os.getenv("OLLAMA_CONCURRENCY", "2"))
+
+    def stream(self, messages: List[dict], timeout: Optional[float] = None, **options: Any) -> Iterator[str]:
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        prompt = "\n\n".join(m["content"] for m in messages if m["role"] != "system")
+        if system:
+            options["system"] = system
+        yield from self.client.stream_generate(self.model, prompt, timeout, **options)
+
+    def stream_json(self, messages: List[dict], timeout: Optional[float] = None) -> Iterator[str]:
+        # Ollama's JSON mode constrains generation to valid JSON
+        return self.stream(messages, timeout, format="json")
+
+    def complete(self, messages: List[dict], timeout: Optional[float] = None) -> str:
+        return "".join(self.stream(messages, timeout)).strip()
+
+    def complete_json(self, messages: List[dict], timeout: Optional[float] = None) -> str:
+        return "".join(self.stream_json(messages, timeout)).strip()
+
+
+def _stub_reply(messages: List[dict]) -> str:
+    # Good enough for receipt prompts: the local parser's reading of the prompt text
+    return json.dumps(parse_receipt(messages[-1]["content"]).data)
+
+
+class StubLLM(LLMBackend):
+    """
+    Canned replies without any network calls, for development and load tests without API keys.
+    Recipe prompts get no recipes; receipt prompts get the local parser's output.
+    """
+    name = "stub"
+
+    def __init__(self, reply: Optional[Callable[[List[dict]], str]] = None, delay: float = 0.0,
+                 concurrency: Optional[int] = None):
+        """
+        Args:
+            reply (Callable[[List[dict]], str], optional): Builds the reply for a list of messages
+            delay (float): Seconds to sleep per call, to simulate upstream latency
+            concurrency (int, optional): Calls in flight at once (unlimited by default)
+        """
+        self.reply = reply or _stub_reply
+        self.delay = delay
+        self.concurrency = concurrency
+
+    def complete(self, messages: List[dict], timeout: Optional[float] = None) -> str:
+        if timeout is not None and self.delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"stub reply takes {self.delay:.2f}s, over the {timeout:.2f}s timeout")
+        if self.delay:
+            time.sleep(self.delay)
+        return self.reply(messages)
+
+
+LLM_BACKENDS = {"openai": OpenAIChat, "ollama": OllamaChat, "stub": StubLLM}
+
+
+def create_llm_backend(name: str, **kwargs) -> LLMBackend:
+    """
+    Args:
+        name (str): "openai", "ollama" or "stub"
+        **kwargs: Passed to the backend constructor
+    """
+    try:
+        return LLM_BACKENDS[name.strip().lower()](**kwargs)
+    except KeyError:
+        raise ValueError(f"Unknown LLM backend: {name}") from None
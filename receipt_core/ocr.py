@@ -0,0 +1,199 @@
+"""
+OCR backends. Each backend turns raw image bytes into an OCRLayout and column-aligned text,
+so callers can swap Cloud Vision for local tesseract (or run both, see routing.BackendGroup).
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from image_normalize import NormalizeConfig, normalize_image_bytes
+from metrics import timed
+from ocr_layout import OCRLayout
+from receipt_batch import annotate_images
+
+
+def create_vision_client(endpoint: Optional[str] = None, credentials_info: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Build a Vision client. google.cloud.vision takes about half a second to import, so it is
+    imported here, on first use, rather than when the module loads.
+    Args:
+        endpoint (str, optional): Vision API endpoint override, defaults to VISION_ENDPOINT. Set it
+            to the local stub in benchmarks/stubs.py; calls then use the REST transport without credentials.
+        credentials_info (dict, optional): Service account key, defaults to the JSON in GOOGLE_CREDENTIALS.
+            Without either, the default credentials (GOOGLE_APPLICATION_CREDENTIALS) are used.
+    Returns:
+        vision.ImageAnnotatorClient: The client
+    """
+    from google.cloud import vision
+
+    endpoint = endpoint or os.getenv("VISION_ENDPOINT")
+    if endpoint:
+        from google.auth.credentials import AnonymousCredentials
+        return vision.ImageAnnotatorClient(transport="rest", credentials=AnonymousCredentials(),
+                                           client_options={"api_endpoint": endpoint})
+    if credentials_info is None and os.getenv("GOOGLE_CREDENTIALS"):
+        credentials_info = json.loads(os.environ["GOOGLE_CREDENTIALS"])
+    if credentials_info is not None:
+        # Straight from memory: no key file written to disk
+        return vision.ImageAnnotatorClient.from_service_account_info(credentials_info)
+    return vision.ImageAnnotatorClient()
+
+
+class OCRBackend:
+    """
+    Base class for OCR backends. `name` keys the backend's concurrency limit and stats;
+    `concurrency` caps calls in flight at once (None is unlimited).
+    """
+    name = "ocr"
+    concurrency: Optional[int] = None
+
+    def extract_layout(self, content: bytes, timeout: Optional[float] = None) -> OCRLayout:
+        raise NotImplementedError
+
+    def extract_text(self, content: bytes, timeout: Optional[float] = None) -> str:
+        """
+        Args:
+            content (bytes): Raw image bytes
+            timeout (float, optional): Seconds the call may take
+        Returns:
+            str: Column-aligned text rebuilt from the word boxes
+        Raises:
+            ValueError: If no text is found
+        """
+        text = self.extract_layout(content, timeout).to_text()
+        if not text.strip():
+            raise ValueError("No text found in image")
+        return text
+
+    def warm_up(self) -> None:
+        """Create clients and import dependencies ahead of the first call. Safe to call repeatedly."""
+
+    def extract_texts(self, contents: Sequence[bytes], timeout: Optional[float] = None) -> List[Union[str, Exception]]:
+        """
+        OCR several images.
+        Returns:
+            List[Union[str, Exception]]: Text per image, or the error for images that failed
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        results: List[Union[str, Exception]] = []
+        for content in contents:
+            try:
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("OCR time budget exhausted")
+                results.append(self.extract_text(content, remaining))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class VisionOCR(OCRBackend):
+    """
+    Google Cloud Vision text detection. Unless one is given, the client is created by the first
+    call (or warm_up), once, however many threads arrive at the same time.
+    """
+    name = "vision"
+
+    def __init__(self, client: Any = None, normalize_config: Optional[NormalizeConfig] = None,
+                 concurrency: Optional[int] = None):
+        """
+        Args:
+            client (vision.ImageAnnotatorClient, optional): Preconfigured client, see create_vision_client
+            normalize_config (NormalizeConfig, optional): Upload normalization, defaults to the environment
+            concurrency (int, optional): Concurrent calls, defaults to VISION_CONCURRENCY or 8
+        """
+        self._client = client
+        self._client_lock = threading.Lock()
+        self.normalize_config = normalize_config or NormalizeConfig.from_env()
+        self.concurrency = concurrency or int(os.getenv("VISION_CONCURRENCY", "8"))
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = create_vision_client()
+        return self._client
+
+    def warm_up(self) -> None:
+        self.client
+
+    def _annotate(self, content: bytes, timeout: Optional[float]) -> Sequence[Any]:
+        from google.cloud import vision
+
+        # Fix orientation, downscale and recompress before upload
+        image = vision.Image(content=normalize_image_bytes(content, self.normalize_config))
+        options = {"timeout": timeout} if timeout else {}
+        texts = self.client.text_detection(image=image, **options).text_annotations
+        if not texts:
+            raise ValueError("No text found in image")
+        return texts
+
+    def extract_layout(self, content: bytes, timeout: Optional[float] = None) -> OCRLayout:
+        return OCRLayout.from_vision(self._annotate(content, timeout))
+
+    def extract_text(self, content: bytes, timeout: Optional[float] = None) -> str:
+        texts = self._annotate(content, timeout)
+        # The first element is the full text, which loses the item/price pairing; rebuild
+        # the printed lines from the word boxes that follow it instead
+        return OCRLayout.from_vision(texts).to_text() or texts[0].description
+
+    def extract_texts(self, contents: Sequence[bytes], timeout: Optional[float] = None) -> List[Union[str, Exception]]:
+        # Up to 16 images per round trip
+        return annotate_images(self.client, contents, self.normalize_config, timeout=timeout)
+
+
+class TesseractOCR(OCRBackend):
+    """Local tesseract through ReceiptOCR: normalization, a preprocessing profile, then word-level OCR."""
+    name = "tesseract"
+
+    def __init__(self, receipt_ocr=None, profile: Optional[str] = None, concurrency: Optional[int] = None):
+        """
+        Args:
+            receipt_ocr (ReceiptOCR, optional): Configured processor, created on first use by default
+            profile (str, optional): Preprocessing profile
+            concurrency (int, optional): Concurrent OCR calls, defaults to TESSERACT_CONCURRENCY or the CPU count
+        """
+        self._receipt_ocr = receipt_ocr
+        self._receipt_ocr_lock = threading.Lock()
+        self.profile = profile
+        self.concurrency = concurrency or int(os.getenv("TESSERACT_CONCURRENCY", str(os.cpu_count() or 1)))
+
+    @property
+    def receipt_ocr(self):
+        if self._receipt_ocr is None:
+            with self._receipt_ocr_lock:
+                if self._receipt_ocr is None:
+                    # Imported here: receipt_ocr pulls in OpenCV and pytesseract, which Vision-only deployments skip
+                    from receipt_ocr import ReceiptOCR
+                    self._receipt_ocr = ReceiptOCR()
+        return self._receipt_ocr
+
+    def warm_up(self) -> None:
+        self.receipt_ocr
+
+    def extract_layout(self, content: bytes, timeout: Optional[float] = None) -> OCRLayout:
+        # Decoding is timed inside image normalization
+        image = self.receipt_ocr.load_image(content)
+        if image is None:
+            raise ValueError("Could not load image from upload buffer")
+        with timed("preprocess"):
+            image = self.receipt_ocr.preprocess_image(image, self.profile)
+        return self.receipt_ocr.extract_layout(image, timeout)
+
+
+OCR_BACKENDS = {"vision": VisionOCR, "tesseract": TesseractOCR}
+
+
+def create_ocr_backend(name: str, **kwargs) -> OCRBackend:
+    """
+    Args:
+        name (str): "vision" or "tesseract"
+        **kwargs: Passed to the backend constructor
+    """
+    try:
+        return OCR_BACKENDS[name.strip().lower()](**kwargs)
+    except KeyError:
+        raise ValueError(f"Unknown OCR backend: {name}") from None
@@ -0,0 +1,409 @@
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from food_lexicon import tag_food
+from metrics import (LLM_STAGES, Sample, backend_samples, cache_samples, count_llm_tokens, parser_samples,
+                     recipe_index_samples, timed)
+from receipt_batch import BATCH_LLM_WORKERS, process_receipt_batch
+from receipt_cache import ReceiptCache, hash_bytes, ingredient_key, text_key
+from receipt_compaction import compact_receipt, merge_chunk_results, report_compaction
+from receipt_parser import MIN_CONFIDENCE, ParserMetrics, parse_receipt
+from recipe_index import RecipeIndex, create_recipe_index
+from receipt_store import ReceiptStore, create_store
+from receipt_prompts import format_messages, parse_json, recipe_messages
+
+from .llm import LLMBackend, create_llm_backend
+from .ocr import OCRBackend, create_ocr_backend
+from .routing import LLM_HEDGE_AFTER, OCR_HEDGE_AFTER, REQUEST_DEADLINE, BackendGroup, Deadline, UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+class ReceiptProcessor:
+    """
+    The receipt pipeline behind every entry point: cache lookups, OCR, the local parser,
+    LLM formatting and recipe suggestions, each upstream call going through a BackendGroup.
+    Every public method takes an optional Deadline shared by all of its stages; without one,
+    a new deadline of `deadline` seconds starts.
+    """
+
+    def __init__(self, ocr: Sequence[OCRBackend], llm: Sequence[LLMBackend], cache: Optional[ReceiptCache] = None,
+                 ocr_hedge_after: Optional[float] = OCR_HEDGE_AFTER,
+                 llm_hedge_after: Optional[float] = LLM_HEDGE_AFTER,
+                 deadline: Optional[float] = REQUEST_DEADLINE, store: Optional[ReceiptStore] = None,
+                 recipe_index: Optional[RecipeIndex] = None):
+        """
+        Args:
+            ocr (Sequence[OCRBackend]): OCR backends, primary first
+            llm (Sequence[LLMBackend]): LLM backends, primary first
+            cache (ReceiptCache, optional): Result cache, defaults to the RECEIPT_CACHE_* configuration
+            ocr_hedge_after (float, optional): Seconds before a slow OCR call is also sent to the next backend
+            llm_hedge_after (float, optional): Seconds before a slow completion is also sent to the next backend
+            deadline (float, optional): Default time budget per request in seconds; None is unlimited
+            store (ReceiptStore, optional): Where processed receipts are kept; re-uploads of a stored
+                image are answered from it. None keeps nothing.
+            recipe_index (RecipeIndex, optional): Corpus of generated recipes; baskets it covers are
+                answered without an LLM call. None always asks the LLM.
+        """
+        self.ocr = BackendGroup(ocr, hedge_after=ocr_hedge_after)
+        self.llm = BackendGroup(llm, hedge_after=llm_hedge_after)
+        self.cache = cache or ReceiptCache.from_env()
+        self.store = store
+        self.recipe_index = recipe_index
+        self.parser_metrics = ParserMetrics()
+        self.deadline = deadline
+
+    def stored_image(self, image_key: str) -> Optional[Dict[str, Any]]:
+        """A receipt already processed from the same image bytes, from the cache or else the store."""
+        receipt_data = self.cache.image.get(image_key)
+        if receipt_data is None and self.store is not None:
+            with timed("store"):
+                receipt_data = self.store.get_by_image(image_key)
+            if receipt_data is not None:
+                self.cache.image.set(image_key, receipt_data)
+        return receipt_data
+
+    def persist(self, receipts: Sequence[Tuple[Dict[str, Any], str]]) -> None:
+        """Save (receipt_data, image_key) pairs to the store. A failed write is logged, not raised."""
+        if self.store is None or not receipts:
+            return
+        try:
+            with timed("store"):
+                self.store.save_many(receipts)
+        except Exception as e:
+            logger.warning("could not save receipts", extra={"receipts": len(receipts), "error": str(e)})
+
+    def new_deadline(self) -> Deadline:
+        return Deadline(self.deadline)
+
+    def extract_text(self, content: bytes, deadline: Optional[Deadline] = None) -> str:
+        """
+        Returns:
+            str: Column-aligned OCR text
+        Raises:
+            ValueError: If no text is found
+            UpstreamUnavailable: If no OCR backend answered in time
+        """
+        with timed("ocr"):
+            return self.ocr.call("extract_text", content, deadline=deadline or self.new_deadline())
+
+    def extract_texts(self, contents: Sequence[bytes], deadline: Optional[Deadline] = None) -> List[Union[str, Exception]]:
+        with timed("ocr"):
+            return self.ocr.call("extract_texts", contents, deadline=deadline or self.new_deadline())
+
+    def complete(self, messages: List[dict], deadline: Optional[Deadline] = None, purpose: str = "format") -> str:
+        """
+        Run a chat completion in JSON mode and return its text, timed as the llm_<purpose> stage.
+        Args:
+            messages (List[dict]): Chat messages
+            deadline (Deadline, optional): Time budget
+            purpose (str): "format" or "recipes", for the stage timer and token counts
+        """
+        with timed(LLM_STAGES[purpose]):
+            content = self.llm.call("complete_json", messages, deadline=deadline or self.new_deadline())
+        count_llm_tokens(purpose, messages, content)
+        return content
+
+    def parse_locally(self, text: str) -> Optional[Dict[str, Any]]:
+        """
+        Parse a receipt with the rule-based parser
+        Returns:
+            dict: Receipt data, or None when the parse is not confident enough to skip the LLM
+        """
+        with timed("local_parse"):
+            result = parse_receipt(text)
+        bypass = result.confidence >= MIN_CONFIDENCE
+        self.parser_metrics.record_parse(result, bypass)
+        return result.data if bypass else None
+
+    def format_with_llm(self, text: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Structure a receipt with the LLM. The text is compacted first; a receipt still over the
+        prompt token budget is formatted in chunks, concurrently, and the results merged. Food
+        items are then tagged with the local lexicon.
+        Args:
+            text (str): OCR text
+            deadline (Deadline, optional): Time budget shared by every chunk
+        Returns:
+            dict: Receipt data
+        """
+        deadline = deadline or self.new_deadline()
+        with timed("prompt_compact"):
+            compacted = compact_receipt(text)
+        report_compaction(compacted)
+
+        def format_chunk(part: int) -> Dict[str, Any]:
+            position = (part + 1, len(compacted.chunks)) if len(compacted.chunks) > 1 else None
+            content = self.complete(format_messages(compacted.chunks[part], position), deadline)
+            with timed("json_parse"):
+                return parse_json(content)
+
+        if len(compacted.chunks) == 1:
+            return tag_food(format_chunk(0))
+        # A fresh copy of the request's context per chunk, so stage timers still count toward it
+        with ThreadPoolExecutor(min(len(compacted.chunks), BATCH_LLM_WORKERS)) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, format_chunk, part)
+                       for part in range(len(compacted.chunks))]
+            return tag_food(merge_chunk_results([future.result() for future in futures]))
+
+    def process_text(self, text: str, local_parse: bool = True,
+                     deadline: Optional[Deadline] = None) -> Optional[Dict[str, Any]]:
+        """
+        Structure receipt text, with the rule-based parser or else the LLM.
+        Args:
+            text (str): OCR text
+            local_parse (bool): Try the rule-based parser first
+            deadline (Deadline, optional): Time budget shared with the caller's other stages
+        Returns:
+            dict: Receipt data, or None if processing failed
+        Raises:
+            UpstreamUnavailable: If the deadline passed or every LLM backend's breaker is open
+        """
+        # Different photos of the same receipt produce the same normalized text
+        cache_key = text_key(text)
+        cached = self.cache.text.get(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            receipt_data = self.parse_locally(text) if local_parse else None
+            if receipt_data is None:
+                start = time.perf_counter()
+                receipt_data = self.format_with_llm(text, deadline)
+                self.parser_metrics.record_llm((time.perf_counter() - start) * 1000)
+
+            # The text key doubles as the receipt ID used by /api/receipts/<id>/recipes
+            receipt_data["receipt_id"] = cache_key
+            self.cache.text.set(cache_key, receipt_data)
+            return receipt_data
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            logger.error("text processing failed", extra={"error": str(e)})
+            return None
+
+    def process_image(self, content: bytes, deadline: Optional[Deadline] = None) -> Optional[Dict[str, Any]]:
+        """
+        Args:
+            content (bytes): Raw image bytes
+            deadline (Deadline, optional): Time budget for OCR and formatting together
+        Returns:
+            dict: Receipt data, or None if OCR or formatting failed
+        Raises:
+            UpstreamUnavailable: If the deadline passed or every backend of a stage is unavailable
+        """
+        deadline = deadline or self.new_deadline()
+        try:
+            # Repeat uploads of the same bytes skip OCR and the LLM entirely
+            image_key = hash_bytes(content)
+            cached = self.stored_image(image_key)
+            if cached is not None:
+                return cached
+
+            receipt_data = self.process_text(self.extract_text(content, deadline), deadline=deadline)
+            if receipt_data:
+                self.cache.image.set(image_key, receipt_data)
+                self.persist([(receipt_data, image_key)])
+            return receipt_data
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            logger.error("receipt processing failed", extra={"error": str(e)})
+            return None
+
+    def process_images(self, contents: Sequence[bytes], deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+        """
+        Process several receipt images with batched OCR and packed completions. Images already
+        in the store are answered from it.
+        Returns:
+            List[Dict[str, Any]]: Per-image {"success": True, "processed_data": ...} or {"success": False, "error": ...}
+        """
+        deadline = deadline or self.new_deadline()
+        image_keys = [hash_bytes(content) for content in contents]
+        results: Dict[int, Dict[str, Any]] = {}
+        for i, image_key in enumerate(image_keys):
+            stored = self.stored_image(image_key)
+            if stored is not None:
+                results[i] = {"success": True, "processed_data": stored}
+        pending = [i for i in range(len(contents)) if i not in results]
+        if pending:
+            processed = process_receipt_batch(
+                [contents[i] for i in pending],
+                self.cache,
+                ocr=lambda images: self.extract_texts(images, deadline),
+                complete=lambda messages: self.complete(messages, deadline),
+                # Receipts that reach format_one have already failed the local parse
+                format_one=lambda text: self.process_text(text, local_parse=False, deadline=deadline),
+                parse=self.parse_locally
+            )
+            results.update(zip(pending, processed))
+            self.persist([(results[i]["processed_data"], image_keys[i]) for i in pending if results[i]["success"]])
+        return [results[i] for i in range(len(contents))]
+
+    def run_job(self, content: bytes) -> Dict[str, Any]:
+        """
+        Job handler: process one receipt image for the background queue
+        """
+        receipt_data = self.process_image(content)
+        if not receipt_data:
+            raise ValueError("Failed to process receipt")
+        return receipt_data
+
+    def get_receipt(self, receipt_id: str) -> Optional[Dict[str, Any]]:
+        receipt_data = self.cache.text.get(receipt_id)
+        if receipt_data is None and self.store is not None:
+            receipt_data = self.store.get(receipt_id)
+        return receipt_data
+
+    def known_recipes(self, food_items: List[str], cache_key: str) -> Optional[List[Dict[str, Any]]]:
+        """Recipes for a basket without an LLM call: from the cache, or else from the recipe index."""
+        recipes = self.cache.recipes.get(cache_key)
+        if recipes is None and self.recipe_index is not None:
+            with timed("recipe_index"):
+                recipes = self.recipe_index.lookup(food_items)
+            if recipes is not None:
+                self.cache.recipes.set(cache_key, recipes)
+        return recipes
+
+    def remember_recipes(self, food_items: List[str], cache_key: str, recipes: List[Dict[str, Any]]) -> None:
+        """Cache freshly generated recipes and add them to the recipe index."""
+        self.cache.recipes.set(cache_key, recipes)
+        if self.recipe_index is not None:
+            self.recipe_index.add(food_items, recipes)
+
+    def generate_recipes(self, food_items: List[str], deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+        """
+        Generate recipe suggestions, memoized per normalized ingredient set and served from the
+        recipe index when it covers the basket
+        """
+        cache_key = ingredient_key(food_items)
+        known = self.known_recipes(food_items, cache_key)
+        if known is not None:
+            return known
+
+        content = self.complete(recipe_messages(food_items), deadline, purpose="recipes")
+        with timed("json_parse"):
+            recipes = parse_json(content).get("recipes", [])
+        self.remember_recipes(food_items, cache_key, recipes)
+        return recipes
+
+    def stream_recipe_tokens(self, food_items: List[str], deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """
+        Stream a recipe completion, yielding tokens as they arrive
+        """
+        messages = recipe_messages(food_items)
+        tokens = []
+        with timed("recipes"):
+            for token in self.llm.stream("stream_json", messages, deadline=deadline or self.new_deadline()):
+                tokens.append(token)
+                yield token
+        count_llm_tokens("recipes", messages, "".join(tokens))
+
+    def events(self, content: bytes) -> Iterator[Tuple[str, Any]]:
+        """
+        Process a receipt, yielding (event, data) pairs as each stage completes:
+        ocr, receipt, recipe_token (repeated), recipes and finally done
+        """
+        # The receipt stages share one deadline; the recipe stream gets its own, since the
+        # client is already seeing progress by then
+        deadline = self.new_deadline()
+        image_key = hash_bytes(content)
+        receipt_data = self.stored_image(image_key)
+        if receipt_data is None:
+            text = self.extract_text(content, deadline)
+            yield 'ocr', {'text': text}
+
+            receipt_data = self.process_text(text, deadline=deadline)
+            if not receipt_data:
+                raise ValueError("Failed to process receipt")
+            self.cache.image.set(image_key, receipt_data)
+            self.persist([(receipt_data, image_key)])
+        yield 'receipt', receipt_data
+
+        food_items = receipt_data.get('food_items') or []
+        if food_items:
+            cache_key = ingredient_key(food_items)
+            recipes = self.known_recipes(food_items, cache_key)
+            if recipes is None:
+                tokens = []
+                for token in self.stream_recipe_tokens(food_items):
+                    tokens.append(token)
+                    yield 'recipe_token', token
+                with timed('json_parse'):
+                    recipes = parse_json(''.join(tokens)).get('recipes', [])
+                self.remember_recipes(food_items, cache_key, recipes)
+            yield 'recipes', recipes
+
+        yield 'done', {}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"ocr": self.ocr.stats(), "llm": self.llm.stats()}
+
+    def warm_up(self) -> Dict[str, Any]:
+        """
+        Import every backend's SDK and create its client now rather than in the first request.
+        Returns:
+            Dict[str, Any]: Milliseconds spent per backend, or the error for backends that failed
+        """
+        timings: Dict[str, Any] = {}
+        for backend in [*self.ocr.backends, *self.llm.backends]:
+            start = time.perf_counter()
+            try:
+                backend.warm_up()
+                timings[backend.name] = round((time.perf_counter() - start) * 1000, 1)
+            except Exception as e:
+                logger.warning("backend warm-up failed", extra={"backend": backend.name, "error": str(e)})
+                timings[backend.name] = {"error": str(e)}
+        return timings
+
+    def metric_samples(self) -> Iterator[Sample]:
+        """
+        Scrape-time samples for metrics.REGISTRY: cache tiers, backend groups, the local parser
+        and the recipe index.
+        """
+        yield from cache_samples(self.cache.stats())
+        yield from backend_samples("ocr", self.ocr.stats())
+        yield from backend_samples("llm", self.llm.stats())
+        yield from parser_samples(self.parser_metrics.stats())
+        if self.recipe_index is not None:
+            yield from recipe_index_samples(self.recipe_index.stats())
+
+    def upstream_stats(self) -> Dict[str, Any]:
+        """Concurrency limits and waiting calls for every backend, keyed by backend name."""
+        return {**self.ocr.limiter.stats(), **self.llm.limiter.stats()}
+
+
+def _names(value: Optional[str], env: str, default: str) -> List[str]:
+    if value is None:
+        value = os.getenv(env, default)
+    return [name for name in value.split(",") if name.strip()]
+
+
+def create_processor(ocr: Optional[str] = None, llm: Optional[str] = None, cache: Optional[ReceiptCache] = None,
+                     vision_client: Any = None, openai_client: Any = None,
+                     store: Optional[ReceiptStore] = None,
+                     recipe_index: Optional[RecipeIndex] = None) -> ReceiptProcessor:
+    """
+    Build a ReceiptProcessor from comma-separated backend names, primary first.
+    Args:
+        ocr (str, optional): OCR backends, defaults to RECEIPT_OCR_BACKENDS or "vision"
+        llm (str, optional): LLM backends, defaults to RECEIPT_LLM_BACKENDS or "openai"
+        cache (ReceiptCache, optional): Result cache
+        vision_client (vision.ImageAnnotatorClient, optional): Preconfigured client for the vision backend
+        openai_client (optional): Preconfigured client for the openai backend
+        store (ReceiptStore, optional): Receipt store, defaults to RECEIPT_STORE_PATH (see receipt_store.create_store)
+        recipe_index (RecipeIndex, optional): Recipe index, defaults to RECIPE_INDEX_SIZE and RECIPE_INDEX_PATH
+            (see recipe_index.create_recipe_index)
+    """
+    clients = {"vision": {"client": vision_client}, "openai": {"client": openai_client}}
+    ocr_backends = [create_ocr_backend(name, **clients.get(name.strip().lower(), {}))
+                    for name in _names(ocr, "RECEIPT_OCR_BACKENDS", "vision")]
+    llm_backends = [create_llm_backend(name, **clients.get(name.strip().lower(), {}))
+                    for name in _names(llm, "RECEIPT_LLM_BACKENDS", "openai")]
+    return ReceiptProcessor(ocr_backends, llm_backends, cache=cache,
+                            store=store if store is not None else create_store(),
+                            recipe_index=recipe_index if recipe_index is not None else create_recipe_index())
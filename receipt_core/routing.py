@@ -0,0 +1,492 @@
+"""
+Runs calls against an ordered list of interchangeable backends. Each backend has its own
+concurrency limit and circuit breaker; an upstream failure (timeout, connection error, 5xx)
+falls over to the next backend, and a call still running after the backend's recent p95
+latency is hedged with a second call, keeping whichever answers first. Every call is bounded
+by the request's Deadline.
+"""
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from metrics import UPSTREAM_IN_FLIGHT, UPSTREAM_SECONDS
+from receipt_jobs import UpstreamLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def _seconds(env: str, default: str) -> Optional[float]:
+    """Seconds from `env` (or `default`); 0 turns the feature off."""
+    value = float(os.getenv(env, default) or 0)
+    return value if value > 0 else None
+
+
+# Time budget for one request across all of its stages
+REQUEST_DEADLINE = _seconds("RECEIPT_DEADLINE", "30")
+# Hedge delay used until a backend has HEDGE_MIN_SAMPLES latencies; after that the delay is
+# the HEDGE_PERCENTILE latency of its recent successful calls, but never below HEDGE_MIN_DELAY
+OCR_HEDGE_AFTER = _seconds("RECEIPT_OCR_HEDGE_AFTER", "4")
+LLM_HEDGE_AFTER = _seconds("RECEIPT_LLM_HEDGE_AFTER", "8")
+HEDGE_PERCENTILE = float(os.getenv("RECEIPT_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+# With a single available backend, hedge by calling it a second time; off by default, since
+# that pays for the call twice
+HEDGE_SAME_BACKEND = os.getenv("RECEIPT_HEDGE_SAME_BACKEND", "0").lower() in ("1", "true", "yes")
+LATENCY_WINDOW = 200
+# A breaker opens when at least BREAKER_ERROR_RATE of the last BREAKER_WINDOW calls failed
+# (once BREAKER_MIN_CALLS have been seen), and lets one probe call through after BREAKER_COOLDOWN
+BREAKER_WINDOW = int(os.getenv("RECEIPT_BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("RECEIPT_BREAKER_MIN_CALLS", "10"))
+BREAKER_ERROR_RATE = float(os.getenv("RECEIPT_BREAKER_ERROR_RATE", "0.5"))
+BREAKER_COOLDOWN = float(os.getenv("RECEIPT_BREAKER_COOLDOWN", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Error classes, by name, that mean the backend could not be reached or did not answer in
+# time: the builtins, socket, concurrent.futures, requests, the openai SDKs and google-api-core
+_UPSTREAM_ERRORS = frozenset({
+    "TimeoutError", "timeout", "ConnectionError", "Timeout", "ConnectTimeout", "ReadTimeout",
+    "APIConnectionError", "APITimeoutError", "ServiceUnavailableError", "TryAgain",
+    "DeadlineExceeded", "ServiceUnavailable", "RetryError",
+})
+
+
+class UpstreamUnavailable(Exception):
+    """No backend could serve the call in time. `status` is the HTTP status to answer with."""
+    status = 503
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(math.ceil(self.retry_after))} if self.retry_after else {}
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class DeadlineExceeded(UpstreamUnavailable, TimeoutError):
+    status = 504
+
+
+class Deadline:
+    """The time by which a request must finish, shared by every stage of it."""
+
+    def __init__(self, seconds: Optional[float] = REQUEST_DEADLINE):
+        """
+        Args:
+            seconds (float, optional): Budget from now; None never expires
+        """
+        self.expires = time.monotonic() + seconds if seconds else None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left (never negative), or None without a deadline."""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def check(self, stage: str) -> None:
+        """
+        Raises:
+            DeadlineExceeded: If the deadline has passed before `stage` starts
+        """
+        if self.expired:
+            raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+
+
+class CircuitBreaker:
+    """
+    Tracks a backend's recent outcomes. Closed: calls pass. Open: calls are refused until
+    the cooldown ends. Half-open: one probe call passes, and its outcome closes or reopens it.
+    """
+
+    def __init__(self, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 error_rate: float = BREAKER_ERROR_RATE, cooldown: float = BREAKER_COOLDOWN):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opens = 0
+        self.rejected = 0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._changed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go to the backend now; in half-open state only the probe may."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            # A half-open probe that never reported back (hung, then abandoned) is replaced
+            # after another cooldown
+            if time.monotonic() - self._changed_at >= self.cooldown:
+                self._set(HALF_OPEN)
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if ok:
+                    self._outcomes.clear()
+                    self._set(CLOSED)
+                else:
+                    self._open()
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if self.state == CLOSED and len(self._outcomes) >= self.min_calls \
+                    and failures / len(self._outcomes) >= self.error_rate:
+                self._open()
+
+    def _set(self, state: str) -> None:
+        self.state = state
+        self._changed_at = time.monotonic()
+
+    def _open(self) -> None:
+        self.opens += 1
+        self._set(OPEN)
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets a probe through."""
+        with self._lock:
+            return max(0.0, self.cooldown - (time.monotonic() - self._changed_at))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = len(self._outcomes)
+            return {
+                "state": self.state,
+                "error_rate": self._outcomes.count(False) / calls if calls else 0.0,
+                "opens": self.opens,
+                "rejected": self.rejected,
+            }
+
+
+def _status(error: BaseException) -> Optional[int]:
+    # HTTP status of an SDK or requests error, if it carries one
+    response = getattr(error, "response", None)
+    for status in (getattr(error, "status_code", None), getattr(error, "http_status", None),
+                   getattr(error, "code", None), getattr(response, "status_code", None)):
+        if isinstance(status, int) and 100 <= status < 600:
+            return status
+    return None
+
+
+def is_upstream_error(error: BaseException) -> bool:
+    """
+    Whether an error says the backend is unhealthy (a timeout, a connection failure, a 5xx or
+    429 response) rather than that this request can't be served, such as an image with no text
+    or a 400. Only upstream errors count against a breaker and fall over to the next backend.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError, UpstreamUnavailable)):
+        return True
+    status = _status(error)
+    if status is not None:
+        return status >= 500 or status in (408, 429)
+    return any(cls.__name__ in _UPSTREAM_ERRORS for cls in type(error).__mro__)
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(q / 100 * len(ordered))) - 1)]
+
+
+class BackendGroup:
+    """
+    An ordered list of backends sharing one interface: the first is the primary, the rest
+    are tried in order when a call fails or a breaker is open, or raced against a slow call.
+    """
+
+    def __init__(self, backends: Sequence[Any], limiter: Optional[UpstreamLimiter] = None,
+                 hedge_after: Optional[float] = None, breakers: bool = True,
+                 hedge_same_backend: bool = HEDGE_SAME_BACKEND):
+        """
+        Args:
+            backends (Sequence): Backends in order of preference; each has `name` and `concurrency`
+            limiter (UpstreamLimiter, optional): Shared limits keyed by backend name; by default
+                one is built from the backends' own `concurrency`
+            hedge_after (float, optional): Hedge delay in seconds until enough latencies have
+                been seen to use the percentile; None disables hedging
+            breakers (bool): Give each backend a circuit breaker
+            hedge_same_backend (bool): Hedge a call by repeating it on the same backend when no
+                other backend is available
+        """
+        if not backends:
+            raise ValueError("At least one backend is required")
+        self.backends = list(backends)
+        self.limiter = limiter or UpstreamLimiter({b.name: b.concurrency for b in self.backends if b.concurrency})
+        self.hedge_after = hedge_after
+        self.hedge_same_backend = hedge_same_backend
+        self.breakers = {b.name: CircuitBreaker() for b in self.backends} if breakers else {}
+        self._latencies: Dict[str, Deque[float]] = {b.name: deque(maxlen=LATENCY_WINDOW) for b in self.backends}
+        self._stats = {b.name: {"calls": 0, "errors": 0, "wins": 0} for b in self.backends}
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.deadline_exceeded = 0
+        self._lock = threading.Lock()
+        # Abandoned calls keep a thread until their own timeout, so leave headroom over the limits
+        workers = 2 * sum(b.concurrency or 8 for b in self.backends)
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix=f"{self.primary.name}-call")
+
+    @property
+    def primary(self) -> Any:
+        return self.backends[0]
+
+    def _bump(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _count(self, backend: Any, field: str) -> None:
+        with self._lock:
+            self._stats[backend.name][field] += 1
+
+    def _allow(self, backend: Any) -> bool:
+        breaker = self.breakers.get(backend.name)
+        return breaker is None or breaker.allow()
+
+    def _record(self, backend: Any, ok: bool) -> None:
+        breaker = self.breakers.get(backend.name)
+        if breaker is not None:
+            before = breaker.state
+            breaker.record(ok)
+            if breaker.state != before:
+                logger.warning("circuit breaker %s", breaker.state, extra={"backend": backend.name})
+
+    def _open_error(self, backend: Any) -> CircuitOpenError:
+        return CircuitOpenError(f"{backend.name} circuit is open", self.breakers[backend.name].retry_after())
+
+    def hedge_delay(self, backend: Any) -> Optional[float]:
+        """Seconds to wait on a call to `backend` before hedging it, or None when hedging is off."""
+        if self.hedge_after is None:
+            return None
+        with self._lock:
+            latencies = list(self._latencies[backend.name])
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return self.hedge_after
+        return max(HEDGE_MIN_DELAY, percentile(latencies, HEDGE_PERCENTILE))
+
+    def _submit(self, backend: Any, method: str, args: tuple, deadline: Deadline) -> Future:
+        # Run in a copy of the caller's context so stage timers inside the backend count
+        # toward the caller's request
+        return self._executor.submit(contextvars.copy_context().run, self._run, backend, method, args, deadline)
+
+    def _run(self, backend: Any, method: str, args: tuple, deadline: Deadline) -> Any:
+        self._count(backend, "calls")
+        UPSTREAM_IN_FLIGHT.inc(backend=backend.name)
+        start = time.monotonic()
+        try:
+            # Time spent waiting for a slot counts toward the hedge delay, so a saturated
+            # backend sheds load to the hedge as well
+            with self.limiter.slot(backend.name, timeout=deadline.remaining()):
+                result = getattr(backend, method)(*args, timeout=deadline.remaining())
+        except Exception as e:
+            self._count(backend, "errors")
+            # The request's own fault says nothing about the backend's health
+            if is_upstream_error(e):
+                self._record(backend, False)
+            UPSTREAM_SECONDS.observe(time.monotonic() - start, backend=backend.name, method=method, outcome="error")
+            raise
+        finally:
+            UPSTREAM_IN_FLIGHT.dec(backend=backend.name)
+        elapsed = time.monotonic() - start
+        self._record(backend, True)
+        UPSTREAM_SECONDS.observe(elapsed, backend=backend.name, method=method, outcome="success")
+        with self._lock:
+            self._latencies[backend.name].append(elapsed)
+        return result
+
+    def call(self, method: str, *args: Any, deadline: Optional[Deadline] = None) -> Any:
+        """
+        Call `method` on the first backend whose breaker allows it, falling over or hedging to
+        the others. The backend gets the time left before the deadline as its `timeout`.
+        Returns:
+            The first successful result
+        Raises:
+            DeadlineExceeded: If no backend answered before the deadline
+            CircuitOpenError: If every backend's breaker is open
+            Exception: An error that is not an upstream failure (see is_upstream_error), at once,
+                or the first backend error when every backend failed
+        """
+        deadline = deadline or Deadline(None)
+        deadline.check(method)
+        candidates = iter(self.backends)
+        pending: Dict[Future, Tuple[Any, bool]] = {}
+        errors: List[Exception] = []
+
+        def launch(hedge: bool) -> bool:
+            return self._launch(candidates, pending, errors, method, args, deadline, hedge)
+
+        if not launch(hedge=False):
+            raise errors[0]
+        first = next(iter(pending.values()))[0]
+        # With a single available backend, the hedge can be a second call to that backend
+        same_backend_hedge = self.hedge_same_backend
+        next_hedge = self.hedge_delay(first)
+        next_hedge_at = time.monotonic() + next_hedge if next_hedge is not None else None
+        while pending:
+            done, _ = wait(pending, timeout=self._wait_timeout(deadline, next_hedge_at), return_when=FIRST_COMPLETED)
+            if not done:
+                if deadline.expired:
+                    # The calls in flight finish (or time out) in the background
+                    self._bump("deadline_exceeded")
+                    raise DeadlineExceeded(f"{method} did not finish before the deadline")
+                # Slower than usual: hedge with the next backend, or the same one again
+                if launch(hedge=True):
+                    self._bump("hedged")
+                elif same_backend_hedge and self._allow(first):
+                    pending[self._submit(first, method, args, deadline)] = (first, True)
+                    self._bump("hedged")
+                same_backend_hedge = False
+                next_hedge_at = None
+                continue
+            succeeded, result = self._first_success(method, done, pending, errors)
+            if succeeded:
+                return result
+            # Every call so far failed: fall over to the next backend
+            if not pending and not deadline.expired and launch(hedge=False):
+                self._bump("failovers")
+        raise self._failure(method, errors, deadline)
+
+    def _launch(self, candidates: Iterator[Any], pending: Dict[Future, Tuple[Any, bool]], errors: List[Exception],
+                method: str, args: tuple, deadline: Deadline, hedge: bool) -> bool:
+        # Start a call on the next candidate whose breaker allows it; False when none is left
+        for backend in candidates:
+            if not self._allow(backend):
+                errors.append(self._open_error(backend))
+                continue
+            pending[self._submit(backend, method, args, deadline)] = (backend, hedge)
+            return True
+        return False
+
+    @staticmethod
+    def _wait_timeout(deadline: Deadline, next_hedge_at: Optional[float]) -> Optional[float]:
+        # Seconds until the deadline or the next hedge, whichever comes first; None for neither
+        timeouts = [t for t in (deadline.remaining(),
+                                next_hedge_at - time.monotonic() if next_hedge_at is not None else None)
+                    if t is not None]
+        return max(0.0, min(timeouts)) if timeouts else None
+
+    def _first_success(self, method: str, done: Iterable[Future], pending: Dict[Future, Tuple[Any, bool]],
+                       errors: List[Exception]) -> Tuple[bool, Any]:
+        # (True, result) for the first of the finished calls that succeeded, else (False, None);
+        # upstream failures are added to `errors` and any other error is raised
+        for future in done:
+            backend, hedge = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                if not is_upstream_error(e):
+                    raise
+                logger.warning("backend call failed", extra={"backend": backend.name, "method": method,
+                                                             "error": str(e)})
+                errors.append(e)
+                continue
+            self._count(backend, "wins")
+            if hedge:
+                self._bump("hedge_wins")
+            return True, result
+        return False, None
+
+    def stream(self, method: str, *args: Any, deadline: Optional[Deadline] = None) -> Iterator[Any]:
+        """
+        Iterate `method` on the first backend that starts producing output. Streams are not
+        hedged; a backend that fails upstream before its first item falls over to the next one,
+        while a failure mid-stream is raised, since part of the output has already been consumed.
+        """
+        deadline = deadline or Deadline(None)
+        errors: List[Exception] = []
+        for backend in self.backends:
+            deadline.check(method)
+            if not self._allow(backend):
+                errors.append(self._open_error(backend))
+                continue
+            if any(not isinstance(e, CircuitOpenError) for e in errors):
+                self._bump("failovers")
+            started = False
+            self._count(backend, "calls")
+            UPSTREAM_IN_FLIGHT.inc(backend=backend.name)
+            start = time.monotonic()
+            try:
+                with self.limiter.slot(backend.name, timeout=deadline.remaining()):
+                    for item in getattr(backend, method)(*args, timeout=deadline.remaining()):
+                        if not started:
+                            started = True
+                            # Time to first item is the latency that matters for a stream
+                            with self._lock:
+                                self._latencies[backend.name].append(time.monotonic() - start)
+                        yield item
+            except Exception as e:
+                self._count(backend, "errors")
+                upstream = is_upstream_error(e)
+                if upstream:
+                    self._record(backend, False)
+                UPSTREAM_SECONDS.observe(time.monotonic() - start, backend=backend.name, method=method,
+                                         outcome="error")
+                if started or not upstream:
+                    raise
+                logger.warning("backend call failed", extra={"backend": backend.name, "method": method,
+                                                             "error": str(e)})
+                errors.append(e)
+                continue
+            finally:
+                UPSTREAM_IN_FLIGHT.dec(backend=backend.name)
+            self._count(backend, "wins")
+            self._record(backend, True)
+            UPSTREAM_SECONDS.observe(time.monotonic() - start, backend=backend.name, method=method, outcome="success")
+            return
+        raise self._failure(method, errors, deadline)
+
+    def _failure(self, method: str, errors: List[Exception], deadline: Deadline) -> Exception:
+        """The error to raise once every backend failed: a real backend error before a breaker refusal."""
+        error = next((e for e in errors if not isinstance(e, CircuitOpenError)), errors[0])
+        # Backends get the remaining budget as their timeout, so their timeouts mean the deadline passed
+        if deadline.expired and not isinstance(error, UpstreamUnavailable):
+            self._bump("deadline_exceeded")
+            exceeded = DeadlineExceeded(f"{method} did not finish before the deadline")
+            exceeded.__cause__ = error
+            return exceeded
+        return error
+
+    def stats(self) -> Dict[str, Any]:
+        backends = {}
+        for backend in self.backends:
+            with self._lock:
+                latencies = list(self._latencies[backend.name])
+                counts = dict(self._stats[backend.name])
+            breaker = self.breakers.get(backend.name)
+            hedge_delay = self.hedge_delay(backend)
+            backends[backend.name] = {
+                **counts,
+                "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+                "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+                "hedge_delay_ms": round(hedge_delay * 1000, 1) if hedge_delay is not None else None,
+                "breaker": breaker.stats() if breaker else None,
+            }
+        with self._lock:
+            return {
+                "order": [b.name for b in self.backends],
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+                "deadline_exceeded": self.deadline_exceeded,
+                "backends": backends,
+                "limits": self.limiter.stats(),
+            }
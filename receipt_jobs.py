@@ -0,0 +1,503 @@
+"""
+Background job queue for receipt processing.
+
+Uploads are submitted as jobs and return an ID immediately; a pool of worker threads drains
+the queue and stores each result for polling (and optionally POSTs it to a webhook). Two
+brokers are available: an in-process queue (the default, lost on restart) and a SQLite table
+that survives restarts and can be shared with worker processes started separately:
+
+    python -m receipt_jobs app:run_receipt_job --workers 4
+"""
+import argparse
+import importlib
+import ipaddress
+import json
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+from receipt_logging import configure_logging
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+# Given up on: every attempt outlived its lease, so the job keeps taking its worker down with it
+DEAD = "dead"
+STATUSES = (QUEUED, RUNNING, SUCCEEDED, FAILED, DEAD)
+
+# A job left RUNNING this long (seconds) is assumed to belong to a crashed worker and is requeued
+JOB_LEASE = float(os.getenv("JOB_LEASE", "300"))
+# Claims a job gets before a lapsed lease marks it dead instead of requeueing it
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Start the web app's workers when it is imported rather than on the first submission, so jobs a
+# restart left in a durable broker are drained straight away
+JOB_AUTOSTART = os.getenv("JOB_AUTOSTART", "0").lower() in ("1", "true", "yes")
+# Finished jobs are kept this long (seconds) for polling
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "86400"))
+WEBHOOK_TIMEOUT = (3.05, 10)
+WEBHOOK_RETRIES = 3
+# Webhook hosts trusted even on private addresses; when set, no other host is accepted
+WEBHOOK_ALLOWED_HOSTS = frozenset(host.strip().lower() for host in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",")
+                                  if host.strip())
+
+Handler = Callable[[bytes], Any]
+
+
+def validate_webhook(url: Optional[str]) -> Optional[str]:
+    """
+    Check a completion webhook URL. The worker POSTs to it from inside the deployment, so
+    a host that resolves to a loopback, private, link-local or otherwise non-public address
+    (the metadata service at 169.254.169.254, say) is refused unless it is listed in
+    WEBHOOK_ALLOWED_HOSTS. When WEBHOOK_ALLOWED_HOSTS is set, no other host is accepted.
+    Args:
+        url (str, optional): Webhook URL supplied by the client
+    Returns:
+        Optional[str]: The URL, or None when none was given
+    Raises:
+        ValueError: If the URL is not an absolute http(s) URL or its host is not allowed
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("webhook must be an absolute http(s) URL")
+    host = parsed.hostname.lower()
+    if WEBHOOK_ALLOWED_HOSTS:
+        if host not in WEBHOOK_ALLOWED_HOSTS:
+            raise ValueError("webhook host is not allowed")
+        return url
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise ValueError("webhook host does not resolve")
+    # Every address must be public: the connection may go to any of them
+    if not all(ipaddress.ip_address(str(address).split("%")[0]).is_global for address in addresses):
+        raise ValueError("webhook must resolve to a public address")
+    return url
+
+
+class UpstreamLimiter:
+    """
+    Per-upstream concurrency limits shared by every thread in the process. Calls beyond
+    the limit wait for a free slot, so a burst of jobs queues instead of tripping rate limits.
+    """
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = dict(limits)
+        self._slots = {name: threading.BoundedSemaphore(limit) for name, limit in limits.items()}
+        self._waiting = {name: 0 for name in limits}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "UpstreamLimiter":
+        return cls({
+            "vision": int(os.getenv("VISION_CONCURRENCY", "8")),
+            "openai": int(os.getenv("OPENAI_CONCURRENCY", "8")),
+        })
+
+    @contextmanager
+    def slot(self, upstream: str, timeout: Optional[float] = None) -> Iterator[None]:
+        """
+        Hold one slot for `upstream` for the duration of the block. Unknown upstreams are unlimited.
+        Args:
+            upstream (str): Upstream name
+            timeout (float, optional): Seconds to wait for a free slot (default: no limit)
+        Raises:
+            TimeoutError: If no slot frees up within `timeout`
+        """
+        semaphore = self._slots.get(upstream)
+        if semaphore is None:
+            yield
+            return
+        with self._lock:
+            self._waiting[upstream] += 1
+        acquired = semaphore.acquire(timeout=timeout)
+        with self._lock:
+            self._waiting[upstream] -= 1
+        if not acquired:
+            raise TimeoutError(f"No free {upstream} slot within {timeout:.1f}s")
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: {"limit": limit, "waiting": self._waiting[name]} for name, limit in self.limits.items()}
+
+
+class JobBroker:
+    """
+    Base class for job brokers. Jobs carry the raw image bytes and an optional webhook URL;
+    results must be JSON-serializable.
+    """
+
+    def submit(self, content: bytes, webhook: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    def claim(self, timeout: float = 1.0) -> Optional[Tuple[str, bytes]]:
+        """
+        Take the oldest queued job and mark it running.
+        Args:
+            timeout (float): Seconds to wait for a job
+        Returns:
+            Optional[Tuple[str, bytes]]: (job ID, image bytes), or None if the queue stayed empty
+        """
+        raise NotImplementedError
+
+    def complete(self, job_id: str, result: Any) -> None:
+        raise NotImplementedError
+
+    def fail(self, job_id: str, error: str) -> None:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns:
+            Optional[Dict[str, Any]]: Public job record (no image bytes), or None for an unknown ID
+        """
+        raise NotImplementedError
+
+    def counts(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": type(self).__name__, **self.counts()}
+
+
+def _new_job(job_id: str, webhook: Optional[str]) -> Dict[str, Any]:
+    return {
+        "id": job_id, "status": QUEUED, "webhook": webhook, "result": None, "error": None,
+        "attempts": 0, "created_at": time.time(), "started_at": None, "finished_at": None,
+    }
+
+
+class InProcessBroker(JobBroker):
+    """
+    Queue held in this process's memory. Jobs are lost on restart and are only visible to
+    the worker that accepted them, so run a single worker process with this broker.
+    """
+
+    def __init__(self, max_finished: int = 1024):
+        self.max_finished = max_finished
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._content: Dict[str, bytes] = {}
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, content: bytes, webhook: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = _new_job(job_id, webhook)
+            self._content[job_id] = content
+        self._queue.put(job_id)
+        return job_id
+
+    def claim(self, timeout: float = 1.0) -> Optional[Tuple[str, bytes]]:
+        try:
+            job_id = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(status=RUNNING, started_at=time.time(), attempts=job["attempts"] + 1)
+            return job_id, self._content[job_id]
+
+    def _finish(self, job_id: str, **fields) -> None:
+        with self._lock:
+            self._jobs[job_id].update(finished_at=time.time(), **fields)
+            self._content.pop(job_id, None)
+            self._finished[job_id] = None
+            while len(self._finished) > self.max_finished:
+                expired, _ = self._finished.popitem(last=False)
+                self._jobs.pop(expired, None)
+
+    def complete(self, job_id: str, result: Any) -> None:
+        self._finish(job_id, status=SUCCEEDED, result=result)
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._finish(job_id, status=FAILED, error=error)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {status: 0 for status in STATUSES}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+
+class SQLiteBroker(JobBroker):
+    """
+    Durable queue in a SQLite table. Jobs survive restarts, and any number of web and
+    worker processes on the same host can share the file. A job whose worker stops
+    responding is requeued when its lease lapses, up to `max_attempts` claims; after that it
+    is marked dead, so a job that crashes its worker can't crash every worker in turn.
+    """
+
+    def __init__(self, path, lease: float = JOB_LEASE, retention: float = JOB_RETENTION,
+                 poll_interval: float = 0.2, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, content BLOB, webhook TEXT, "
+                "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created_at ON jobs (status, created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def submit(self, content: bytes, webhook: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO jobs (id, status, content, webhook, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, QUEUED, sqlite3.Binary(content), webhook, now),
+        )
+        conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (now - self.retention,))
+        return job_id
+
+    def _claim_once(self) -> Optional[Tuple[str, bytes]]:
+        conn = self._connect()
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't claim the same row
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, content = NULL, finished_at = ? "
+                "WHERE status = ? AND started_at < ? AND attempts >= ?",
+                (DEAD, f"Gave up after {self.max_attempts} attempts that never finished", now,
+                 RUNNING, now - self.lease, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT id, content FROM jobs WHERE status = ? OR (status = ? AND started_at < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now - self.lease),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (RUNNING, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return (row[0], bytes(row[1])) if row is not None else None
+
+    def claim(self, timeout: float = 1.0) -> Optional[Tuple[str, bytes]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self._claim_once()
+            if job is not None or time.monotonic() >= deadline:
+                return job
+            time.sleep(self.poll_interval)
+
+    def complete(self, job_id: str, result: Any) -> None:
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, content = NULL, finished_at = ? WHERE id = ?",
+            (SUCCEEDED, json.dumps(result), time.time(), job_id),
+        )
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, error = ?, content = NULL, finished_at = ? WHERE id = ?",
+            (FAILED, error, time.time(), job_id),
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT id, status, webhook, result, error, attempts, created_at, started_at, finished_at "
+            "FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("id", "status", "webhook", "result", "error", "attempts",
+                        "created_at", "started_at", "finished_at"), row))
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        counts = {status: 0 for status in STATUSES}
+        for status, count in self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            counts[status] = count
+        return counts
+
+
+def create_broker(backend: Optional[str] = None, **kwargs) -> JobBroker:
+    """
+    Build a job broker from arguments, falling back to environment configuration:
+    RECEIPT_JOB_BACKEND (memory or sqlite) and RECEIPT_JOB_PATH.
+    Args:
+        backend (str, optional): Backend name overriding RECEIPT_JOB_BACKEND
+    Returns:
+        JobBroker: Configured broker
+    """
+    if backend is None:
+        backend = os.getenv("RECEIPT_JOB_BACKEND", "memory")
+    backend = backend.lower()
+    if backend == "memory":
+        return InProcessBroker(**kwargs)
+    if backend == "sqlite":
+        path = kwargs.pop("path", None) or os.getenv("RECEIPT_JOB_PATH", "cache/jobs.sqlite3")
+        return SQLiteBroker(path, **kwargs)
+    raise ValueError(f"Unknown job backend: {backend}")
+
+
+def public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Job record as returned to clients: the webhook URL is omitted.
+    """
+    return {key: value for key, value in job.items() if key != "webhook"}
+
+
+class JobQueue:
+    """
+    Worker threads that drain a broker, running `handler(image_bytes)` for each job and
+    recording its return value (or exception message) as the job's result.
+    """
+
+    def __init__(self, broker: JobBroker, handler: Handler, workers: Optional[int] = None):
+        """
+        Args:
+            broker (JobBroker): Where jobs are queued and results stored
+            handler (Callable[[bytes], Any]): Processes one image; its return value must be JSON-serializable
+            workers (int, optional): Worker threads, defaults to JOB_WORKERS or 4; 0 only enqueues
+        """
+        self.broker = broker
+        self.handler = handler
+        self.workers = int(os.getenv("JOB_WORKERS", "4")) if workers is None else workers
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._session = requests.Session()
+
+    def start(self) -> None:
+        """Start the worker threads, once."""
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"receipt-job-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Ask the workers to exit after their current job and wait for them."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, content: bytes, webhook: Optional[str] = None) -> str:
+        """
+        Queue an image for processing, starting the workers on first use.
+        Args:
+            content (bytes): Raw image bytes
+            webhook (str, optional): URL to POST the finished job record to
+        Returns:
+            str: Job ID
+        """
+        job_id = self.broker.submit(content, validate_webhook(webhook))
+        self.start()
+        return job_id
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            job = self.broker.claim(timeout=1.0)
+            if job is None:
+                continue
+            job_id, content = job
+            try:
+                self.broker.complete(job_id, self.handler(content))
+            except Exception as e:
+                logger.error("job failed", extra={"job_id": job_id, "error": str(e)})
+                self.broker.fail(job_id, str(e))
+            self._notify(job_id)
+
+    def _notify(self, job_id: str) -> None:
+        job = self.broker.get(job_id)
+        if job is None or not job.get("webhook"):
+            return
+        try:
+            # Checked again at delivery: the host's DNS may have changed since the job was queued
+            validate_webhook(job["webhook"])
+        except ValueError as e:
+            logger.error("webhook refused", extra={"job_id": job_id, "error": str(e)})
+            return
+        for attempt in range(WEBHOOK_RETRIES):
+            try:
+                # A redirect could point anywhere, including the addresses refused above
+                response = self._session.post(job["webhook"], json=public_job(job), timeout=WEBHOOK_TIMEOUT,
+                                              allow_redirects=False)
+                if response.status_code < 500:
+                    return
+            except requests.exceptions.RequestException as e:
+                logger.warning("webhook delivery failed", extra={"job_id": job_id, "attempt": attempt + 1,
+                                                                 "error": str(e)})
+            time.sleep(0.5 * 2 ** attempt)
+        logger.error("giving up on webhook", extra={"job_id": job_id})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": len(self._threads), **self.broker.stats()}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("handler", help="module:function that processes one image, e.g. app:run_receipt_job")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker threads (default JOB_WORKERS or 4)")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    module_name, _, function_name = args.handler.partition(":")
+    # The workers are these; the handler's module must not start a set of its own on import
+    os.environ["JOB_AUTOSTART"] = "0"
+    handler = getattr(importlib.import_module(module_name), function_name)
+    # Only the SQLite broker is visible across processes
+    jobs = JobQueue(create_broker("sqlite"), handler, args.workers)
+    jobs.start()
+    logger.info("workers started", extra={"workers": jobs.workers, "broker": jobs.broker.stats()["backend"]})
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        jobs.stop()
+
+
+if __name__ == "__main__":
+    main()
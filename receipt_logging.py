@@ -0,0 +1,79 @@
+"""
+Leveled, structured logging for the apps and workers. Modules log through
+logging.getLogger(__name__) and pass fields in `extra`; configure_logging() renders them as
+key=value pairs (LOG_FORMAT=text, the default) or one JSON object per line (LOG_FORMAT=json).
+"""
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# Attributes every LogRecord has; anything else came from `extra`
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def record_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    """The structured fields passed to a log call through `extra`."""
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and the extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **record_fields(record),
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+def _text_value(value: Any) -> str:
+    if isinstance(value, str) and value and not any(c.isspace() or c in '"=' for c in value):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return json.dumps(value, default=str)
+
+
+class KeyValueFormatter(logging.Formatter):
+    """The usual text line followed by the extra fields as key=value pairs."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = record_fields(record)
+        if not fields:
+            return line
+        pairs = " ".join(f"{key}={_text_value(value)}" for key, value in fields.items())
+        # Keep the traceback after the fields rather than splitting them off the message
+        head, sep, tail = line.partition("\n")
+        return f"{head} {pairs}{sep}{tail}"
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None) -> None:
+    """
+    Set the root logger's level and, unless the host (gunicorn, a serverless runtime) already
+    installed a handler, add one writing to stderr in the configured format.
+    Args:
+        level (str, optional): Level name, defaults to LOG_LEVEL or INFO
+        fmt (str, optional): "text" or "json", defaults to LOG_FORMAT
+    """
+    root = logging.getLogger()
+    root.setLevel(level or LOG_LEVEL)
+    if root.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JSONFormatter() if (fmt or LOG_FORMAT) == "json" else KeyValueFormatter())
+    root.addHandler(handler)
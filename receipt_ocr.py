@@ -1,31 +1,55 @@
+import argparse
 import cv2
 import pytesseract
 import numpy as np
 from PIL import Image
 import os
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 from pathlib import Path
-import requests
 import json
-from typing import Optional, Dict, Any, List
+import logging
+from typing import Optional, Dict, Any, Iterable, Iterator, List, Set, Tuple
+from image_normalize import NormalizeConfig, normalize_image_array
+from preprocessing import PROFILES, run_profile, run_profile_batch
+from tesseract_pool import TesseractPool, pool_available
+from ollama_client import OllamaClient
+from receipt_core.llm import LLMBackend, OllamaChat
+from food_lexicon import classify_food
+from receipt_parser import MIN_CONFIDENCE, parse_receipt
+from recipe_index import RecipeIndex, create_recipe_index, format_recipes
+from ocr_layout import OCRLayout
+from receipt_logging import configure_logging
+
+logger = logging.getLogger(__name__)
 
 class ReceiptOCR:
-    # Ollama API configuration
-    OLLAMA_API_URL = "http://localhost:11434/api/generate"
+    # Ollama API configuration (server URL comes from OLLAMA_URL, see ollama_client.py)
     DEFAULT_MODEL = "llama3"
 
-    # Common food-related keywords to help identify food items
-    FOOD_KEYWORDS = [
-        "fresh", "organic", "fruit", "vegetable", "meat", "dairy",
-        "produce", "grocery", "ingredients", "food", "spice"
-    ]
-
-    def __init__(self, tesseract_cmd=None, llm_model=None):
+    def __init__(self, tesseract_cmd=None, llm_model=None, normalize_config=None, preprocess_profile=None,
+                 ocr_pool_size=None, ollama_client=None, llm: Optional[LLMBackend] = None,
+                 recipe_index: Optional[RecipeIndex] = None):
         """
         Initialize the ReceiptOCR processor.
         Args:
             tesseract_cmd (str, optional): Path to tesseract executable
             llm_model (str, optional): Name of the Ollama model to use
+            normalize_config (NormalizeConfig, optional): Image normalization settings
+                (defaults to the IMAGE_* environment configuration)
+            preprocess_profile (str, optional): Default preprocessing profile
+                ("fast", "balanced" or "quality"; defaults to OCR_PREPROCESS_PROFILE)
+            ocr_pool_size (int, optional): Number of persistent tesseract engines to keep loaded
+                (defaults to OCR_POOL_SIZE; 0 runs a tesseract subprocess per call)
+            ollama_client (OllamaClient, optional): Pooled client for the Ollama API
+            llm (LLMBackend, optional): Backend for the formatting and recipe prompts
+                (defaults to Ollama with llm_model; any receipt_core LLM backend works)
+            recipe_index (RecipeIndex, optional): Corpus of recipes the web app generated, consulted
+                before the recipe prompt (defaults to RECIPE_INDEX_PATH, opened on first use)
         """
+        self.tesseract_cmd = tesseract_cmd
         if tesseract_cmd:
             pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
         
@@ -35,54 +59,148 @@ class ReceiptOCR:
 
         # Set LLM model
         self.llm_model = llm_model or self.DEFAULT_MODEL
+        self.ollama_client = ollama_client or OllamaClient()
+        self.llm = llm or OllamaChat(self.ollama_client, self.llm_model)
+        self._recipe_index = recipe_index
+        self._recipe_index_opened = recipe_index is not None
+
+        # Orientation fix, downscale and grayscale before preprocessing
+        self.normalize_config = normalize_config or NormalizeConfig.from_env()
+
+        self.preprocess_profile = preprocess_profile
+        # Per-stage timings (ms) of the most recent preprocess_image call
+        self.last_preprocess_timings: Dict[str, float] = {}
+
+        # Persistent in-process tesseract engines, when tesserocr is installed
+        self.ocr_pool = None
+        if ocr_pool_size is None:
+            ocr_pool_size = int(os.getenv("OCR_POOL_SIZE", "0"))
+        if ocr_pool_size:
+            if pool_available():
+                self.ocr_pool = TesseractPool(ocr_pool_size)
+            else:
+                logger.warning("tesserocr is not installed, falling back to pytesseract")
 
     def load_image(self, image_path):
         """
-        Load an image from the given path.
+        Load an image from the given path or from in-memory encoded bytes.
         Args:
-            image_path (str): Path to the image file
+            image_path (str | bytes | memoryview): Path to the image file, or its encoded content
         Returns:
-            numpy.ndarray: Loaded image
+            numpy.ndarray: Loaded image (grayscale when normalization converts it)
         """
+        if self.normalize_config.enabled:
+            if isinstance(image_path, (bytes, bytearray, memoryview)):
+                return normalize_image_array(image_path, self.normalize_config)
+            try:
+                content = Path(image_path).read_bytes()
+            except OSError:
+                return None
+            return normalize_image_array(content, self.normalize_config)
+        if isinstance(image_path, (bytes, bytearray, memoryview)):
+            # Decode straight from the buffer; np.frombuffer does not copy
+            return cv2.imdecode(np.frombuffer(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
         return cv2.imread(str(image_path))
 
-    def preprocess_image(self, image):
+    def preprocess_image(self, image, profile: Optional[str] = None):
         """
         Preprocess the image to improve OCR accuracy.
         Args:
             image (numpy.ndarray): Input image
+            profile (str, optional): Preprocessing profile ("fast", "balanced" or "quality")
         Returns:
             numpy.ndarray: Preprocessed image
         """
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Apply adaptive thresholding
-        thresh = cv2.adaptiveThreshold(
-            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY, 21, 10
-        )
-        
-        # Denoise
-        denoised = cv2.fastNlMeansDenoising(thresh)
+        processed, self.last_preprocess_timings = run_profile(image, profile or self.preprocess_profile)
+        return processed
+
+    def preprocess_images(self, images, profile: Optional[str] = None) -> List[Tuple[np.ndarray, Dict[str, float]]]:
+        """
+        Preprocess several images at once.
+        Args:
+            images (List[numpy.ndarray]): Input images
+            profile (str, optional): Preprocessing profile
+        Returns:
+            List[Tuple[numpy.ndarray, Dict[str, float]]]: Preprocessed images with per-stage timings
+        """
+        return run_profile_batch(images, profile or self.preprocess_profile)
+
+    def extract_layout(self, image, timeout: Optional[float] = None) -> OCRLayout:
+        """
+        OCR the preprocessed image, keeping each word's bounding box.
+        Args:
+            image (numpy.ndarray): Preprocessed image
+            timeout (float, optional): Seconds to allow; the tesseract subprocess is killed after
+                that, or with the engine pool, the wait for a free engine is bounded
+        Returns:
+            OCRLayout: Words, boxes and reconstructed lines
+        """
+        if self.ocr_pool is not None:
+            return self.ocr_pool.extract_layout(image, timeout)
+
+        # Convert numpy array to PIL Image
+        pil_image = Image.fromarray(image)
         
-        return denoised
+        # image_to_data runs the same single tesseract pass as image_to_string, but reports word boxes
+        data = pytesseract.image_to_data(pil_image, output_type=pytesseract.Output.DICT, timeout=timeout or 0)
+        return OCRLayout.from_tesseract(data)
 
     def extract_text(self, image):
         """
         Extract text from the preprocessed image using OCR.
         Args:
             image (numpy.ndarray): Preprocessed image
+        Returns:
+            str: Column-aligned text, one printed line per line
+        """
+        return self.extract_layout(image).to_text()
+
+    def ocr_image(self, image_path) -> str:
+        """
+        Run load_image, preprocess_image and extract_text on a single image.
+        Args:
+            image_path (str | bytes | memoryview): Path to the image file, or its encoded content
         Returns:
             str: Extracted text
         """
-        # Convert numpy array to PIL Image
-        pil_image = Image.fromarray(image)
-        
-        # Extract text using pytesseract
-        text = pytesseract.image_to_string(pil_image)
-        
-        return text
+        image = self.load_image(image_path)
+        if image is None:
+            raise ValueError("Could not decode image")
+        return self.extract_text(self.preprocess_image(image))
+
+    def process_batch(self, source, workers: Optional[int] = None, skip: Iterable[str] = (),
+                      max_pending: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        OCR every image in a directory or zip archive across a process pool.
+        At most `max_pending` images are queued or in flight at once, so memory stays flat
+        regardless of the number of files. Results are yielded in completion order.
+        Args:
+            source (str): Directory (searched recursively) or .zip archive
+            workers (int, optional): Pool size, defaults to the CPU count
+            skip (Iterable[str]): Names of already processed files, e.g. from a checkpoint
+            max_pending (int, optional): Queue bound, defaults to twice the pool size
+        Yields:
+            Dict[str, Any]: {"file", "raw_text", "error", "elapsed_ms"} per image
+        """
+        workers = workers or os.cpu_count() or 1
+        max_pending = max_pending or workers * 2
+        skip = set(skip)
+
+        with ProcessPoolExecutor(workers, initializer=_init_batch_worker,
+                                 initargs=(self.tesseract_cmd, self.normalize_config, self.preprocess_profile)) as pool:
+            pending: Set[Future] = set()
+            for name, image_source in iter_batch_sources(source):
+                if name in skip:
+                    continue
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(pool.submit(_batch_worker, name, image_source))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
 
     def save_debug_image(self, image, original_path):
         """
@@ -91,17 +209,19 @@ class ReceiptOCR:
             image (numpy.ndarray): Preprocessed image
             original_path (str): Original image path
         """
+        if isinstance(original_path, (bytes, bytearray, memoryview)):
+            original_path = "upload.png"
         debug_path = self.output_dir / f"preprocessed_{Path(original_path).name}"
         cv2.imwrite(str(debug_path), image)
 
-    def call_ollama_llm(self, text: str, prompt_type: str = "format_receipt") -> Optional[str]:
+    def build_llm_prompt(self, text: str, prompt_type: str = "format_receipt") -> str:
         """
-        Calls the local Ollama LLM API with different prompt types.
+        Build the Ollama prompt for a given prompt type.
         Args:
             text (str): Input text for the LLM
             prompt_type (str): Type of prompt to use ("format_receipt" or "generate_recipe")
         Returns:
-            Optional[str]: Processed text or None if the request fails
+            str: Prompt text
         """
         if prompt_type == "format_receipt":
             prompt = f"""
@@ -140,31 +260,37 @@ class ReceiptOCR:
         else:
             raise ValueError(f"Unknown prompt type: {prompt_type}")
 
-        payload = {
-            "model": self.llm_model,
-            "prompt": prompt,
-            "stream": True
-        }
+        return prompt
 
+    def call_ollama_llm(self, text: str, prompt_type: str = "format_receipt") -> Optional[str]:
+        """
+        Calls the configured LLM backend (local Ollama by default) with different prompt types.
+        Args:
+            text (str): Input text for the LLM
+            prompt_type (str): Type of prompt to use ("format_receipt" or "generate_recipe")
+        Returns:
+            Optional[str]: Processed text or None if the request fails
+        """
+        prompt = self.build_llm_prompt(text, prompt_type)
         try:
-            response = requests.post(self.OLLAMA_API_URL, json=payload, stream=True)
-            response.raise_for_status()
-            
-            result_text = ""
-            for line in response.iter_lines(decode_unicode=True):
-                if line:
-                    try:
-                        data = json.loads(line)
-                        result_text += data.get("response", "")
-                    except json.JSONDecodeError as e:
-                        print(f"Warning: JSON decode error: {e}")
-                        continue
-            
-            return result_text.strip()
-        except requests.exceptions.RequestException as e:
-            print(f"Error calling Ollama API: {e}")
+            return self.llm.complete([{"role": "user", "content": prompt}]).strip()
+        except Exception as e:
+            logger.error("LLM call failed", extra={"backend": self.llm.name, "error": str(e)})
             return None
 
+    def stream_ollama_llm(self, text: str, prompt_type: str = "format_receipt") -> Iterator[str]:
+        """
+        Like call_ollama_llm, but yields tokens as they arrive so callers can forward them.
+        Args:
+            text (str): Input text for the LLM
+            prompt_type (str): Type of prompt to use ("format_receipt" or "generate_recipe")
+        Yields:
+            str: Response fragments
+        Raises:
+            Exception: The backend's error if the request fails
+        """
+        yield from self.llm.stream([{"role": "user", "content": self.build_llm_prompt(text, prompt_type)}])
+
     def extract_food_items(self, refined_text: str) -> List[str]:
         """
         Extract food items from the refined receipt text.
@@ -180,19 +306,37 @@ class ReceiptOCR:
             items = [item.strip("- ").strip() for item in food_section.split("\n") if item.strip()]
             return [item for item in items if item]
         
-        # If no explicit food section, try to extract from the items list
-        items_section = ""
-        for line in refined_text.split("\n"):
-            if any(keyword in line.lower() for keyword in self.FOOD_KEYWORDS):
-                items_section += line + "\n"
-        
-        # Clean up and return items
-        items = [item.strip("- ").strip() for item in items_section.split("\n") if item.strip()]
-        return [item for item in items if item]
+        # If no explicit food section, keep the lines the food lexicon classifies as food
+        items = [line.strip("- ").strip() for line in refined_text.split("\n")]
+        return [item for item in items if item and classify_food(item)]
+
+    def format_parsed_receipt(self, data: Dict[str, Any]) -> str:
+        """
+        Render rule-based parser output in the same readable layout the LLM is asked for.
+        Args:
+            data (Dict[str, Any]): Receipt data from receipt_parser.parse_receipt
+        Returns:
+            str: Formatted receipt text, ending with a "Food Items:" section
+        """
+        lines = [f"Merchant: {data['merchant'] or 'N/A'}", f"Date/Time: {data['datetime'] or 'N/A'}", "", "Items:"]
+        lines += [f"- {item['name']}: {item['price']}" for item in data["items"]]
+        lines += ["", f"Subtotal: {data['subtotal'] or 'N/A'}", f"Tax: {data['tax'] or 'N/A'}",
+                  f"Total: {data['total'] or 'N/A'}", "", "Food Items:"]
+        lines += [f"- {item}" for item in data["food_items"]]
+        return "\n".join(lines)
+
+    @property
+    def recipe_index(self) -> Optional[RecipeIndex]:
+        # Opened lazily so batch OCR workers, which never suggest recipes, don't load the corpus
+        if not self._recipe_index_opened:
+            self._recipe_index = create_recipe_index()
+            self._recipe_index_opened = True
+        return self._recipe_index
 
     def generate_recipe_suggestions(self, food_items: List[str]) -> Optional[str]:
         """
-        Generate recipe suggestions based on the food items.
+        Generate recipe suggestions based on the food items, from the recipe index when it
+        covers them and from the LLM otherwise.
         Args:
             food_items (List[str]): List of food items from the receipt
         Returns:
@@ -200,28 +344,35 @@ class ReceiptOCR:
         """
         if not food_items:
             return "No food items found in the receipt to generate recipes."
-        
+        if self.recipe_index is not None:
+            recipes = self.recipe_index.lookup(food_items)
+            if recipes:
+                return format_recipes(recipes)
+
         # Format food items for the prompt
         ingredients_text = "\n".join(f"- {item}" for item in food_items)
         return self.call_ollama_llm(ingredients_text, prompt_type="generate_recipe")
 
-    def process_receipt(self, image_path: str, save_debug: bool = True, use_llm: bool = True) -> Dict[str, Any]:
+    def process_receipt(self, image_path: str, save_debug: bool = True, use_llm: bool = True,
+                        profile: Optional[str] = None) -> Dict[str, Any]:
         """
         Process a receipt image and extract its text.
         Args:
-            image_path (str): Path to the receipt image
+            image_path (str | bytes | memoryview): Path to the receipt image, or its encoded content
             save_debug (bool): Whether to save debug images
             use_llm (bool): Whether to use LLM for text refinement
+            profile (str, optional): Preprocessing profile
         Returns:
             Dict[str, Any]: Dictionary containing raw and processed text
         """
         # Load image
         image = self.load_image(image_path)
         if image is None:
-            raise ValueError(f"Could not load image from {image_path}")
+            source = "upload buffer" if isinstance(image_path, (bytes, bytearray, memoryview)) else image_path
+            raise ValueError(f"Could not load image from {source}")
 
         # Preprocess image
-        processed_image = self.preprocess_image(image)
+        processed_image = self.preprocess_image(image, profile)
 
         # Save debug image if requested
         if save_debug:
@@ -236,14 +387,22 @@ class ReceiptOCR:
             "food_items": [],
             "recipe_suggestions": None,
             "success": True,
-            "error": None
+            "error": None,
+            "preprocess_timings": self.last_preprocess_timings,
+            "parser_confidence": None
         }
 
         # Use LLM to refine the text if requested
         if use_llm and raw_text.strip():
             try:
-                # First, get refined receipt text
-                refined_text = self.call_ollama_llm(raw_text, prompt_type="format_receipt")
+                # Common layouts are parsed locally; Ollama only formats receipts the parser is unsure of
+                parsed = parse_receipt(raw_text)
+                result["parser_confidence"] = parsed.confidence
+                refined_text: Optional[str]
+                if parsed.confidence >= MIN_CONFIDENCE:
+                    refined_text = self.format_parsed_receipt(parsed.data)
+                else:
+                    refined_text = self.call_ollama_llm(raw_text, prompt_type="format_receipt")
                 if refined_text:
                     result["refined_text"] = refined_text
                     
@@ -263,7 +422,117 @@ class ReceiptOCR:
 
         return result
 
-def main():
+BATCH_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+def iter_batch_sources(source) -> Iterator[Tuple[str, Any]]:
+    """
+    List the images of a batch lazily, one at a time.
+    Args:
+        source (str): Directory (searched recursively) or .zip archive
+    Yields:
+        Tuple[str, Any]: (name, path) for directories, (name, bytes) for archive members
+    """
+    path = Path(source)
+    if path.is_dir():
+        files = (p for p in path.rglob("*") if p.is_file() and p.suffix.lower() in BATCH_EXTENSIONS)
+        for file in sorted(files):
+            yield str(file.relative_to(path)), str(file)
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and Path(info.filename).suffix.lower() in BATCH_EXTENSIONS:
+                    yield info.filename, archive.read(info)
+    else:
+        raise ValueError(f"Batch source must be a directory or zip archive: {source}")
+
+
+# One ReceiptOCR per pool process, created by the pool initializer
+_batch_ocr: Optional[ReceiptOCR] = None
+
+
+def _init_batch_worker(tesseract_cmd, normalize_config, preprocess_profile):
+    global _batch_ocr
+    # The pool already runs one process per core; stop OpenCV from spawning its own threads
+    cv2.setNumThreads(1)
+    # A single persistent engine per process loads the traineddata once for the whole batch
+    _batch_ocr = ReceiptOCR(tesseract_cmd=tesseract_cmd, normalize_config=normalize_config,
+                            preprocess_profile=preprocess_profile,
+                            ocr_pool_size=1 if pool_available() else 0)
+
+
+def _batch_worker(name: str, image_source) -> Dict[str, Any]:
+    start = time.perf_counter()
+    result: Dict[str, Any] = {"file": name, "raw_text": None, "error": None}
+    try:
+        if _batch_ocr is None:
+            raise RuntimeError("batch worker was not initialized")
+        result["raw_text"] = _batch_ocr.ocr_image(image_source)
+    except Exception as e:
+        result["error"] = str(e)
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def load_checkpoint(output_path) -> Set[str]:
+    """
+    Read the names already processed successfully in a JSON Lines output file so a rerun
+    can skip them; failed files are retried. A partially written last line (from a crash
+    mid-write) is truncated away.
+    Args:
+        output_path (str): JSON Lines results file
+    Returns:
+        Set[str]: Names of finished files
+    """
+    path = Path(output_path)
+    if not path.exists():
+        return set()
+
+    done = set()
+    valid_bytes = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+                if not result.get("error"):
+                    done.add(result["file"])
+            except (json.JSONDecodeError, KeyError, UnicodeDecodeError, AttributeError):
+                break
+            valid_bytes += len(line)
+    if valid_bytes < path.stat().st_size:
+        with open(path, "r+b") as f:
+            f.truncate(valid_bytes)
+    return done
+
+
+def run_batch(source, output=None, workers=None, max_pending=None, profile=None) -> int:
+    """
+    Batch OCR `source` and write one JSON object per line to `output` (or stdout).
+    Rerunning with the same output file resumes where the previous run stopped.
+    Returns:
+        int: Number of images that failed
+    """
+    ocr = ReceiptOCR(preprocess_profile=profile)
+    done = load_checkpoint(output) if output else set()
+    if done:
+        print(f"Resuming: {len(done)} files already processed", file=sys.stderr)
+
+    failures = 0
+    out = open(output, "a", encoding="utf-8") if output else sys.stdout
+    try:
+        for result in ocr.process_batch(source, workers=workers, skip=done, max_pending=max_pending):
+            if result["error"]:
+                failures += 1
+            out.write(json.dumps(result) + "\n")
+            # Flush per line so the output file is always a usable checkpoint
+            out.flush()
+    finally:
+        if output:
+            out.close()
+    return failures
+
+
+def run_example():
     # Example usage
     ocr = ReceiptOCR()
     
@@ -301,5 +570,24 @@ def main():
     except Exception as e:
         print(f"Error processing receipt: {e}")
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Receipt OCR with tesseract and a local Ollama LLM")
+    subcommands = parser.add_subparsers(dest="command")
+    batch = subcommands.add_parser("batch", help="OCR a directory or zip archive of receipts to JSON Lines")
+    batch.add_argument("source", help="directory or .zip archive of receipt images")
+    batch.add_argument("-o", "--output", help="JSON Lines output file; rerunning with it resumes (default: stdout)")
+    batch.add_argument("-w", "--workers", type=int, help="worker processes (default: CPU count)")
+    batch.add_argument("--max-pending", type=int, help="images queued at once (default: 2x workers)")
+    batch.add_argument("--profile", choices=sorted(PROFILES), help="preprocessing profile (default: quality)")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    if args.command == "batch":
+        failures = run_batch(args.source, args.output, args.workers, args.max_pending, args.profile)
+        if failures:
+            print(f"{failures} files could not be processed", file=sys.stderr)
+        return
+    run_example()
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,204 @@
+"""
+Rule-based receipt parser. Handles the common layout (merchant header, one item per line with
+its price at the right margin, then subtotal, tax and total) without an LLM call, and scores
+how far its own output can be trusted so callers can fall back to the LLM when it can't.
+"""
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from food_lexicon import classify_food, food_item_names
+from ocr_layout import OCRLayout
+
+# Parses at or above this confidence are used as-is; anything lower goes to the LLM
+MIN_CONFIDENCE = float(os.getenv("RECEIPT_PARSER_MIN_CONFIDENCE", "0.8"))
+
+# Amount at the end of a line, optionally followed by a tax-code letter ("2.49 A", "$10.00 T")
+PRICE_RE = re.compile(r"(-?)\$?\s?(\d{1,5}[.,]\d{2})(?:\s*-)?\s*[A-Z*]{0,2}\s*$")
+DATE_RE = re.compile(
+    r"\b(\d{4}[-/.]\d{1,2}[-/.]\d{1,2}|\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}"
+    r"|\d{1,2} (?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]* \d{2,4})\b",
+    re.IGNORECASE,
+)
+TIME_RE = re.compile(r"\b(\d{1,2}:\d{2}(?::\d{2})?(?:\s?[AP]M)?)\b", re.IGNORECASE)
+
+SUBTOTAL_RE = re.compile(r"\bsub\s*-?\s*total\b", re.IGNORECASE)
+TAX_RE = re.compile(r"\b(tax|vat|gst|hst|pst)\b", re.IGNORECASE)
+TOTAL_RE = re.compile(r"\b(total|balance due|amount due|grand total)\b", re.IGNORECASE)
+# Lines after the total that carry amounts but are not items
+PAYMENT_RE = re.compile(
+    r"\b(cash|change|visa|mastercard|amex|debit|credit|card|tender|paid|payment|balance|"
+    r"savings|you saved|points|auth|approval)\b",
+    re.IGNORECASE,
+)
+# Header lines that are never the merchant name
+NOT_MERCHANT_RE = re.compile(
+    r"(\d{3}[-. )]\d{3}[-. ]\d{4}|www\.|https?:|\.com\b|\b(tel|phone|fax|store|receipt|welcome|"
+    r"cashier|register|st|street|ave|avenue|rd|road|blvd|suite)\b)",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class ParseResult:
+    data: Dict[str, Any]
+    confidence: float
+    # Which checks passed, for debugging low-confidence parses
+    checks: Dict[str, bool] = field(default_factory=dict)
+    elapsed_ms: float = 0.0
+
+
+def _amount(line: str) -> Optional[float]:
+    match = PRICE_RE.search(line)
+    if not match:
+        return None
+    value = float(match.group(2).replace(",", "."))
+    return -value if match.group(1) else value
+
+
+def _label(line: str) -> str:
+    match = PRICE_RE.search(line)
+    label = line[:match.start()] if match else line
+    # Drop leading quantities and SKU-style codes ("2 x", "012345678")
+    label = re.sub(r"^\s*(\d+\s*[x@]\s*|\d{5,}\s+)", "", label, flags=re.IGNORECASE)
+    return re.sub(r"\s+", " ", label).strip(" .:-")
+
+
+def _close(a: float, b: float) -> bool:
+    return abs(a - b) <= max(0.02, 0.005 * abs(b))
+
+
+def _money(value: Optional[float]) -> Optional[str]:
+    return None if value is None else f"{value:.2f}"
+
+
+def _merchant(lines: List[str]) -> Optional[str]:
+    # The first top line with words that is not an amount, a date or other header text
+    for line in lines[:5]:
+        if re.search(r"[A-Za-z]{2}", line) and _amount(line) is None and not NOT_MERCHANT_RE.search(line) \
+                and not DATE_RE.search(line):
+            return line
+    return None
+
+
+def _confidence(checks: Dict[str, bool], has_subtotal: bool, items: int, unclassified: int) -> float:
+    weights = {"merchant": 0.05, "datetime": 0.05, "items": 0.1, "total": 0.2, "items_match": 0.4, "totals_match": 0.2}
+    confidence = sum(weight for name, weight in weights.items() if checks[name])
+    # Receipts without a subtotal line can still balance: items + tax == total
+    if not has_subtotal and checks["items_match"]:
+        confidence += weights["totals_match"]
+    # Unknown item names make the food flags guesswork
+    if items:
+        confidence *= 1 - 0.5 * unclassified / items
+    return confidence
+
+
+def parse_receipt(text: str = "", layout: Optional[OCRLayout] = None) -> ParseResult:
+    """
+    Parse receipt OCR output into the same JSON structure the LLM produces. Works best on
+    line-oriented text such as OCRLayout.to_text(), where each price shares a line with its item.
+    Args:
+        text (str): OCR text
+        layout (OCRLayout, optional): Word boxes; when given, lines are rebuilt from them and `text` is ignored
+    Returns:
+        ParseResult: Parsed data and a confidence between 0 and 1
+    """
+    start = time.perf_counter()
+    lines = layout.line_texts() if layout is not None else text.splitlines()
+    lines = [line.strip() for line in lines if line.strip()]
+
+    merchant = _merchant(lines)
+    date = next((m.group(1) for m in map(DATE_RE.search, lines) if m), None)
+    clock = next((m.group(1) for m in map(TIME_RE.search, lines) if m), None)
+    datetime_text = " ".join(part for part in (date, clock) if part) or None
+
+    items: List[Dict[str, Any]] = []
+    item_total = 0.0
+    subtotal = tax = total = None
+    unclassified = 0
+    for line in lines:
+        amount = _amount(line)
+        if amount is None:
+            continue
+        if SUBTOTAL_RE.search(line):
+            subtotal = amount
+        elif TAX_RE.search(line):
+            tax = (tax or 0.0) + amount
+        elif TOTAL_RE.search(line):
+            # The first total wins; later "total" lines are usually payment summaries
+            if total is None:
+                total = amount
+        elif total is None and subtotal is None and not PAYMENT_RE.search(line):
+            name = _label(line)
+            if not re.search(r"[A-Za-z]{2}", name):
+                continue
+            is_food = classify_food(name)
+            unclassified += is_food is None
+            items.append({"name": name, "price": _money(amount), "is_food": bool(is_food)})
+            item_total += amount
+
+    checks = {
+        "merchant": merchant is not None,
+        "datetime": date is not None,
+        "items": bool(items),
+        "total": total is not None,
+        "items_match": bool(items) and _close(item_total, subtotal if subtotal is not None else
+                                              (total - (tax or 0.0) if total is not None else -1)),
+        "totals_match": total is not None and subtotal is not None and _close(subtotal + (tax or 0.0), total),
+    }
+    confidence = _confidence(checks, subtotal is not None, len(items), unclassified)
+
+    data = {
+        "merchant": merchant,
+        "datetime": datetime_text,
+        "items": items,
+        "subtotal": _money(subtotal if subtotal is not None else (item_total if items else None)),
+        "tax": _money(tax),
+        "total": _money(total),
+        # Canonical ingredient names, so "ORG BNLS CHKN BRST 2LB" reaches the recipe prompt as chicken breast
+        "food_items": food_item_names(items),
+    }
+    return ParseResult(data, round(confidence, 3), checks, (time.perf_counter() - start) * 1000)
+
+
+class ParserMetrics:
+    """
+    Counts how often the parser bypasses the LLM, and estimates the latency that saves
+    from the LLM calls that were still made.
+    """
+
+    def __init__(self):
+        self.parsed = 0
+        self.bypassed = 0
+        self.parse_ms = 0.0
+        self.llm_calls = 0
+        self.llm_ms = 0.0
+        self._lock = threading.Lock()
+
+    def record_parse(self, result: ParseResult, bypassed: bool) -> None:
+        with self._lock:
+            self.parsed += 1
+            self.bypassed += bypassed
+            self.parse_ms += result.elapsed_ms
+
+    def record_llm(self, elapsed_ms: float) -> None:
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_ms += elapsed_ms
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            mean_llm_ms = self.llm_ms / self.llm_calls if self.llm_calls else None
+            return {
+                "min_confidence": MIN_CONFIDENCE,
+                "parsed": self.parsed,
+                "bypassed": self.bypassed,
+                "bypass_rate": self.bypassed / self.parsed if self.parsed else 0.0,
+                "mean_parse_ms": self.parse_ms / self.parsed if self.parsed else None,
+                "llm_calls": self.llm_calls,
+                "mean_llm_ms": mean_llm_ms,
+                "estimated_saved_ms": self.bypassed * mean_llm_ms if mean_llm_ms is not None else None,
+            }
@@ -0,0 +1,144 @@
+import json
+import os
+import re
+from typing import Any, List, Optional, Tuple
+
+MODEL = "gpt-3.5-turbo"
+
+# Every prompt here asks for a JSON object, so OpenAI calls send response_format json_object
+# and replies always parse. Turn it off for models that do not support it.
+OPENAI_JSON_MODE = os.getenv("OPENAI_JSON_MODE", "1").lower() not in ("0", "false", "no")
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+# Instructions and schemas live in the system messages, which are identical on every call;
+# the user message carries only the receipt text or ingredient list. food_items is not asked
+# for: it is built locally from the items by food_lexicon.tag_food, and is_food only counts
+# for names the lexicon does not know
+RECEIPT_SCHEMA = ('{"merchant": str, "datetime": str, "items": [{"name": str, "price": str, "is_food": bool}], '
+                  '"subtotal": str, "tax": str, "total": str}')
+
+FORMAT_SYSTEM_PROMPT = (
+    "You extract structured data from receipt OCR text: the merchant, date and time, each item with its "
+    "price and whether it is food, subtotal, tax and total. "
+    f"Respond with only a JSON object of the form {RECEIPT_SCHEMA}, using null for anything missing."
+)
+
+BATCH_FORMAT_SYSTEM_PROMPT = (
+    "You extract structured data from the OCR text of several receipts: for each, the merchant, date and time, "
+    "each item with its price and whether it is food, subtotal, tax and total. "
+    f'Respond with only a JSON object {{"receipts": [...]}} holding one object of the form {RECEIPT_SCHEMA} '
+    "per receipt, in the order given, using null for anything missing."
+)
+
+RECIPE_SYSTEM_PROMPT = (
+    "You are a chef who suggests 2-3 recipes using some or all of the ingredients given. "
+    'Respond with only a JSON object of the form {"recipes": [{"name": str, "additional_ingredients": [str], '
+    '"instructions": [str], "cooking_time": str, "difficulty": "Easy" | "Medium" | "Hard"}]}.'
+)
+
+
+def build_format_prompt(text: str, part: Optional[Tuple[int, int]] = None) -> str:
+    """
+    Build the user message that turns OCR text into structured receipt JSON.
+    Args:
+        text (str): Receipt text, compacted by receipt_compaction
+        part (Tuple[int, int], optional): (part, parts) when a long receipt is sent in chunks
+    Returns:
+        str: User prompt
+    """
+    if part:
+        return f"Receipt text, part {part[0]} of {part[1]}; structure only the lines below:\n{text}"
+    return f"Receipt text:\n{text}"
+
+
+def build_recipe_prompt(food_items: List[str]) -> str:
+    """
+    Build the user message that asks for recipe suggestions.
+    Args:
+        food_items (List[str]): Food items from the receipt
+    Returns:
+        str: User prompt
+    """
+    return f"Ingredients: {', '.join(food_items)}"
+
+
+def format_messages(text: str, part: Optional[Tuple[int, int]] = None) -> List[dict]:
+    return [
+        {"role": "system", "content": FORMAT_SYSTEM_PROMPT},
+        {"role": "user", "content": build_format_prompt(text, part)},
+    ]
+
+
+def recipe_messages(food_items: List[str]) -> List[dict]:
+    return [
+        {"role": "system", "content": RECIPE_SYSTEM_PROMPT},
+        {"role": "user", "content": build_recipe_prompt(food_items)},
+    ]
+
+
+def build_batch_format_prompt(texts: List[str]) -> str:
+    """
+    Build one prompt that structures several receipts at once, so the instructions and
+    schema are sent (and paid for) once per batch rather than once per receipt.
+    Args:
+        texts (List[str]): OCR text of each receipt
+    Returns:
+        str: User prompt
+    """
+    receipts = "\n\n".join(f"### Receipt {i}\n{text}" for i, text in enumerate(texts, 1))
+    return f"{len(texts)} receipts; the receipts array must hold exactly {len(texts)} entries.\n\n{receipts}"
+
+
+def batch_format_messages(texts: List[str]) -> List[dict]:
+    return [
+        {"role": "system", "content": BATCH_FORMAT_SYSTEM_PROMPT},
+        {"role": "user", "content": build_batch_format_prompt(texts)},
+    ]
+
+
+# The tiktoken encoding once loaded, or False when tiktoken is unavailable
+_encoding: Any = None
+
+
+def parse_json(content: str) -> Any:
+    """
+    Parse a JSON reply. Replies from a JSON mode parse directly; for backends without one,
+    prose or code fences around the object are tolerated.
+    Raises:
+        ValueError: If no JSON object can be found
+    """
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        match = re.search(r"\{.*\}", content, re.DOTALL)
+        if not match:
+            raise ValueError("Could not find valid JSON in the response")
+        return json.loads(match.group())
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count prompt tokens with tiktoken's cl100k_base encoding (used by gpt-3.5-turbo). When
+    tiktoken or its encoding file is unavailable, fall back to an estimate: one token per
+    punctuation mark or whitespace run and one per four characters of each word.
+    Args:
+        text (str): Prompt text
+    Returns:
+        int: Token count
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return sum((len(piece) + 3) // 4 if piece[0].isalnum() else 1
+               for piece in re.findall(r"\w+|[^\w\s]|\s+", text))
+
+
+def count_message_tokens(messages: List[dict]) -> int:
+    # Each chat message carries about four tokens of framing on top of its content
+    return sum(count_tokens(message["content"]) + 4 for message in messages) + 2
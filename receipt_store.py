@@ -0,0 +1,504 @@
+"""
+Persistent receipt store. Every processed receipt is saved to SQLite: one row per receipt with
+indexed merchant, purchase date and total columns, plus a normalized row per line item, so
+spending history can be queried, aggregated and exported without re-running OCR or the LLM.
+Aggregates are computed by SQLite, and listings and exports page through the indexes.
+"""
+import base64
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from receipt_parser import DATE_RE
+
+# Page size limits for listings
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Rows fetched per round trip while exporting
+EXPORT_BATCH = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    id TEXT PRIMARY KEY,
+    image_hash TEXT,
+    merchant TEXT,
+    merchant_key TEXT,
+    purchased_at TEXT,
+    purchase_date TEXT,
+    subtotal_cents INTEGER,
+    tax_cents INTEGER,
+    total_cents INTEGER,
+    item_count INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS receipts_merchant_date ON receipts (merchant_key, purchase_date);
+CREATE INDEX IF NOT EXISTS receipts_purchase_date ON receipts (purchase_date);
+CREATE INDEX IF NOT EXISTS receipts_total ON receipts (total_cents);
+CREATE INDEX IF NOT EXISTS receipts_created ON receipts (created_at, id);
+CREATE UNIQUE INDEX IF NOT EXISTS receipts_image_hash ON receipts (image_hash) WHERE image_hash IS NOT NULL;
+CREATE TABLE IF NOT EXISTS receipt_items (
+    receipt_id TEXT NOT NULL REFERENCES receipts (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    price_cents INTEGER,
+    is_food INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (receipt_id, position)
+);
+CREATE INDEX IF NOT EXISTS receipt_items_name ON receipt_items (name_key);
+CREATE INDEX IF NOT EXISTS receipt_items_food ON receipt_items (name_key, receipt_id) WHERE is_food = 1;
+"""
+
+# Day-first is only assumed when the first number cannot be a month
+_DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d", "%m/%d/%Y", "%m/%d/%y", "%m-%d-%Y", "%m-%d-%y",
+                 "%d/%m/%Y", "%d/%m/%y", "%d.%m.%Y", "%d.%m.%y", "%d-%m-%Y", "%d %b %Y", "%d %B %Y", "%d %b %y")
+
+# A receipt saved again is replaced, but keeps the image hash it was first stored with. An
+# image hash already taken by another receipt is never moved to this one
+_UPSERT = (
+    "INSERT INTO receipts (id, image_hash, merchant, merchant_key, purchased_at, purchase_date, "
+    "subtotal_cents, tax_cents, total_cents, item_count, data, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (id) DO UPDATE SET merchant = excluded.merchant, merchant_key = excluded.merchant_key, "
+    "purchased_at = excluded.purchased_at, purchase_date = excluded.purchase_date, "
+    "subtotal_cents = excluded.subtotal_cents, tax_cents = excluded.tax_cents, "
+    "total_cents = excluded.total_cents, item_count = excluded.item_count, data = excluded.data, "
+    "image_hash = COALESCE(receipts.image_hash, CASE WHEN EXISTS (SELECT 1 FROM receipts AS owner "
+    "WHERE owner.image_hash = excluded.image_hash) THEN NULL ELSE excluded.image_hash END) "
+    "ON CONFLICT (image_hash) WHERE image_hash IS NOT NULL DO NOTHING"
+)
+
+
+def to_cents(value: Any) -> Optional[int]:
+    """
+    Args:
+        value: An amount as the parser or LLM returns it ("$1,234.50", "2,49", 3.5, None)
+    Returns:
+        int: The amount in cents, or None if it is not a number
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return round(value * 100)
+    text = str(value).strip().replace(" ", "")
+    negative = text.startswith("-") or text.endswith("-")
+    match = re.search(r"\d[\d,.]*", text)
+    if not match:
+        return None
+    number = match.group()
+    # "2,49" is a decimal comma; "1,234.50" and "1.234,50" have thousands separators
+    if re.fullmatch(r"\d+,\d{2}", number):
+        number = number.replace(",", ".")
+    elif re.fullmatch(r"[\d.]+,\d{2}", number):
+        number = number.replace(".", "").replace(",", ".")
+    else:
+        number = number.replace(",", "")
+    try:
+        cents = round(float(number) * 100)
+    except ValueError:
+        return None
+    return -cents if negative else cents
+
+
+def parse_purchase_date(value: Any) -> Optional[str]:
+    """
+    Args:
+        value: The receipt's date and time as printed or as the LLM returned it
+    Returns:
+        str: The date as YYYY-MM-DD, or None if no date can be read
+    """
+    if not value:
+        return None
+    iso = re.match(r"\d{4}-\d{2}-\d{2}", str(value))
+    if iso:
+        try:
+            return datetime.strptime(iso.group(), "%Y-%m-%d").date().isoformat()
+        except ValueError:
+            return None
+    match = DATE_RE.search(str(value))
+    if not match:
+        return None
+    text = match.group(1)
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_name(name: str) -> str:
+    return re.sub(r"\s+", " ", name).strip().lower()
+
+
+def _parse_date_arg(value: Optional[str], name: str) -> Optional[str]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        raise ValueError(f"{name} must be a date in YYYY-MM-DD format") from None
+
+
+def _parse_amount_arg(value: Optional[str], name: str) -> Optional[int]:
+    if value in (None, ""):
+        return None
+    cents = to_cents(value)
+    if cents is None:
+        raise ValueError(f"{name} must be an amount")
+    return cents
+
+
+@dataclass
+class ReceiptFilter:
+    """Receipt selection shared by listings, aggregates and exports. Dates are inclusive."""
+    merchant: Optional[str] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    min_total_cents: Optional[int] = None
+    max_total_cents: Optional[int] = None
+
+    @classmethod
+    def from_args(cls, args: Mapping[str, str]) -> "ReceiptFilter":
+        """
+        Build a filter from query parameters: merchant, from, to (YYYY-MM-DD), min_total and max_total.
+        Raises:
+            ValueError: If a parameter is malformed
+        """
+        return cls(
+            merchant=args.get("merchant") or None,
+            date_from=_parse_date_arg(args.get("from"), "from"),
+            date_to=_parse_date_arg(args.get("to"), "to"),
+            min_total_cents=_parse_amount_arg(args.get("min_total"), "min_total"),
+            max_total_cents=_parse_amount_arg(args.get("max_total"), "max_total"),
+        )
+
+    def where(self, alias: str = "r", *extra: str) -> Tuple[str, List[Any]]:
+        """
+        Args:
+            alias (str): Alias of the receipts table in the query
+            *extra (str): Further conditions, ANDed with the filter's
+        Returns:
+            Tuple[str, List[Any]]: A WHERE clause (empty when nothing is filtered) and its parameters
+        """
+        clauses: List[str] = list(extra)
+        params: List[Any] = []
+        if self.merchant:
+            clauses.append(f"{alias}.merchant_key = ?")
+            params.append(normalize_name(self.merchant))
+        if self.date_from:
+            clauses.append(f"{alias}.purchase_date >= ?")
+            params.append(self.date_from)
+        if self.date_to:
+            clauses.append(f"{alias}.purchase_date <= ?")
+            params.append(self.date_to)
+        if self.min_total_cents is not None:
+            clauses.append(f"{alias}.total_cents >= ?")
+            params.append(self.min_total_cents)
+        if self.max_total_cents is not None:
+            clauses.append(f"{alias}.total_cents <= ?")
+            params.append(self.max_total_cents)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def _encode_cursor(created_at: float, receipt_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, receipt_id]).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        created_at, receipt_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return float(created_at), str(receipt_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor") from None
+
+
+def _amount(cents: Optional[int]) -> Optional[float]:
+    return cents / 100 if cents is not None else None
+
+
+RECEIPT_COLUMNS = ("id", "merchant", "purchase_date", "purchased_at", "subtotal", "tax", "total",
+                   "item_count", "created_at")
+ITEM_COLUMNS = ("receipt_id", "merchant", "purchase_date", "position", "name", "price", "is_food")
+
+
+class ReceiptStore:
+    """
+    SQLite-backed history of processed receipts, shared by every worker pointing at the same
+    file. Receipts are keyed by receipt_id (the OCR text key); saving one again replaces it.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def save(self, receipt_data: Dict[str, Any], image_hash: Optional[str] = None) -> None:
+        """
+        Save (or replace) a processed receipt and its items.
+        Args:
+            receipt_data (Dict[str, Any]): Structured receipt data including its receipt_id
+            image_hash (str, optional): Hash of the uploaded image, so re-uploads are answered from the store
+        """
+        self.save_many([(receipt_data, image_hash)])
+
+    def save_many(self, receipts: Sequence[Tuple[Dict[str, Any], Optional[str]]]) -> None:
+        """Save several (receipt_data, image_hash) pairs in one transaction."""
+        now = time.time()
+        rows: List[tuple] = []
+        items: List[tuple] = []
+        ids: List[Tuple[str]] = []
+        for receipt_data, image_hash in receipts:
+            receipt_id = receipt_data.get("receipt_id")
+            if not receipt_id:
+                continue
+            merchant = str(receipt_data.get("merchant") or "").strip() or None
+            receipt_items = [item for item in receipt_data.get("items") or [] if isinstance(item, dict)]
+            rows.append((
+                receipt_id, image_hash, merchant, normalize_name(merchant) if merchant else None,
+                receipt_data.get("datetime"), parse_purchase_date(receipt_data.get("datetime")),
+                to_cents(receipt_data.get("subtotal")), to_cents(receipt_data.get("tax")),
+                to_cents(receipt_data.get("total")), len(receipt_items), json.dumps(receipt_data), now,
+            ))
+            ids.append((receipt_id,))
+            items.extend(
+                (receipt_id, position, str(item.get("name") or ""), normalize_name(str(item.get("name") or "")),
+                 to_cents(item.get("price")), int(bool(item.get("is_food"))))
+                for position, item in enumerate(receipt_items)
+            )
+        if not rows:
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany(_UPSERT, rows)
+            # An image already stored under another receipt_id (its OCR text came out differently
+            # this time) keeps that receipt; the new one is stored without the image hash
+            hashed = [row for row in rows if row[1] is not None]
+            stored = {row[0] for row in conn.execute(
+                f"SELECT id FROM receipts WHERE id IN ({', '.join('?' * len(hashed))})",
+                [row[0] for row in hashed])} if hashed else set()
+            conn.executemany(_UPSERT, [(row[0], None, *row[2:]) for row in hashed if row[0] not in stored])
+            conn.executemany("DELETE FROM receipt_items WHERE receipt_id = ?", ids)
+            conn.executemany(
+                "INSERT INTO receipt_items (receipt_id, position, name, name_key, price_cents, is_food) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                items,
+            )
+
+    def get(self, receipt_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT data FROM receipts WHERE id = ?", (receipt_id,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def get_by_image(self, image_hash: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT data FROM receipts WHERE image_hash = ?", (image_hash,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def delete(self, receipt_id: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM receipts WHERE id = ?", (receipt_id,)).rowcount > 0
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+
+    @staticmethod
+    def _summary(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "merchant": row["merchant"],
+            "purchase_date": row["purchase_date"],
+            "purchased_at": row["purchased_at"],
+            "subtotal": _amount(row["subtotal_cents"]),
+            "tax": _amount(row["tax_cents"]),
+            "total": _amount(row["total_cents"]),
+            "item_count": row["item_count"],
+            "created_at": row["created_at"],
+        }
+
+    def list(self, receipt_filter: Optional[ReceiptFilter] = None, limit: int = DEFAULT_PAGE_SIZE,
+             cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        One page of receipts, newest first. Pages are keyed on (created_at, id) rather than an
+        offset, so deep pages cost the same as the first.
+        Args:
+            receipt_filter (ReceiptFilter, optional): Selection
+            limit (int): Page size, at most MAX_PAGE_SIZE
+            cursor (str, optional): next_cursor from the previous page
+        Returns:
+            Dict[str, Any]: {"receipts": [...], "next_cursor": str or None}
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        receipt_filter = receipt_filter or ReceiptFilter()
+        if cursor:
+            created_at, receipt_id = _decode_cursor(cursor)
+            where, params = receipt_filter.where("r", "(r.created_at, r.id) < (?, ?)")
+            params = [created_at, receipt_id, *params]
+        else:
+            where, params = receipt_filter.where()
+        rows = self._connect().execute(
+            f"SELECT * FROM receipts r{where} ORDER BY r.created_at DESC, r.id DESC LIMIT ?", (*params, limit + 1)
+        ).fetchall()
+        page = rows[:limit]
+        next_cursor = _encode_cursor(page[-1]["created_at"], page[-1]["id"]) if len(rows) > limit else None
+        return {"receipts": [self._summary(row) for row in page], "next_cursor": next_cursor}
+
+    def spend_by_merchant_month(self, receipt_filter: Optional[ReceiptFilter] = None) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            List[Dict[str, Any]]: {"merchant", "month" (YYYY-MM), "receipts", "total"} per merchant
+            and month, latest month first and largest spend first within a month. Receipts without
+            a readable date are grouped under a null month.
+        """
+        where, params = (receipt_filter or ReceiptFilter()).where()
+        rows = self._connect().execute(
+            "SELECT MAX(r.merchant) AS merchant, substr(r.purchase_date, 1, 7) AS month, COUNT(*) AS receipts, "
+            f"SUM(r.total_cents) AS total_cents FROM receipts r{where} "
+            "GROUP BY r.merchant_key, month ORDER BY month DESC, total_cents DESC",
+            params,
+        ).fetchall()
+        return [{"merchant": row["merchant"], "month": row["month"], "receipts": row["receipts"],
+                 "total": _amount(row["total_cents"])} for row in rows]
+
+    def top_food_items(self, receipt_filter: Optional[ReceiptFilter] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            List[Dict[str, Any]]: {"name", "purchases", "receipts", "spend"} for the food items bought
+            most often, most frequent first
+        """
+        where, params = (receipt_filter or ReceiptFilter()).where("r", "i.is_food = 1")
+        rows = self._connect().execute(
+            "SELECT MAX(i.name) AS name, COUNT(*) AS purchases, COUNT(DISTINCT i.receipt_id) AS receipts, "
+            f"SUM(i.price_cents) AS spend_cents FROM receipt_items i JOIN receipts r ON r.id = i.receipt_id{where} "
+            "GROUP BY i.name_key ORDER BY purchases DESC, spend_cents DESC LIMIT ?",
+            (*params, max(1, min(int(limit), MAX_PAGE_SIZE))),
+        ).fetchall()
+        return [{"name": row["name"], "purchases": row["purchases"], "receipts": row["receipts"],
+                 "spend": _amount(row["spend_cents"])} for row in rows]
+
+    def summary(self, receipt_filter: Optional[ReceiptFilter] = None) -> Dict[str, Any]:
+        """Receipt count, total spend, merchants and date range of the selection."""
+        where, params = (receipt_filter or ReceiptFilter()).where()
+        row = self._connect().execute(
+            "SELECT COUNT(*) AS receipts, SUM(r.total_cents) AS total_cents, COUNT(DISTINCT r.merchant_key) AS merchants, "
+            f"MIN(r.purchase_date) AS first_date, MAX(r.purchase_date) AS last_date FROM receipts r{where}",
+            params,
+        ).fetchone()
+        return {"receipts": row["receipts"], "total": _amount(row["total_cents"]), "merchants": row["merchants"],
+                "first_date": row["first_date"], "last_date": row["last_date"]}
+
+    def _export_rows(self, kind: str, receipt_filter: Optional[ReceiptFilter]) -> Iterator[Dict[str, Any]]:
+        where, params = (receipt_filter or ReceiptFilter()).where()
+        if kind == "receipts":
+            query = f"SELECT * FROM receipts r{where} ORDER BY r.created_at, r.id"
+            convert = self._summary
+        elif kind == "items":
+            query = (
+                "SELECT i.receipt_id, r.merchant, r.purchase_date, i.position, i.name, i.price_cents, i.is_food "
+                f"FROM receipt_items i JOIN receipts r ON r.id = i.receipt_id{where} "
+                "ORDER BY r.created_at, i.receipt_id, i.position"
+            )
+
+            def convert(row: sqlite3.Row) -> Dict[str, Any]:
+                return {"receipt_id": row["receipt_id"], "merchant": row["merchant"],
+                        "purchase_date": row["purchase_date"], "position": row["position"], "name": row["name"],
+                        "price": _amount(row["price_cents"]), "is_food": bool(row["is_food"])}
+        else:
+            raise ValueError("kind must be receipts or items")
+        # A connection of its own: the export is consumed while the response streams, interleaved
+        # with other queries, and an ASGI server may resume it on a different thread each time
+        conn = sqlite3.connect(str(self.path), timeout=5, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(query, params)
+            while True:
+                batch = rows.fetchmany(EXPORT_BATCH)
+                if not batch:
+                    return
+                for row in batch:
+                    yield convert(row)
+        finally:
+            conn.close()
+
+    def export(self, fmt: str = "jsonl", kind: str = "receipts",
+               receipt_filter: Optional[ReceiptFilter] = None) -> Iterator[str]:
+        """
+        Stream the selection as CSV or JSON Lines without holding it in memory.
+        Args:
+            fmt (str): "csv" or "jsonl"
+            kind (str): "receipts" (one line per receipt) or "items" (one line per item)
+            receipt_filter (ReceiptFilter, optional): Selection
+        Yields:
+            str: Chunks of the file, a batch of lines at a time
+        Raises:
+            ValueError: If the format or kind is unknown (raised before anything is yielded)
+        """
+        if fmt not in ("csv", "jsonl"):
+            raise ValueError("format must be csv or jsonl")
+        if kind not in ("receipts", "items"):
+            raise ValueError("kind must be receipts or items")
+        return self._export(fmt, kind, receipt_filter)
+
+    def _export(self, fmt: str, kind: str, receipt_filter: Optional[ReceiptFilter]) -> Iterator[str]:
+        columns = RECEIPT_COLUMNS if kind == "receipts" else ITEM_COLUMNS
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, columns) if fmt == "csv" else None
+        if writer:
+            writer.writeheader()
+        for count, row in enumerate(self._export_rows(kind, receipt_filter), 1):
+            if writer:
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(row) + "\n")
+            if count % EXPORT_BATCH == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        return {
+            "receipts": len(self),
+            "items": conn.execute("SELECT COUNT(*) FROM receipt_items").fetchone()[0],
+            "path": str(self.path),
+        }
+
+
+def create_store(path: Optional[str] = None) -> Optional[ReceiptStore]:
+    """
+    Build the receipt store from RECEIPT_STORE_PATH (default data/receipts.sqlite3).
+    Args:
+        path (str, optional): Database file, overriding RECEIPT_STORE_PATH; "none" disables the store
+    Returns:
+        ReceiptStore: The store, or None when disabled
+    """
+    if path is None:
+        path = os.getenv("RECEIPT_STORE_PATH", "data/receipts.sqlite3")
+    if path.lower() in ("", "none", "off"):
+        return None
+    return ReceiptStore(path)
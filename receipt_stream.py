@@ -0,0 +1,17 @@
+import json
+from typing import Any
+
+# Disable proxy buffering so each event reaches the browser as soon as it is written
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data: Any) -> str:
+    """
+    Format one Server-Sent Event.
+    Args:
+        event (str): Event name ("ocr", "receipt", "recipe_token", "recipes", "done" or "error")
+        data (Any): JSON-serializable payload
+    Returns:
+        str: Event frame, terminated by a blank line
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,343 @@
+"""
+Upload handling: reading uploads off the request stream, a pre-flight check that rejects
+anything that is not a reasonably sized JPEG or PNG before it is decoded or sent upstream,
+and coalescing of repeat submissions of the same file.
+"""
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, List, NamedTuple, Optional, Tuple, TypeVar
+
+from PIL import Image
+
+from metrics import UPLOADS_COALESCED, UPLOADS_REJECTED, timed
+from receipt_cache import hash_bytes
+
+T = TypeVar("T")
+
+CHUNK_SIZE = 1024 * 1024
+# Largest accepted image, Vision's own per-image limit
+MAX_UPLOAD_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+# Largest request body, checked against Content-Length before anything is read; batches need headroom
+MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(128 * 1024 * 1024)))
+# Largest accepted image in pixels; a 48 MP phone photo passes, a decompression bomb does not
+MAX_IMAGE_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", str(50_000_000)))
+# Seconds a finished upload keeps answering repeats of it; 0 turns coalescing off
+DEDUPE_WINDOW = float(os.getenv("UPLOAD_DEDUPE_WINDOW", "10"))
+
+ACCEPTED_FORMATS = ("JPEG", "PNG")
+# Leading bytes of the formats clients send, so a rejection can say what was uploaded
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+    (b"%PDF", "PDF"),
+)
+_HEIF_BRANDS = (b"heic", b"heix", b"hevc", b"mif1", b"msf1", b"avif")
+
+
+class UploadRejected(ValueError):
+    """An upload refused by the pre-flight check. `status` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400, reason: str = "invalid"):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        UPLOADS_REJECTED.inc(reason=reason)
+
+
+class ImageInfo(NamedTuple):
+    format: str
+    width: int
+    height: int
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """
+    Args:
+        head (bytes): The first 16 bytes or more of a file
+    Returns:
+        Optional[str]: The image format the bytes start with ("JPEG", "PNG", "HEIC", ...), or None
+    """
+    head = bytes(head[:16])
+    for signature, name in _SIGNATURES:
+        if head.startswith(signature):
+            return name
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    if head[4:8] == b"ftyp" and head[8:12] in _HEIF_BRANDS:
+        return "HEIC"
+    return None
+
+
+def check_format(head: bytes) -> str:
+    """
+    Reject anything but JPEG and PNG by its leading bytes, whatever its filename says.
+    Raises:
+        UploadRejected: 415 for other or unrecognized formats
+    """
+    name = sniff_format(head)
+    if name is None:
+        raise UploadRejected("File is not an image", 415, "format")
+    if name not in ACCEPTED_FORMATS:
+        raise UploadRejected(f"{name} files are not supported, upload a JPEG or PNG image", 415, "format")
+    return name
+
+
+def check_size(size: int, max_bytes: Optional[int] = None) -> None:
+    """
+    Raises:
+        UploadRejected: 413 when `size` is over `max_bytes` (default MAX_UPLOAD_BYTES)
+    """
+    limit = MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    if size > limit:
+        raise UploadRejected(f"Image is over the {limit / 1024 / 1024:g} MiB limit", 413, "too_large")
+
+
+def preflight(data, max_bytes: Optional[int] = None, max_pixels: Optional[int] = None) -> ImageInfo:
+    """
+    Check an upload before anything decodes it: size, format by magic bytes, and dimensions
+    read from the image header.
+    Args:
+        data (bytes | memoryview): Uploaded bytes
+        max_bytes (int, optional): Size limit, defaults to MAX_UPLOAD_BYTES
+        max_pixels (int, optional): Pixel limit, defaults to MAX_IMAGE_PIXELS
+    Returns:
+        ImageInfo: Format and dimensions
+    Raises:
+        UploadRejected: 413 for images too large in bytes or pixels, 415 for other formats and
+            400 for images whose header cannot be read
+    """
+    limit = MAX_IMAGE_PIXELS if max_pixels is None else max_pixels
+    with timed("preflight"):
+        check_size(len(data), max_bytes)
+        name = check_format(data[:16])
+        try:
+            # Image.open only parses the header; pixel data is decoded later, and only if asked
+            with Image.open(io.BytesIO(data)) as image:
+                width, height = image.size
+        except Image.DecompressionBombError:
+            raise UploadRejected(f"Image is over the {limit / 1e6:g} MP limit", 413, "too_large")
+        except Exception:
+            raise UploadRejected("Image is truncated or corrupt", 400, "corrupt")
+        info = ImageInfo(name, width, height)
+        if not width or not height:
+            raise UploadRejected("Image has no pixels", 400, "corrupt")
+        if info.pixels > limit:
+            raise UploadRejected(f"Image is {width}x{height}, over the {limit / 1e6:g} MP limit", 413, "too_large")
+        return info
+
+
+def read_upload(file_storage, max_bytes: Optional[int] = None) -> bytes:
+    """
+    Read an uploaded file straight from its stream without saving it under its client-supplied name.
+    Reading stops as soon as the content is known to be unacceptable: not a JPEG or PNG
+    by its first bytes, or over the size limit. Accepted uploads are at most `max_bytes`, so
+    they are held in memory.
+    Args:
+        file_storage (werkzeug.datastructures.FileStorage): Uploaded file
+        max_bytes (int, optional): Size limit, defaults to MAX_UPLOAD_BYTES
+    Returns:
+        bytes: Upload content
+    Raises:
+        UploadRejected: For other formats and oversized uploads
+    """
+    limit = MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    stream = file_storage.stream
+    # Sniff the first chunk before reading on, so a 40 MB video is refused after one read
+    first = stream.read(CHUNK_SIZE)
+    check_format(first)
+    chunks = [first]
+    size = len(first)
+    check_size(size, limit)
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        check_size(size, limit)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def _settled(future: Optional[Future]) -> None:
+    # Wait for a run to finish, whatever its outcome. Shielded, so cancelling the waiter
+    # leaves the run alone
+    if future is None:
+        return
+    try:
+        await asyncio.shield(asyncio.wrap_future(future))
+    except asyncio.CancelledError:
+        if not future.cancelled():
+            raise
+    except Exception:
+        pass
+
+
+class _Submission:
+    __slots__ = ("client", "key", "future", "finished_at")
+
+    def __init__(self, client: Optional[str], key: str):
+        self.client = client
+        self.key = key
+        self.future: Future = Future()
+        self.finished_at: Optional[float] = None
+
+
+class UploadCoalescer:
+    """
+    Collapses repeat submissions of the same file by the same client into one run, such as a
+    double click on "Process". A repeat with identical bytes that arrives while the first is in
+    flight waits for its result; one that arrives up to `window` seconds after it finished gets
+    the same result. Failures are shared only with repeats already waiting.
+
+    Only identical bytes are coalesced. A resized or recompressed copy of a photo runs on its
+    own: it may be a different receipt, and its upstream calls differ from the first's anyway.
+    """
+
+    def __init__(self, endpoint: str, window: float = DEDUPE_WINDOW):
+        """
+        Args:
+            endpoint (str): Label for the coalesced-uploads metric
+            window (float): Seconds a finished run keeps answering repeats; 0 disables coalescing
+        """
+        self.endpoint = endpoint
+        self.window = window
+        self.coalesced = 0
+        self._recent: List[_Submission] = []
+        self._lock = threading.Lock()
+
+    def _claim(self, content, client: Optional[str]) -> Tuple[_Submission, bool]:
+        # (submission, first): an identical upload's submission and False, or this upload's
+        # own submission and True
+        key = hash_bytes(content)
+        now = time.monotonic()
+        with self._lock:
+            self._recent = [s for s in self._recent if s.finished_at is None or now - s.finished_at < self.window]
+            for submission in self._recent:
+                if submission.client == client and submission.key == key:
+                    self.coalesced += 1
+                    UPLOADS_COALESCED.inc(endpoint=self.endpoint)
+                    return submission, False
+            submission = _Submission(client, key)
+            self._recent.append(submission)
+            return submission, True
+
+    def _finish(self, submission: _Submission, result: Any = None, error: Optional[BaseException] = None) -> None:
+        if error is not None:
+            with self._lock:
+                self._recent.remove(submission)
+            if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+                # The first client went away; repeats of its upload still want an answer
+                submission.future.cancel()
+            else:
+                submission.future.set_exception(error)
+        else:
+            submission.finished_at = time.monotonic()
+            submission.future.set_result(result)
+
+    def run(self, content, func: Callable[[], T], client: Optional[str] = None) -> T:
+        """
+        Run `func` for an upload, or return the result of a run of identical bytes instead.
+        Args:
+            content (bytes): The uploaded image
+            func (Callable[[], T]): Does the work for the upload
+            client (str, optional): Who uploaded it; only the same client's uploads are coalesced
+        Returns:
+            T: The result of `func`, this call's or an identical upload's
+        """
+        if self.window <= 0:
+            return func()
+        submission, first = self._claim(content, client)
+        if not first:
+            return submission.future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            self._finish(submission, error=e)
+            raise
+        self._finish(submission, result)
+        return result
+
+    async def run_async(self, content, func: Callable[[], Awaitable[T]], client: Optional[str] = None) -> T:
+        """Like run, for a coroutine function; the content hash is taken on a worker thread."""
+        if self.window <= 0:
+            return await func()
+        submission, first = await asyncio.to_thread(self._claim, content, client)
+        if not first:
+            try:
+                # Shielded, so a repeat whose client disconnects does not cancel the shared run
+                return await asyncio.shield(asyncio.wrap_future(submission.future))
+            except asyncio.CancelledError:
+                if not submission.future.cancelled():
+                    raise
+            return await func()
+        try:
+            result = await func()
+        except BaseException as e:
+            self._finish(submission, error=e)
+            raise
+        self._finish(submission, result)
+        return result
+
+    def stream(self, content, func: Callable[[], Iterator[T]], client: Optional[str] = None) -> Iterator[T]:
+        """
+        Like run, for a streamed response. Events can't be shared between connections, so a
+        repeat waits until the matching stream has finished and then streams its own, which
+        the result cache answers without any upstream calls.
+        """
+        if self.window <= 0:
+            yield from func()
+            return
+        submission, first = self._claim(content, client)
+        if not first:
+            try:
+                submission.future.result()
+            except Exception:
+                # Failed or abandoned; this request tries for itself
+                pass
+            yield from func()
+            return
+        try:
+            yield from func()
+        except BaseException as e:
+            self._finish(submission, error=e)
+            raise
+        self._finish(submission, True)
+
+    async def stream_async(self, content, func: Callable[[], AsyncIterator[T]],
+                           client: Optional[str] = None) -> AsyncIterator[T]:
+        """Like stream, for an async generator function."""
+        if self.window <= 0:
+            async for item in func():
+                yield item
+            return
+        submission, first = await asyncio.to_thread(self._claim, content, client)
+        if not first:
+            # Finished, failed or abandoned, this request streams for itself
+            await _settled(submission.future)
+            async for item in func():
+                yield item
+            return
+        try:
+            async for item in func():
+                yield item
+        except BaseException as e:
+            self._finish(submission, error=e)
+            raise
+        self._finish(submission, True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"coalesced": self.coalesced, "tracked": len(self._recent), "window": self.window}
@@ -0,0 +1,319 @@
+"""
+Local recipe corpus with an inverted index from canonical ingredient to recipe. Recipes the
+LLM suggests are added as they are generated; a basket whose ingredients are covered well
+enough by recipes already in the corpus is answered from it without an LLM call. Grocery
+baskets repeat heavily, so the corpus soon answers most of them.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Sequence, Set
+
+from food_lexicon import default_lexicon
+
+logger = logging.getLogger(__name__)
+
+# Recipes kept in memory, least recently served evicted first; 0 disables the index
+RECIPE_INDEX_SIZE = int(os.getenv("RECIPE_INDEX_SIZE", "5000"))
+# Share of a recipe's ingredients the basket must have for the recipe to be served
+MIN_COVERAGE = float(os.getenv("RECIPE_INDEX_MIN_COVERAGE", "0.75"))
+# Share of the basket the served recipes must use between them
+MIN_BASKET_COVERAGE = float(os.getenv("RECIPE_INDEX_MIN_BASKET_COVERAGE", "0.4"))
+# Recipes served per basket, and the fewest worth serving instead of asking the LLM
+RESULTS = int(os.getenv("RECIPE_INDEX_RESULTS", "3"))
+MIN_RESULTS = 2
+
+# Assumed to be in every kitchen, so they neither count toward coverage nor count as missing
+PANTRY = frozenset({"salt", "black pepper", "water", "vegetable oil", "olive oil", "sugar", "flour", "butter"})
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recipe_index (
+    id TEXT PRIMARY KEY,
+    recipe TEXT NOT NULL,
+    ingredients TEXT NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recipe_index_used_at ON recipe_index (used_at);
+"""
+
+
+class IndexedRecipe(NamedTuple):
+    id: str
+    recipe: Dict[str, Any]
+    # Canonical names of the basket ingredients the recipe uses, pantry staples excluded;
+    # whatever else it needs was already in additional_ingredients
+    ingredients: FrozenSet[str]
+
+
+def basket_ingredients(food_items: Iterable[str]) -> Set[str]:
+    """Canonical ingredient names of a basket, pantry staples excluded."""
+    lexicon = default_lexicon()
+    names = {lexicon.ingredient_name(item) for item in food_items if item and item.strip()}
+    return {name for name in names if name} - PANTRY
+
+
+def recipe_ingredients(recipe: Dict[str, Any], food_items: Iterable[str]) -> FrozenSet[str]:
+    """
+    The basket ingredients a recipe uses: those the food lexicon finds in its name and
+    instructions, or that the text names outright.
+    Args:
+        recipe (Dict[str, Any]): Recipe as the LLM returns it
+        food_items (Iterable[str]): The basket it was generated for
+    Returns:
+        FrozenSet[str]: Canonical ingredient names, pantry staples excluded
+    """
+    instructions = recipe.get("instructions") or []
+    if not isinstance(instructions, list):
+        instructions = [instructions]
+    text = "\n".join([str(recipe.get("name") or ""), *map(str, instructions)])
+    found = set(default_lexicon().ingredients_in(text))
+    # Items the lexicon does not know ("kombucha") still count when the recipe names them
+    lowered = text.lower()
+    return frozenset(name for name in basket_ingredients(food_items) if name in found or name in lowered)
+
+
+def _recipe_id(recipe: Dict[str, Any], ingredients: FrozenSet[str]) -> str:
+    key = " ".join(str(recipe.get("name") or "").lower().split()) + "|" + ",".join(sorted(ingredients))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]
+
+
+class RecipeIndex:
+    """
+    Recipe corpus with an inverted index, in memory and optionally in SQLite. With a path,
+    recipes added by any worker are written through and every worker loads the most
+    recently used ones at startup; each worker then grows its own copy.
+    """
+
+    def __init__(self, max_recipes: int = RECIPE_INDEX_SIZE, min_coverage: float = MIN_COVERAGE,
+                 min_basket_coverage: float = MIN_BASKET_COVERAGE, results: int = RESULTS,
+                 path: Optional[str] = None):
+        """
+        Args:
+            max_recipes (int): Recipes kept, in memory and on disk
+            min_coverage (float): Share of a recipe's ingredients a basket must have for it to be served
+            min_basket_coverage (float): Share of the basket the served recipes must use between them
+            results (int): Recipes served per basket
+            path (str, optional): SQLite file the corpus is kept in; None keeps it in memory only
+        """
+        self.max_recipes = max_recipes
+        self.min_coverage = min_coverage
+        self.min_basket_coverage = min_basket_coverage
+        self.results = results
+        self.hits = 0
+        self.misses = 0
+        self.added = 0
+        self.evictions = 0
+        self._recipes: "OrderedDict[str, IndexedRecipe]" = OrderedDict()
+        self._postings: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.path = Path(path) if path else None
+        self._local = threading.local()
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connect().executescript(_SCHEMA)
+            self._load()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _load(self) -> None:
+        rows = self._connect().execute(
+            "SELECT id, recipe, ingredients FROM recipe_index ORDER BY used_at DESC LIMIT ?", (self.max_recipes,)
+        ).fetchall()
+        # Oldest first, so the most recently used end up last in LRU order
+        for recipe_id, recipe, ingredients in reversed(rows):
+            self._insert(IndexedRecipe(recipe_id, json.loads(recipe), frozenset(json.loads(ingredients))))
+        logger.info("recipe index loaded", extra={"recipes": len(self._recipes), "path": str(self.path)})
+
+    def _insert(self, entry: IndexedRecipe) -> None:
+        self._recipes[entry.id] = entry
+        self._recipes.move_to_end(entry.id)
+        for ingredient in entry.ingredients:
+            self._postings.setdefault(ingredient, set()).add(entry.id)
+        while len(self._recipes) > self.max_recipes:
+            _, evicted = self._recipes.popitem(last=False)
+            for ingredient in evicted.ingredients:
+                postings = self._postings.get(ingredient)
+                if postings is not None:
+                    postings.discard(evicted.id)
+                    if not postings:
+                        del self._postings[ingredient]
+            self.evictions += 1
+
+    def add(self, food_items: Sequence[str], recipes: Sequence[Dict[str, Any]]) -> int:
+        """
+        Add LLM-generated recipes to the corpus.
+        Args:
+            food_items (Sequence[str]): The basket they were generated for
+            recipes (Sequence[Dict[str, Any]]): The recipes
+        Returns:
+            int: Recipes indexed; ones using fewer than two basket ingredients are skipped
+        """
+        entries = []
+        for recipe in recipes:
+            if not isinstance(recipe, dict) or not recipe.get("name"):
+                continue
+            ingredients = recipe_ingredients(recipe, food_items)
+            # Nothing to match a basket against
+            if len(ingredients) < 2:
+                continue
+            entries.append(IndexedRecipe(_recipe_id(recipe, ingredients), recipe, ingredients))
+        if not entries:
+            return 0
+        with self._lock:
+            for entry in entries:
+                self.added += entry.id not in self._recipes
+                self._insert(entry)
+        if self.path is not None:
+            self._write(entries)
+        return len(entries)
+
+    def _write(self, entries: Sequence[IndexedRecipe]) -> None:
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO recipe_index (id, recipe, ingredients, used_at) VALUES (?, ?, ?, ?)",
+                    [(e.id, json.dumps(e.recipe), json.dumps(sorted(e.ingredients)), now) for e in entries],
+                )
+                conn.execute(
+                    "DELETE FROM recipe_index WHERE id IN (SELECT id FROM recipe_index ORDER BY used_at DESC "
+                    "LIMIT -1 OFFSET ?)", (self.max_recipes,),
+                )
+        except sqlite3.Error as e:
+            logger.warning("could not save recipes", extra={"recipes": len(entries), "error": str(e)})
+
+    def _touch(self, ids: Sequence[str]) -> None:
+        try:
+            with self._connect() as conn:
+                conn.executemany("UPDATE recipe_index SET used_at = ? WHERE id = ?",
+                                 [(time.time(), recipe_id) for recipe_id in ids])
+        except sqlite3.Error as e:
+            logger.warning("could not update recipe index", extra={"error": str(e)})
+
+    def lookup(self, food_items: Sequence[str]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Recipes for a basket from the corpus, chosen greedily so each one adds the most
+        basket ingredients not yet used, among those the basket covers well enough.
+        Args:
+            food_items (Sequence[str]): Food items from the receipt
+        Returns:
+            Optional[List[Dict[str, Any]]]: Recipes with additional_ingredients adjusted to
+            the basket, or None when the corpus does not cover it well enough
+        """
+        basket = basket_ingredients(food_items)
+        with self._lock:
+            chosen = self._choose(basket) if basket else []
+            if not chosen:
+                self.misses += 1
+                return None
+            self.hits += 1
+            for entry in chosen:
+                self._recipes.move_to_end(entry.id)
+        if self.path is not None:
+            self._touch([entry.id for entry in chosen])
+        return [self._served(entry, basket) for entry in chosen]
+
+    def _choose(self, basket: Set[str]) -> List[IndexedRecipe]:
+        overlap: Dict[str, int] = {}
+        for ingredient in basket:
+            for recipe_id in self._postings.get(ingredient, ()):
+                overlap[recipe_id] = overlap.get(recipe_id, 0) + 1
+        candidates = [self._recipes[recipe_id] for recipe_id, count in overlap.items()
+                      if count >= 2 and count / len(self._recipes[recipe_id].ingredients) >= self.min_coverage]
+
+        chosen: List[IndexedRecipe] = []
+        names: Set[str] = set()
+        used: Set[str] = set()
+        while candidates and len(chosen) < self.results:
+            best = max(candidates, key=lambda e: (len((e.ingredients & basket) - used),
+                                                  len(e.ingredients & basket) / len(e.ingredients)))
+            candidates.remove(best)
+            name = " ".join(str(best.recipe.get("name")).lower().split())
+            if name in names:
+                continue
+            chosen.append(best)
+            names.add(name)
+            used |= best.ingredients & basket
+        if len(chosen) < min(MIN_RESULTS, self.results) or len(used) / len(basket) < self.min_basket_coverage:
+            return []
+        return chosen
+
+    @staticmethod
+    def _served(entry: IndexedRecipe, basket: Set[str]) -> Dict[str, Any]:
+        # The stored additional ingredients were relative to another basket: drop what this
+        # one has and add what the recipe needs that it lacks
+        lexicon = default_lexicon()
+        additional = [item for item in entry.recipe.get("additional_ingredients") or []
+                      if lexicon.ingredient_name(str(item)) not in basket]
+        listed = {lexicon.ingredient_name(str(item)) for item in additional}
+        additional += sorted(entry.ingredients - basket - listed)
+        return {**entry.recipe, "additional_ingredients": additional}
+
+    def __len__(self) -> int:
+        return len(self._recipes)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: Size, limits and hit/miss/eviction counters
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._recipes),
+            "ingredients": len(self._postings),
+            "max_recipes": self.max_recipes,
+            "min_coverage": self.min_coverage,
+            "min_basket_coverage": self.min_basket_coverage,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "added": self.added,
+            "evictions": self.evictions,
+            "persistent": self.path is not None,
+        }
+
+
+def format_recipes(recipes: Sequence[Dict[str, Any]]) -> str:
+    """Render structured recipes as the readable text ReceiptOCR prints."""
+    blocks = []
+    for number, recipe in enumerate(recipes, 1):
+        lines = [f"{number}. {recipe.get('name')}"]
+        if recipe.get("additional_ingredients"):
+            lines.append(f"   Additional ingredients: {', '.join(map(str, recipe['additional_ingredients']))}")
+        lines += [f"   {step}. {text}" for step, text in enumerate(recipe.get("instructions") or [], 1)]
+        details = [f"{label}: {recipe[key]}" for key, label in (("cooking_time", "Cooking time"),
+                                                                ("difficulty", "Difficulty")) if recipe.get(key)]
+        if details:
+            lines.append("   " + "  ".join(details))
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+def create_recipe_index(path: Optional[str] = None) -> Optional[RecipeIndex]:
+    """
+    Build the recipe index from RECIPE_INDEX_SIZE and RECIPE_INDEX_PATH (default data/recipes.sqlite3).
+    Args:
+        path (str, optional): Database file, overriding RECIPE_INDEX_PATH; "none" keeps the corpus in memory only
+    Returns:
+        RecipeIndex: The index, or None when RECIPE_INDEX_SIZE is 0
+    """
+    if RECIPE_INDEX_SIZE <= 0:
+        return None
+    if path is None:
+        path = os.getenv("RECIPE_INDEX_PATH", "data/recipes.sqlite3")
+    if path.lower() in ("", "none", "off"):
+        return RecipeIndex()
+    return RecipeIndex(path=path)
@@ -0,0 +1,117 @@
+import os
+import queue
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+
+from ocr_layout import OCRLayout
+
+try:
+    import tesserocr
+except ImportError:  # optional: falls back to the pytesseract subprocess path
+    tesserocr = None
+
+
+def pool_available() -> bool:
+    """Whether the tesserocr bindings needed for TesseractPool are installed."""
+    return tesserocr is not None
+
+
+class TesseractPool:
+    """
+    Pool of long-lived tesseract engines, driven in-process through the tesserocr C-API bindings.
+    Each engine loads its traineddata once at startup, and images are handed over as
+    in-memory pixel buffers, so there is no per-call fork, temp file or language-data reload.
+    tesserocr releases the GIL while recognizing, so `size` threads can OCR in parallel.
+    """
+
+    def __init__(self, size: Optional[int] = None, lang: str = "eng", psm: Optional[int] = None,
+                 tessdata_path: Optional[str] = None):
+        """
+        Args:
+            size (int, optional): Number of engines, defaults to OCR_POOL_SIZE or the CPU count
+            lang (str): Tesseract language(s), e.g. "eng" or "eng+deu"
+            psm (int, optional): Page segmentation mode (tesserocr.PSM value)
+            tessdata_path (str, optional): Directory containing the traineddata files
+        """
+        if tesserocr is None:
+            raise RuntimeError("TesseractPool requires the tesserocr package (pip install tesserocr)")
+        self.size = size or int(os.getenv("OCR_POOL_SIZE", "0")) or os.cpu_count() or 1
+        self._engines: "queue.Queue" = queue.Queue()
+        for _ in range(self.size):
+            kwargs: Dict[str, Any] = {"lang": lang}
+            if psm is not None:
+                kwargs["psm"] = psm
+            if tessdata_path:
+                kwargs["path"] = tessdata_path
+            self._engines.put(tesserocr.PyTessBaseAPI(**kwargs))
+
+    @contextmanager
+    def engine(self, timeout: Optional[float] = None) -> Iterator["tesserocr.PyTessBaseAPI"]:
+        """
+        Borrow an engine, blocking until one is free.
+        Args:
+            timeout (float, optional): Seconds to wait before raising queue.Empty
+        """
+        api = self._engines.get(timeout=timeout)
+        try:
+            yield api
+        finally:
+            api.Clear()
+            self._engines.put(api)
+
+    def extract_text(self, image: np.ndarray, timeout: Optional[float] = None) -> str:
+        """
+        OCR an in-memory image.
+        Args:
+            image (numpy.ndarray): Grayscale (H, W) or 3-channel (H, W, 3) uint8 image
+            timeout (float, optional): Seconds to wait for a free engine
+        Returns:
+            str: Extracted text
+        """
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+        with self.engine(timeout) as api:
+            api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+            return api.GetUTF8Text()
+
+    def extract_layout(self, image: np.ndarray, timeout: Optional[float] = None) -> OCRLayout:
+        """
+        OCR an in-memory image, keeping each word's bounding box.
+        Args:
+            image (numpy.ndarray): Grayscale (H, W) or 3-channel (H, W, 3) uint8 image
+            timeout (float, optional): Seconds to wait for a free engine
+        Returns:
+            OCRLayout: Words, boxes and reconstructed lines
+        """
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+        texts, boxes = [], []
+        with self.engine(timeout) as api:
+            api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+            api.Recognize()
+            level = tesserocr.RIL.WORD
+            for word in tesserocr.iterate_level(api.GetIterator(), level):
+                text = word.GetUTF8Text(level)
+                box = word.BoundingBox(level)
+                if text and text.strip() and box:
+                    texts.append(text.strip())
+                    boxes.append(box)
+        return OCRLayout(texts, boxes)
+
+    def close(self) -> None:
+        """Shut down every idle engine."""
+        while True:
+            try:
+                self._engines.get_nowait().End()
+            except queue.Empty:
+                break
+
+    def __enter__(self) -> "TesseractPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,18 @@
+import importlib
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def vercel_app(tmp_path_factory):
+    """
+    The Vercel handler module, imported once with a dummy OpenAI key and its SQLite files in a
+    temporary directory. No upstream client is created at import.
+    """
+    data = tmp_path_factory.mktemp("vercel")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("OPENAI_API_KEY", "dummy-key")
+        mp.setenv("RECEIPT_STORE_PATH", str(data / "receipts.sqlite3"))
+        mp.setenv("RECIPE_INDEX_PATH", str(data / "recipes.sqlite3"))
+        mp.setenv("RATE_LIMIT_PATH", str(data / "ratelimit.sqlite3"))
+        return importlib.import_module("vercel_app")
@@ -0,0 +1,77 @@
+import pytest
+
+from food_lexicon import (FoodLexicon, canonical_ingredient, classify_food, default_lexicon, edit_distance,
+                          food_item_names, parse_ingredients, tag_food)
+
+
+@pytest.mark.parametrize("name, ingredient", [
+    ("ORG BNLS CHKN BRST 2LB", "chicken breast"),
+    ("GRND BF 80/20", "ground beef"),
+    ("EGGS LG 12CT", "egg"),
+    ("BNNA", "banana"),
+    ("TORTILLA CHIPS", "chips"),
+    ("STRAWBERRYS", "strawberry"),
+])
+def test_abbreviations_and_plurals_reach_the_canonical_ingredient(name, ingredient):
+    assert canonical_ingredient(name) == ingredient
+    assert classify_food(name) is True
+
+
+def test_longest_phrase_wins_and_no_word_counts_twice():
+    # "dog" alone is non-food, but here it is part of "hot dog"
+    assert classify_food("HOT DOGS 8CT") is True
+    assert canonical_ingredient("HOT DOG") == "hot dog"
+    # "hot dog bun" is a longer phrase still
+    assert canonical_ingredient("HOT DOG BUNS") == "bun"
+    assert classify_food("DOG FOOD") is False
+
+
+@pytest.mark.parametrize("name, is_food", [("PAPER TOWELS", False), ("BAG FEE", False), ("ORGANIC", True),
+                                           ("XYZZY 123", None)])
+def test_classification(name, is_food):
+    assert classify_food(name) is is_food
+    assert default_lexicon().match(name).ingredient is None
+
+
+def test_ocr_digits_inside_words_are_read_as_letters():
+    match = default_lexicon().match("CH1CKEN")
+    assert (match.ingredient, match.fuzzy) == ("chicken", False)
+
+
+def test_typos_are_corrected_and_flagged():
+    match = default_lexicon().match("CHIKEN BREST")
+    assert (match.ingredient, match.fuzzy) == ("chicken breast", True)
+    # Ties go to food words
+    assert canonical_ingredient("peper") == "bell pepper"
+    # Fuzzy lookup can be turned off
+    assert FoodLexicon({"milk": ["milk"]}, max_edits=0).classify("MLIK") is None
+
+
+def test_ingredients_in_free_text():
+    text = "Fry the onions and garlic, then add chicken breast and a dog biscuit"
+    assert default_lexicon().ingredients_in(text) == ["onion", "garlic", "chicken breast"]
+
+
+def test_edit_distance():
+    assert edit_distance("kitten", "sitting") == 3
+    # An adjacent swap is one edit
+    assert edit_distance("ab", "ba") == 1
+    assert edit_distance("", "abc") == 3
+
+
+def test_parse_ingredients():
+    assert parse_ingredients("a: b, c\nd") == {"a": ["a", "b", "c"], "d": ["d"]}
+
+
+def test_food_item_names_are_canonical_and_deduplicated():
+    items = [{"name": "MLK", "is_food": True}, {"name": "WHL MILK", "is_food": True}, {"name": "BAG", "is_food": False}]
+    assert food_item_names(items) == ["milk"]
+
+
+def test_tag_food_overrides_the_llm_only_for_known_names():
+    data = tag_food({"items": [{"name": "BNNA", "is_food": False}, {"name": "MYSTERY", "is_food": True},
+                               {"name": "BAG", "is_food": True}]})
+    assert [item["is_food"] for item in data["items"]] == [True, True, False]
+    assert data["food_items"] == ["banana", "mystery"]
+    # Without items, the food_items the LLM listed are canonicalized
+    assert tag_food({"food_items": ["CHKN BRST", "milk"]})["food_items"] == ["chicken breast", "milk"]
@@ -0,0 +1,91 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_normalize import NormalizeConfig, normalize_image_array, normalize_image_bytes, open_normalized
+
+
+def encode(image, fmt="JPEG", orientation=None, **params) -> bytes:
+    buffer = io.BytesIO()
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        params["exif"] = exif
+    image.save(buffer, fmt, **params)
+    return buffer.getvalue()
+
+
+def noisy_photo(size=(3000, 2000)) -> Image.Image:
+    # Noise compresses badly, so the byte budget has something to do
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+
+
+def decoded(data: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(data))
+
+
+def test_large_photos_are_downscaled_to_grayscale_within_the_budget():
+    original = encode(noisy_photo(), quality=95)
+    config = NormalizeConfig(max_dimension=1000, max_bytes=400 * 1024)
+    normalized = normalize_image_bytes(original, config)
+    image = decoded(normalized)
+    assert (image.format, image.mode) == ("JPEG", "L")
+    assert max(image.size) == 1000
+    assert image.size[0] > image.size[1]
+    assert len(normalized) < len(original)
+
+
+def test_quality_steps_down_only_to_the_minimum():
+    config = NormalizeConfig(max_dimension=1000, max_bytes=1000, min_quality=50)
+    normalized = normalize_image_bytes(encode(noisy_photo(), quality=95), config)
+    # The budget can't be met, so the result is the minimum-quality encode rather than nothing
+    assert 1000 < len(normalized) <= len(encode(decoded(normalized).convert("L"), quality=55))
+
+
+def test_exif_orientation_is_applied():
+    # Stored landscape, tagged to display rotated a quarter turn
+    rotated = encode(Image.new("RGB", (400, 200), "white"), orientation=6)
+    image = open_normalized(rotated, NormalizeConfig())
+    assert image.size == (200, 400)
+    # Rotation alone is reason enough to re-encode
+    assert decoded(normalize_image_bytes(rotated, NormalizeConfig())).size == (200, 400)
+
+
+def test_a_smaller_upright_original_is_sent_as_it_is():
+    small = encode(noisy_photo((300, 200)).convert("L"), quality=30)
+    assert normalize_image_bytes(small, NormalizeConfig(start_quality=95)) == small
+
+
+def test_png_output_and_colour_can_be_kept():
+    original = encode(noisy_photo((800, 600)), quality=95)
+    normalized = normalize_image_bytes(original, NormalizeConfig(grayscale=False, format="PNG", max_dimension=200))
+    image = decoded(normalized)
+    assert (image.format, image.mode, max(image.size)) == ("PNG", "RGB", 200)
+
+
+@pytest.mark.parametrize("content, config", [
+    (encode(noisy_photo((800, 600))), NormalizeConfig(enabled=False)),
+    (b"not an image", NormalizeConfig()),
+])
+def test_disabled_or_undecodable_uploads_pass_through(content, config):
+    assert normalize_image_bytes(memoryview(content), config) == content
+
+
+def test_array_for_tesseract_is_bgr_or_grayscale():
+    red = encode(Image.new("RGB", (40, 30), (255, 0, 0)), "PNG")
+    colour = normalize_image_array(red, NormalizeConfig(grayscale=False))
+    assert colour.shape == (30, 40, 3)
+    assert tuple(colour[0, 0]) == (0, 0, 255)
+    assert normalize_image_array(red, NormalizeConfig()).shape == (30, 40)
+    assert normalize_image_array(b"not an image", NormalizeConfig()) is None
+
+
+def test_config_from_env(monkeypatch):
+    monkeypatch.setenv("IMAGE_NORMALIZE", "0")
+    monkeypatch.setenv("IMAGE_MAX_DIMENSION", "1600")
+    monkeypatch.setenv("IMAGE_FORMAT", "png")
+    config = NormalizeConfig.from_env()
+    assert (config.enabled, config.max_dimension, config.format) == (False, 1600, "PNG")
@@ -0,0 +1,98 @@
+import pytest
+from flask import Flask
+
+from metrics import (CONTENT_TYPE, REGISTRY, STAGE_SECONDS, Registry, RequestTrace, Sample, _request_stages,
+                     cache_samples, instrument_flask, timed)
+
+
+def test_counter_and_gauge_render_one_series_per_label_set():
+    registry = Registry()
+    counter = registry.counter("jobs_total", "Jobs", ["status"])
+    counter.inc(status="ok")
+    counter.inc(2, status="ok")
+    counter.inc(status='bad "input"')
+    gauge = registry.gauge("queue_depth", "Queued jobs")
+    gauge.set(5)
+    gauge.dec()
+    text = registry.render()
+    assert "# TYPE jobs_total counter" in text
+    assert 'jobs_total{status="ok"} 3' in text
+    assert 'jobs_total{status="bad \\"input\\""} 1' in text
+    assert "queue_depth 4" in text
+    assert counter.value(status="ok") == 3
+
+
+def test_labels_must_match_the_declared_names():
+    counter = Registry().counter("jobs_total", "Jobs", ["status"])
+    with pytest.raises(ValueError):
+        counter.inc(state="ok")
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "latency_seconds_sum 6.05" in lines
+    assert "latency_seconds_count 4" in lines
+    assert histogram.count() == 4
+
+
+def test_registering_a_metric_twice_reuses_it():
+    registry = Registry()
+    assert registry.counter("jobs_total", "Jobs") is registry.counter("jobs_total", "Jobs")
+
+
+def test_collectors_run_at_scrape_time_and_may_fail():
+    registry = Registry()
+    size = [1]
+    registry.register_collector("queue", lambda: [Sample("queue_size", "gauge", "Queue size", {}, size[0]),
+                                                  Sample("queue_unknown", "gauge", "Not known yet", {}, None)])
+    registry.register_collector("broken", lambda: [1 / 0])
+    size[0] = 7
+    text = registry.render()
+    assert "queue_size 7" in text
+    # Samples without a value are left out
+    assert "queue_unknown" not in text
+
+
+def test_cache_samples_label_each_tier():
+    samples = list(cache_samples({"image": {"hits": 3, "misses": 1, "evictions": 0, "hit_rate": 0.75, "size": 2}}))
+    assert Sample("receipt_cache_hits_total", "counter", "Cache hits", {"tier": "image"}, 3) in samples
+
+
+def test_timed_adds_to_the_current_requests_stages():
+    before = STAGE_SECONDS.count(stage="test_stage")
+    trace = RequestTrace("test", sample=False)
+    with timed("test_stage"):
+        pass
+    with timed("test_stage"):
+        pass
+    trace.finish(200)
+    assert STAGE_SECONDS.count(stage="test_stage") == before + 2
+    assert set(trace.stages) == {"test_stage"}
+    assert trace.status == 200 and trace.duration is not None
+    # Finished requests stop collecting stages
+    assert _request_stages.get() is None
+
+
+def test_flask_requests_are_counted_and_metrics_served():
+    app = Flask(__name__)
+
+    @app.route("/work")
+    def work():
+        return "ok"
+
+    instrument_flask(app)
+    requests_metric = REGISTRY.counter("receipt_http_requests_total", "")
+    before = requests_metric.value(endpoint="work", status=200)
+    client = app.test_client()
+    client.get("/work").close()
+    assert requests_metric.value(endpoint="work", status=200) == before + 1
+    response = client.get("/metrics")
+    assert response.content_type == CONTENT_TYPE
+    assert 'receipt_http_requests_total{endpoint="work",status="200"}' in response.get_data(as_text=True)
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+from ocr_layout import OCRLayout, Word
+from receipt_parser import parse_receipt
+
+# 10 px per character, 20 px line height; prices sit in a right-hand column and the scan is
+# slightly skewed, so each price is a few pixels lower than its item
+WORDS = [
+    Word("TOTAL", 0, 84, 50, 104),
+    Word("4.49", 300, 87, 340, 107),
+    Word("MILK", 0, 20, 40, 40),
+    Word("2.99", 300, 23, 340, 43),
+    Word("BREAD", 0, 50, 50, 70),
+    Word("1.50", 300, 53, 340, 73),
+    Word("-----", 0, 76, 50, 82),
+]
+
+
+def test_words_are_grouped_into_printed_lines():
+    layout = OCRLayout.from_words(WORDS)
+    assert layout.line_texts() == ["MILK 2.99", "BREAD 1.50", "-----", "TOTAL 4.49"]
+    assert len(layout) == len(WORDS)
+
+
+def test_text_keeps_prices_in_a_right_aligned_column():
+    lines = OCRLayout.from_words(WORDS).to_text().splitlines()
+    # The rule line carries nothing and is dropped
+    assert [line.split() for line in lines] == [["MILK", "2.99"], ["BREAD", "1.50"], ["TOTAL", "4.49"]]
+    assert len({line.index(line.split()[1]) for line in lines}) == 1
+    assert lines[0].index("2.99") == 30
+
+
+def test_wide_pages_are_squeezed_to_the_line_width():
+    layout = OCRLayout.from_words([Word("ITEM", 0, 0, 40, 20), Word("9.99", 2000, 0, 2040, 20)])
+    assert len(layout.to_text(max_width=48)) <= 48 + len("9.99")
+    assert layout.to_text(max_width=48).split() == ["ITEM", "9.99"]
+
+
+def test_tesseract_rows_without_words_are_skipped():
+    data = {"text": ["", "MILK", " ", "2.99"], "conf": [-1, 91, -1, "88.5"], "left": [0, 0, 0, 300],
+            "top": [0, 20, 20, 22], "width": [400, 40, 400, 40], "height": [200, 20, 20, 20]}
+    layout = OCRLayout.from_tesseract(data)
+    assert layout.texts == ["MILK", "2.99"]
+    assert layout.boxes.tolist() == [[0, 20, 40, 40], [300, 22, 340, 42]]
+
+
+def test_vision_annotations_skip_the_full_text_entry():
+    def annotation(text, x0, y0, x1, y1):
+        vertices = [SimpleNamespace(x=x, y=y) for x, y in ((x0, y0), (x1, y0), (x1, y1), (x0, y1))]
+        return SimpleNamespace(description=text, bounding_poly=SimpleNamespace(vertices=vertices))
+
+    no_box = SimpleNamespace(description="?", bounding_poly=SimpleNamespace(vertices=[]))
+    annotations = [annotation("MILK 2.99", 0, 0, 340, 40), annotation("MILK", 0, 20, 40, 40),
+                   annotation("2.99", 300, 20, 340, 40), no_box]
+    assert OCRLayout.from_vision(annotations).line_texts() == ["MILK 2.99"]
+
+
+def test_parser_reads_lines_rebuilt_from_the_layout():
+    result = parse_receipt(layout=OCRLayout.from_words(WORDS))
+    assert [(item["name"], item["price"]) for item in result.data["items"]] == [("MILK", "2.99"), ("BREAD", "1.50")]
+    assert result.data["total"] == "4.49"
+
+
+def test_empty_layout():
+    layout = OCRLayout([], [])
+    assert (layout.lines(), layout.to_text()) == ([], "")
+    assert layout.to_dict() == {"words": [], "boxes": [], "lines": []}
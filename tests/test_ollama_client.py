@@ -0,0 +1,99 @@
+import json
+import time
+
+import pytest
+import requests
+
+from benchmarks.stubs import OllamaStubHandler, start_stub_server
+from ollama_client import OllamaClient
+
+
+class BrokenStreamHandler(OllamaStubHandler):
+    """Streams one token, a line that is not JSON, then an error line as Ollama does mid-generation."""
+
+    def do_POST(self):
+        self.read_json()
+        self.start_chunked("application/x-ndjson")
+        self._write_chunk(json.dumps({"response": "partial ", "done": False}) + "\n")
+        self._write_chunk("not json\n")
+        self._write_chunk(json.dumps({"error": "model 'llama3' not found"}) + "\n")
+        self._write_chunk(json.dumps({"response": "never read", "done": False}) + "\n")
+        self.end_chunked()
+
+
+@pytest.fixture
+def stub():
+    """Start an Ollama stub with the given settings; every server started is shut down afterwards."""
+    servers = []
+
+    def start(handler=OllamaStubHandler, **settings):
+        server, url = start_stub_server(handler, **settings)
+        servers.append(server)
+        return server, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_streamed_tokens_arrive_in_order(stub):
+    _, url = stub()
+    with OllamaClient(url) as client:
+        tokens = list(client.stream_generate("llama3", "Read this receipt"))
+    assert tokens == ["stub ", "reply ", "from ", "llama3: ", "Read ", "this ", "receipt "]
+
+
+def test_generate_joins_the_stream_and_reads_non_streamed_replies(stub):
+    _, url = stub(repeat=2)
+    with OllamaClient(url) as client:
+        assert client.generate("llama3", "hi") == "stub reply from llama3: hi " * 2
+        # stream=False gets one JSON object back, which reads as a single line
+        assert client.generate("llama3", "hi", stream=False) == "stub reply from llama3: hi " * 2
+
+
+def test_5xx_responses_are_retried(stub):
+    # With seed 1 the first request draws below the error rate and the second above it
+    server, url = stub(error_rate=0.5, error_status=503, seed=1)
+    with OllamaClient(url, backoff_factor=0) as client:
+        assert client.generate("llama3", "hi") == "stub reply from llama3: hi "
+    assert (server.requests, server.errors) == (2, 1)
+
+
+def test_a_persistent_5xx_raises_after_the_retries(stub):
+    server, url = stub(error_rate=1.0, error_status=502)
+    with OllamaClient(url, retries=2, backoff_factor=0) as client:
+        with pytest.raises(requests.exceptions.HTTPError) as failed:
+            client.generate("llama3", "hi")
+    assert failed.value.response.status_code == 502
+    assert server.requests == 3
+
+
+def test_an_error_line_in_the_stream_raises(stub):
+    _, url = stub(BrokenStreamHandler)
+    received = []
+    with OllamaClient(url) as client:
+        with pytest.raises(requests.exceptions.RequestException, match="not found"):
+            for token in client.stream_generate("llama3", "hi"):
+                received.append(token)
+    # Tokens before the error were yielded and the undecodable line skipped
+    assert received == ["partial "]
+
+
+def test_read_timeout_applies_between_chunks_not_to_the_whole_generation(stub):
+    _, url = stub(token_delay=0.03, repeat=3)
+    with OllamaClient(url, timeout=(1, 0.3)) as client:
+        started = time.monotonic()
+        text = client.generate("llama3", "hi")
+        # Longer in total than the read timeout, but no gap between tokens is
+        assert time.monotonic() - started > 0.3
+        assert text.count("stub") == 3
+        # A per-call timeout shorter than the gap between tokens fails the call
+        with pytest.raises(requests.exceptions.RequestException):
+            client.generate("llama3", "hi", timeout=(1, 0.01))
+
+
+def test_unreachable_server_raises_connection_error():
+    with OllamaClient("http://127.0.0.1:9", retries=0, timeout=(0.5, 0.5)) as client:
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.generate("llama3", "hi")
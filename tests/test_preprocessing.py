@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+import pytest
+
+import preprocessing
+from preprocessing import (PROFILES, crop_receipt, deskew, estimate_skew, register_profile, run_profile,
+                           run_profile_batch)
+from receipt_ocr import ReceiptOCR
+
+
+def receipt_photo(angle=0.0):
+    """BGR photo of a white receipt with rows of dark "text" on a dark table, tilted by `angle` degrees."""
+    paper = np.full((700, 400), 255, np.uint8)
+    for y in range(40, 660, 30):
+        paper[y:y + 8, 30:370 - (y % 90)] = 0
+    photo = np.full((1000, 800), 40, np.uint8)
+    photo[150:850, 200:600] = paper
+    if angle:
+        matrix = cv2.getRotationMatrix2D((400, 500), angle, 1.0)
+        photo = cv2.warpAffine(photo, matrix, (800, 1000), borderValue=40)
+    return cv2.cvtColor(photo, cv2.COLOR_GRAY2BGR)
+
+
+def test_crop_keeps_only_the_paper():
+    gray = cv2.cvtColor(receipt_photo(), cv2.COLOR_BGR2GRAY)
+    cropped = crop_receipt(gray)
+    height, width = cropped.shape
+    # The paper plus a small margin
+    assert 700 <= height <= 740 and 400 <= width <= 440
+    # Nothing that looks like a receipt: the image is left alone
+    blank = np.full((300, 200), 255, np.uint8)
+    assert crop_receipt(blank) is blank
+
+
+@pytest.mark.parametrize("angle", [-6.0, 4.0])
+def test_deskew_levels_tilted_text(angle):
+    gray = cv2.cvtColor(receipt_photo(angle), cv2.COLOR_BGR2GRAY)
+    assert abs(abs(estimate_skew(gray)) - abs(angle)) < 0.5
+    assert abs(estimate_skew(deskew(gray))) < 0.5
+
+
+def test_level_text_is_not_rotated():
+    gray = cv2.cvtColor(receipt_photo(), cv2.COLOR_BGR2GRAY)
+    assert deskew(gray) is gray
+
+
+@pytest.mark.parametrize("profile", sorted(PROFILES))
+def test_profiles_binarize_and_time_every_stage(profile):
+    processed, timings = run_profile(receipt_photo(), profile)
+    assert processed.ndim == 2 and processed.dtype == np.uint8
+    # Cropped, so tesseract sees fewer pixels than the photo has
+    assert processed.size < 1000 * 800
+    assert list(timings) == [name for name, _ in PROFILES[profile]]
+    assert all(ms >= 0 for ms in timings.values())
+
+
+def test_unknown_profile_is_refused():
+    with pytest.raises(ValueError, match="Unknown preprocessing profile"):
+        run_profile(receipt_photo(), "sharpest")
+
+
+def test_profiles_can_be_added_and_are_the_default_when_configured(monkeypatch):
+    monkeypatch.setattr(preprocessing, "PROFILES", dict(PROFILES))
+    register_profile("invert", [("grayscale", preprocessing.grayscale), ("invert", cv2.bitwise_not)])
+    monkeypatch.setattr(preprocessing, "DEFAULT_PROFILE", "invert")
+    processed, timings = run_profile(receipt_photo())
+    assert list(timings) == ["grayscale", "invert"]
+    assert processed[0, 0] == 255 - 40
+
+
+def test_batches_keep_their_order():
+    images = [receipt_photo(), np.zeros((50, 60, 3), np.uint8), receipt_photo(3.0)]
+    results = run_profile_batch(images, "fast", workers=2)
+    assert [result[0].shape for result in results] == [run_profile(image, "fast")[0].shape for image in images]
+    assert run_profile_batch([], "fast") == []
+
+
+def test_receipt_ocr_takes_a_profile_per_call(tmp_path, monkeypatch):
+    # ReceiptOCR keeps its debug images in the working directory
+    monkeypatch.chdir(tmp_path)
+    ocr = ReceiptOCR(preprocess_profile="quality")
+    ocr.preprocess_image(receipt_photo(), "fast")
+    assert list(ocr.last_preprocess_timings) == [name for name, _ in PROFILES["fast"]]
+    ocr.preprocess_image(receipt_photo())
+    assert list(ocr.last_preprocess_timings) == [name for name, _ in PROFILES["quality"]]
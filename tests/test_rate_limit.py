@@ -0,0 +1,163 @@
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+import rate_limit
+from rate_limit import (AdmissionController, InProcessRateLimiter, RateLimited, SQLiteRateLimiter, client_key,
+                        create_rate_limiter, protect_flask)
+
+
+class Clock:
+    """Stands in for time.monotonic and time.time; advanced by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    monkeypatch.setattr(rate_limit.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def limiter(request, tmp_path):
+    if request.param == "memory":
+        return InProcessRateLimiter(rate=1, burst=2)
+    return SQLiteRateLimiter(tmp_path / "ratelimit.sqlite3", rate=1, burst=2)
+
+
+def test_bucket_allows_a_burst_then_refills(limiter, clock):
+    assert limiter.acquire("alice") == 0
+    assert limiter.acquire("alice") == 0
+    assert limiter.acquire("alice") == pytest.approx(1.0)
+    # Other clients have buckets of their own
+    assert limiter.acquire("bob") == 0
+    clock.now += 0.5
+    assert limiter.acquire("alice") == pytest.approx(0.5)
+    clock.now += 0.5
+    assert limiter.acquire("alice") == 0
+    # A long rest refills only up to the burst
+    clock.now += 60
+    assert [limiter.acquire("alice") for _ in range(3)][-1] > 0
+    assert (limiter.stats()["allowed"], limiter.stats()["limited"]) == (6, 3)
+    assert limiter.stats()["clients"] == 2
+
+
+def test_check_raises_with_retry_after(clock):
+    limiter = InProcessRateLimiter(rate=0.5, burst=1)
+    limiter.check("alice")
+    with pytest.raises(RateLimited) as limited:
+        limiter.check("alice")
+    assert limited.value.status == 429
+    assert limited.value.headers() == {"Retry-After": "2"}
+
+
+def test_sqlite_buckets_are_shared_between_limiters(tmp_path, clock):
+    path = tmp_path / "ratelimit.sqlite3"
+    first, second = SQLiteRateLimiter(path, rate=1, burst=1), SQLiteRateLimiter(path, rate=1, burst=1)
+    assert first.acquire("alice") == 0
+    assert second.acquire("alice") > 0
+
+
+def test_memory_limiter_forgets_the_least_recent_client(clock):
+    limiter = InProcessRateLimiter(rate=1, burst=1, max_clients=2)
+    for key in ("alice", "bob", "carol"):
+        limiter.acquire(key)
+    assert limiter.stats()["clients"] == 2
+    # Forgotten, so alice starts again with a full bucket
+    assert limiter.acquire("alice") == 0
+
+
+def test_limiter_settings_are_checked():
+    with pytest.raises(ValueError):
+        InProcessRateLimiter(rate=0)
+    with pytest.raises(ValueError):
+        create_rate_limiter("redis")
+    assert create_rate_limiter("none") is None
+    assert create_rate_limiter("memory", rate=2).rate == 2
+
+
+def test_client_key(monkeypatch):
+    monkeypatch.setattr(rate_limit, "API_KEYS", frozenset({"secret"}))
+    forwarded = {"X-Forwarded-For": "203.0.113.7, 10.0.0.1"}
+    assert client_key(forwarded, "10.0.0.1") == "ip:10.0.0.1"
+    assert client_key(forwarded, "10.0.0.1", trust_forwarded=True) == "ip:203.0.113.7"
+    assert client_key({}, None, trust_forwarded=True) == "ip:unknown"
+    key = client_key({"X-API-Key": "secret"}, "10.0.0.1")
+    assert key.startswith("key:") and "secret" not in key
+    # Unknown keys are ignored
+    assert client_key({"X-API-Key": "guess"}, "10.0.0.1") == "ip:10.0.0.1"
+
+
+def test_admission_holds_a_busy_client_to_its_fair_share():
+    admission = AdmissionController(capacity=4, queue_timeout=0.1)
+    # Alone, alice may use the whole capacity
+    held = [admission.admit("alice"), admission.admit("alice")]
+    admission.admit("bob")
+    assert admission.stats()["fair_share"] == 2
+    # With bob running, alice's third waits even though a slot is free...
+    with pytest.raises(RateLimited) as refused:
+        admission.admit("alice")
+    assert refused.value.reason == "overload"
+    # ...and bob still gets a second
+    admission.admit("bob")
+    admission.release("alice", held[0])
+    assert admission.stats()["running"] == 3
+
+
+def test_a_waiting_request_is_admitted_when_a_slot_frees_up():
+    admission = AdmissionController(capacity=1, queue_timeout=5)
+    admitted_at = admission.admit("alice")
+    waiter = threading.Thread(target=admission.admit, args=("bob",))
+    waiter.start()
+    while not admission.stats()["waiting"]:
+        time.sleep(0.005)
+    admission.release("alice", admitted_at)
+    waiter.join()
+    stats = admission.stats()
+    assert (stats["running"], stats["queued"], stats["rejected"]) == (1, 1, 0)
+
+
+def test_admission_refuses_when_the_queue_is_full_or_upstream_is_busy():
+    admission = AdmissionController(capacity=1, queue_size=0)
+    admission.admit("alice")
+    with pytest.raises(RateLimited):
+        admission.admit("bob")
+    busy = AdmissionController(capacity=1, queue_timeout=0.05, upstream_waiting=lambda: 16, max_upstream_waiting=16)
+    with pytest.raises(RateLimited):
+        busy.admit("alice")
+    assert busy.stats()["rejected"] == 1
+
+
+def test_protect_flask_answers_429_and_releases_admissions():
+    app = Flask(__name__)
+
+    @app.route("/work")
+    def work():
+        return "ok"
+
+    @app.route("/queue")
+    def queue():
+        return "queued"
+
+    admission = AdmissionController(capacity=1, queue_size=0)
+    protect_flask(app, ["work", "queue"], InProcessRateLimiter(rate=0.1, burst=2), admission, queued=["queue"])
+    client = app.test_client()
+    client.get("/work").close()
+    # The slot was given back once the response was sent
+    assert admission.stats()["running"] == 0
+    # Queued endpoints are rate limited but not admitted
+    client.get("/queue").close()
+    assert admission.stats()["admitted"] == 1
+    refused = client.get("/work")
+    assert refused.status_code == 429
+    assert refused.headers["Retry-After"] == "10"
+    assert "Rate limit exceeded" in refused.get_json()["error"]
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import threading
+
+import pytest
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from rate_limit import ASGIProtection, AdmissionController, InProcessRateLimiter
+from receipt_async import AsyncReceiptProcessor
+from receipt_cache import LRUCache, ReceiptCache
+from receipt_core import OCRBackend, ReceiptProcessor, StubLLM
+from receipt_prompts import RECIPE_SYSTEM_PROMPT
+
+RECEIPT = {"merchant": "Corner Shop", "items": [{"name": "BREAD", "price": 2.5, "is_food": True}], "total": 2.5,
+           "food_items": ["bread"]}
+RECIPES = {"recipes": [{"name": "Toast", "instructions": ["Toast the bread"]}]}
+
+
+class FakeOCR(OCRBackend):
+    name = "fake-ocr"
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def extract_text(self, content, timeout=None):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        # Too little for the local parser, so the LLM formats it
+        return "smudged receipt"
+
+
+def reply(messages):
+    return json.dumps(RECIPES if messages[0]["content"] == RECIPE_SYSTEM_PROMPT else RECEIPT)
+
+
+def async_processor(ocr=None):
+    cache = ReceiptCache(LRUCache(), LRUCache(), LRUCache())
+    return AsyncReceiptProcessor(ReceiptProcessor([ocr or FakeOCR()], [StubLLM(reply)], cache=cache), threads=4)
+
+
+def collect(iterator):
+    async def run():
+        return [item async for item in iterator]
+    return asyncio.run(run())
+
+
+def test_process_runs_the_shared_pipeline_off_the_event_loop():
+    pipeline = async_processor()
+    loop_thread = threading.get_ident()
+    threads = []
+    pipeline.processor.ocr.backends[0].extract_text = lambda content, timeout=None: (
+        threads.append(threading.get_ident()) or "smudged receipt")
+    data = asyncio.run(pipeline.process(b"image"))
+    assert data["merchant"] == "Corner Shop"
+    assert threads and threads[0] != loop_thread
+    # Cached by image bytes like every other entry point
+    assert asyncio.run(pipeline.process(b"image")) is data
+
+
+def test_stream_yields_the_receipt_then_its_recipes():
+    events = collect(async_processor().stream(b"image"))
+    assert [event["stage"] for event in events] == ["receipt", "recipes"]
+    assert events[1]["data"][0]["name"] == "Toast"
+
+
+def test_stream_raises_when_the_receipt_fails():
+    with pytest.raises(ValueError, match="Failed to process receipt"):
+        collect(async_processor(FakeOCR(RuntimeError("unreadable"))).stream(b"image"))
+
+
+def test_events_come_from_the_processor_in_order():
+    events = collect(async_processor().events(b"image"))
+    names = [name for name, _ in events]
+    assert names[:2] == ["ocr", "receipt"]
+    assert names[-2:] == ["recipes", "done"]
+    assert "".join(data for name, data in events if name == "recipe_token") == json.dumps(RECIPES)
+
+
+def test_errors_in_the_generator_reach_the_consumer():
+    pipeline = async_processor(FakeOCR(ConnectionError("vision down")))
+    with pytest.raises(ConnectionError, match="vision down"):
+        collect(pipeline.events(b"image"))
+
+
+def test_a_consumer_that_stops_early_closes_the_generator():
+    closed = threading.Event()
+
+    def numbers():
+        try:
+            for i in range(1000):
+                yield i
+        finally:
+            closed.set()
+
+    async def first_two():
+        items = []
+        async for item in async_processor().iterate(numbers):
+            items.append(item)
+            if len(items) == 2:
+                break
+        return items
+
+    assert asyncio.run(first_two()) == [0, 1]
+    assert closed.wait(5)
+
+
+def asgi_get(app, path, headers=()):
+    """Send one GET through an ASGI app; returns (status, headers, body)."""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+             "headers": [(name.lower().encode(), value.encode()) for name, value in headers],
+             "client": ("203.0.113.7", 50000), "server": ("testserver", 80)}
+    asyncio.run(app(scope, receive, send))
+    start = messages[0]
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return start["status"], dict((k.decode(), v.decode()) for k, v in start["headers"]), body
+
+
+def protected_app(limiter=None, admission=None):
+    async def work(request):
+        return PlainTextResponse("ok")
+
+    async def health(request):
+        return PlainTextResponse("up")
+
+    routes = [Route("/work", work), Route("/health", health)]
+    return Starlette(routes=routes, middleware=[
+        Middleware(ASGIProtection, routes=routes, endpoints=["work"], limiter=limiter, admission=admission)])
+
+
+def test_asgi_protection_answers_429_with_retry_after():
+    app = protected_app(limiter=InProcessRateLimiter(rate=0.1, burst=1))
+    assert asgi_get(app, "/work")[0] == 200
+    status, headers, body = asgi_get(app, "/work")
+    assert status == 429
+    assert headers["retry-after"] == "10"
+    assert "Rate limit exceeded" in json.loads(body)["error"]
+    # Routes not named are left alone
+    assert asgi_get(app, "/health")[0] == 200
+
+
+def test_asgi_protection_releases_the_admission_once_the_response_is_sent():
+    admission = AdmissionController(capacity=1, queue_size=0)
+    app = protected_app(admission=admission)
+    assert asgi_get(app, "/work")[0] == 200
+    assert asgi_get(app, "/work")[0] == 200
+    stats = admission.stats()
+    assert (stats["admitted"], stats["running"]) == (2, 0)
+    admission.admit("ip:10.0.0.1")
+    # Full, and nothing may queue
+    assert asgi_get(app, "/work")[0] == 429
@@ -0,0 +1,109 @@
+import json
+import re
+
+import pytest
+
+from receipt_batch import (combined_food_items, format_receipt_texts, pack_texts, parse_batch_response,
+                           process_receipt_batch)
+from receipt_cache import LRUCache, ReceiptCache, hash_bytes, text_key
+
+
+def receipt_text(n: int) -> str:
+    return f"STORE {n}\nMILK 2.99\nBREAD 1.50\nTOTAL {n}.49"
+
+
+class FakeCompletions:
+    """Answers batched prompts with one receipt per "STORE <n>" it finds, in order."""
+
+    def __init__(self, reply=None):
+        self.reply = reply
+        self.prompts = []
+
+    def __call__(self, messages):
+        prompt = messages[-1]["content"]
+        self.prompts.append(prompt)
+        if self.reply is not None:
+            return self.reply
+        stores = re.findall(r"STORE (\d+)", prompt)
+        return json.dumps({"receipts": [{"store_name": f"Store {n}", "items": [{"name": "Milk", "price": 2.99}]}
+                                        for n in stores]})
+
+
+@pytest.fixture
+def cache():
+    return ReceiptCache(LRUCache(), LRUCache(), LRUCache())
+
+
+def format_one(text):
+    return {"store_name": "single", "items": [], "food_items": []}
+
+
+def test_pack_texts_limits_count_and_characters():
+    assert pack_texts(["a"] * 5, max_receipts=2, max_chars=100) == [[0, 1], [2, 3], [4]]
+    assert pack_texts(["a" * 60, "b" * 60, "c" * 30], max_receipts=8, max_chars=100) == [[0], [1, 2]]
+    # A receipt longer than the budget still gets a group of its own
+    assert pack_texts(["a" * 500, "b"], max_receipts=8, max_chars=100) == [[0], [1]]
+    assert pack_texts([]) == []
+
+
+def test_parse_batch_response_tolerates_prose_around_the_json():
+    reply = 'Here you go:\n```json\n{"receipts": [{"total": 1}, {"total": 2}]}\n```'
+    assert parse_batch_response(reply, 2) == [{"total": 1}, {"total": 2}]
+
+
+@pytest.mark.parametrize("reply", ['{"receipts": [{"total": 1}]}', '{"receipts": [{}, 2]}', "[]", "no json here"])
+def test_parse_batch_response_refuses_replies_of_the_wrong_shape(reply):
+    with pytest.raises(ValueError):
+        parse_batch_response(reply, 2)
+
+
+def test_receipts_are_packed_into_one_completion(cache):
+    complete = FakeCompletions()
+    texts = [receipt_text(n) for n in range(3)]
+    results = format_receipt_texts(texts, cache, complete, format_one)
+    assert len(complete.prompts) == 1
+    assert [result["store_name"] for result in results] == ["Store 0", "Store 1", "Store 2"]
+    assert results[0]["receipt_id"] == text_key(texts[0])
+    assert results[0]["food_items"] == ["milk"]
+    assert cache.text.get(text_key(texts[2]))["store_name"] == "Store 2"
+
+
+def test_cached_and_locally_parsed_receipts_skip_the_completion(cache):
+    complete = FakeCompletions()
+    cached, parsed, sent = receipt_text(0), receipt_text(1), receipt_text(2)
+    cache.text.set(text_key(cached), {"store_name": "cached"})
+
+    def parse(text):
+        return {"store_name": "parsed"} if text == parsed else None
+
+    results = format_receipt_texts([cached, parsed, sent], cache, complete, format_one, parse)
+    assert [result["store_name"] for result in results] == ["cached", "parsed", "single"]
+    # A single leftover receipt goes through format_one rather than a packed prompt
+    assert complete.prompts == []
+
+
+def test_unsplittable_reply_falls_back_to_one_receipt_per_call(cache):
+    complete = FakeCompletions(reply='{"receipts": []}')
+    results = format_receipt_texts([receipt_text(0), receipt_text(1)], cache, complete, format_one)
+    assert len(complete.prompts) == 1
+    assert [result["store_name"] for result in results] == ["single", "single"]
+
+
+def test_process_receipt_batch_reports_each_image(cache):
+    def ocr(contents):
+        return [ValueError("blurry") if content == b"blurry" else receipt_text(len(content)) for content in contents]
+
+    cache.image.set(hash_bytes(b"seen"), {"store_name": "seen before"})
+    results = process_receipt_batch([b"seen", b"blurry", b"one", b"three"], cache, ocr, FakeCompletions(),
+                                    lambda text: None)
+    assert results[0] == {"success": True, "processed_data": {"store_name": "seen before"}}
+    assert results[1] == {"success": False, "error": "blurry"}
+    assert [result["processed_data"]["store_name"] for result in results[2:]] == ["Store 3", "Store 5"]
+
+
+def test_combined_food_items_puts_the_most_common_first():
+    receipts = [{"food_items": ["milk", "bread"]}, {"food_items": ["milk", "eggs"]}, {"food_items": None}, {}]
+    assert combined_food_items(receipts)[0] == "milk"
+    # Names are canonicalized before they are counted
+    assert sorted(combined_food_items(receipts)) == ["bread", "egg", "milk"]
+    assert combined_food_items(receipts, limit=1) == ["milk"]
@@ -0,0 +1,118 @@
+import pytest
+
+import receipt_cache
+from receipt_cache import (LRUCache, NullCache, ReceiptCache, SQLiteCache, create_cache, ingredient_key,
+                           normalize_ocr_text, text_key)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_cache(request, tmp_path):
+    def make(max_entries=1024, ttl=None):
+        if request.param == "memory":
+            return LRUCache(max_entries, ttl)
+        return SQLiteCache(tmp_path / "cache.sqlite3", max_entries=max_entries, ttl=ttl)
+    return make
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(receipt_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_get_returns_what_was_set(make_cache):
+    cache = make_cache()
+    assert cache.get("a") is None
+    cache.set("a", {"items": [1, 2]})
+    assert cache.get("a") == {"items": [1, 2]}
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_expire_after_ttl(make_cache, clock):
+    cache = make_cache(ttl=10)
+    cache.set("a", 1)
+    clock[0] += 9
+    assert cache.get("a") == 1
+    clock[0] += 2
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.stats()["evictions"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(make_cache, clock):
+    cache = make_cache(max_entries=2)
+    cache.set("a", 1)
+    clock[0] += 1
+    cache.set("b", 2)
+    clock[0] += 1
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a") == 1
+    clock[0] += 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert cache.stats()["evictions"] == 1
+
+
+def test_clear_empties_the_cache(make_cache):
+    cache = make_cache()
+    cache.set("a", 1)
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.get("a") is None
+
+
+def test_sqlite_caches_share_a_file(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    SQLiteCache(path).set("a", [1])
+    assert SQLiteCache(path).get("a") == [1]
+    assert SQLiteCache(path, table="other").get("a") is None
+
+
+def test_sqlite_rejects_unsafe_table_names(tmp_path):
+    with pytest.raises(ValueError):
+        SQLiteCache(tmp_path / "cache.sqlite3", table="cache; DROP TABLE cache")
+
+
+def test_null_cache_stores_nothing():
+    cache = NullCache()
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_create_cache_reads_the_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv("RECEIPT_CACHE_BACKEND", "SQLite")
+    monkeypatch.setenv("RECEIPT_CACHE_PATH", str(tmp_path / "env.sqlite3"))
+    monkeypatch.setenv("RECEIPT_CACHE_TTL", "30")
+    monkeypatch.setenv("RECEIPT_CACHE_SIZE", "5")
+    cache = create_cache("results")
+    assert isinstance(cache, SQLiteCache)
+    assert (cache.table, cache.ttl, cache.max_entries) == ("results", 30.0, 5)
+    assert isinstance(create_cache("results", "memory"), LRUCache)
+    assert isinstance(create_cache("results", "none"), NullCache)
+    with pytest.raises(ValueError):
+        create_cache("results", "redis")
+
+
+def test_ocr_text_keys_ignore_case_and_spacing():
+    assert normalize_ocr_text("  MILK   2.99\n\n BREAD\t1.50 ") == "milk 2.99\nbread 1.50"
+    assert text_key("MILK 2.99\nBREAD 1.50") == text_key("milk  2.99\n\nbread 1.50\n")
+    assert text_key("MILK 2.99") != text_key("MILK 2.98")
+
+
+def test_ingredient_keys_ignore_order_and_duplicates():
+    assert ingredient_key(["Tomatoes", "basil", "basil"]) == ingredient_key(["Basil", " tomatoes "])
+    assert ingredient_key(["basil"]) != ingredient_key(["basil", "garlic"])
+
+
+def test_receipt_cache_reports_every_tier():
+    cache = ReceiptCache(LRUCache(), LRUCache(), NullCache())
+    cache.image.set("a", 1)
+    stats = cache.stats()
+    assert stats["image"]["size"] == 1
+    assert stats["recipes"]["backend"] == "NullCache"
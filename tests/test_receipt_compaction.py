@@ -0,0 +1,91 @@
+import pytest
+
+from receipt_compaction import chunk_lines, compact_lines, compact_receipt, is_boilerplate, merge_chunk_results
+from receipt_prompts import count_tokens
+
+RECEIPT = """\
+FRESH MART
+FRESH MART
+2024-03-15  14:32
+--------------------------
+MILK 2%            3.49
+MILK 2%            3.49
+BONUS POINTS CHICKEN     5.99
+SUBTOTAL          12.97
+TOTAL             12.97
+VISA ************1234
+AUTH CODE 012345
+0123456789012
+Tell us how we did! www.freshmart.com/survey
+Thank you, come again
+"""
+
+
+@pytest.mark.parametrize("line", ["==========", "0123456789012", "|||| |||| ||||", "VISA ************1234",
+                                  "AUTH CODE 012345", "Visit www.example.com", "Thank you for shopping"])
+def test_boilerplate_lines(line):
+    assert is_boilerplate(line)
+
+
+@pytest.mark.parametrize("line", ["MILK 2% 3.49", "TOTAL 12.97", "2024-03-15 14:32",
+                                  "BONUS POINTS CHICKEN 5.99", "Member savings total 1.00"])
+def test_lines_that_matter_are_kept(line):
+    assert not is_boilerplate(line)
+
+
+@pytest.mark.parametrize("line", ["AID: A0000000031010", "AID A0000000031010", "TVR 0000008000", "TID 12345678",
+                                  "MID: 123456", "SEQ NO: 0012", "TERMINAL ID 00123"])
+def test_payment_terminal_fields(line):
+    assert is_boilerplate(line)
+
+
+def test_items_named_like_terminal_fields_are_kept():
+    text = "KROGER\nBAND-AID BANDAGES 4.99\nMID ATLANTIC MILK 3.49\nTID BITS\nSUBTOTAL 8.48\nTOTAL 8.48"
+    assert compact_lines(text) == ["KROGER", "BAND-AID BANDAGES 4.99", "MID ATLANTIC MILK 3.49", "TID BITS",
+                                   "SUBTOTAL 8.48", "TOTAL 8.48"]
+
+
+def test_compact_lines_drops_noise_and_repeated_banners():
+    assert compact_lines(RECEIPT) == [
+        "FRESH MART",
+        "2024-03-15  14:32",
+        # The same item bought twice stays twice
+        "MILK 2%  3.49",
+        "MILK 2%  3.49",
+        "BONUS POINTS CHICKEN  5.99",
+        "SUBTOTAL  12.97",
+        "TOTAL  12.97",
+    ]
+
+
+def test_compact_receipt_counts_what_it_saved():
+    compacted = compact_receipt(RECEIPT)
+    assert compacted.chunks == [compacted.text]
+    assert (compacted.lines_before, compacted.lines_after) == (14, 7)
+    assert compacted.tokens_after < compacted.tokens_before
+
+
+def test_long_receipts_are_chunked_between_lines():
+    lines = [f"ITEM NUMBER {i}  {i}.99" for i in range(200)]
+    chunks = chunk_lines(lines, budget=100)
+    assert len(chunks) > 1
+    assert "\n".join(chunks).splitlines() == lines
+    assert all(count_tokens(chunk) <= 100 for chunk in chunks)
+    # A line longer than the budget gets a chunk of its own rather than being split
+    assert chunk_lines(["A" * 1000, "B"], budget=10) == ["A" * 1000, "B"]
+    assert compact_receipt("\n".join(lines), budget=100).chunks == chunks
+
+
+def test_chunk_results_merge_into_one_receipt():
+    parts = [
+        {"merchant": "FRESH MART", "datetime": "2024-03-15", "items": [{"name": "MILK"}], "food_items": ["milk"],
+         "subtotal": None, "total": None},
+        {"merchant": None, "items": [{"name": "CHEESE"}], "food_items": ["cheese", "milk"], "subtotal": "9.48"},
+        {"merchant": "IGNORED", "items": None, "total": "10.24", "tax": "0.76"},
+    ]
+    assert merge_chunk_results(parts) == {
+        "merchant": "FRESH MART", "datetime": "2024-03-15",
+        "items": [{"name": "MILK"}, {"name": "CHEESE"}],
+        "subtotal": "9.48", "tax": "0.76", "total": "10.24",
+        "food_items": ["milk", "cheese"],
+    }
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from receipt_cache import LRUCache, ReceiptCache
+from receipt_core import (OCRBackend, OpenAIChat, ReceiptProcessor, StubLLM, TesseractOCR, VisionOCR,
+                          create_llm_backend, create_ocr_backend, create_processor)
+from receipt_core.processor import _names
+from receipt_parser import parse_receipt
+
+RECEIPT = {"merchant": "Corner Shop", "items": [{"name": "RICE", "price": 1.8, "is_food": True}], "total": 1.8,
+           "food_items": ["rice"]}
+
+
+class FakeOCR(OCRBackend):
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+        self.calls = 0
+
+    def extract_text(self, content, timeout=None):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        # Too little for the local parser, so the LLM formats it
+        return "smudged receipt"
+
+    def warm_up(self):
+        if self.error is not None:
+            raise self.error
+
+
+def make_processor(*ocr):
+    cache = ReceiptCache(LRUCache(), LRUCache(), LRUCache())
+    return ReceiptProcessor(list(ocr), [StubLLM(lambda messages: json.dumps(RECEIPT))], cache=cache)
+
+
+def test_backends_are_created_by_name():
+    assert isinstance(create_ocr_backend(" Vision "), VisionOCR)
+    assert isinstance(create_ocr_backend("tesseract", concurrency=2), TesseractOCR)
+    assert isinstance(create_llm_backend("STUB"), StubLLM)
+    with pytest.raises(ValueError, match="Unknown OCR backend: textract"):
+        create_ocr_backend("textract")
+    with pytest.raises(ValueError, match="Unknown LLM backend: claude"):
+        create_llm_backend("claude")
+
+
+def test_backend_lists_come_from_the_argument_or_the_environment(monkeypatch):
+    assert _names("vision, tesseract,,", "RECEIPT_OCR_BACKENDS", "vision") == ["vision", " tesseract"]
+    monkeypatch.delenv("RECEIPT_LLM_BACKENDS", raising=False)
+    assert _names(None, "RECEIPT_LLM_BACKENDS", "openai") == ["openai"]
+    monkeypatch.setenv("RECEIPT_LLM_BACKENDS", "ollama,stub")
+    assert _names(None, "RECEIPT_LLM_BACKENDS", "openai") == ["ollama", "stub"]
+    # An explicit argument wins, even an empty one
+    assert _names("", "RECEIPT_LLM_BACKENDS", "openai") == []
+
+
+def test_create_processor_orders_backends_and_hands_over_clients(monkeypatch):
+    monkeypatch.setenv("RECEIPT_STORE_PATH", "none")
+    monkeypatch.setenv("RECIPE_INDEX_PATH", "none")
+    vision_client, openai_client = object(), object()
+    processor = create_processor("tesseract, vision", "stub,openai", vision_client=vision_client,
+                                 openai_client=openai_client)
+    tesseract, vision = processor.ocr.backends
+    stub, openai = processor.llm.backends
+    assert (type(tesseract), type(vision), type(stub), type(openai)) == (TesseractOCR, VisionOCR, StubLLM, OpenAIChat)
+    assert vision.client is vision_client
+    assert openai.client is openai_client
+    assert processor.store is None
+
+
+def test_the_stub_times_out_like_a_slow_upstream():
+    with pytest.raises(TimeoutError, match="over the 0.01s timeout"):
+        StubLLM(delay=0.5).complete([{"role": "user", "content": "receipt"}], timeout=0.01)
+    # Without a reply function, the local parser reads the prompt
+    text = "MILK 1.99\nTOTAL 1.99"
+    assert json.loads(StubLLM().complete([{"role": "user", "content": text}])) == parse_receipt(text).data
+
+
+def test_an_unhealthy_ocr_backend_falls_over_to_the_next():
+    primary, fallback = FakeOCR("primary", ConnectionError("vision down")), FakeOCR("fallback")
+    processor = make_processor(primary, fallback)
+    assert processor.process_image(b"image")["merchant"] == "Corner Shop"
+    assert (primary.calls, fallback.calls) == (1, 1)
+    assert processor.stats()["ocr"]["failovers"] == 1
+
+
+def test_a_request_error_is_not_retried_elsewhere():
+    primary, fallback = FakeOCR("primary", ValueError("No text found in image")), FakeOCR("fallback")
+    processor = make_processor(primary, fallback)
+    with pytest.raises(ValueError, match="No text found"):
+        processor.extract_text(b"image")
+    assert fallback.calls == 0
+
+
+def test_warm_up_times_each_backend_and_reports_failures():
+    processor = make_processor(FakeOCR("primary"), FakeOCR("fallback", ConnectionError("no credentials")))
+    timings = processor.warm_up()
+    assert timings["primary"] >= 0
+    assert timings["fallback"] == {"error": "no credentials"}
+    assert timings["stub"] >= 0
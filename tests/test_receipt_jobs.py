@@ -0,0 +1,200 @@
+import socket
+import time
+
+import pytest
+
+import receipt_jobs
+from receipt_jobs import (DEAD, FAILED, QUEUED, RUNNING, SUCCEEDED, InProcessBroker, JobQueue, SQLiteBroker,
+                          UpstreamLimiter, public_job, validate_webhook)
+
+
+@pytest.fixture
+def resolve(monkeypatch):
+    """Answer getaddrinfo from a dict of host -> addresses instead of DNS."""
+    hosts = {}
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host not in hosts:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, 0)) for address in hosts[host]]
+
+    monkeypatch.setattr(receipt_jobs.socket, "getaddrinfo", getaddrinfo)
+    return hosts
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def broker(request, tmp_path):
+    if request.param == "memory":
+        return InProcessBroker()
+    return SQLiteBroker(tmp_path / "jobs.sqlite3", poll_interval=0.01)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_webhook_on_a_public_address_is_accepted(resolve):
+    resolve["hooks.example.com"] = ["93.184.216.34"]
+    assert validate_webhook("https://hooks.example.com/done") == "https://hooks.example.com/done"
+    assert validate_webhook(None) is None
+    assert validate_webhook("") is None
+
+
+@pytest.mark.parametrize("address", ["127.0.0.1", "10.0.0.5", "192.168.1.1", "169.254.169.254", "::1",
+                                     "fe80::1%eth0", "::ffff:127.0.0.1", "0.0.0.0"])
+def test_webhook_on_a_private_address_is_refused(resolve, address):
+    resolve["internal.example.com"] = [address]
+    with pytest.raises(ValueError, match="public address"):
+        validate_webhook("http://internal.example.com/hook")
+
+
+def test_webhook_with_any_private_address_is_refused(resolve):
+    resolve["mixed.example.com"] = ["93.184.216.34", "127.0.0.1"]
+    with pytest.raises(ValueError, match="public address"):
+        validate_webhook("http://mixed.example.com/hook")
+
+
+@pytest.mark.parametrize("url", ["ftp://example.com/hook", "/relative/hook", "http:///no-host", "javascript:alert(1)"])
+def test_webhook_must_be_an_absolute_http_url(resolve, url):
+    with pytest.raises(ValueError, match="absolute"):
+        validate_webhook(url)
+
+
+def test_webhook_host_must_resolve(resolve):
+    with pytest.raises(ValueError, match="does not resolve"):
+        validate_webhook("http://nowhere.invalid/hook")
+
+
+def test_webhook_allowlist_admits_only_listed_hosts(resolve, monkeypatch):
+    monkeypatch.setattr(receipt_jobs, "WEBHOOK_ALLOWED_HOSTS", frozenset({"ci.internal"}))
+    # Listed hosts are trusted whatever they resolve to
+    assert validate_webhook("http://CI.internal:8080/hook") == "http://CI.internal:8080/hook"
+    resolve["hooks.example.com"] = ["93.184.216.34"]
+    with pytest.raises(ValueError, match="not allowed"):
+        validate_webhook("https://hooks.example.com/done")
+
+
+def test_broker_runs_a_job_through_its_states(broker):
+    job_id = broker.submit(b"image", "https://hooks.example.com/done")
+    assert broker.get(job_id)["status"] == QUEUED
+    assert broker.claim(timeout=0.1) == (job_id, b"image")
+    job = broker.get(job_id)
+    assert (job["status"], job["attempts"]) == (RUNNING, 1)
+    broker.complete(job_id, {"total": 4.49})
+    job = broker.get(job_id)
+    assert (job["status"], job["result"]) == (SUCCEEDED, {"total": 4.49})
+    assert job["finished_at"] >= job["started_at"]
+    assert broker.counts() == {QUEUED: 0, RUNNING: 0, SUCCEEDED: 1, FAILED: 0, DEAD: 0}
+    assert broker.get("unknown") is None
+
+
+def test_broker_records_failures(broker):
+    job_id = broker.submit(b"image")
+    broker.claim(timeout=0.1)
+    broker.fail(job_id, "Vision is down")
+    job = broker.get(job_id)
+    assert (job["status"], job["error"], job["result"]) == (FAILED, "Vision is down", None)
+
+
+def test_broker_hands_out_jobs_oldest_first(broker):
+    first = broker.submit(b"1")
+    second = broker.submit(b"2")
+    assert broker.claim(timeout=0.1)[0] == first
+    assert broker.claim(timeout=0.1)[0] == second
+    assert broker.claim(timeout=0.05) is None
+
+
+def test_sqlite_broker_requeues_jobs_of_crashed_workers(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    job_id = SQLiteBroker(path, lease=0.05).submit(b"image")
+    assert SQLiteBroker(path, lease=0.05).claim(timeout=0.1)[0] == job_id
+    time.sleep(0.1)
+    # Another process picks it up once the lease has run out
+    assert SQLiteBroker(path, lease=0.05).claim(timeout=0.1) == (job_id, b"image")
+    assert SQLiteBroker(path).get(job_id)["attempts"] == 2
+
+
+def test_sqlite_broker_gives_up_on_jobs_that_never_finish(tmp_path):
+    broker = SQLiteBroker(tmp_path / "jobs.sqlite3", lease=0.05, max_attempts=2, poll_interval=0.01)
+    job_id = broker.submit(b"crashes its worker")
+    other = broker.submit(b"fine")
+    assert broker.claim(timeout=0.1)[0] == job_id
+    time.sleep(0.1)
+    assert broker.claim(timeout=0.1)[0] == job_id
+    time.sleep(0.1)
+    # Out of attempts: dead rather than claimed a third time, and the queue moves on
+    assert broker.claim(timeout=0.1)[0] == other
+    job = broker.get(job_id)
+    assert (job["status"], job["attempts"]) == (DEAD, 2)
+    assert "2 attempts" in job["error"]
+    assert broker.counts()[DEAD] == 1
+
+
+def test_in_process_broker_forgets_the_oldest_finished_jobs():
+    broker = InProcessBroker(max_finished=2)
+    ids = [broker.submit(b"x") for _ in range(3)]
+    for job_id in ids:
+        broker.claim(timeout=0.1)
+        broker.complete(job_id, None)
+    assert broker.get(ids[0]) is None
+    assert broker.get(ids[2])["status"] == SUCCEEDED
+
+
+def test_job_queue_stores_results_and_errors(broker, resolve):
+    def handler(content):
+        if content == b"bad":
+            raise ValueError("not a receipt")
+        return {"bytes": len(content)}
+
+    jobs = JobQueue(broker, handler, workers=2)
+    jobs.start()
+    try:
+        good = jobs.submit(b"good")
+        bad = jobs.submit(b"bad")
+        wait_for(lambda: broker.counts()[SUCCEEDED] + broker.counts()[FAILED] == 2)
+    finally:
+        jobs.stop()
+    assert broker.get(good)["result"] == {"bytes": 4}
+    assert broker.get(bad)["error"] == "not a receipt"
+
+
+def test_job_queue_drains_jobs_queued_before_it_started(tmp_path):
+    broker = SQLiteBroker(tmp_path / "jobs.sqlite3", poll_interval=0.01)
+    job_id = broker.submit(b"left over")
+    jobs = JobQueue(broker, len, workers=1)
+    jobs.start()
+    try:
+        wait_for(lambda: broker.get(job_id)["status"] == SUCCEEDED)
+    finally:
+        jobs.stop()
+    assert broker.get(job_id)["result"] == 9
+
+
+def test_job_queue_refuses_private_webhooks_before_queueing(resolve):
+    resolve["metadata.internal"] = ["169.254.169.254"]
+    broker = InProcessBroker()
+    jobs = JobQueue(broker, len, workers=0)
+    with pytest.raises(ValueError):
+        jobs.submit(b"image", "http://metadata.internal/latest")
+    assert broker.counts()[QUEUED] == 0
+
+
+def test_public_job_hides_the_webhook():
+    job = {"id": "1", "status": QUEUED, "webhook": "https://hooks.example.com/secret-token"}
+    assert public_job(job) == {"id": "1", "status": QUEUED}
+
+
+def test_upstream_limiter_times_out_when_every_slot_is_taken():
+    limiter = UpstreamLimiter({"vision": 1})
+    with limiter.slot("vision"):
+        with pytest.raises(TimeoutError):
+            with limiter.slot("vision", timeout=0.01):
+                pass
+        # Unknown upstreams are not limited
+        with limiter.slot("ollama", timeout=0.01):
+            pass
+    with limiter.slot("vision", timeout=0.01):
+        assert limiter.stats() == {"vision": {"limit": 1, "waiting": 0}}
@@ -0,0 +1,69 @@
+import json
+import zipfile
+
+import pytest
+
+from receipt_ocr import ReceiptOCR, iter_batch_sources, load_checkpoint, run_batch
+
+
+@pytest.fixture
+def receipts(tmp_path, monkeypatch):
+    """A directory of receipts that don't decode, so every file fails fast without tesseract."""
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / "receipts"
+    (folder / "march").mkdir(parents=True)
+    for name in ("a.jpg", "b.PNG", "march/c.jpeg"):
+        (folder / name).write_bytes(b"not really an image")
+    (folder / "notes.txt").write_text("skipped")
+    return folder
+
+
+def test_directories_are_listed_recursively_and_in_order(receipts):
+    names = [name for name, _ in iter_batch_sources(receipts)]
+    assert names == ["a.jpg", "b.PNG", "march/c.jpeg"]
+
+
+def test_zip_members_are_read_into_memory(tmp_path):
+    archive = tmp_path / "receipts.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("june/x.jpg", b"x")
+        zf.writestr("readme.md", b"skipped")
+        zf.writestr("empty/", b"")
+    assert list(iter_batch_sources(archive)) == [("june/x.jpg", b"x")]
+
+
+def test_other_sources_are_refused(tmp_path):
+    single = tmp_path / "receipt.jpg"
+    single.write_bytes(b"x")
+    with pytest.raises(ValueError, match="directory or zip"):
+        list(iter_batch_sources(single))
+
+
+def test_checkpoint_keeps_successes_and_drops_a_torn_last_line(tmp_path):
+    output = tmp_path / "results.jsonl"
+    lines = [{"file": "a.jpg", "raw_text": "MILK 1.99", "error": None},
+             {"file": "b.jpg", "raw_text": None, "error": "Could not decode image"}]
+    intact = "".join(json.dumps(line) + "\n" for line in lines)
+    output.write_text(intact + '{"file": "c.jp')
+    # Failed files are retried
+    assert load_checkpoint(output) == {"a.jpg"}
+    assert output.read_text() == intact
+    assert load_checkpoint(tmp_path / "missing.jsonl") == set()
+
+
+def test_process_batch_reports_every_file_and_skips_finished_ones(receipts):
+    results = list(ReceiptOCR().process_batch(receipts, workers=2, skip={"a.jpg"}, max_pending=1))
+    assert sorted(result["file"] for result in results) == ["b.PNG", "march/c.jpeg"]
+    for result in results:
+        assert result["raw_text"] is None
+        assert result["error"] == "Could not decode image"
+        assert result["elapsed_ms"] >= 0
+
+
+def test_run_batch_resumes_from_its_output(receipts, tmp_path):
+    output = tmp_path / "results.jsonl"
+    output.write_text(json.dumps({"file": "a.jpg", "raw_text": "MILK 1.99", "error": None}) + "\n")
+    assert run_batch(str(receipts), str(output), workers=1) == 2
+    written = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [line["file"] for line in written[:1]] == ["a.jpg"]
+    assert sorted(line["file"] for line in written[1:]) == ["b.PNG", "march/c.jpeg"]
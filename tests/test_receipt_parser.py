@@ -0,0 +1,71 @@
+from receipt_parser import MIN_CONFIDENCE, ParserMetrics, parse_receipt
+
+GROCERY = """\
+FRESH MART
+123 Main St
+Tel 555-123-4567
+2024-03-15 14:32
+MILK 2%            3.49
+BANANAS            1.29
+CHEDDAR CHEESE     5.99
+SUBTOTAL          10.77
+TAX                0.86
+TOTAL             11.63
+VISA              11.63
+CHANGE             0.00
+"""
+
+
+def test_common_layout_is_parsed_with_confidence():
+    result = parse_receipt(GROCERY)
+    assert result.confidence >= MIN_CONFIDENCE
+    assert all(result.checks.values())
+    data = result.data
+    assert data["merchant"] == "FRESH MART"
+    assert data["datetime"] == "2024-03-15 14:32"
+    assert [(item["name"], item["price"]) for item in data["items"]] == [
+        ("MILK 2%", "3.49"), ("BANANAS", "1.29"), ("CHEDDAR CHEESE", "5.99")]
+    assert all(item["is_food"] for item in data["items"])
+    assert (data["subtotal"], data["tax"], data["total"]) == ("10.77", "0.86", "11.63")
+    assert "banana" in data["food_items"]
+
+
+def test_lines_after_the_total_are_not_items():
+    names = [item["name"] for item in parse_receipt(GROCERY).data["items"]]
+    assert "VISA" not in names
+    assert "CHANGE" not in names
+
+
+def test_items_that_do_not_add_up_lower_the_confidence():
+    result = parse_receipt(GROCERY.replace("BANANAS            1.29", "BANANAS            1.92"))
+    assert not result.checks["items_match"]
+    assert result.confidence < MIN_CONFIDENCE
+
+
+def test_receipt_without_a_subtotal_balances_on_items_plus_tax():
+    text = "CORNER SHOP\n01/02/2024\nBREAD 2.50\nEGGS 3.00\nTAX 0.50\nTOTAL 6.00\n"
+    result = parse_receipt(text)
+    assert result.checks["items_match"]
+    assert result.data["subtotal"] == "5.50"
+    assert result.confidence >= MIN_CONFIDENCE
+
+
+def test_quantities_and_codes_are_dropped_from_item_names():
+    result = parse_receipt("SHOP\n2 x APPLES 1.00\n0123456789 RICE 4.00\nTOTAL 5.00\n")
+    assert [item["name"] for item in result.data["items"]] == ["APPLES", "RICE"]
+
+
+def test_text_without_prices_has_no_confidence():
+    result = parse_receipt("just some words\nno prices here")
+    assert result.data["items"] == []
+    assert result.confidence < 0.2
+
+
+def test_parser_metrics_estimate_the_time_saved():
+    metrics = ParserMetrics()
+    metrics.record_parse(parse_receipt(GROCERY), bypassed=True)
+    metrics.record_parse(parse_receipt("nothing"), bypassed=False)
+    metrics.record_llm(800.0)
+    stats = metrics.stats()
+    assert (stats["parsed"], stats["bypassed"], stats["bypass_rate"]) == (2, 1, 0.5)
+    assert stats["estimated_saved_ms"] == 800.0
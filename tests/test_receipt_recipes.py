@@ -0,0 +1,63 @@
+import json
+
+from receipt_cache import LRUCache, ReceiptCache
+from receipt_core import OCRBackend, ReceiptProcessor, StubLLM
+from receipt_prompts import RECIPE_SYSTEM_PROMPT
+
+RECEIPT = {"merchant": "Corner Shop", "items": [{"name": "TOMATOES", "price": 3.0, "is_food": True},
+                                                {"name": "BASIL", "price": 1.5, "is_food": True}],
+           "total": 4.5, "food_items": ["tomatoes", "basil"]}
+RECIPES = {"recipes": [{"name": "Tomato Salad", "instructions": ["Slice the tomatoes", "Tear the basil"]}]}
+
+
+class FakeOCR(OCRBackend):
+    name = "fake-ocr"
+
+    def extract_text(self, content, timeout=None):
+        # Too little for the local parser, so the LLM formats it
+        return f"smudged receipt {content.decode()}"
+
+
+class CountingLLM(StubLLM):
+    def __init__(self):
+        super().__init__(self.answer)
+        self.prompts = []
+
+    def answer(self, messages):
+        recipe = messages[0]["content"] == RECIPE_SYSTEM_PROMPT
+        self.prompts.append("recipes" if recipe else "receipt")
+        return json.dumps(RECIPES if recipe else RECEIPT)
+
+
+def make_processor():
+    llm = CountingLLM()
+    cache = ReceiptCache(LRUCache(), LRUCache(), LRUCache())
+    return ReceiptProcessor([FakeOCR()], [llm], cache=cache), llm
+
+
+def test_processing_a_receipt_does_not_ask_for_recipes():
+    processor, llm = make_processor()
+    receipt = processor.process_image(b"1")
+    assert receipt["food_items"] == ["tomato", "basil"]
+    assert "recipe_suggestions" not in receipt
+    assert llm.prompts == ["receipt"]
+
+
+def test_recipes_are_generated_later_from_the_receipt_id():
+    processor, llm = make_processor()
+    receipt_id = processor.process_image(b"1")["receipt_id"]
+    stored = processor.get_receipt(receipt_id)
+    assert stored["merchant"] == "Corner Shop"
+    assert processor.generate_recipes(stored["food_items"]) == RECIPES["recipes"]
+    assert llm.prompts == ["receipt", "recipes"]
+    assert processor.get_receipt("unknown") is None
+
+
+def test_the_same_basket_never_asks_the_llm_twice():
+    processor, llm = make_processor()
+    first = processor.generate_recipes(["Tomatoes", "basil"])
+    # Another receipt with the same groceries in another order and case
+    assert processor.generate_recipes(["BASIL", "tomatoes ", "basil"]) == first
+    assert llm.prompts == ["recipes"]
+    processor.generate_recipes(["tomatoes", "basil", "garlic"])
+    assert llm.prompts == ["recipes", "recipes"]
@@ -0,0 +1,141 @@
+import csv
+import io
+import json
+
+import pytest
+
+import receipt_store
+from receipt_store import ReceiptFilter, ReceiptStore, create_store, parse_purchase_date, to_cents
+
+
+def receipt(receipt_id, merchant="Fresh Mart", date="2024-03-15", total="10.00", items=()):
+    return {"receipt_id": receipt_id, "merchant": merchant, "datetime": date, "total": total,
+            "items": [{"name": name, "price": price, "is_food": is_food} for name, price, is_food in items]}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ReceiptStore(tmp_path / "receipts.sqlite3")
+
+
+@pytest.mark.parametrize("value, cents", [("$1,234.50", 123450), ("2,49", 249), ("1.234,50", 123450), (3.5, 350),
+                                          ("4.00-", -400), ("-0.99", -99), (None, None), ("n/a", None), (True, None)])
+def test_to_cents(value, cents):
+    assert to_cents(value) == cents
+
+
+@pytest.mark.parametrize("value, date", [("2024-03-15 14:32", "2024-03-15"), ("03/15/2024", "2024-03-15"),
+                                         ("15/03/2024", "2024-03-15"), ("15 Mar 2024", "2024-03-15"),
+                                         ("2024-02-30", None), ("tomorrow", None), (None, None)])
+def test_parse_purchase_date(value, date):
+    assert parse_purchase_date(value) == date
+
+
+def test_saved_receipts_can_be_read_back_and_replaced(store):
+    store.save(receipt("a", items=[("MILK", "2.99", True)]), image_hash="img-a")
+    assert store.get("a")["merchant"] == "Fresh Mart"
+    assert store.get_by_image("img-a")["receipt_id"] == "a"
+    store.save(receipt("a", merchant="Corner Shop", items=[("BREAD", "1.50", True), ("BAG", "0.10", False)]))
+    assert len(store) == 1
+    assert store.get("a")["merchant"] == "Corner Shop"
+    # Saving again without a hash keeps the one it was stored with
+    assert store.get_by_image("img-a")["merchant"] == "Corner Shop"
+    assert store.stats()["items"] == 2
+    assert store.delete("a")
+    assert not store.delete("a")
+    assert store.stats()["items"] == 0
+
+
+def test_image_already_stored_under_another_receipt_keeps_it(store):
+    store.save(receipt("first"), image_hash="img")
+    # The same photo read differently this time: a new receipt_id with the same image hash
+    store.save(receipt("second", items=[("MILK", "2.99", True)]), image_hash="img")
+    assert store.get("second")["items"][0]["name"] == "MILK"
+    assert store.get_by_image("img")["receipt_id"] == "first"
+    assert store.stats() == {"receipts": 2, "items": 1, "path": str(store.path)}
+    # An existing receipt without a hash can't take one that is already taken either
+    store.save(receipt("third"))
+    store.save(receipt("third"), image_hash="img")
+    assert store.get_by_image("img")["receipt_id"] == "first"
+    store.save_many([(receipt("fourth"), "img-4"), (receipt("fifth"), "img-4")])
+    assert store.get_by_image("img-4")["receipt_id"] == "fourth"
+    assert store.get("fifth") is not None
+
+
+def test_receipts_without_an_id_are_skipped(store):
+    store.save({"merchant": "Nowhere"})
+    assert len(store) == 0
+
+
+def test_listing_pages_through_every_receipt_once(store, monkeypatch):
+    monkeypatch.setattr(receipt_store.time, "time", lambda: 1000.0)
+    # Saved together, so they tie on created_at and are ordered by id
+    store.save_many([(receipt(f"r{i:02}"), None) for i in range(7)])
+    monkeypatch.setattr(receipt_store.time, "time", lambda: 1001.0)
+    store.save(receipt("newest"))
+    seen, cursor = [], None
+    while True:
+        page = store.list(limit=3, cursor=cursor)
+        seen.extend(summary["id"] for summary in page["receipts"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == ["newest"] + [f"r{i:02}" for i in reversed(range(7))]
+    with pytest.raises(ValueError):
+        store.list(cursor="not a cursor")
+
+
+def test_filters_select_by_merchant_date_and_total(store):
+    store.save_many([
+        (receipt("a", "Fresh Mart", "2024-01-10", "5.00"), None),
+        (receipt("b", "FRESH  MART", "2024-02-10", "50.00"), None),
+        (receipt("c", "Corner Shop", "2024-02-20", "20.00"), None),
+        (receipt("d", "Corner Shop", None, "1.00"), None),
+    ])
+
+    def ids(**args):
+        return sorted(r["id"] for r in store.list(ReceiptFilter.from_args(args))["receipts"])
+
+    assert ids(merchant="fresh mart") == ["a", "b"]
+    assert ids(**{"from": "2024-02-01", "to": "2024-02-15"}) == ["b"]
+    assert ids(min_total="10", max_total="$30") == ["c"]
+    assert ids() == ["a", "b", "c", "d"]
+    with pytest.raises(ValueError, match="from"):
+        ReceiptFilter.from_args({"from": "last week"})
+    with pytest.raises(ValueError, match="min_total"):
+        ReceiptFilter.from_args({"min_total": "lots"})
+
+
+def test_aggregates(store):
+    store.save_many([
+        (receipt("a", "Fresh Mart", "2024-01-10", "5.00", [("MILK", "2.99", True), ("BAG", "0.10", False)]), None),
+        (receipt("b", "Fresh Mart", "2024-01-20", "7.00", [("Milk", "3.09", True), ("EGGS", "4.00", True)]), None),
+        (receipt("c", "Corner Shop", "2024-02-05", "2.50", [("milk", "2.50", True)]), None),
+    ])
+    assert store.spend_by_merchant_month() == [
+        {"merchant": "Corner Shop", "month": "2024-02", "receipts": 1, "total": 2.5},
+        {"merchant": "Fresh Mart", "month": "2024-01", "receipts": 2, "total": 12.0},
+    ]
+    top = store.top_food_items()
+    assert (top[0]["purchases"], top[0]["receipts"], top[0]["spend"]) == (3, 3, 8.58)
+    assert [item["name"].lower() for item in top] == ["milk", "eggs"]
+    assert store.summary(ReceiptFilter(merchant="fresh mart")) == {
+        "receipts": 2, "total": 12.0, "merchants": 1, "first_date": "2024-01-10", "last_date": "2024-01-20"}
+
+
+def test_exports_stream_csv_and_json_lines(store):
+    store.save_many([(receipt(f"r{i}", items=[("MILK", "2.99", True)]), None) for i in range(3)])
+    rows = list(csv.DictReader(io.StringIO("".join(store.export("csv", "receipts")))))
+    assert [row["id"] for row in rows] == ["r0", "r1", "r2"]
+    assert rows[0]["total"] == "10.0"
+    items = [json.loads(line) for line in "".join(store.export("jsonl", "items")).splitlines()]
+    assert items[0] == {"receipt_id": "r0", "merchant": "Fresh Mart", "purchase_date": "2024-03-15", "position": 0,
+                        "name": "MILK", "price": 2.99, "is_food": True}
+    with pytest.raises(ValueError):
+        store.export("xml")
+
+
+def test_create_store(tmp_path, monkeypatch):
+    assert create_store("none") is None
+    monkeypatch.setenv("RECEIPT_STORE_PATH", str(tmp_path / "env.sqlite3"))
+    assert create_store().path == tmp_path / "env.sqlite3"
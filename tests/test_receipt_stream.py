@@ -0,0 +1,108 @@
+import io
+import json
+
+import pytest
+from PIL import Image
+
+from receipt_cache import LRUCache, ReceiptCache
+from receipt_core import OCRBackend, ReceiptProcessor, StubLLM
+from receipt_prompts import RECIPE_SYSTEM_PROMPT
+from receipt_stream import SSE_HEADERS, sse_event
+
+RECEIPT = {"merchant": "Corner Shop", "items": [{"name": "EGGS", "price": 3.2, "is_food": True}], "total": 3.2,
+           "food_items": ["eggs"]}
+RECIPES = {"recipes": [{"name": "Omelette", "instructions": ["Whisk the eggs", "Fry"]}]}
+
+
+class FakeOCR(OCRBackend):
+    name = "fake-ocr"
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def extract_text(self, content, timeout=None):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        # Too little for the local parser, so the LLM formats it
+        return "smudged receipt"
+
+
+def reply(messages):
+    return json.dumps(RECIPES if messages[0]["content"] == RECIPE_SYSTEM_PROMPT else RECEIPT)
+
+
+def make_processor(ocr=None):
+    cache = ReceiptCache(LRUCache(), LRUCache(), LRUCache())
+    return ReceiptProcessor([ocr or FakeOCR()], [StubLLM(reply)], cache=cache)
+
+
+def parse_sse(body: str):
+    """(event, data) pairs of an event stream."""
+    events = []
+    for frame in body.split("\n\n"):
+        if frame:
+            name, data = frame.split("\n")
+            events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_each_event_is_one_frame_whatever_its_payload():
+    frame = sse_event("ocr", {"text": "MILK 1.99\nBREAD 2.50\n\n"})
+    # Newlines inside the payload are escaped, so they can't end the frame early
+    assert frame == 'event: ocr\ndata: {"text": "MILK 1.99\\nBREAD 2.50\\n\\n"}\n\n'
+    assert parse_sse(frame + sse_event("done", {})) == [("ocr", {"text": "MILK 1.99\nBREAD 2.50\n\n"}), ("done", {})]
+
+
+def test_events_follow_the_pipeline_and_skip_cached_stages():
+    processor = make_processor()
+    events = list(processor.events(b"image"))
+    names = [name for name, _ in events]
+    assert names[:2] == ["ocr", "receipt"]
+    assert set(names[2:-2]) == {"recipe_token"}
+    assert names[-2:] == ["recipes", "done"]
+    assert events[0][1] == {"text": "smudged receipt"}
+    assert "".join(data for name, data in events if name == "recipe_token") == json.dumps(RECIPES)
+    assert events[-2][1] == RECIPES["recipes"]
+    # The same photo again: served from the cache, with no OCR and no recipe tokens
+    assert [name for name, _ in processor.events(b"image")] == ["receipt", "recipes", "done"]
+    assert processor.ocr.backends[0].calls == 1
+
+
+def test_a_failed_receipt_stops_the_stream_before_the_receipt_event():
+    events = make_processor(FakeOCR(RuntimeError("unreadable"))).events(b"image")
+    with pytest.raises(RuntimeError, match="unreadable"):
+        next(events)
+
+
+def jpeg() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), "white").save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def post_stream(app, content):
+    client = app.test_client()
+    return client.post("/api/process-receipt/stream", data={"file": (io.BytesIO(content), "receipt.jpg")},
+                       content_type="multipart/form-data")
+
+
+def test_stream_endpoint_sends_server_sent_events(vercel_app, monkeypatch):
+    monkeypatch.setattr(vercel_app, "processor", make_processor())
+    response = post_stream(vercel_app.app, jpeg())
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    for header, value in SSE_HEADERS.items():
+        assert response.headers[header] == value
+    events = parse_sse(response.get_data(as_text=True))
+    assert [name for name, _ in events if name != "recipe_token"] == ["ocr", "receipt", "recipes", "done"]
+    assert events[1][1]["merchant"] == "Corner Shop"
+
+
+def test_stream_endpoint_reports_failures_as_an_error_event(vercel_app, monkeypatch):
+    monkeypatch.setattr(vercel_app, "processor", make_processor(FakeOCR(RuntimeError("unreadable"))))
+    response = post_stream(vercel_app.app, jpeg())
+    # Headers are already sent when processing fails, so the failure is the last event
+    assert response.status_code == 200
+    assert parse_sse(response.get_data(as_text=True)) == [("error", {"error": "unreadable"})]
@@ -0,0 +1,212 @@
+import asyncio
+import io
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from receipt_upload import CHUNK_SIZE, ImageInfo, UploadCoalescer, UploadRejected, preflight, read_upload, sniff_format
+
+
+class FakeUpload:
+    """The part of werkzeug's FileStorage read_upload uses, counting the bytes read."""
+
+    def __init__(self, data: bytes):
+        self.stream = self
+        self._data = io.BytesIO(data)
+        self.read_bytes = 0
+
+    def read(self, size: int) -> bytes:
+        chunk = self._data.read(size)
+        self.read_bytes += len(chunk)
+        return chunk
+
+
+def image_bytes(fmt="JPEG", size=(64, 48)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "white").save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def test_read_upload_returns_the_whole_file():
+    data = image_bytes("PNG") + b"\0" * (2 * CHUNK_SIZE)
+    assert read_upload(FakeUpload(data)) == data
+
+
+def test_read_upload_stops_at_the_first_chunk_of_a_non_image():
+    upload = FakeUpload(b"%PDF-1.7" + b"\0" * (3 * CHUNK_SIZE))
+    with pytest.raises(UploadRejected) as rejected:
+        read_upload(upload)
+    assert rejected.value.status == 415
+    assert "PDF" in str(rejected.value)
+    assert upload.read_bytes == CHUNK_SIZE
+
+
+def test_read_upload_stops_once_over_the_limit():
+    upload = FakeUpload(image_bytes() + b"\0" * (5 * CHUNK_SIZE))
+    with pytest.raises(UploadRejected) as rejected:
+        read_upload(upload, max_bytes=2 * CHUNK_SIZE)
+    assert rejected.value.status == 413
+    assert upload.read_bytes <= 3 * CHUNK_SIZE
+
+
+def receipt_photo(quality=90, size=(160, 120)) -> bytes:
+    # Dark rows of "text" on white, so recompression changes the bytes but not the picture
+    image = Image.new("L", size, 255)
+    for row in range(10, size[1] - 10, 12):
+        image.paste(0, (10, row, size[0] - 10 - row % 40, row + 4))
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("head, name", [(b"\xff\xd8\xff\xe0", "JPEG"), (b"\x89PNG\r\n\x1a\n", "PNG"),
+                                        (b"RIFF\0\0\0\0WEBPVP8 ", "WEBP"), (b"\0\0\0\x18ftypheic", "HEIC"),
+                                        (b"GIF89a", "GIF"), (b"hello", None)])
+def test_sniff_format(head, name):
+    assert sniff_format(head) == name
+
+
+def test_preflight_reads_format_and_size_from_the_header():
+    assert preflight(image_bytes("PNG", (30, 20))) == ImageInfo("PNG", 30, 20)
+    assert preflight(memoryview(image_bytes())).pixels == 64 * 48
+
+
+@pytest.mark.parametrize("data, limits, status, reason", [
+    (image_bytes("GIF"), {}, 415, "format"),
+    (b"not an image at all", {}, 415, "format"),
+    (image_bytes(), {"max_bytes": 100}, 413, "too_large"),
+    (image_bytes(size=(100, 100)), {"max_pixels": 5000}, 413, "too_large"),
+    (image_bytes()[:40], {}, 400, "corrupt"),
+])
+def test_preflight_rejects(data, limits, status, reason):
+    with pytest.raises(UploadRejected) as rejected:
+        preflight(data, **limits)
+    assert (rejected.value.status, rejected.value.reason) == (status, reason)
+
+
+def in_thread(func, *args):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(func(*args)))
+    thread.start()
+    return thread, results
+
+
+def slow(release, value, calls):
+    def work():
+        calls.append(value)
+        release.wait(5)
+        return value
+    return work
+
+
+def test_identical_bytes_share_one_run():
+    coalescer, release, calls = UploadCoalescer("test"), threading.Event(), []
+    data = receipt_photo()
+    first, first_result = in_thread(coalescer.run, data, slow(release, "first", calls), "alice")
+    while not calls:
+        time.sleep(0.005)
+    second, second_result = in_thread(coalescer.run, data, slow(release, "second", calls), "alice")
+    time.sleep(0.05)
+    release.set()
+    first.join()
+    second.join()
+    assert calls == ["first"]
+    assert first_result == second_result == ["first"]
+    # Finished runs still answer repeats within the window
+    assert coalescer.run(data, lambda: "third", "alice") == "first"
+    assert coalescer.stats()["coalesced"] == 2
+
+
+def test_a_recompressed_copy_runs_at_once_on_its_own_bytes():
+    coalescer, release, calls = UploadCoalescer("test"), threading.Event(), []
+    first, _ = in_thread(coalescer.run, receipt_photo(90), slow(release, "first", calls), "alice")
+    while not calls:
+        time.sleep(0.005)
+    # Does not wait for the first run, which is still in flight
+    assert coalescer.run(receipt_photo(40), lambda: "second", "alice") == "second"
+    release.set()
+    first.join()
+    assert coalescer.stats()["coalesced"] == 0
+
+
+def test_only_the_same_clients_uploads_are_coalesced():
+    coalescer = UploadCoalescer("test")
+    data = receipt_photo()
+    assert coalescer.run(data, lambda: "alice", "alice") == "alice"
+    assert coalescer.run(data, lambda: "bob", "bob") == "bob"
+    assert coalescer.stats()["coalesced"] == 0
+
+
+def test_window_zero_turns_coalescing_off():
+    coalescer = UploadCoalescer("test", window=0)
+    data = receipt_photo()
+    assert [coalescer.run(data, lambda i=i: i) for i in range(2)] == [0, 1]
+    assert coalescer.stats()["tracked"] == 0
+
+
+def test_failures_are_shared_only_with_waiting_repeats():
+    coalescer, release, calls = UploadCoalescer("test"), threading.Event(), []
+    data = receipt_photo()
+
+    def fail():
+        calls.append("first")
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    first = threading.Thread(target=lambda: pytest.raises(RuntimeError, coalescer.run, data, fail))
+    first.start()
+    while not calls:
+        time.sleep(0.005)
+    errors = []
+    second = threading.Thread(target=lambda: errors.append(pytest.raises(RuntimeError, coalescer.run, data, str)))
+    second.start()
+    time.sleep(0.05)
+    release.set()
+    first.join()
+    second.join()
+    assert len(errors) == 1
+    # The failed run is forgotten: the next upload runs again
+    assert coalescer.run(data, lambda: "retried") == "retried"
+
+
+def test_async_runs_are_coalesced():
+    coalescer = UploadCoalescer("test")
+    data = receipt_photo()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def both():
+        return await asyncio.gather(coalescer.run_async(data, work, "alice"), coalescer.run_async(data, work, "alice"))
+
+    assert asyncio.run(both()) == [1, 1]
+    assert calls == [1]
+
+
+def test_repeat_streams_wait_then_stream_for_themselves():
+    coalescer = UploadCoalescer("test")
+    data = receipt_photo()
+    events = []
+
+    async def tokens(name):
+        events.append(f"{name} start")
+        await asyncio.sleep(0.05)
+        yield name
+        events.append(f"{name} end")
+
+    async def consume(name):
+        return [item async for item in coalescer.stream_async(data, lambda: tokens(name), "alice")]
+
+    async def both():
+        return await asyncio.gather(consume("first"), consume("second"))
+
+    assert asyncio.run(both()) == [["first"], ["second"]]
+    # Either may claim the upload first, but the other only starts once it has finished
+    leader, follower = events[0].split()[0], events[2].split()[0]
+    assert events == [f"{leader} start", f"{leader} end", f"{follower} start", f"{follower} end"]
+    assert list(coalescer.stream(data, lambda: iter("ab"), "alice")) == ["a", "b"]
@@ -0,0 +1,106 @@
+import pytest
+
+import recipe_index
+from recipe_index import RecipeIndex, basket_ingredients, create_recipe_index, format_recipes, recipe_ingredients
+
+BASKET = ["CHKN BRST", "BROCCOLI", "GARLIC", "RICE", "SALT"]
+STIR_FRY = {"name": "Chicken Stir Fry", "instructions": ["Fry chicken breast with garlic", "Add broccoli"],
+            "additional_ingredients": ["soy sauce", "garlic"]}
+GARLIC_RICE = {"name": "Garlic Rice", "instructions": ["Cook rice with garlic"], "additional_ingredients": []}
+TOAST = {"name": "Toast", "instructions": ["Toast bread"]}
+
+
+def recipe(name, *ingredients):
+    return {"name": name, "instructions": [f"Cook {' and '.join(ingredients)}"]}
+
+
+def test_basket_ingredients_are_canonical_and_skip_the_pantry():
+    assert basket_ingredients(BASKET + ["", "  "]) == {"chicken breast", "broccoli", "garlic", "rice"}
+
+
+def test_recipe_ingredients_are_the_basket_items_it_mentions():
+    assert recipe_ingredients(STIR_FRY, BASKET) == {"chicken breast", "broccoli", "garlic"}
+    assert recipe_ingredients(TOAST, BASKET) == frozenset()
+    # Items the lexicon does not know count when the recipe names them
+    assert recipe_ingredients(recipe("Kombucha Rice", "kombucha", "rice"), ["kombucha", "rice"]) == {"kombucha", "rice"}
+
+
+def test_recipes_using_too_few_basket_items_are_not_indexed():
+    index = RecipeIndex()
+    assert index.add(BASKET, [STIR_FRY, GARLIC_RICE, TOAST, "not a recipe", {}]) == 2
+    assert len(index) == 2
+    # Adding the same recipes again replaces them
+    index.add(BASKET, [STIR_FRY])
+    assert index.stats()["added"] == 2
+
+
+def test_a_covered_basket_is_answered_from_the_corpus():
+    index = RecipeIndex()
+    index.add(BASKET, [STIR_FRY, GARLIC_RICE])
+    served = index.lookup(["chicken breast", "broccoli", "garlic", "rice"])
+    assert [r["name"] for r in served] == ["Chicken Stir Fry", "Garlic Rice"]
+    # What the basket already has is no longer "additional"
+    assert served[0]["additional_ingredients"] == ["soy sauce"]
+    assert index.lookup(["apple"]) is None
+    assert index.lookup([]) is None
+    stats = index.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_recipes_the_basket_covers_too_little_of_are_not_served():
+    index = RecipeIndex()
+    index.add(BASKET, [STIR_FRY, GARLIC_RICE])
+    # Two of the stir fry's three ingredients is below the default 75%
+    assert index.lookup(["chicken breast", "garlic", "rice"]) is None
+
+
+def test_missing_ingredients_are_added_to_the_served_recipe():
+    index = RecipeIndex(min_coverage=0.6)
+    index.add(BASKET, [STIR_FRY, GARLIC_RICE])
+    served = {r["name"]: r for r in index.lookup(["chicken breast", "garlic", "rice"])}
+    assert served["Chicken Stir Fry"]["additional_ingredients"] == ["soy sauce", "broccoli"]
+
+
+def test_least_recently_served_recipes_are_evicted():
+    index = RecipeIndex(max_recipes=2)
+    index.add(["egg", "milk", "cheese"], [recipe("Omelette", "egg", "milk"), recipe("Quiche", "egg", "cheese")])
+    index.lookup(["egg", "milk", "cheese"])
+    index.add(["apple", "pear"], [recipe("Fruit Salad", "apple", "pear")])
+    assert len(index) == 2
+    assert index.stats()["evictions"] == 1
+    assert index.stats()["ingredients"] == 4
+
+
+def test_the_corpus_is_shared_through_sqlite(tmp_path):
+    path = str(tmp_path / "recipes.sqlite3")
+    RecipeIndex(path=path).add(BASKET, [STIR_FRY, GARLIC_RICE])
+    loaded = RecipeIndex(path=path)
+    assert len(loaded) == 2
+    assert loaded.stats()["persistent"]
+    assert loaded.lookup(["chicken breast", "broccoli", "garlic", "rice"]) is not None
+    # Workers load up to their own limit, most recently used first
+    assert len(RecipeIndex(max_recipes=1, path=path)) == 1
+
+
+def test_format_recipes():
+    text = format_recipes([{**STIR_FRY, "cooking_time": "20 min", "difficulty": "easy"}, GARLIC_RICE])
+    assert text.splitlines()[:5] == [
+        "1. Chicken Stir Fry",
+        "   Additional ingredients: soy sauce, garlic",
+        "   1. Fry chicken breast with garlic",
+        "   2. Add broccoli",
+        "   Cooking time: 20 min  Difficulty: easy",
+    ]
+    assert "\n\n2. Garlic Rice\n" in text
+
+
+@pytest.mark.parametrize("path, persistent", [("none", False), ("recipes.sqlite3", True)])
+def test_create_recipe_index(tmp_path, path, persistent):
+    if persistent:
+        path = str(tmp_path / path)
+    assert create_recipe_index(path).stats()["persistent"] is persistent
+
+
+def test_size_zero_disables_the_index(monkeypatch):
+    monkeypatch.setattr(recipe_index, "RECIPE_INDEX_SIZE", 0)
+    assert create_recipe_index("none") is None
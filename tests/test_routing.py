@@ -0,0 +1,230 @@
+import threading
+import time
+
+import pytest
+
+from receipt_core.routing import (CLOSED, HALF_OPEN, HEDGE_MIN_DELAY, HEDGE_MIN_SAMPLES, OPEN, BackendGroup,
+                                  CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceeded, is_upstream_error,
+                                  percentile)
+
+
+class FakeBackend:
+    """A backend whose calls take `delays[i]` seconds and raise `errors[i]` for the i-th call."""
+
+    def __init__(self, name, delays=(), errors=(), concurrency=4):
+        self.name = name
+        self.concurrency = concurrency
+        self.delays = list(delays)
+        self.errors = list(errors)
+        self.calls = 0
+        self.timeouts = []
+        self._lock = threading.Lock()
+
+    def _next(self, timeout):
+        with self._lock:
+            i = self.calls
+            self.calls += 1
+            self.timeouts.append(timeout)
+        if i < len(self.delays):
+            time.sleep(self.delays[i])
+        if i < len(self.errors) and self.errors[i] is not None:
+            raise self.errors[i]
+        return i
+
+    def extract(self, content, timeout=None):
+        return f"{self.name}:{self._next(timeout)}"
+
+    def tokens(self, prompt, timeout=None):
+        self._next(timeout)
+        yield from (f"{self.name}-a", f"{self.name}-b")
+
+
+def test_breaker_opens_once_the_error_rate_is_reached():
+    breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5, cooldown=60)
+    for ok in (True, False, True):
+        breaker.record(ok)
+    # Too few calls to judge, even at a high error rate
+    assert breaker.state == CLOSED
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+    assert 59 < breaker.retry_after() <= 60
+
+
+def test_breaker_lets_one_probe_through_after_the_cooldown():
+    breaker = CircuitBreaker(window=4, min_calls=2, error_rate=0.5, cooldown=0.05)
+    breaker.record(False)
+    breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # The probe has not reported back; everyone else is still refused
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["error_rate"] == 0.0
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker(window=4, min_calls=2, error_rate=0.5, cooldown=0.05)
+    breaker.record(False)
+    breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.stats()["opens"] == 2
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile([3.0], 95) == 3.0
+
+
+def test_deadline():
+    assert Deadline(None).remaining() is None
+    assert not Deadline(None).expired
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+    assert deadline.expired
+    assert deadline.remaining() == 0.0
+    with pytest.raises(DeadlineExceeded):
+        deadline.check("ocr")
+
+
+def test_failed_call_falls_over_to_the_next_backend():
+    primary = FakeBackend("vision", errors=[ConnectionError("down")])
+    group = BackendGroup([primary, FakeBackend("tesseract")])
+    assert group.call("extract", b"image") == "tesseract:0"
+    stats = group.stats()
+    assert stats["failovers"] == 1
+    assert stats["backends"]["vision"]["errors"] == 1
+    assert stats["backends"]["tesseract"]["wins"] == 1
+
+
+def test_first_error_is_raised_when_every_backend_fails():
+    group = BackendGroup([FakeBackend("a", errors=[ConnectionError("a failed")]),
+                          FakeBackend("b", errors=[ConnectionError("b failed")])])
+    with pytest.raises(ConnectionError, match="a failed"):
+        group.call("extract", b"image")
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class APITimeoutError(Exception):
+    pass
+
+
+@pytest.mark.parametrize("error, upstream", [
+    (TimeoutError(), True), (ConnectionError(), True), (HTTPError(503), True), (HTTPError(429), True),
+    (APITimeoutError(), True), (ValueError("No text found in image"), False), (HTTPError(400), False),
+    (KeyError("items"), False),
+])
+def test_upstream_errors(error, upstream):
+    assert is_upstream_error(error) is upstream
+
+
+def test_request_errors_are_raised_without_failover_or_breaker():
+    primary, secondary = FakeBackend("vision", errors=[ValueError("No text found in image")] * 3), FakeBackend("tess")
+    group = BackendGroup([primary, secondary])
+    group.breakers["vision"] = CircuitBreaker(min_calls=1, cooldown=60)
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            group.call("extract", b"blank")
+    assert secondary.calls == 0
+    assert group.breakers["vision"].state == CLOSED
+    assert group.stats()["failovers"] == 0
+    stream_group = BackendGroup([FakeBackend("ollama", errors=[ValueError("bad prompt")]), secondary])
+    with pytest.raises(ValueError):
+        list(stream_group.stream("tokens", "prompt"))
+    assert secondary.calls == 0
+
+
+def test_slow_call_is_hedged_with_the_next_backend():
+    primary = FakeBackend("vision", delays=[1.0])
+    group = BackendGroup([primary, FakeBackend("tesseract")], hedge_after=0.05)
+    start = time.monotonic()
+    assert group.call("extract", b"image") == "tesseract:0"
+    assert time.monotonic() - start < 0.5
+    stats = group.stats()
+    assert (stats["hedged"], stats["hedge_wins"]) == (1, 1)
+
+
+def test_single_backend_is_hedged_with_a_second_call_to_itself_only_when_enabled():
+    backend = FakeBackend("openai", delays=[1.0, 0.0])
+    group = BackendGroup([backend], hedge_after=0.05, hedge_same_backend=True)
+    assert group.call("extract", b"image") == "openai:1"
+    assert group.stats()["hedge_wins"] == 1
+    backend = FakeBackend("openai", delays=[0.2])
+    group = BackendGroup([backend], hedge_after=0.05)
+    assert group.call("extract", b"image") == "openai:0"
+    assert backend.calls == 1
+    assert group.stats()["hedged"] == 0
+
+
+def test_hedge_delay_follows_recent_latency():
+    group = BackendGroup([FakeBackend("vision")], hedge_after=4.0)
+    backend = group.primary
+    assert group.hedge_delay(backend) == 4.0
+    for _ in range(HEDGE_MIN_SAMPLES):
+        group.call("extract", b"image")
+    # Fast calls: the percentile is tiny, so the floor applies
+    assert group.hedge_delay(backend) == HEDGE_MIN_DELAY
+    assert BackendGroup([FakeBackend("vision")]).hedge_delay(backend) is None
+
+
+def test_call_gives_up_at_the_deadline():
+    backend = FakeBackend("vision", delays=[1.0])
+    group = BackendGroup([backend])
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        group.call("extract", b"image", deadline=Deadline(0.05))
+    assert time.monotonic() - start < 0.5
+    assert group.stats()["deadline_exceeded"] == 1
+    # The backend was told how long it had
+    assert 0 < backend.timeouts[0] <= 0.05
+
+
+def test_open_breakers_skip_their_backend():
+    primary, secondary = FakeBackend("vision"), FakeBackend("tesseract")
+    group = BackendGroup([primary, secondary])
+    group.breakers["vision"] = CircuitBreaker(min_calls=1, cooldown=60)
+    group.breakers["vision"].record(False)
+    assert group.call("extract", b"image") == "tesseract:0"
+    assert primary.calls == 0
+    group.breakers["tesseract"] = CircuitBreaker(min_calls=1, cooldown=60)
+    group.breakers["tesseract"].record(False)
+    with pytest.raises(CircuitOpenError) as refused:
+        group.call("extract", b"image")
+    assert refused.value.status == 503
+    assert "Retry-After" in refused.value.headers()
+
+
+def test_stream_falls_over_only_before_its_first_item():
+    group = BackendGroup([FakeBackend("ollama", errors=[ConnectionError("refused")]), FakeBackend("openai")])
+    assert list(group.stream("tokens", "prompt")) == ["openai-a", "openai-b"]
+    assert group.stats()["failovers"] == 1
+
+    class Broken(FakeBackend):
+        def tokens(self, prompt, timeout=None):
+            yield "partial"
+            raise ConnectionError("reset")
+
+    group = BackendGroup([Broken("ollama"), FakeBackend("openai")])
+    received = []
+    with pytest.raises(ConnectionError):
+        for token in group.stream("tokens", "prompt"):
+            received.append(token)
+    assert received == ["partial"]
+
+
+def test_backend_group_needs_a_backend():
+    with pytest.raises(ValueError):
+        BackendGroup([])
@@ -0,0 +1,119 @@
+import logging
+import queue
+import threading
+from types import SimpleNamespace
+from typing import List
+
+import numpy as np
+import pytest
+
+import receipt_ocr
+import tesseract_pool
+from tesseract_pool import TesseractPool, pool_available
+
+
+class FakeWord:
+    def __init__(self, text, box):
+        self.text, self.box = text, box
+
+    def GetUTF8Text(self, level):
+        return self.text
+
+    def BoundingBox(self, level):
+        return self.box
+
+
+class FakeAPI:
+    """Stands in for tesserocr.PyTessBaseAPI: records the buffers it is given."""
+    created: List["FakeAPI"] = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.images = []
+        self.cleared = self.ended = 0
+        FakeAPI.created.append(self)
+
+    def SetImageBytes(self, data, width, height, bytes_per_pixel, bytes_per_line):
+        self.images.append((len(data), width, height, bytes_per_pixel, bytes_per_line))
+
+    def GetUTF8Text(self):
+        return "MILK 1.99\n"
+
+    def Recognize(self):
+        pass
+
+    def GetIterator(self):
+        return [FakeWord("MILK", (10, 5, 60, 20)), FakeWord("  ", (70, 5, 80, 20)), FakeWord("1.99", (200, 5, 240, 20))]
+
+    def Clear(self):
+        self.cleared += 1
+
+    def End(self):
+        self.ended += 1
+
+
+@pytest.fixture
+def fake_tesserocr(monkeypatch):
+    FakeAPI.created = []
+    fake = SimpleNamespace(PyTessBaseAPI=FakeAPI, RIL=SimpleNamespace(WORD=3), iterate_level=lambda it, level: it)
+    monkeypatch.setattr(tesseract_pool, "tesserocr", fake)
+    return fake
+
+
+def test_engines_are_loaded_once_with_their_options(fake_tesserocr):
+    pool = TesseractPool(size=3, lang="eng+deu", psm=6, tessdata_path="/opt/tessdata")
+    assert pool_available()
+    assert len(FakeAPI.created) == 3
+    assert FakeAPI.created[0].kwargs == {"lang": "eng+deu", "psm": 6, "path": "/opt/tessdata"}
+    for _ in range(5):
+        pool.extract_text(np.zeros((20, 30), np.uint8))
+    # Reused, not recreated
+    assert len(FakeAPI.created) == 3
+
+
+def test_images_are_passed_as_pixel_buffers(fake_tesserocr):
+    pool = TesseractPool(size=1)
+    assert pool.extract_text(np.zeros((20, 30), np.uint8)) == "MILK 1.99\n"
+    pool.extract_text(np.zeros((20, 30, 3), np.uint8))
+    api = FakeAPI.created[0]
+    assert api.images == [(600, 30, 20, 1, 30), (1800, 30, 20, 3, 90)]
+    # Cleared after every call so no state leaks to the next borrower
+    assert api.cleared == 2
+
+
+def test_layout_keeps_words_and_boxes(fake_tesserocr):
+    layout = TesseractPool(size=1).extract_layout(np.zeros((40, 300), np.uint8))
+    assert layout.texts == ["MILK", "1.99"]
+    assert layout.boxes.tolist() == [[10, 5, 60, 20], [200, 5, 240, 20]]
+
+
+def test_a_busy_pool_blocks_until_an_engine_is_returned(fake_tesserocr):
+    pool = TesseractPool(size=1)
+    with pool.engine():
+        with pytest.raises(queue.Empty):
+            with pool.engine(timeout=0.01):
+                pass
+        result = []
+        waiter = threading.Thread(target=lambda: result.append(pool.extract_text(np.zeros((2, 2), np.uint8))))
+        waiter.start()
+        waiter.join(0.05)
+        assert waiter.is_alive()
+    waiter.join(5)
+    assert result == ["MILK 1.99\n"]
+
+
+def test_close_ends_every_engine(fake_tesserocr):
+    with TesseractPool(size=2):
+        pass
+    assert [api.ended for api in FakeAPI.created] == [1, 1]
+
+
+def test_without_tesserocr_receipt_ocr_falls_back_to_pytesseract(monkeypatch, tmp_path, caplog):
+    monkeypatch.setattr(tesseract_pool, "tesserocr", None)
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(RuntimeError, match="requires the tesserocr package"):
+        TesseractPool(size=1)
+    with caplog.at_level(logging.WARNING):
+        ocr = receipt_ocr.ReceiptOCR(ocr_pool_size=2)
+    assert ocr.ocr_pool is None
+    assert "falling back to pytesseract" in caplog.text
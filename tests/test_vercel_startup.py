@@ -0,0 +1,97 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from google.cloud import vision
+
+from receipt_cache import LRUCache, ReceiptCache
+from receipt_core import OCRBackend, ReceiptProcessor, StubLLM, VisionOCR
+from receipt_core import ocr as receipt_core_ocr
+
+REPO = Path(__file__).resolve().parent.parent
+SDKS = ("google.cloud.vision", "openai")
+
+
+def import_in_fresh_interpreter(tmp_path, **env):
+    """Import vercel_app in a new interpreter; returns (returncode, {sdk: loaded}, stderr)."""
+    script = f"import json, sys\nimport vercel_app\nprint(json.dumps({{m: m in sys.modules for m in {SDKS!r}}}))"
+    environ = {**os.environ, "PYTHONPATH": str(REPO), "RECEIPT_STORE_PATH": "none", "RECIPE_INDEX_PATH": "none",
+               "RATE_LIMIT_PATH": str(tmp_path / "ratelimit.sqlite3")}
+    environ.pop("OPENAI_API_KEY", None)
+    environ.update(env)
+    result = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=environ, capture_output=True,
+                            text=True, timeout=60)
+    loaded = json.loads(result.stdout.splitlines()[-1]) if result.returncode == 0 else None
+    return result.returncode, loaded, result.stderr
+
+
+def test_importing_the_app_loads_neither_sdk(tmp_path):
+    returncode, loaded, stderr = import_in_fresh_interpreter(tmp_path, OPENAI_API_KEY="dummy-key")
+    assert returncode == 0, stderr
+    assert loaded == {"google.cloud.vision": False, "openai": False}
+
+
+def test_the_app_still_refuses_to_start_without_an_openai_key(tmp_path):
+    returncode, _, stderr = import_in_fresh_interpreter(tmp_path)
+    assert returncode != 0
+    assert "OpenAI API key is required" in stderr
+
+
+def test_the_vision_client_is_created_once_by_the_first_caller(monkeypatch):
+    created = []
+
+    def slow_client():
+        time.sleep(0.05)
+        created.append(object())
+        return created[-1]
+
+    monkeypatch.setattr(receipt_core_ocr, "create_vision_client", slow_client)
+    backend = VisionOCR()
+    assert created == []
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(backend.client)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1
+    assert all(client is created[0] for client in clients)
+
+
+def test_vision_credentials_are_read_from_the_environment_without_a_key_file(monkeypatch, tmp_path):
+    key = {"type": "service_account", "project_id": "receipts"}
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("VISION_ENDPOINT", raising=False)
+    monkeypatch.setenv("GOOGLE_CREDENTIALS", json.dumps(key))
+    monkeypatch.setattr(vision.ImageAnnotatorClient, "from_service_account_info", lambda info: ("client", info))
+    assert receipt_core_ocr.create_vision_client() == ("client", key)
+    assert list(tmp_path.iterdir()) == []
+
+
+class FakeOCR(OCRBackend):
+    name = "fake-ocr"
+
+    def __init__(self):
+        self.warmed = 0
+
+    def warm_up(self):
+        self.warmed += 1
+
+
+def test_warmup_prepares_every_backend_and_reports_a_cold_start_once(vercel_app, monkeypatch):
+    ocr = FakeOCR()
+    processor = ReceiptProcessor([ocr], [StubLLM()], cache=ReceiptCache(LRUCache(), LRUCache(), LRUCache()))
+    monkeypatch.setattr(vercel_app, "processor", processor)
+    monkeypatch.setattr(vercel_app, "_warm", False)
+    client = vercel_app.app.test_client()
+    first = client.get("/api/warmup").get_json()
+    assert first["cold"] is True
+    assert first["import_ms"] == vercel_app.IMPORT_MS > 0
+    assert set(first["backends"]) == {"fake-ocr", "stub"}
+    assert first["warmup_ms"] >= 0
+    assert client.get("/api/warmup").get_json()["cold"] is False
+    assert ocr.warmed == 2
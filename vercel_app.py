@@ -1,148 +1,107 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
-from werkzeug.utils import secure_filename
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory
+from werkzeug.exceptions import RequestEntityTooLarge
+import logging
 import os
-from pathlib import Path
-import json
-import openai
-from google.cloud import vision
-import base64
+import threading
+from metrics import REGISTRY, UPLOADS_REJECTED, admission_samples, instrument_flask, rate_limit_samples, timed
+from receipt_logging import configure_logging
+from receipt_upload import MAX_REQUEST_BYTES, UploadCoalescer, UploadRejected, preflight, read_upload
+from receipt_stream import SSE_HEADERS, sse_event
+from receipt_batch import BATCH_MAX_FILES, combined_food_items
+from receipt_core import UpstreamUnavailable, create_processor
+from receipt_store import DEFAULT_PAGE_SIZE, ReceiptFilter
+from rate_limit import client_key, create_admission, create_rate_limiter, protect_flask
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+instrument_flask(app)
 
 # Configuration
 # Use /tmp for Vercel's serverless environment
 UPLOAD_FOLDER = '/tmp'
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+# Bodies over UPLOAD_MAX_REQUEST_BYTES are refused from Content-Length, before any of it is read
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+LOCAL_CREDENTIALS_FILE = 'receiptreader-452521-728df5344329.json'
 
 # Get API key and validate
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 if not OPENAI_API_KEY:
-    print("ERROR: OPENAI_API_KEY environment variable is not set")
+    logger.critical("OPENAI_API_KEY environment variable is not set")
     raise ValueError("OpenAI API key is required. Please set OPENAI_API_KEY environment variable.")
 
-# Initialize OpenAI client with explicit API key
-try:
-    openai.api_key = OPENAI_API_KEY
-    print("OpenAI client initialized successfully")
-except Exception as e:
-    print(f"Error initializing OpenAI client: {str(e)}")
-    raise
-
-# Initialize Vision client with credentials from environment variable
-try:
-    import json
-    google_creds = os.getenv('GOOGLE_CREDENTIALS')
-    if google_creds:
-        creds_path = '/tmp/google-credentials.json'
-        with open(creds_path, 'w') as f:
-            f.write(google_creds)
-        vision_client = vision.ImageAnnotatorClient.from_service_account_file(creds_path)
-        os.remove(creds_path)  # Clean up after initialization
-        print("Vision client initialized with environment credentials")
-    else:
-        print("Using local credentials file for Vision API")
-        vision_client = vision.ImageAnnotatorClient.from_service_account_file('receiptreader-452521-728df5344329.json')
-    print("Vision client initialized successfully")
-except Exception as e:
-    print(f"Error initializing Vision client: {str(e)}")
-    vision_client = None
+# The Vision and OpenAI SDKs are imported, and their clients built, by the first request that
+# needs them (or by /api/warmup), not here: together they are most of a cold start. Vision
+# reads the service account key straight from GOOGLE_CREDENTIALS, falling back to the local
+# key file in development.
+if not os.getenv('GOOGLE_CREDENTIALS') and os.path.exists(LOCAL_CREDENTIALS_FILE):
+    logger.info("using local credentials file for Vision API")
+    os.environ.setdefault('GOOGLE_APPLICATION_CREDENTIALS', LOCAL_CREDENTIALS_FILE)
+
+# Only /tmp is writable on Vercel, and it lasts as long as the instance; point
+# RECEIPT_STORE_PATH and RECIPE_INDEX_PATH at durable storage to keep them across instances
+os.environ.setdefault('RECEIPT_STORE_PATH', os.path.join(UPLOAD_FOLDER, 'receipts.sqlite3'))
+os.environ.setdefault('RECIPE_INDEX_PATH', os.path.join(UPLOAD_FOLDER, 'recipes.sqlite3'))
+os.environ.setdefault('RATE_LIMIT_PATH', os.path.join(UPLOAD_FOLDER, 'ratelimit.sqlite3'))
+
+# Vision and OpenAI by default; RECEIPT_OCR_BACKENDS / RECEIPT_LLM_BACKENDS add fallbacks
+processor = create_processor()
+receipt_cache = processor.cache
+REGISTRY.register_collector('processor', processor.metric_samples)
+# Double submits of the same photo share one run (see receipt_upload.UploadCoalescer)
+receipt_uploads = UploadCoalescer('process-receipt')
+receipt_streams = UploadCoalescer('process-receipt-stream')
+
+# Per-client token buckets and fair-share admission, per instance: each Vercel instance keeps
+# its own buckets unless RATE_LIMIT_BACKEND=sqlite points RATE_LIMIT_PATH at shared storage.
+# Vercel's edge sets X-Forwarded-For to the real client address
+rate_limiter = create_rate_limiter()
+admission = create_admission(lambda: sum(s['waiting'] for s in processor.upstream_stats().values()))
+protect_flask(app, ['process_receipt', 'process_receipts_route', 'process_receipt_stream', 'receipt_recipes'],
+              rate_limiter, admission, trust_forwarded=True)
+if rate_limiter is not None:
+    limiter = rate_limiter
+    REGISTRY.register_collector('rate_limit', lambda: rate_limit_samples(limiter.stats()))
+if admission is not None:
+    admission_controller = admission
+    REGISTRY.register_collector('admission', lambda: admission_samples(admission_controller.stats()))
+
+IMPORT_MS = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)
+logger.info("app loaded", extra={"import_ms": IMPORT_MS})
+_warm = False
+_warm_lock = threading.Lock()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def process_receipt_with_vision(image_path):
-    try:
-        if not vision_client:
-            print("Vision client is not initialized")
-            raise ValueError("Vision client not properly initialized")
-
-        print(f"Processing image at path: {image_path}")
-        with open(image_path, 'rb') as image_file:
-            content = image_file.read()
-        
-        print("Image loaded successfully, sending to Vision API")
-        image = vision.Image(content=content)
-        response = vision_client.text_detection(image=image)
-        texts = response.text_annotations
-
-        if not texts:
-            print("No text found in the image")
-            raise ValueError("No text found in image")
-
-        print(f"Text detected in image: {texts[0].description[:100]}...")
-        return process_receipt_text(texts[0].description)
-    except Exception as e:
-        print(f"Error in OCR processing: {str(e)}")
-        return None
+def request_client():
+    """
+    Returns the identity repeat uploads are coalesced under, the same one the rate limiter uses:
+    the client address Vercel's edge forwards, not the proxy's
+    """
+    return client_key(request.headers, request.remote_addr, trust_forwarded=True)
 
-def process_receipt_text(text):
-    try:
-        print("Processing receipt text with OpenAI")
-        format_prompt = f"""Format the following receipt text into JSON with: merchant name, date/time, items (with prices and food flag), subtotal, tax, total, and food items list.
-Receipt text: {text}"""
-
-        print("Sending request to OpenAI")
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Format receipt text into JSON with merchant, datetime, items (name, price, is_food), subtotal, tax, total, food_items. Ensure the response is valid JSON."},
-                {"role": "user", "content": format_prompt}
-            ]
-        )
-
-        print("Received response from OpenAI")
-        response_content = response.choices[0].message.content.strip()
-        print(f"Raw OpenAI response: {response_content}")
-        
-        try:
-            receipt_data = json.loads(response_content)
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {str(e)}")
-            print("Attempting to fix JSON format...")
-            # Try to extract JSON from the response if it's wrapped in backticks or has extra text
-            import re
-            json_match = re.search(r'\{.*\}', response_content, re.DOTALL)
-            if json_match:
-                try:
-                    receipt_data = json.loads(json_match.group())
-                except json.JSONDecodeError as e:
-                    print(f"Second JSON parsing attempt failed: {str(e)}")
-                    raise
-            else:
-                raise ValueError("Could not find valid JSON in the response")
-        
-        print(f"Parsed receipt data: {json.dumps(receipt_data, indent=2)}")
-        
-        if receipt_data.get("food_items"):
-            print("Food items found, generating recipe suggestions")
-            recipe_prompt = """Generate a JSON array of 2-3 recipe suggestions using these ingredients: {}. 
-Format the response as a JSON object with a 'recipes' array containing objects with 'name', 'ingredients', 'instructions', 'time', and 'difficulty' fields.""".format(', '.join(receipt_data['food_items']))
-
-            recipe_response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Generate recipe suggestions in valid JSON format with the structure: {'recipes': [{'name': string, 'ingredients': string[], 'instructions': string[], 'time': string, 'difficulty': string}]}"},
-                    {"role": "user", "content": recipe_prompt}
-                ]
-            )
-
-            recipe_content = recipe_response.choices[0].message.content.strip()
-            print(f"Raw recipe response: {recipe_content}")
-            
-            try:
-                recipe_data = json.loads(recipe_content)
-                receipt_data["recipe_suggestions"] = recipe_data.get("recipes", [])
-                print("Recipe suggestions generated successfully")
-            except json.JSONDecodeError as e:
-                print(f"Recipe JSON parsing error: {str(e)}")
-                receipt_data["recipe_suggestions"] = []
-
-        return receipt_data
+def read_file(file):
+    # Raises UploadRejected for anything that is not a reasonably sized JPEG or PNG
+    with timed('upload_read'):
+        content = read_upload(file)
+    preflight(content)
+    return content
 
-    except Exception as e:
-        print(f"Error in text processing: {str(e)}")
-        print(f"Full error details: {type(e).__name__}: {str(e)}")
-        return None
+@app.errorhandler(UploadRejected)
+def upload_rejected(e):
+    logger.info("upload rejected", extra={"reason": e.reason, "error": str(e)})
+    return jsonify({'error': str(e)}), e.status
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    UPLOADS_REJECTED.inc(reason='request_too_large')
+    return jsonify({'error': f'Request is over the {MAX_REQUEST_BYTES / 1024 / 1024:g} MiB limit'}), 413
 
 @app.route('/')
 def index():
@@ -157,24 +116,188 @@ def process_receipt():
     if file.filename == '' or not allowed_file(file.filename):
         return jsonify({'error': 'Invalid file'}), 400
     
+    content = read_file(file)
     try:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        print(f"Saving file to: {filepath}")
-        file.save(filepath)
-        
-        processed_data = process_receipt_with_vision(filepath)
+        processed_data = receipt_uploads.run(content, lambda: processor.process_image(content),
+                                             client=request_client())
         if not processed_data:
-            print("Receipt processing failed")
             raise ValueError("Failed to process receipt")
 
-        os.remove(filepath)
         return jsonify({'success': True, 'processed_data': processed_data})
     
+    except UpstreamUnavailable as e:
+        logger.warning("upstream unavailable", extra={"error": str(e), "status": e.status})
+        return jsonify({'error': str(e)}), e.status, e.headers()
     except Exception as e:
-        print(f"Error in process_receipt route: {str(e)}")
+        logger.exception("process_receipt failed")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/process-receipts', methods=['POST'])
+def process_receipts_route():
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({'error': f'At most {BATCH_MAX_FILES} files per request'}), 400
+    if any(file.filename == '' or not allowed_file(file.filename) for file in files):
+        return jsonify({'error': 'Invalid file'}), 400
+
+    contents = [read_file(file) for file in files]
+    try:
+        logger.info("processing batch", extra={"images": len(contents)})
+        results = processor.process_images(contents)
+
+        recipe_suggestions = []
+        if request.args.get('recipes', '1') not in ('0', 'false'):
+            food_items = combined_food_items([r['processed_data'] for r in results if r['success']])
+            if food_items:
+                recipe_suggestions = processor.generate_recipes(food_items)
+
+        return jsonify({'success': True, 'results': results, 'recipe_suggestions': recipe_suggestions})
+    except UpstreamUnavailable as e:
+        logger.warning("upstream unavailable", extra={"error": str(e), "status": e.status})
+        return jsonify({'error': str(e)}), e.status, e.headers()
+    except Exception as e:
+        logger.exception("process_receipts failed")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/process-receipt/stream', methods=['POST'])
+def process_receipt_stream():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    file = request.files['file']
+    if file.filename == '' or not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file'}), 400
+
+    # The request body is gone once the response starts, so read it up front
+    content = read_file(file)
+
+    client = request_client()
+
+    def events():
+        try:
+            for event, data in receipt_streams.stream(content, lambda: processor.events(content), client=client):
+                yield sse_event(event, data)
+        except Exception as e:
+            logger.exception("process_receipt_stream failed")
+            yield sse_event('error', {'error': str(e)})
+
+    return Response(events(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@app.route('/api/receipts/<receipt_id>/recipes')
+def receipt_recipes(receipt_id):
+    receipt_data = processor.get_receipt(receipt_id)
+    if receipt_data is None:
+        return jsonify({'error': 'Unknown or expired receipt'}), 404
+
+    food_items = receipt_data.get('food_items') or []
+    if not food_items:
+        return jsonify({'success': True, 'recipe_suggestions': []})
+
+    try:
+        return jsonify({'success': True, 'recipe_suggestions': processor.generate_recipes(food_items)})
+    except UpstreamUnavailable as e:
+        logger.warning("upstream unavailable", extra={"error": str(e), "status": e.status})
+        return jsonify({'error': str(e)}), e.status, e.headers()
+    except Exception as e:
+        logger.exception("recipe generation failed")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/warmup')
+def warmup():
+    """
+    Create the upstream clients now so the next real request does not pay for them. Point a
+    cron job or deploy hook at it; `cold` is true only for the first call in an instance.
+    """
+    global _warm
+    with _warm_lock:
+        cold, _warm = not _warm, True
+        start = time.perf_counter()
+        backends = processor.warm_up()
+    return jsonify({
+        'cold': cold,
+        'import_ms': IMPORT_MS,
+        'warmup_ms': round((time.perf_counter() - start) * 1000, 1),
+        'backends': backends,
+    })
+
+def query_store(run):
+    """
+    Run a query against the receipt store with the request's filter (merchant, from, to,
+    min_total, max_total). A disabled store is a 404 and malformed parameters a 400.
+    """
+    if processor.store is None:
+        return jsonify({'error': 'Receipt store is disabled'}), 404
+    try:
+        return jsonify(run(processor.store, ReceiptFilter.from_args(request.args)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/receipts')
+def list_receipts():
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return query_store(lambda store, where: store.list(where, limit, request.args.get('cursor')))
+
+@app.route('/api/receipts/<receipt_id>')
+def get_receipt(receipt_id):
+    receipt_data = processor.get_receipt(receipt_id)
+    if receipt_data is None:
+        return jsonify({'error': 'Unknown receipt'}), 404
+    return jsonify(receipt_data)
+
+@app.route('/api/receipts/export')
+def export_receipts():
+    if processor.store is None:
+        return jsonify({'error': 'Receipt store is disabled'}), 404
+    fmt = request.args.get('format', 'jsonl')
+    kind = request.args.get('kind', 'receipts')
+    try:
+        chunks = processor.store.export(fmt, kind, ReceiptFilter.from_args(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(chunks, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'})
+
+@app.route('/api/analytics/summary')
+def analytics_summary():
+    return query_store(lambda store, where: store.summary(where))
+
+@app.route('/api/analytics/spend-by-merchant')
+def spend_by_merchant():
+    return query_store(lambda store, where: {'spend': store.spend_by_merchant_month(where)})
+
+@app.route('/api/analytics/top-food-items')
+def top_food_items():
+    limit = request.args.get('limit', 20, type=int)
+    return query_store(lambda store, where: {'items': store.top_food_items(where, limit)})
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    return jsonify(receipt_cache.stats())
+
+@app.route('/api/parser-stats')
+def parser_stats():
+    return jsonify(processor.parser_metrics.stats())
+
+@app.route('/api/recipe-index-stats')
+def recipe_index_stats():
+    if processor.recipe_index is None:
+        return jsonify({'error': 'Recipe index is disabled'}), 404
+    return jsonify(processor.recipe_index.stats())
+
+@app.route('/api/rate-limit-stats')
+def rate_limit_stats():
+    return jsonify({
+        'rate_limit': rate_limiter.stats() if rate_limiter is not None else None,
+        'admission': admission.stats() if admission is not None else None,
+    })
+
+@app.route('/api/backend-stats')
+def backend_stats():
+    return jsonify(processor.stats())
+
 @app.route('/static/<path:path>')
 def serve_static(path):
     return send_from_directory('static', path)